@@ -0,0 +1,139 @@
+# benchmarks/bench_backends.py
+"""
+一括投入（load_student_exam / load_exam_adjust / import_subject_scores）の
+SQLite と PostgreSQL（bulk_create / COPY）の比較
+
+各構成をサブプロセスで実行する（settings の DB 選択が import 時に決まるため）。
+PostgreSQL は EXAM2_DB_ENGINE=postgresql と PG* 環境変数の接続先に
+テスト DB（test_<PGDATABASE>）を作って計測し、終わったら削除する。
+テスト DB は template1 から作られるので、student テーブルは template1 に
+exam2/student_postgres.sql を流して用意しておく（migrate が FK を張るため）。
+psycopg2 が無い / 接続できない場合はその構成をスキップする。
+
+使い方（リポジトリ直下で）:
+    PGUSER=... PGPASSWORD=... python benchmarks/bench_backends.py --students 500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CONFIGS = (
+    ("sqlite", {"EXAM2_DB_ENGINE": "sqlite"}, []),
+    ("postgresql bulk_create", {"EXAM2_DB_ENGINE": "postgresql"}, ["--no-copy"]),
+    ("postgresql COPY", {"EXAM2_DB_ENGINE": "postgresql"}, []),
+)
+
+
+def worker(args):
+    sys.path.insert(0, str(ROOT))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "examProj2.settings")
+
+    from django.conf import settings
+
+    tmpdir = tempfile.mkdtemp(prefix="exam2_bench_")
+    if os.environ.get("EXAM2_DB_ENGINE") != "postgresql":
+        settings.DATABASES["default"]["TEST"] = {"NAME": os.path.join(tmpdir, "bench.sqlite3")}
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    from exam2.models import Exam, Question, Student, StudentExamVersion, StudentExam, ExamAdjust
+    from exam2.tests import make_subject_fixture
+
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        if Student._meta.db_table not in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                editor.create_model(Student)
+
+        subject, _, _, _ = make_subject_fixture(students=args.students, rows=args.rows, cols=args.cols)
+        # fixture の StudentExam / ExamAdjust は消して、SEV だけ残す（load_* の投入を測る）
+        StudentExam.objects.all().delete()
+        ExamAdjust.objects.all().delete()
+
+        extra = args.extra
+        opts = {"fsyear": subject.fsyear, "stdout": open(os.devnull, "w")}
+        timings = {}
+
+        t0 = time.perf_counter()
+        call_command("load_student_exam", subject.subjectNo, *extra, **opts)
+        timings["load_student_exam"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        call_command("load_exam_adjust", subject.subjectNo, *extra, **opts)
+        timings["load_exam_adjust"] = time.perf_counter() - t0
+
+        # import: 全セル TF=1 の examTFdata.json を組み立てて取り込む
+        exams_json, students_json = {}, {}
+        for exam in Exam.objects.filter(subject=subject):
+            q_list = list(Question.objects.filter(exam=exam).order_by("gyo", "retu", "id"))
+            exams_json[exam.version] = {
+                "problem_hash": exam.problem_hash,
+                "question_order": [{"gyo": q.gyo, "retu": q.retu, "q_no": q.q_no} for q in q_list],
+            }
+        for sev in StudentExamVersion.objects.filter(subject=subject).select_related("student", "exam"):
+            n = len(exams_json[sev.exam.version]["question_order"])
+            students_json[sev.student.stdNo] = {
+                "version": sev.exam.version,
+                "answers": [{"TF": 1, "hosei": 0}] * n,
+                "adjust": 1,
+            }
+        export_path = Path(tmpdir) / "examTFdata.json"
+        export_path.write_text(
+            json.dumps({"subjects": {subject.subjectNo: {"exams": exams_json, "students": students_json}}}),
+            encoding="utf-8",
+        )
+
+        t0 = time.perf_counter()
+        call_command("import_subject_scores", subject.subjectNo, "--json", str(export_path), *extra, **opts)
+        timings["import_subject_scores"] = time.perf_counter() - t0
+
+        assert StudentExam.objects.filter(TF=1).count() == StudentExam.objects.count()
+        assert StudentExamVersion.objects.count() == args.students
+        print(json.dumps(timings))
+    finally:
+        connection.creation.destroy_test_db(connection.settings_dict["NAME"], verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("extra", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    print(f"students={args.students} cells={args.students * args.rows * args.cols}")
+    for label, env, extra in CONFIGS:
+        cmd = [
+            sys.executable, __file__, "--worker",
+            "--students", str(args.students), "--rows", str(args.rows), "--cols", str(args.cols),
+            "--", *extra,
+        ]
+        proc = subprocess.run(cmd, env={**os.environ, **env}, capture_output=True, text=True, cwd=ROOT)
+        if proc.returncode != 0:
+            last = (proc.stderr.strip().splitlines() or ["?"])[-1]
+            print(f"{label:24s} skipped ({last})")
+            continue
+        timings = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{label:24s} " + "  ".join(f"{k}={v * 1000:8.1f} ms" for k, v in timings.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/bench_concurrent_grading.py
+"""
+同時採点者 N 人の PATCH /api/student-exams/bulk_update/ を再現し、
+書き込み層（exam2/dbwrite.py）有無でのエラー件数とレイテンシを比較する。
+
+- legacy : 書き込みを素の transaction.atomic で実行（BEGIN DEFERRED・再試行なし）
+- layer  : run_write（BEGIN IMMEDIATE・ジッタ付き再試行）
+- serial : run_write + EXAM2_WRITE["serialize"] = True
+
+使い方（リポジトリ直下で）:
+    python benchmarks/bench_concurrent_grading.py --graders 6 --seconds 5
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "examProj2.settings")
+
+
+def run(label, args, cells_by_sheet):
+    from django.db import connection
+    from django.test import Client
+
+    stop = time.perf_counter() + args.seconds
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    sheets = list(cells_by_sheet)
+
+    def grader(seed):
+        rnd = random.Random(seed)
+        client = Client()
+        try:
+            while time.perf_counter() < stop:
+                cells = cells_by_sheet[rnd.choice(sheets)]
+                payload = [{"id": cid, "TF": rnd.randint(0, 1), "hosei": 0} for cid in rnd.sample(cells, 3)]
+                t0 = time.perf_counter()
+                try:
+                    res = client.patch(
+                        "/api/student-exams/bulk_update/", json.dumps(payload), content_type="application/json",
+                    )
+                    code = res.status_code
+                except Exception:
+                    code = 500  # legacy はロックエラーがそのまま例外（= 500）になる
+                with lock:
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    statuses[code] = statuses.get(code, 0) + 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=grader, args=(i,)) for i in range(args.graders)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{label:7s} req/s={len(latencies) / args.seconds:7.1f}  "
+        f"p50={statistics.median(latencies):7.1f} ms  p95={p95:7.1f} ms  status={dict(sorted(statuses.items()))}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graders", type=int, default=6)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="exam2_bench_")
+
+    from django.conf import settings
+    settings.DATABASES["default"]["NAME"] = os.path.join(tmpdir, "bench.sqlite3")
+    settings.ALLOWED_HOSTS = ["testserver"]
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection, transaction
+
+    from exam2 import views
+    from exam2.models import Student, StudentExam
+    from exam2.tests import make_subject_fixture
+
+    logging.disable(logging.CRITICAL)  # legacy の 500 のトレースバックを抑止
+    call_command("migrate", verbosity=0)
+    with connection.schema_editor() as editor:
+        editor.create_model(Student)
+    make_subject_fixture(students=args.students, rows=10, cols=10)
+
+    cells_by_sheet = {}
+    for cid, sid, eid in StudentExam.objects.values_list("id", "student_id", "exam_id"):
+        cells_by_sheet.setdefault((sid, eid), []).append(cid)
+    connection.close()
+    print(f"graders={args.graders} sheets={len(cells_by_sheet)} profile={settings.SQLITE_PROFILE}")
+
+    run_write = views.run_write
+
+    def legacy_write(fn, **kwargs):
+        with transaction.atomic():
+            return fn()
+
+    views.run_write = legacy_write
+    run("legacy", args, cells_by_sheet)
+
+    views.run_write = run_write
+    run("layer", args, cells_by_sheet)
+
+    settings.EXAM2_WRITE = {**settings.EXAM2_WRITE, "serialize": True}
+    run("serial", args, cells_by_sheet)
+
+
+if __name__ == "__main__":
+    main()
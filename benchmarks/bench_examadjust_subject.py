@@ -0,0 +1,106 @@
+# benchmarks/bench_examadjust_subject.py
+"""
+/api/examadjust_subject/ の集計ベンチマーク（StudentExam.earned 導入の効果確認用）
+
+一時 SQLite DB に migrate し、200 学生 × A/B × 10行10列 の科目を作ってから
+- 旧集計: Sum(Case(When(TF=1, then=question__points)))  … Question を JOIN
+- 新集計: Sum("earned")                                 … StudentExam のインデックスのみ
+- エンドポイント全体: GET /api/examadjust_subject/
+をそれぞれ繰り返し計測する。
+
+使い方（リポジトリ直下で）:
+    python benchmarks/bench_examadjust_subject.py --students 200 --repeat 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "examProj2.settings")
+
+
+def timeit(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="exam2_bench_")
+
+    from django.conf import settings
+    settings.DATABASES["default"]["NAME"] = os.path.join(tmpdir, "bench.sqlite3")
+    settings.ALLOWED_HOSTS = ["testserver"]
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.db.models import Sum, Case, When, F, IntegerField
+    from django.test import Client
+
+    from exam2.models import Student, StudentExam
+    from exam2.scoring import score_totals
+    from exam2.tests import make_subject_fixture
+
+    call_command("migrate", verbosity=0)
+    with connection.schema_editor() as editor:
+        editor.create_model(Student)
+
+    subject, exams, _, _ = make_subject_fixture(
+        students=args.students, rows=args.rows, cols=args.cols,
+    )
+    exam_ids = [e.id for e in exams.values()]
+    print(f"students={args.students} StudentExam rows={StudentExam.objects.count()}")
+
+    def legacy_totals():
+        return list(
+            StudentExam.objects.filter(exam_id__in=exam_ids)
+            .values("student_id", "exam_id")
+            .order_by()
+            .annotate(
+                score=Sum(Case(When(TF=1, then=F("question__points")), default=0, output_field=IntegerField())),
+                hosei_sum=Sum("hosei"),
+            )
+        )
+
+    def earned_totals():
+        return score_totals(exam_ids)
+
+    client = Client()
+    url = f"/api/examadjust_subject/?subjectNo={subject.subjectNo}&fsyear={subject.fsyear}"
+
+    def endpoint():
+        res = client.get(url)
+        assert res.status_code == 200, res.status_code
+
+    legacy = {(r["student_id"], r["exam_id"]): (r["score"], r["hosei_sum"]) for r in legacy_totals()}
+    assert legacy == earned_totals(), "earned と points JOIN の集計が一致しません"
+
+    for name, fn in (
+        ("legacy join (question__points)", legacy_totals),
+        ("earned column", earned_totals),
+        ("GET /api/examadjust_subject/", endpoint),
+    ):
+        median, best = timeit(fn, args.repeat)
+        print(f"{name:34s} median={median:8.2f} ms  best={best:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# benchmarks/bench_sqlite_profile.py
+"""
+SQLite 接続プロファイル（settings.SQLITE_PROFILE）有無での同時読み書きスループット比較
+
+一時 SQLite ファイルに科目データを作り、
+- writer スレッド: StudentExam 1 セルの TF/hosei を更新（採点 PATCH 相当）
+- reader スレッド: score_totals（結果一覧・調整一覧の集計相当）
+を一定時間まわして、成功件数と "database is locked" 件数を数える。
+
+使い方（リポジトリ直下で）:
+    python benchmarks/bench_sqlite_profile.py --writers 4 --readers 4 --seconds 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "examProj2.settings")
+
+
+def run(label, profile, args, exam_ids, cell_ids):
+    from django.conf import settings
+    from django.db import OperationalError, connection, transaction
+
+    from exam2.models import StudentExam
+    from exam2.scoring import score_totals
+
+    settings.SQLITE_PROFILE = profile
+    # WAL は DB ファイルに残るので、プロファイル無しの回は明示的に DELETE へ戻す
+    connection.close()
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode = %s" % ((profile or {}).get("journal_mode") or "DELETE"))
+    connection.close()
+
+    stop = time.perf_counter() + args.seconds
+    counts = {"write": 0, "read": 0, "locked": 0}
+    lock = threading.Lock()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def writer():
+        rnd = random.Random()
+        try:
+            while time.perf_counter() < stop:
+                try:
+                    with transaction.atomic():
+                        se = StudentExam.objects.select_related("question").get(id=rnd.choice(cell_ids))
+                        se.TF = 1 - se.TF
+                        se.save(update_fields=["TF"])
+                    bump("write")
+                except OperationalError:
+                    bump("locked")
+        finally:
+            connection.close()
+
+    def reader():
+        try:
+            while time.perf_counter() < stop:
+                try:
+                    score_totals(exam_ids)
+                    bump("read")
+                except OperationalError:
+                    bump("locked")
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(
+        f"{label:10s} writes/s={counts['write'] / args.seconds:8.1f}  "
+        f"reads/s={counts['read'] / args.seconds:8.1f}  locked={counts['locked']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="exam2_bench_")
+
+    from django.conf import settings
+    settings.DATABASES["default"]["NAME"] = os.path.join(tmpdir, "bench.sqlite3")
+    tuned = dict(settings.SQLITE_PROFILE or {})
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    from exam2.models import Student, StudentExam
+    from exam2.tests import make_subject_fixture
+
+    call_command("migrate", verbosity=0)
+    with connection.schema_editor() as editor:
+        editor.create_model(Student)
+
+    _, exams, _, _ = make_subject_fixture(students=args.students, rows=10, cols=10)
+    exam_ids = [e.id for e in exams.values()]
+    cell_ids = list(StudentExam.objects.values_list("id", flat=True))
+    print(f"students={args.students} rows={len(cell_ids)} writers={args.writers} readers={args.readers}")
+
+    run("default", None, args, exam_ids, cell_ids)
+    run("profile", tuned, args, exam_ids, cell_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/bench_year_sync.py
+"""
+年度まとめての export / import（--all）のベンチマーク
+
+一時 SQLite DB に migrate し、同じ学生集合で N 科目（各 A/B × rows×cols 問）を作ってから
+- 従来: 科目ごとに `python manage.py export_subject_scores <subjectNo>` を別プロセスで順に実行
+- 新:   `export_subject_scores --all --workers W`（import も同様）
+を計測する。
+
+使い方（リポジトリ直下で）:
+    python benchmarks/bench_year_sync.py --subjects 12 --students 300 --workers 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "examProj2.settings")
+
+SETTINGS_SHIM = """
+from examProj2.settings import *  # noqa
+DATABASES["default"]["NAME"] = {db!r}
+EXAM2_CATALOG = {{"stamp": None}}
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subjects", type=int, default=12)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=8)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    tmpdir = Path(tempfile.mkdtemp(prefix="exam2_bench_"))
+    db = tmpdir / "bench.sqlite3"
+    (tmpdir / "bench_settings.py").write_text(SETTINGS_SHIM.format(db=str(db)), encoding="utf-8")
+
+    from django.conf import settings
+    settings.DATABASES["default"]["NAME"] = str(db)
+    settings.EXAM2_CATALOG = {"stamp": None}
+
+    import django
+    django.setup()
+    logging.disable(logging.CRITICAL)
+
+    from django.core.management import call_command
+    from django.db import connection, connections
+
+    from exam2.models import Exam, Question, Student, StudentExam, StudentExamVersion, ExamAdjust, Subject
+    from exam2.tests import make_subject_fixture
+
+    call_command("migrate", verbosity=0)
+    with connection.schema_editor() as editor:
+        editor.create_model(Student)
+
+    first, _, _, students = make_subject_fixture(students=args.students, rows=args.rows, cols=args.cols)
+    subjectNos = [first.subjectNo]
+    for n in range(1, args.subjects):
+        subject = Subject.objects.create(subjectNo=f"20{n:05d}", fsyear=first.fsyear, term=1, name=f"科目{n}", nenji=1)
+        subjectNos.append(subject.subjectNo)
+        exams = {v: Exam.objects.create(subject=subject, title=subject.name, version=v) for v in ("A", "B")}
+        questions = {
+            v: Question.objects.bulk_create([
+                Question(exam=e, q_no=f"{g}-{r}", gyo=g, retu=r, points=2)
+                for g in range(1, args.rows + 1) for r in range(1, args.cols + 1)
+            ])
+            for v, e in exams.items()
+        }
+        sev, cells, adj = [], [], []
+        for i, stu in enumerate(students):
+            v = "A" if i % 2 == 0 else "B"
+            sev.append(StudentExamVersion(student=stu, exam=exams[v], subject=subject))
+            adj.append(ExamAdjust(student=stu, exam=exams[v], subject=subject, adjust=0))
+            cells.extend(
+                StudentExam(student=stu, exam=exams[v], subject=subject, question=q,
+                            TF=j % 2, hosei=0, earned=q.points * (j % 2))
+                for j, q in enumerate(questions[v])
+            )
+        StudentExamVersion.objects.bulk_create(sev)
+        ExamAdjust.objects.bulk_create(adj)
+        StudentExam.objects.bulk_create(cells, batch_size=2000)
+    connections.close_all()
+    print(f"subjects={args.subjects} students={args.students} StudentExam rows={args.subjects * args.students * args.rows * args.cols}")
+
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "bench_settings", "PYTHONPATH": f"{tmpdir}:{ROOT}"}
+
+    def manage(*argv):
+        subprocess.run([sys.executable, str(ROOT / "manage.py"), *argv], env=env, check=True, capture_output=True)
+
+    serial_dir = tmpdir / "serial"
+    serial_dir.mkdir()
+    t0 = time.perf_counter()
+    for sno in subjectNos:
+        manage("export_subject_scores", sno, "--fsyear", str(first.fsyear), "--out", str(serial_dir / f"examTFdata_{sno}.json"))
+    t_export_serial = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for sno in subjectNos:
+        manage("import_subject_scores", sno, "--fsyear", str(first.fsyear), "--json", str(serial_dir / f"examTFdata_{sno}.json"))
+    t_import_serial = time.perf_counter() - t0
+
+    all_dir = tmpdir / "all"
+    t0 = time.perf_counter()
+    manage("export_subject_scores", "--all", "--fsyear", str(first.fsyear), "--out-dir", str(all_dir), "--workers", str(args.workers))
+    t_export_all = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    manage("import_subject_scores", "--all", "--fsyear", str(first.fsyear), "--json-dir", str(all_dir), "--workers", str(args.workers))
+    t_import_all = time.perf_counter() - t0
+
+    summary = json.loads((all_dir / "import_summary.json").read_text(encoding="utf-8"))
+    print(f"export: per-subject processes {t_export_serial:.2f}s  --all --workers {args.workers} {t_export_all:.2f}s")
+    print(f"import: per-subject processes {t_import_serial:.2f}s  --all --workers {args.workers} {t_import_all:.2f}s")
+    print(f"import --all succeeded={summary['succeeded']} failed={len(summary['failed'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+# exam2/answersheet.py
+"""
+AnswerSheet（パック版採点データ）の変換と、StudentExam API 互換アダプタ。
+
+- StudentExam（1セル1行）⇔ AnswerSheet（1学生×1試験で1行）の相互変換
+- /api/student-exams/ の契約（id, student, exam, question, TF, hosei）を
+  AnswerSheet 上で再現する PackedStudentExamAdapter
+
+セルの id は「sheet.id * CELL_ID_STRIDE + セル位置」で表す。
+packed モードではフロントは StudentExam の id ではなくこの id を使う。
+"""
+
+import sys
+from array import array
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog
+from .models import Student, StudentExam, StudentExamVersion, AnswerSheet
+
+
+CELL_ID_STRIDE = 1000  # 1試験あたりの問題数の上限
+HOSEI_MIN, HOSEI_MAX = -32768, 32767  # hosei は int16 で持つ
+
+
+class CellError(ValueError):
+    """セルの指定・値が不正（API では 400 で返す）"""
+
+
+def use_packed_storage() -> bool:
+    """settings.EXAM2_ANSWER_STORAGE が "packed" なら AnswerSheet を正とする"""
+    return getattr(settings, "EXAM2_ANSWER_STORAGE", "rows") == "packed"
+
+
+# =========================
+# pack / unpack
+# =========================
+
+def pack_tf(values) -> bytes:
+    values = list(values)
+    buf = bytearray((len(values) + 7) // 8)
+    for i, v in enumerate(values):
+        if v:
+            buf[i >> 3] |= 1 << (i & 7)
+    return bytes(buf)
+
+
+def unpack_tf(data, count: int) -> list[int]:
+    data = bytes(data or b"")
+    out = []
+    for i in range(count):
+        byte = i >> 3
+        out.append((data[byte] >> (i & 7)) & 1 if byte < len(data) else 0)
+    return out
+
+
+def pack_hosei(values) -> bytes:
+    arr = array("h", (int(v or 0) for v in values))
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_hosei(data, count: int) -> list[int]:
+    arr = array("h")
+    arr.frombytes(bytes(data or b""))
+    if sys.byteorder != "little":
+        arr.byteswap()
+    out = arr.tolist()[:count]
+    out.extend([0] * (count - len(out)))
+    return out
+
+
+def cell_id(sheet_id: int, index: int) -> int:
+    if not 0 <= index < CELL_ID_STRIDE:
+        raise ValueError(f"セル位置は 0..{CELL_ID_STRIDE - 1}: {index}")
+    return sheet_id * CELL_ID_STRIDE + index
+
+
+def split_cell_id(value) -> tuple[int, int]:
+    value = int(value)
+    return value // CELL_ID_STRIDE, value % CELL_ID_STRIDE
+
+
+# =========================
+# レイアウト（Question の並び）
+# =========================
+
+@dataclass(frozen=True)
+class SheetLayout:
+    question_ids: tuple
+    points: tuple
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def index_of(self, question_id: int) -> int:
+        return self.question_ids.index(question_id)
+
+
+def exam_layouts(exam_ids) -> dict[int, SheetLayout]:
+    """exam_id → SheetLayout（export/import と同じ gyo, retu, id 順。catalog の question_points から）"""
+    layouts = {}
+    for eid in exam_ids:
+        cells = catalog.question_points(eid)
+        layouts[eid] = SheetLayout(tuple(qid for qid, _ in cells), tuple(int(p or 0) for _, p in cells))
+    return layouts
+
+
+def fill_sheet(sheet: AnswerSheet, layout: SheetLayout, tf_list, hosei_list) -> AnswerSheet:
+    """セル配列を sheet に書き込み、集計キャッシュも更新する"""
+    tf_list = [1 if v else 0 for v in tf_list]
+    hosei_list = [int(v or 0) for v in hosei_list]
+
+    sheet.question_count = len(layout)
+    sheet.tf_bits = pack_tf(tf_list)
+    sheet.hosei = pack_hosei(hosei_list)
+    sheet.score = sum(p for p, tf in zip(layout.points, tf_list) if tf)
+    sheet.hosei_total = sum(hosei_list)
+    sheet.total = sheet.score + sheet.hosei_total
+    sheet.updated_at = timezone.now()  # bulk_update では auto_now が効かないため
+    return sheet
+
+
+def sheet_cells(sheet: AnswerSheet) -> tuple[list[int], list[int]]:
+    n = sheet.question_count
+    return unpack_tf(sheet.tf_bits, n), unpack_hosei(sheet.hosei, n)
+
+
+# =========================
+# StudentExam → AnswerSheet
+# =========================
+
+def build_answer_sheets(subject, *, batch_size: int = 500) -> dict:
+    """
+    subject の SEV 割当ごとに AnswerSheet を StudentExam から作り直す。
+    StudentExam が無いセルは 0 とみなす。
+    """
+    sev_pairs = list(
+        StudentExamVersion.objects.filter(subject=subject)
+        .values_list("student_id", "exam_id")
+    )
+    exam_ids = {eid for _, eid in sev_pairs}
+    layouts = exam_layouts(exam_ids)
+
+    cells = {}
+    for student_id, exam_id, qid, tf, hosei in (
+        StudentExam.objects.filter(exam_id__in=exam_ids)
+        .values_list("student_id", "exam_id", "question_id", "TF", "hosei")
+    ):
+        cells[(student_id, exam_id, qid)] = (tf, hosei)
+
+    existing = {
+        (s.student_id, s.exam_id): s
+        for s in AnswerSheet.objects.filter(exam_id__in=exam_ids)
+    }
+
+    to_create, to_update = [], []
+    for student_id, exam_id in sev_pairs:
+        layout = layouts[exam_id]
+        pairs = [cells.get((student_id, exam_id, qid), (0, 0)) for qid in layout.question_ids]
+        sheet = existing.get((student_id, exam_id))
+        if sheet is None:
+            sheet = AnswerSheet(student_id=student_id, exam_id=exam_id)
+            to_create.append(sheet)
+        else:
+            to_update.append(sheet)
+        fill_sheet(sheet, layout, [p[0] for p in pairs], [p[1] for p in pairs])
+
+    stale = AnswerSheet.objects.filter(exam_id__in=exam_ids).exclude(
+        id__in=[s.id for s in to_update]
+    )
+
+    with transaction.atomic():
+        deleted, _ = stale.delete()
+        AnswerSheet.objects.bulk_create(to_create, batch_size=batch_size)
+        AnswerSheet.objects.bulk_update(
+            to_update,
+            ["question_count", "tf_bits", "hosei", "score", "hosei_total", "total", "updated_at"],
+            batch_size=batch_size,
+        )
+
+    return {"created": len(to_create), "updated": len(to_update), "deleted": deleted}
+
+
+def write_back_rows(subject, *, batch_size: int = 2000) -> dict:
+    """AnswerSheet の内容を StudentExam に書き戻す（packed → rows へ戻す時用）"""
+    sheets = list(AnswerSheet.objects.filter(exam__subject=subject))
+    layouts = exam_layouts({s.exam_id for s in sheets})
+
+    rows = {
+        (se.student_id, se.exam_id, se.question_id): se
+        for se in StudentExam.objects.filter(subject=subject)
+    }
+
+    now = timezone.now()  # bulk_update では auto_now が効かないため
+    to_create, to_update = [], []
+    for sheet in sheets:
+        layout = layouts[sheet.exam_id]
+        tf_list, hosei_list = sheet_cells(sheet)
+        for qid, points, tf, hosei in zip(layout.question_ids, layout.points, tf_list, hosei_list):
+            se = rows.get((sheet.student_id, sheet.exam_id, qid))
+            if se is None:
+                to_create.append(StudentExam(
+                    student_id=sheet.student_id, exam_id=sheet.exam_id, subject_id=subject.id,
+                    question_id=qid, TF=tf, hosei=hosei, earned=points if tf else 0,
+                ))
+            elif se.TF != tf or int(se.hosei or 0) != hosei or se.earned != (points if tf else 0):
+                se.TF = tf
+                se.hosei = hosei
+                se.earned = points if tf else 0
+                se.updated_at = now
+                to_update.append(se)
+
+    with transaction.atomic():
+        StudentExam.objects.bulk_create(to_create, batch_size=batch_size)
+        StudentExam.objects.bulk_update(to_update, ["TF", "hosei", "earned", "updated_at"], batch_size=batch_size)
+
+    return {"created": len(to_create), "updated": len(to_update)}
+
+
+def rescore_sheets(exam_ids, *, batch_size: int = 500) -> int:
+    """Question.points が変わった exam の AnswerSheet.score/total を付け直す"""
+    layouts = exam_layouts(set(exam_ids))
+    sheets = list(AnswerSheet.objects.filter(exam_id__in=list(layouts)))
+    for sheet in sheets:
+        tf_list, hosei_list = sheet_cells(sheet)
+        fill_sheet(sheet, layouts[sheet.exam_id], tf_list, hosei_list)
+    AnswerSheet.objects.bulk_update(
+        sheets,
+        ["question_count", "tf_bits", "hosei", "score", "hosei_total", "total", "updated_at"],
+        batch_size=batch_size,
+    )
+    return len(sheets)
+
+
+def remap_sheets(exam_id: int, old_layout: SheetLayout, *, batch_size: int = 500) -> int:
+    """
+    問題の追加・削除で exam の並びが変わったとき、AnswerSheet のセルを question_id で新しい並びに移す。
+    消えた問題のセルは捨て、新しい問題のセルは 0。old_layout は変更前の exam_layouts の値。
+    """
+    layout = exam_layouts([exam_id])[exam_id]
+    old_index = {qid: i for i, qid in enumerate(old_layout.question_ids)}
+    sheets = list(AnswerSheet.objects.select_for_update().filter(exam_id=exam_id))
+    for sheet in sheets:
+        tf_old, hosei_old = unpack_tf(sheet.tf_bits, len(old_layout)), unpack_hosei(sheet.hosei, len(old_layout))
+        picks = [old_index.get(qid) for qid in layout.question_ids]
+        fill_sheet(
+            sheet, layout,
+            [tf_old[i] if i is not None else 0 for i in picks],
+            [hosei_old[i] if i is not None else 0 for i in picks],
+        )
+    AnswerSheet.objects.bulk_update(
+        sheets,
+        ["question_count", "tf_bits", "hosei", "score", "hosei_total", "total", "updated_at"],
+        batch_size=batch_size,
+    )
+    return len(sheets)
+
+
+def clear_sheets(exam_ids, *, batch_size: int = 500) -> int:
+    """exam_ids の AnswerSheet を全セル 0 にする（行は残す。clear_subject_scores の packed 版）"""
+    layouts = exam_layouts(set(exam_ids))
+    sheets = list(AnswerSheet.objects.filter(exam_id__in=list(layouts)))
+    for sheet in sheets:
+        n = len(layouts[sheet.exam_id])
+        fill_sheet(sheet, layouts[sheet.exam_id], [0] * n, [0] * n)
+    AnswerSheet.objects.bulk_update(
+        sheets,
+        ["question_count", "tf_bits", "hosei", "score", "hosei_total", "total", "updated_at"],
+        batch_size=batch_size,
+    )
+    return len(sheets)
+
+
+def is_graded(sheet_values) -> bool:
+    """(tf_bits, hosei) のどちらかに 0 以外のセルがあるか"""
+    tf_bits, hosei = sheet_values
+    return any(bytes(tf_bits or b"")) or any(bytes(hosei or b""))
+
+
+def reset_sheet(student_id: int, exam) -> AnswerSheet:
+    """科目内の旧 AnswerSheet を消し、exam の 0 埋め AnswerSheet を作り直す（版変更時）"""
+    layout = exam_layouts([exam.id])[exam.id]
+    AnswerSheet.objects.filter(student_id=student_id, exam__subject_id=exam.subject_id).delete()
+    sheet = AnswerSheet(student_id=student_id, exam_id=exam.id)
+    fill_sheet(sheet, layout, [0] * len(layout), [0] * len(layout))
+    sheet.save()
+    return sheet
+
+
+# =========================
+# /api/student-exams/ 互換アダプタ
+# =========================
+
+class PackedStudentExamAdapter:
+    """
+    AnswerSheet を StudentExamSerializer と同じ形のセル一覧として見せる。
+    GET（一覧/1件）、PATCH（1件/一括）を提供する。
+    """
+
+    fields = ("TF", "hosei")
+
+    def _rows(self, sheet: AnswerSheet, layout: SheetLayout) -> list[dict]:
+        tf_list, hosei_list = sheet_cells(sheet)
+        return [
+            {
+                "id": cell_id(sheet.id, i),
+                "student": sheet.student_id,
+                "exam": sheet.exam_id,
+                "question": qid,
+                "TF": tf_list[i],
+                "hosei": hosei_list[i],
+            }
+            for i, qid in enumerate(layout.question_ids[:sheet.question_count])
+        ]
+
+    def list_cells(self, *, exam_id=None, student_id=None, student_stdno=None) -> list[dict]:
+        qs = AnswerSheet.objects.all()
+        if exam_id:
+            qs = qs.filter(exam_id=exam_id)
+        if student_id:
+            qs = qs.filter(student_id=student_id)
+        if student_stdno:
+            qs = qs.filter(student__stdNo=student_stdno)
+
+        sheets = list(qs.order_by("exam_id", "student_id"))
+        layouts = exam_layouts({s.exam_id for s in sheets})
+
+        out = []
+        for sheet in sheets:
+            out.extend(self._rows(sheet, layouts[sheet.exam_id]))
+        return out
+
+    def get_cell(self, pk) -> dict | None:
+        try:
+            sheet_id, index = split_cell_id(pk)
+        except (TypeError, ValueError):
+            return None
+        sheet = AnswerSheet.objects.filter(id=sheet_id).first()
+        if sheet is None:
+            return None
+        rows = self._rows(sheet, exam_layouts([sheet.exam_id])[sheet.exam_id])
+        return rows[index] if index < len(rows) else None
+
+    @staticmethod
+    def _values(item) -> dict:
+        """item の TF / hosei を検査して int にする（整数でない・hosei が int16 を超える → CellError）"""
+        values = {}
+        try:
+            if "TF" in item:
+                values["TF"] = 1 if int(item["TF"] or 0) else 0
+            if "hosei" in item:
+                values["hosei"] = int(item["hosei"] or 0)
+        except (TypeError, ValueError):
+            raise CellError(f"TF / hosei は整数で指定してください: {item}")
+        if not HOSEI_MIN <= values.get("hosei", 0) <= HOSEI_MAX:
+            raise CellError(f"hosei は {HOSEI_MIN}..{HOSEI_MAX}: {item}")
+        return values
+
+    def update_cells(self, items) -> int:
+        """
+        items: [{id, TF?, hosei?}, ...]
+        sheet 単位にまとめて 1 回ずつ更新する。
+        存在しない id（整数でない / セル位置が sheet の外）は KeyError、値が不正なら CellError（どちらも何も書かない）。
+        """
+        by_sheet = {}
+        for item in items:
+            if not isinstance(item, dict):
+                raise CellError(f"セルは {{id, TF, hosei}} で指定してください: {item!r}")
+            try:
+                sheet_id, index = split_cell_id(item.get("id"))
+            except (TypeError, ValueError):
+                raise KeyError(f"cell not found: {item.get('id')!r}")
+            by_sheet.setdefault(sheet_id, []).append((index, self._values(item)))
+
+        with transaction.atomic():
+            sheets = {
+                s.id: s for s in AnswerSheet.objects.select_for_update().filter(id__in=list(by_sheet))
+            }
+            missing = set(by_sheet) - set(sheets)
+            if missing:
+                raise KeyError(f"AnswerSheet not found: {sorted(missing)}")
+
+            layouts = exam_layouts({s.exam_id for s in sheets.values()})
+            changed = []
+            for sheet_id, cells in by_sheet.items():
+                sheet = sheets[sheet_id]
+                layout = layouts[sheet.exam_id]
+                tf_list, hosei_list = sheet_cells(sheet)
+                for index, values in cells:
+                    if index >= min(len(layout), sheet.question_count):
+                        raise KeyError(f"cell out of range: {cell_id(sheet_id, index)}")
+                    if "TF" in values:
+                        tf_list[index] = values["TF"]
+                    if "hosei" in values:
+                        hosei_list[index] = values["hosei"]
+                fill_sheet(sheet, layout, tf_list, hosei_list)
+                changed.append(sheet)
+
+            AnswerSheet.objects.bulk_update(
+                changed,
+                ["question_count", "tf_bits", "hosei", "score", "hosei_total", "total", "updated_at"],
+            )
+        return len(changed)
+
+
+def students_with_sheets(exam_id):
+    return Student.objects.filter(answersheet__exam_id=exam_id).distinct()
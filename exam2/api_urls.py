@@ -18,6 +18,9 @@ from .views import (
     ExamAdjustSubjectAPIView,
     ExamAdjustCommentSubjectAPIView,
     ExamAdjustUpdateSubjectAPIView,
+    WriteMetricsAPIView,
+    CatalogStatsAPIView,
+    FsyearListAPIView,
 )
 
 router = DefaultRouter()
@@ -47,6 +50,9 @@ urlpatterns = [
 
     path("student-exams/bulk_update/", studentexam_bulk_update),
 
+    # 年度一覧（アーカイブ済み年度を含む）
+    path("fsyears/", FsyearListAPIView.as_view()),
+
     path("subjects/", SubjectListAPIView.as_view()),
     path("exams_of_subject/", ExamsOfSubjectAPIView.as_view()),
     path("students_of_exam/", StudentsOfExamAPIView.as_view()),
@@ -55,6 +61,10 @@ urlpatterns = [
     path("examadjustcomment_subject/", ExamAdjustCommentSubjectAPIView.as_view()),
     path("exam-adjust-update-subject/", ExamAdjustUpdateSubjectAPIView.as_view()),
 
+    # 書き込み層のメトリクス
+    path("write-metrics/", WriteMetricsAPIView.as_view()),
+    path("catalog-stats/", CatalogStatsAPIView.as_view()),
+
     # StudentExam の CRUD
     path("", include(router.urls)),
 
@@ -0,0 +1,148 @@
+# exam2/archive.py
+"""
+過年度（fsyear）アーカイブ。
+
+- archive_fsyear コマンドが、終わった年度の Subject 以下を
+  settings.EXAM2_ARCHIVE_DIR/exam2_<fsyear>.sqlite3 に移す
+- ファイルは DB エイリアス "fsyear_<fsyear>" として登録される（settings.py が起動時に検出、
+  コマンド実行中は register_archive で追加）
+- リクエストの ?fsyear=（または X-Fsyear ヘッダ）がアーカイブ済み年度なら、
+  FsyearArchiveRouter が exam2 の読み込みをそのファイルへ振り向ける
+- アーカイブ済み年度への書き込みは ArchivedYearReadOnly（API では 409）
+
+models を import しないこと（settings / router から読まれるため）。
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import JsonResponse
+
+
+ALIAS_PREFIX = "fsyear_"
+FILE_PATTERN = "exam2_{fsyear}.sqlite3"
+
+_current_fsyear = ContextVar("exam2_fsyear", default=None)
+
+
+class ArchivedYearReadOnly(Exception):
+    """アーカイブ済み年度のデータを書き換えようとした"""
+
+
+# =========================
+# ファイル / エイリアス
+# =========================
+
+def archive_dir() -> Path:
+    return Path(getattr(settings, "EXAM2_ARCHIVE_DIR", Path(settings.BASE_DIR) / "archive"))
+
+
+def archive_path(fsyear: int) -> Path:
+    return archive_dir() / FILE_PATTERN.format(fsyear=int(fsyear))
+
+
+def archive_alias(fsyear: int) -> str:
+    return f"{ALIAS_PREFIX}{int(fsyear)}"
+
+
+def archive_database(path) -> dict:
+    return {"ENGINE": "django.db.backends.sqlite3", "NAME": str(path)}
+
+
+def archived_years() -> list[int]:
+    return sorted(
+        int(alias[len(ALIAS_PREFIX):])
+        for alias in connections.settings
+        if alias.startswith(ALIAS_PREFIX) and alias[len(ALIAS_PREFIX):].isdigit()
+    )
+
+
+def register_archive(fsyear: int) -> str:
+    """archive_path(fsyear) を実行中のプロセスに DB エイリアスとして登録する"""
+    alias = archive_alias(fsyear)
+    if alias not in connections.settings:
+        configured = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            alias: archive_database(archive_path(fsyear)),
+        })
+        connections.settings[alias] = configured[alias]
+        settings.DATABASES[alias] = configured[alias]
+    return alias
+
+
+def unregister_archive(fsyear: int) -> None:
+    alias = archive_alias(fsyear)
+    if alias in connections.settings:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+        settings.DATABASES.pop(alias, None)
+
+
+# =========================
+# 年度コンテキスト
+# =========================
+
+def current_fsyear():
+    return _current_fsyear.get()
+
+
+@contextmanager
+def use_fsyear(fsyear):
+    token = _current_fsyear.set(int(fsyear) if fsyear not in (None, "") else None)
+    try:
+        yield
+    finally:
+        _current_fsyear.reset(token)
+
+
+def archived_alias_for_current():
+    fsyear = current_fsyear()
+    if fsyear is None:
+        return None
+    alias = archive_alias(fsyear)
+    return alias if alias in connections.settings else None
+
+
+class FsyearArchiveRouter:
+    """アーカイブ済み年度のコンテキストでは exam2 の読み込みを年度ファイルへ"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != "exam2":
+            return None
+        return archived_alias_for_current()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != "exam2":
+            return None
+        alias = archived_alias_for_current()
+        if alias:
+            raise ArchivedYearReadOnly(f"{current_fsyear()} 年度はアーカイブ済みのため更新できません")
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db.startswith(ALIAS_PREFIX):
+            return app_label == "exam2"
+        return None
+
+
+class FsyearMiddleware:
+    """?fsyear=（無ければ X-Fsyear ヘッダ）をリクエスト中の年度コンテキストにする"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        fsyear = request.GET.get("fsyear") or request.headers.get("X-Fsyear")
+        if not (fsyear and str(fsyear).isdigit()):
+            fsyear = None
+        with use_fsyear(fsyear):
+            return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, ArchivedYearReadOnly):
+            return JsonResponse({"error": str(exception)}, status=409)
+        return None
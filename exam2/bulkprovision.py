@@ -0,0 +1,384 @@
+# exam2/bulkprovision.py
+"""
+StudentExam / ExamAdjust の初期行を一括で作る（studentexam_init / studentexam_from_version /
+examadjust_init / provision_subject）。
+
+従来の *_init は学生 × 問題ごとに get_or_create（1 行 2 クエリ）で、studentexam_init は学年で絞るために
+Student を全件 Python に読み込んでいた。
+
+- 対象のキー（(student, exam, question) など）は集合として作る
+  学生は SQL で絞り込み（学年 = entyear、割当 = StudentExamVersion）、Question は exam ごとに 1 回で引く
+- 既存の行のキーは 1 クエリで集合にして差を取る → 無い行だけ作る
+- 作成は ignore_conflicts の bulk_create を batch_size ごと（PostgreSQL は COPY → ON CONFLICT DO NOTHING）
+  差を取ったあとに別プロセスが同じ行を作っても一意制約で落ちない
+- 件数・所要時間・rows/sec を BulkStats で返す
+
+後から割り当てられた学生（provision_delta）:
+- StudentExamVersion はあるのに StudentExam / ExamAdjust が欠けている割当、
+  逆に割当の無い StudentExam / ExamAdjust を NOT EXISTS（anti-join）で探す。科目でも年度全体でも 1 回のクエリ
+- 欠けている学生の分だけ上の insert_missing で作る（既存との突き合わせもその学生に絞る）
+- 割当の無い行は prune=True のときだけ消す。採点済み（TF / hosei / adjust が 0 以外）の行は force=True のときだけ
+
+packed 運用（settings.EXAM2_ANSWER_STORAGE = "packed"）では StudentExam の代わりに
+全セル 0 の AnswerSheet を (student, exam) ごとに作る（provision_answer_sheets / missing_answer_sheet）。
+"""
+
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q
+from django.utils import timezone
+
+from .answersheet import pack_hosei, pack_tf
+from .models import AnswerSheet, ExamAdjust, Question, Student, StudentExam, StudentExamVersion, Subject
+from .pgcopy import copy_rows
+
+
+BATCH_SIZE = 2000
+
+STUDENT_EXAM_KEYS = ("student", "exam", "question")
+EXAM_ADJUST_KEYS = ("student", "exam")
+ANSWER_SHEET_KEYS = ("student", "exam")
+
+
+class BulkProvisionError(Exception):
+    pass
+
+
+@dataclass
+class BulkStats:
+    target: int = 0        # 作るべき行（キーの数）
+    existing: int = 0      # そのうち既にあった行
+    inserted: int = 0      # 作成した行（bulk_create は試行数、COPY は実際に入った数）
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.inserted / self.seconds if self.seconds > 0 else 0.0
+
+    def add(self, other: "BulkStats") -> "BulkStats":
+        for name in ("target", "existing", "inserted", "batches", "seconds"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    def summary(self) -> str:
+        return (
+            f"target={self.target} existing={self.existing} inserted={self.inserted}"
+            f" batches={self.batches} {self.seconds:.3f}s ({self.rows_per_sec:,.0f} rows/sec)"
+        )
+
+
+def _batches(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_missing(model, key_fields, targets, existing, *, defaults=None, batch_size=BATCH_SIZE,
+                   use_copy=False, dry_run=False) -> BulkStats:
+    """
+    targets（key_fields 順の id のタプル）のうち existing（model の QuerySet）に無いものだけ作る。
+    defaults: キー以外の列の値（ForeignKey はフィールド名 → id）
+    """
+    started = time.perf_counter()
+    defaults = dict(defaults or {})
+    stats = BulkStats()
+
+    have = set(existing.values_list(*key_fields))   # 既存との突き合わせは 1 クエリ
+    missing = []
+    for key in targets:
+        stats.target += 1
+        if key in have:
+            stats.existing += 1
+        else:
+            missing.append(key)
+
+    if not dry_run and missing:
+        meta = model._meta
+        with transaction.atomic():
+            if use_copy:
+                # COPY はモデルを通らないので updated_at（auto_now）はここで入れる
+                if any(f.name == "updated_at" for f in meta.concrete_fields):
+                    defaults.setdefault("updated_at", timezone.now())
+                fields = (*key_fields, *defaults)
+                extra = tuple(defaults.values())
+                for chunk in _batches(missing, batch_size):
+                    stats.inserted += copy_rows(
+                        model, fields, (key + extra for key in chunk), conflict_fields=key_fields,
+                    )
+                    stats.batches += 1
+            else:
+                attnames = [meta.get_field(name).attname for name in key_fields]
+                values = {meta.get_field(name).attname: value for name, value in defaults.items()}
+                for chunk in _batches(missing, batch_size):
+                    model.objects.bulk_create(
+                        [model(**dict(zip(attnames, key)), **values) for key in chunk],
+                        batch_size=batch_size,
+                        ignore_conflicts=True,
+                    )
+                    stats.inserted += len(chunk)
+                    stats.batches += 1
+    elif dry_run:
+        stats.inserted = len(missing)
+
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+# =========================
+# 対象（Subject / キー）
+# =========================
+
+def resolve_subject(subjectNo, fsyear, term=None):
+    """Phase3：Subject は (subjectNo, fsyear) で確定。term を渡したら Subject.term と照合する"""
+    try:
+        subject = Subject.objects.get(subjectNo=subjectNo, fsyear=int(fsyear))
+    except Subject.DoesNotExist:
+        raise BulkProvisionError(f"Subject が存在しません: subjectNo={subjectNo} fsyear={fsyear}")
+    if term is not None and subject.term is not None and int(subject.term) != int(term):
+        raise BulkProvisionError(
+            f"term 不一致: 引数={term}, Subject.term={subject.term}（subjectNo={subjectNo} fsyear={fsyear}）"
+        )
+    return subject
+
+
+def question_ids_by_exam(exam_ids) -> dict:
+    """{exam_id: [question_id, ...]}（1 クエリ）"""
+    by_exam = {exam_id: [] for exam_id in exam_ids}
+    for exam_id, qid in (
+        Question.objects.filter(exam_id__in=list(by_exam)).order_by("exam_id", "gyo", "retu")
+        .values_list("exam_id", "id")
+    ):
+        by_exam[exam_id].append(qid)
+    return by_exam
+
+
+def grade_student_ids(fsyear, nenji) -> list:
+    """fsyear に nenji 年生の学生（学年 = fsyear - entyear + 1 を entyear の条件にして SQL で絞る）"""
+    entyear = int(fsyear) - int(nenji) + 1
+    return list(Student.objects.filter(entyear=entyear).order_by("stdNo").values_list("id", flat=True))
+
+
+def assigned_pairs(subject) -> list:
+    """科目の StudentExamVersion の (student_id, exam_id)"""
+    return list(StudentExamVersion.objects.filter(subject=subject).values_list("student_id", "exam_id"))
+
+
+def student_exam_keys(pairs, question_ids: dict):
+    """(student_id, exam_id) × その exam の Question → (student_id, exam_id, question_id)"""
+    for student_id, exam_id in pairs:
+        for qid in question_ids.get(exam_id) or ():
+            yield (student_id, exam_id, qid)
+
+
+# =========================
+# 作成
+# =========================
+
+def _existing(model, subject, pairs, only_listed):
+    qs = model.objects.filter(subject=subject)
+    if only_listed:
+        qs = qs.filter(student_id__in=sorted({student_id for student_id, _ in pairs}))
+    return qs
+
+
+def provision_student_exams(subject, pairs, *, question_ids=None, only_listed=False, **kw) -> BulkStats:
+    """
+    pairs（(student_id, exam_id)）× Question の StudentExam（TF=0, hosei=0, earned=0）のうち無いものを作る
+    only_listed: 既存との突き合わせを pairs の学生に絞る（科目の一部の学生だけ作るとき）
+    """
+    pairs = list(pairs)
+    existing = _existing(StudentExam, subject, pairs, only_listed)
+    if question_ids is None:
+        question_ids = question_ids_by_exam({exam_id for _, exam_id in pairs})
+    else:
+        # 問題を渡されたとき（reconcile で追加した問題だけ など）は既存との突き合わせもその問題に絞る
+        existing = existing.filter(question_id__in=sorted({q for ids in question_ids.values() for q in ids}))
+    return insert_missing(
+        StudentExam,
+        STUDENT_EXAM_KEYS,
+        student_exam_keys(pairs, question_ids),
+        existing,
+        defaults={"subject": subject.id, "TF": 0, "hosei": 0, "earned": 0},
+        **kw,
+    )
+
+
+def provision_exam_adjusts(subject, pairs, *, only_listed=False, **kw) -> BulkStats:
+    """pairs（(student_id, exam_id)）の ExamAdjust（adjust=0）のうち無いものを作る"""
+    pairs = list(pairs)
+    return insert_missing(
+        ExamAdjust,
+        EXAM_ADJUST_KEYS,
+        pairs,
+        _existing(ExamAdjust, subject, pairs, only_listed),
+        defaults={"subject": subject.id, "adjust": 0},
+        **kw,
+    )
+
+
+def provision_answer_sheets(subject, pairs, *, question_ids=None, only_listed=False, **kw) -> BulkStats:
+    """
+    packed 運用：pairs（(student_id, exam_id)）の AnswerSheet（全セル 0）のうち無いものを作る。
+    セル数は exam ごとに違うので、exam ごとに insert_missing を呼ぶ
+    """
+    by_exam = {}
+    for student_id, exam_id in pairs:
+        by_exam.setdefault(exam_id, []).append((student_id, exam_id))
+    if question_ids is None:
+        question_ids = question_ids_by_exam(by_exam)
+
+    stats = BulkStats()
+    for exam_id, keys in by_exam.items():
+        n = len(question_ids.get(exam_id) or ())
+        existing = AnswerSheet.objects.filter(exam_id=exam_id)
+        if only_listed:
+            existing = existing.filter(student_id__in=sorted({student_id for student_id, _ in keys}))
+        stats.add(insert_missing(
+            AnswerSheet,
+            ANSWER_SHEET_KEYS,
+            keys,
+            existing,
+            defaults={
+                "question_count": n, "tf_bits": pack_tf([0] * n), "hosei": pack_hosei([0] * n),
+                "score": 0, "hosei_total": 0, "total": 0,
+            },
+            **kw,
+        ))
+    return stats
+
+
+# =========================
+# 差分（後から割り当てられた学生 / 割当の無い行）
+# =========================
+
+def missing_student_exam(scope: dict):
+    """割当の exam の Question のうち StudentExam が 1 つでも欠けている割当（(subject_id, student_id, exam_id)）"""
+    missing_cell = Question.objects.filter(exam=OuterRef("exam")).filter(
+        ~Exists(StudentExam.objects.filter(
+            student=OuterRef(OuterRef("student")), exam=OuterRef(OuterRef("exam")), question=OuterRef("pk"),
+        ))
+    )
+    return (
+        StudentExamVersion.objects.filter(**scope).filter(Exists(missing_cell))
+        .values_list("subject_id", "student_id", "exam_id")
+    )
+
+
+def missing_exam_adjust(scope: dict):
+    """ExamAdjust が無い割当（(subject_id, student_id, exam_id)）"""
+    return (
+        StudentExamVersion.objects.filter(**scope)
+        .filter(~Exists(ExamAdjust.objects.filter(student=OuterRef("student"), exam=OuterRef("exam"))))
+        .values_list("subject_id", "student_id", "exam_id")
+    )
+
+
+def missing_answer_sheet(scope: dict):
+    """AnswerSheet が無い割当（(subject_id, student_id, exam_id)）"""
+    return (
+        StudentExamVersion.objects.filter(**scope)
+        .filter(~Exists(AnswerSheet.objects.filter(student=OuterRef("student"), exam=OuterRef("exam"))))
+        .values_list("subject_id", "student_id", "exam_id")
+    )
+
+
+def orphan_rows(model, scope: dict):
+    """(student, exam) の割当が無い StudentExam / ExamAdjust の QuerySet"""
+    return model.objects.filter(**scope).filter(
+        ~Exists(StudentExamVersion.objects.filter(student=OuterRef("student"), exam=OuterRef("exam")))
+    )
+
+
+GRADED = {
+    StudentExam: ~Q(TF=0) | ~Q(hosei=0),
+    ExamAdjust: ~Q(adjust=0),
+}
+
+
+@dataclass
+class DeltaReport:
+    subject: object
+    missing_student_exam: list = field(default_factory=list)   # [(student_id, exam_id)]
+    missing_exam_adjust: list = field(default_factory=list)
+    missing_answer_sheet: list = field(default_factory=list)
+    orphans: dict = field(default_factory=dict)     # "student_exam" / "exam_adjust" → {"rows", "graded", "students", "deleted"}
+    stats: dict = field(default_factory=dict)       # "student_exam" / "exam_adjust" → BulkStats
+
+    @property
+    def clean(self) -> bool:
+        return not (self.missing_student_exam or self.missing_exam_adjust or self.missing_answer_sheet
+                    or any(o["rows"] for o in self.orphans.values()))
+
+
+def find_gaps(scope: dict, *, student_exam: bool = True, answer_sheet: bool = False) -> dict:
+    """
+    scope（{"subject": ...} / {"subject__fsyear": ...}）の欠け・割当の無い行を subject_id ごとにまとめる
+    answer_sheet=True（packed 運用）なら AnswerSheet の欠けも見る
+    """
+    reports = {}
+
+    def report(subject_id):
+        if subject_id not in reports:
+            reports[subject_id] = DeltaReport(subject=subject_id)
+        return reports[subject_id]
+
+    if student_exam:
+        for subject_id, student_id, exam_id in missing_student_exam(scope):
+            report(subject_id).missing_student_exam.append((student_id, exam_id))
+    for subject_id, student_id, exam_id in missing_exam_adjust(scope):
+        report(subject_id).missing_exam_adjust.append((student_id, exam_id))
+    if answer_sheet:
+        for subject_id, student_id, exam_id in missing_answer_sheet(scope):
+            report(subject_id).missing_answer_sheet.append((student_id, exam_id))
+
+    for key, model in (("student_exam", StudentExam), ("exam_adjust", ExamAdjust)):
+        orphans = orphan_rows(model, scope)
+        for subject_id, student_id, graded in orphans.values_list(
+            "subject_id", "student_id", ExpressionWrapper(GRADED[model], output_field=BooleanField()),
+        ).iterator():
+            entry = report(subject_id).orphans.setdefault(
+                key, {"rows": 0, "graded": 0, "students": set(), "deleted": 0},
+            )
+            entry["rows"] += 1
+            entry["graded"] += bool(graded)
+            entry["students"].add(student_id)
+
+    subjects = Subject.objects.in_bulk(list(reports))
+    for subject_id, rep in reports.items():
+        rep.subject = subjects[subject_id]
+    return dict(sorted(reports.items(), key=lambda item: item[1].subject.subjectNo))
+
+
+def fill_gaps(rep: DeltaReport, *, prune: bool = False, force: bool = False, dry_run: bool = False, **kw) -> DeltaReport:
+    """find_gaps の 1 科目分を反映する（欠けている学生の分だけ作る / prune なら割当の無い行を消す）"""
+    subject = rep.subject
+    with transaction.atomic():
+        if rep.missing_student_exam:
+            rep.stats["student_exam"] = provision_student_exams(
+                subject, rep.missing_student_exam, only_listed=True, dry_run=dry_run, **kw,
+            )
+        if rep.missing_exam_adjust:
+            rep.stats["exam_adjust"] = provision_exam_adjusts(
+                subject, rep.missing_exam_adjust, only_listed=True, dry_run=dry_run, **kw,
+            )
+        if rep.missing_answer_sheet:
+            rep.stats["answer_sheet"] = provision_answer_sheets(
+                subject, rep.missing_answer_sheet, only_listed=True, dry_run=dry_run, **kw,
+            )
+        if prune:
+            for key, model in (("student_exam", StudentExam), ("exam_adjust", ExamAdjust)):
+                entry = rep.orphans.get(key)
+                if not entry:
+                    continue
+                qs = orphan_rows(model, {"subject": subject})
+                if not force:
+                    qs = qs.exclude(GRADED[model])
+                entry["deleted"] = qs.count() if dry_run else qs.delete()[1].get(model._meta.label, 0)
+    return rep
@@ -0,0 +1,256 @@
+# exam2/catalog.py
+"""
+マスタ系（Subject / Exam / Question / Student）の参照キャッシュ（プロセス内・件数上限付き LRU）。
+
+- (subjectNo, fsyear) → Subject
+- exam_id → Exam（subject を select_related 済み）
+- subject_id → {version: Exam}
+- exam_id → ((question_id, points), ...)（gyo, retu, id 順。AnswerSheet のセル並び / sparse の既定セル）
+- stdNo → student_id
+
+これらは load_* 系コマンドでしか変わらないので、リクエストごとの同じ SELECT を省く。
+
+無効化:
+- このプロセスでの save / delete（signals.py の post_save / post_delete）→ invalidate()
+- Question を bulk で書き換える処理（questionsync / load_questions）→ 書いた直後に invalidate()
+- マスタを書き換えるコマンド（handle に @invalidates_catalog）→ 終了時に invalidate()
+- invalidate() は settings.EXAM2_CATALOG["stamp"] のファイルも touch する。
+  他のプロセス（web のワーカー）は check_interval 秒ごとに mtime を見て、変わっていれば捨てる
+
+キーには読み込み先の DB エイリアスを含める（アーカイブ年度・レプリカのルーティングと混ざらないように）。
+モデルインスタンスは呼び出し側が書き換えても良いよう、コピーを返す。
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.http import Http404
+
+
+DEFAULTS = {
+    "enabled": True,
+    "maxsize": 4096,        # 全種類合わせたエントリ数の上限
+    "stamp": None,          # プロセス間で無効化を伝えるファイル（None ならプロセス内のみ）
+    "check_interval": 1.0,  # 秒。stamp の mtime を見る間隔
+}
+
+_MISSING = object()
+
+
+def catalog_options() -> dict:
+    return {**DEFAULTS, **(getattr(settings, "EXAM2_CATALOG", None) or {})}
+
+
+# =========================
+# LRU 本体
+# =========================
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._stamp_mtime = None
+        self._stamp_checked = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = {}
+            self.misses = {}
+            self.evictions = 0
+            self.invalidations = 0
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def _sync_stamp(self, opts):
+        path = opts["stamp"]
+        if not path:
+            return
+        now = time.monotonic()
+        if now - self._stamp_checked < opts["check_interval"]:
+            return
+        self._stamp_checked = now
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._stamp_mtime:
+            if self._stamp_mtime is not None or mtime is not None:
+                self.clear()
+            self._stamp_mtime = mtime
+
+    def get(self, key, loader):
+        """key が無ければ loader() で読んで入れる（None も「無い」として覚える）"""
+        opts = catalog_options()
+        if not opts["enabled"]:
+            return loader()
+
+        kind = key[0]
+        self._sync_stamp(opts)
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is not _MISSING:
+                self._data.move_to_end(key)
+                self.hits[kind] = self.hits.get(kind, 0) + 1
+                return value
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+
+        value = loader()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > opts["maxsize"]:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def touch_stamp(self):
+        path = catalog_options()["stamp"]
+        if not path:
+            return
+        path = Path(path)
+        path.touch()
+        with self._lock:
+            self._stamp_mtime = path.stat().st_mtime_ns
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            kinds = sorted(set(self.hits) | set(self.misses))
+            total_hits = sum(self.hits.values())
+            total = total_hits + sum(self.misses.values())
+            return {
+                "size": len(self._data),
+                "maxsize": catalog_options()["maxsize"],
+                "hit_rate": round(total_hits / total, 4) if total else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "kinds": {
+                    k: {"hits": self.hits.get(k, 0), "misses": self.misses.get(k, 0)}
+                    for k in kinds
+                },
+            }
+
+
+catalog = CatalogCache()
+
+
+def invalidate():
+    """キャッシュを捨て、他プロセスにも stamp で知らせる（トランザクション中ならコミット後にもう一度）"""
+    catalog.clear()
+    catalog.touch_stamp()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate)
+
+
+def invalidates_catalog(handle):
+    """マスタを書き換えるコマンドの handle 用：終わったら（失敗しても）invalidate()"""
+
+    @wraps(handle)
+    def wrapper(self, *args, **options):
+        try:
+            return handle(self, *args, **options)
+        finally:
+            invalidate()
+
+    return wrapper
+
+
+# =========================
+# 参照
+# =========================
+
+def _alias(model):
+    return router.db_for_read(model) or DEFAULT_DB_ALIAS
+
+
+def subject(subjectNo, fsyear):
+    from .models import Subject
+
+    alias = _alias(Subject)
+    obj = catalog.get(
+        ("subject", alias, str(subjectNo), int(fsyear)),
+        lambda: Subject.objects.using(alias).filter(subjectNo=subjectNo, fsyear=int(fsyear)).first(),
+    )
+    return copy.copy(obj) if obj is not None else None
+
+
+def subject_or_404(subjectNo, fsyear):
+    obj = subject(subjectNo, fsyear)
+    if obj is None:
+        raise Http404("Subject が見つかりません")
+    return obj
+
+
+def exam(pk):
+    from .models import Exam
+
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    alias = _alias(Exam)
+    obj = catalog.get(
+        ("exam", alias, pk),
+        lambda: Exam.objects.using(alias).select_related("subject").filter(pk=pk).first(),
+    )
+    return copy.copy(obj) if obj is not None else None
+
+
+def exam_or_404(pk):
+    obj = exam(pk)
+    if obj is None:
+        raise Http404("Exam が見つかりません")
+    return obj
+
+
+def exams_by_version(subject_id) -> dict:
+    """{version: Exam}（version 順）"""
+    from .models import Exam
+
+    alias = _alias(Exam)
+    exams = catalog.get(
+        ("exams", alias, int(subject_id)),
+        lambda: tuple(Exam.objects.using(alias).filter(subject_id=subject_id).order_by("version")),
+    )
+    return {e.version: copy.copy(e) for e in exams}
+
+
+def question_points(exam_id) -> tuple:
+    """((question_id, points), ...)（gyo, retu, id 順）"""
+    from .models import Question
+
+    alias = _alias(Question)
+    return catalog.get(
+        ("questions", alias, int(exam_id)),
+        lambda: tuple(
+            Question.objects.using(alias).filter(exam_id=exam_id)
+            .order_by("gyo", "retu", "id").values_list("id", "points")
+        ),
+    )
+
+
+def student_id(stdNo):
+    from .models import Student
+
+    alias = _alias(Student)
+    return catalog.get(
+        ("student", alias, str(stdNo)),
+        lambda: Student.objects.using(alias).filter(stdNo=stdNo).values_list("id", flat=True).first(),
+    )
+
+
+def student_id_or_404(stdNo):
+    sid = student_id(stdNo)
+    if sid is None:
+        raise Http404("Student が見つかりません")
+    return sid
@@ -0,0 +1,79 @@
+# exam2/dbprofile.py
+"""
+SQLite 接続プロファイル。
+
+settings.SQLITE_PROFILE の PRAGMA を、新しい DB 接続ができるたびに
+（connection_created シグナル経由で）発行する。sqlite 以外の接続では何もしない。
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+# 発行順。journal_mode は他より先に（WAL 切替はロックを取るため）
+PRAGMA_ORDER = ("busy_timeout", "journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store")
+
+CHOICES = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+INTEGER_PRAGMAS = {"busy_timeout", "mmap_size", "cache_size"}
+# PRAGMA の読み出しは数値で返るものがあるので名前に戻す
+READ_NAMES = {
+    "synchronous": {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"},
+    "temp_store": {0: "DEFAULT", 1: "FILE", 2: "MEMORY"},
+}
+
+
+def get_profile() -> dict:
+    return getattr(settings, "SQLITE_PROFILE", None) or {}
+
+
+def pragma_statements(profile: dict) -> list[str]:
+    """profile を検証して PRAGMA 文のリストにする"""
+    unknown = set(profile) - set(PRAGMA_ORDER)
+    if unknown:
+        raise ImproperlyConfigured(f"SQLITE_PROFILE に未対応の項目があります: {sorted(unknown)}")
+
+    statements = []
+    for name in PRAGMA_ORDER:
+        if name not in profile or profile[name] is None:
+            continue
+        value = profile[name]
+        if name in INTEGER_PRAGMAS:
+            value = int(value)
+        else:
+            value = str(value).upper()
+            if value not in CHOICES[name]:
+                raise ImproperlyConfigured(f"SQLITE_PROFILE[{name!r}] が不正です: {profile[name]!r}")
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def apply_profile(connection, profile: dict | None = None) -> None:
+    if connection.vendor != "sqlite":
+        return
+    profile = dict(get_profile() if profile is None else profile)
+    if connection.settings_dict.get("READ_ONLY"):
+        # 読み取り専用で開いた DB（レプリカ）はジャーナル設定を変えられない
+        profile.pop("journal_mode", None)
+        profile.pop("synchronous", None)
+    statements = pragma_statements(profile)
+    if not statements:
+        return
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def effective_pragmas(connection) -> dict:
+    """接続上で実際に効いている値（show_db_pragmas 用）"""
+    out = {}
+    with connection.cursor() as cursor:
+        for name in PRAGMA_ORDER:
+            cursor.execute(f"PRAGMA {name}")
+            row = cursor.fetchone()
+            value = row[0] if row else None
+            out[name] = READ_NAMES.get(name, {}).get(value, value)
+    return out
@@ -0,0 +1,165 @@
+# exam2/dbwrite.py
+"""
+短い書き込みトランザクションの実行層（SQLite のロック競合対策）。
+
+- BEGIN IMMEDIATE で開始し、書き込みロックを最初に取る
+  （BEGIN（DEFERRED）だと読み→書きの昇格時に SQLITE_BUSY になり、busy_timeout でも待てない）
+- "database is locked" / "database table is locked" は、上限付きのジッタ入り指数バックオフで再試行する
+- settings.EXAM2_WRITE["serialize"] = True なら、プロセス内の書き込みを 1 本の待ち行列に並べる
+- 待ち時間・再試行回数などを write_metrics に集計（/api/write-metrics/ で参照）
+
+すでに atomic ブロックの中で呼ばれた場合は外側のトランザクションを壊さないよう、
+再試行せずにそのまま実行する。
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+
+DEFAULTS = {
+    "retries": 6,          # 再試行回数（初回を含まない）
+    "base_delay": 0.02,    # 秒。attempt ごとに 2 倍
+    "max_delay": 0.5,      # 秒。1 回の待ちの上限
+    "serialize": False,    # True: プロセス内の書き込みを直列化する
+}
+
+LOCK_MESSAGES = ("database is locked", "database table is locked")
+
+
+class WriteBusy(Exception):
+    """再試行しても書き込みロックが取れなかった（API では 503 で返す）"""
+
+
+def write_options() -> dict:
+    return {**DEFAULTS, **(getattr(settings, "EXAM2_WRITE", None) or {})}
+
+
+def is_lock_error(exc: Exception) -> bool:
+    return isinstance(exc, OperationalError) and any(m in str(exc) for m in LOCK_MESSAGES)
+
+
+# =========================
+# メトリクス
+# =========================
+
+class WriteMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.retries = 0
+            self.failures = 0
+            self.queue_wait_ms = 0.0
+            self.backoff_ms = 0.0
+            self.txn_ms = 0.0
+            self.max_wait_ms = 0.0
+
+    def record(self, *, retries, queue_wait_ms, backoff_ms, txn_ms, failed):
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.failures += 1 if failed else 0
+            self.queue_wait_ms += queue_wait_ms
+            self.backoff_ms += backoff_ms
+            self.txn_ms += txn_ms
+            self.max_wait_ms = max(self.max_wait_ms, queue_wait_ms + backoff_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = self.calls or 1
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "avg_queue_wait_ms": round(self.queue_wait_ms / calls, 3),
+                "avg_backoff_ms": round(self.backoff_ms / calls, 3),
+                "avg_txn_ms": round(self.txn_ms / calls, 3),
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+
+write_metrics = WriteMetrics()
+_write_queue = threading.Lock()  # serialize=True のときの待ち行列
+
+
+# =========================
+# 実行
+# =========================
+
+@contextmanager
+def immediate_atomic(using=None):
+    """sqlite なら BEGIN IMMEDIATE で始まる transaction.atomic"""
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    def begin_immediate():
+        connection.cursor().execute("BEGIN IMMEDIATE")
+
+    # 接続はスレッドごとなので、インスタンス属性での差し替えは他スレッドに影響しない
+    connection._start_transaction_under_autocommit = begin_immediate
+    try:
+        with transaction.atomic(using=using):
+            connection.__dict__.pop("_start_transaction_under_autocommit", None)
+            yield
+    finally:
+        connection.__dict__.pop("_start_transaction_under_autocommit", None)
+
+
+def run_write(fn, *, using=None):
+    """
+    fn() を短い書き込みトランザクションとして実行し、その戻り値を返す。
+    ロック競合は再試行し、上限を超えたら WriteBusy。fn は再実行されても良いように書くこと。
+    """
+    if connections[using or DEFAULT_DB_ALIAS].in_atomic_block:
+        return fn()
+
+    opts = write_options()
+    retries = 0
+    backoff = 0.0
+    queue_wait = 0.0
+    started = time.perf_counter()
+    failed = False
+
+    try:
+        while True:
+            try:
+                if opts["serialize"]:
+                    t0 = time.perf_counter()
+                    with _write_queue:
+                        queue_wait += time.perf_counter() - t0
+                        with immediate_atomic(using):
+                            return fn()
+                with immediate_atomic(using):
+                    return fn()
+            except OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                if retries >= opts["retries"]:
+                    failed = True
+                    raise WriteBusy(str(e)) from e
+                cap = min(opts["max_delay"], opts["base_delay"] * (2 ** retries))
+                delay = random.uniform(cap / 2, cap)
+                time.sleep(delay)
+                backoff += delay
+                retries += 1
+    finally:
+        elapsed = time.perf_counter() - started
+        write_metrics.record(
+            retries=retries,
+            queue_wait_ms=queue_wait * 1000,
+            backoff_ms=backoff * 1000,
+            txn_ms=(elapsed - queue_wait - backoff) * 1000,
+            failed=failed,
+        )
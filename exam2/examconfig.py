@@ -0,0 +1,192 @@
+# exam2/examconfig.py
+"""
+試験設定（answer_xxxx.json などのパス・現在の年度）の解決。
+
+従来は各コマンドが sys.path に <BASE_DIR の親>/@TTC/util を足して utils を import し、
+実行のたびに utils.get_exam_config_path / get_current_fsyear（= YAML の読み直し）を呼んでいた。
+
+- 解決の順は 上書きファイル → dirinfo.yaml → 外部の utils
+- ローカルの上書きファイル（settings.EXAM2_EXAM_CONFIG["override"]）にあればそれを使う
+  → 外部ツリーが無い環境（開発PC・テスト）でも動く
+- 外部の dirinfo.yaml（["dirinfo"]）は自前で 1 回だけパースし、全科目をそのコピーから引く
+  （上書きファイルと同じ形。utils.get_exam_config_path は呼ぶたびに YAML を読み直すため）
+- どちらにも無いキーだけ utils に聞く。utils は初めて必要になったときに 1 回だけ import する
+- パース結果・解決結果はプロセス内で覚えておく。監視している YAML（上書きファイル・dirinfo.yaml・
+  watch）の mtime が変わったら捨てる。多数の科目を回すバッチでも YAML は mtime が変わるまで読み直さない
+
+上書きファイル / dirinfo.yaml の形（YAML）:
+
+    fsyear: 2025              # get_current_fsyear の代わり（任意）
+    subjects:
+      "1010401":
+        2025:
+          ans_json: answers/answer_1010401.json   # 相対パスは上書きファイルの場所から
+"""
+
+import importlib
+import os
+import sys
+import threading
+from pathlib import Path
+
+import yaml
+from django.conf import settings
+
+
+_lock = threading.Lock()
+_state = {"stamp": None, "yaml": {}, "resolved": {}}
+_helpers = {}   # (util_dir, module) → import 済みモジュール
+
+
+class ExamConfigError(Exception):
+    pass
+
+
+def config_options() -> dict:
+    base = Path(settings.BASE_DIR)
+    dirinfo = base.parent / "@TTC" / "dirinfo.yaml"
+    defaults = {
+        "util_dir": base.parent / "@TTC" / "util",   # 外部 utils.py の場所
+        "module": "utils",
+        "override": base / "exam2" / "data" / "examconfig.local.yaml",
+        "dirinfo": dirinfo,                           # utils が読む YAML（自前でもパースする）
+        "watch": (dirinfo,),                          # mtime を見る YAML
+    }
+    return {**defaults, **(getattr(settings, "EXAM2_EXAM_CONFIG", None) or {})}
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+def _sync(opts) -> None:
+    """監視ファイルの mtime が変わっていたら覚えている内容を捨てる（_lock 中に呼ぶ）"""
+    watched = dict.fromkeys(str(p) for p in (opts["override"], opts["dirinfo"], *opts["watch"]) if p)
+    stamp = tuple((p, _mtime(p)) for p in watched)
+    if stamp != _state["stamp"]:
+        _state.update(stamp=stamp, yaml={}, resolved={})
+
+
+def clear_cache() -> None:
+    with _lock:
+        _state.update(stamp=None, yaml={}, resolved={})
+
+
+# =========================
+# 読み込み元
+# =========================
+
+def _load_yaml(path) -> dict:
+    """YAML を mtime が変わるまで 1 回だけパースする（_lock 中に呼ぶ）。無ければ {}"""
+    key = str(path) if path else ""
+    if key not in _state["yaml"]:
+        data = {}
+        if path and Path(path).exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = yaml.safe_load(f) or {}
+            except (OSError, yaml.YAMLError) as e:
+                raise ExamConfigError(f"{path} を読めません: {e}")
+        _state["yaml"][key] = data if isinstance(data, dict) else {}
+    return _state["yaml"][key]
+
+
+def _sources(opts):
+    """(パース済み YAML, 相対パスの基準) を優先順に"""
+    for name in ("override", "dirinfo"):
+        path = opts[name]
+        if path:
+            yield _load_yaml(path), Path(path).parent
+
+
+def _load_helper(opts):
+    """外部の utils を 1 回だけ import する"""
+    util_dir = str(opts["util_dir"])
+    key = (util_dir, opts["module"])
+    if key not in _helpers:
+        if util_dir not in sys.path:
+            sys.path.insert(0, util_dir)
+        try:
+            _helpers[key] = importlib.import_module(opts["module"])
+        except Exception as e:
+            raise ExamConfigError(
+                f"{opts['module']}.py を import できません（{util_dir}）: {e}。"
+                f" 上書きファイル {opts['override']} に設定を書けば外部ツリー無しでも動きます"
+            )
+    return _helpers[key]
+
+
+def _lookup_path(data, base_dir, subjectNo, fsyear, key):
+    """subjects → subjectNo → fsyear → key。形が違う（utils 独自の書き方など）ときは None"""
+    block = data.get("subjects")
+    for k in ((str(subjectNo), _as_int(subjectNo)), (int(fsyear), str(fsyear))):
+        if not isinstance(block, dict):
+            return None
+        block = block.get(k[0]) or block.get(k[1])
+    value = block.get(key) if isinstance(block, dict) else None
+    if not value:
+        return None
+    path = Path(value)
+    return path if path.is_absolute() else base_dir / path
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# =========================
+# 解決
+# =========================
+
+def current_fsyear() -> int:
+    """上書きファイル → dirinfo.yaml の fsyear、無ければ utils.get_current_fsyear()"""
+    opts = config_options()
+    with _lock:
+        _sync(opts)
+        cached = _state["resolved"].get(("fsyear",))
+        if cached is not None:
+            return cached
+        fsyear = next((data["fsyear"] for data, _ in _sources(opts) if data.get("fsyear")), None)
+    if fsyear is None:
+        try:
+            fsyear = _load_helper(opts).get_current_fsyear()
+        except ExamConfigError:
+            raise
+        except Exception as e:
+            raise ExamConfigError(f"fsyear を自動特定できませんでした: {e}")
+    fsyear = int(fsyear)
+    with _lock:
+        _state["resolved"][("fsyear",)] = fsyear
+    return fsyear
+
+
+def config_path(subjectNo, fsyear, key: str = "ans_json") -> Path:
+    """(subjectNo, fsyear) の key（ans_json など）のパス。上書きファイル → dirinfo.yaml → utils の順"""
+    opts = config_options()
+    cache_key = ("path", str(subjectNo), int(fsyear), key)
+    with _lock:
+        _sync(opts)
+        cached = _state["resolved"].get(cache_key)
+        if cached is not None:
+            return cached
+        path = None
+        for data, base_dir in _sources(opts):
+            path = _lookup_path(data, base_dir, subjectNo, fsyear, key)
+            if path is not None:
+                break
+    if path is None:
+        try:
+            path = Path(_load_helper(opts).get_exam_config_path(str(subjectNo), str(int(fsyear)), key))
+        except ExamConfigError:
+            raise
+        except Exception as e:
+            raise ExamConfigError(f"YAML からのパス取得に失敗しました（{subjectNo}, {fsyear}, {key}）: {e}")
+    with _lock:
+        _state["resolved"][cache_key] = path
+    return path
@@ -0,0 +1,117 @@
+# exam2/management/commands/archive_fsyear.py
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from exam2.archive import archive_path, register_archive, unregister_archive
+from exam2.catalog import invalidates_catalog
+from exam2.models import (
+    Subject,
+    Exam,
+    Question,
+    Student,
+    StudentExamVersion,
+    StudentExam,
+    ExamAdjust,
+    AnswerSheet,
+    ExportWatermark,
+)
+
+
+class Command(BaseCommand):
+    help = "終わった年度の Subject 以下（Exam/Question/採点データ）を年度別 SQLite ファイルへ移す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("fsyear", type=int)
+        parser.add_argument("--dry-run", action="store_true", help="件数の確認のみ")
+        parser.add_argument("--keep", action="store_true", help="コピーのみ行い、作業DBからは削除しない")
+        parser.add_argument("--replace", action="store_true", help="既存のアーカイブファイルを作り直す")
+        parser.add_argument("--force", action="store_true", help="settings.FSYEAR（当年度）でも実行する")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def querysets(self, fsyear):
+        """コピー順（参照される側から）"""
+        sev_students = StudentExamVersion.objects.filter(subject__fsyear=fsyear).values("student_id")
+        se_students = StudentExam.objects.filter(subject__fsyear=fsyear).values("student_id")
+        return [
+            (Student, Student.objects.filter(id__in=sev_students) | Student.objects.filter(id__in=se_students)),
+            (Subject, Subject.objects.filter(fsyear=fsyear)),
+            (Exam, Exam.objects.filter(subject__fsyear=fsyear)),
+            (Question, Question.objects.filter(exam__subject__fsyear=fsyear)),
+            (StudentExamVersion, StudentExamVersion.objects.filter(subject__fsyear=fsyear)),
+            (StudentExam, StudentExam.objects.filter(subject__fsyear=fsyear)),
+            (ExamAdjust, ExamAdjust.objects.filter(subject__fsyear=fsyear)),
+            (AnswerSheet, AnswerSheet.objects.filter(exam__subject__fsyear=fsyear)),
+            # Subject の CASCADE で作業DBから消えるので、delta の基準時刻も年度ファイルへ残す
+            (ExportWatermark, ExportWatermark.objects.filter(subject__fsyear=fsyear)),
+        ]
+
+    @invalidates_catalog
+    def handle(self, *args, **options):
+        fsyear = options["fsyear"]
+        batch_size = options["batch_size"]
+
+        if fsyear == getattr(settings, "FSYEAR", None) and not options["force"]:
+            raise CommandError(f"{fsyear} は settings.FSYEAR（当年度）です。アーカイブするなら --force を付けてください。")
+
+        querysets = [(model, qs.using(DEFAULT_DB_ALIAS)) for model, qs in self.querysets(fsyear)]
+        counts = {model.__name__: qs.count() for model, qs in querysets}
+        if not counts["Subject"]:
+            raise CommandError(f"fsyear={fsyear} の Subject が作業DBにありません")
+
+        path = archive_path(fsyear)
+        self.stdout.write(f"fsyear={fsyear} → {path}")
+        for name, cnt in counts.items():
+            self.stdout.write(f"  {name:20s} {cnt}")
+
+        if options["dry_run"]:
+            self.stdout.write(self.style.SUCCESS("DRY-RUN OK"))
+            return
+
+        if path.exists():
+            if not options["replace"]:
+                raise CommandError(f"アーカイブが既にあります: {path}（作り直すなら --replace）")
+            unregister_archive(fsyear)
+            path.unlink()
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # ---- 年度ファイルを作成（exam2 のスキーマ + student）----
+        alias = register_archive(fsyear)
+        call_command("migrate", "exam2", database=alias, verbosity=0)
+        with connections[alias].schema_editor() as editor:
+            editor.create_model(Student)  # managed=False なので migrate では作られない
+
+        # ---- コピー（id はそのまま）----
+        with transaction.atomic(using=alias):
+            for model, qs in querysets:
+                buf = []
+                for obj in qs.order_by("pk").iterator(chunk_size=batch_size):
+                    buf.append(obj)
+                    if len(buf) >= batch_size:
+                        model.objects.using(alias).bulk_create(buf, batch_size=batch_size)
+                        buf.clear()
+                if buf:
+                    model.objects.using(alias).bulk_create(buf, batch_size=batch_size)
+
+        copied = {model.__name__: model.objects.using(alias).count() for model, _ in querysets}
+        if copied != counts:
+            raise CommandError(f"コピー件数が一致しません（作業DBは変更していません）: {copied} != {counts}")
+        self.stdout.write(self.style.SUCCESS(f"アーカイブ作成: {path}"))
+
+        if options["keep"]:
+            self.stdout.write("--keep のため作業DBからは削除しません")
+            return
+
+        # ---- 作業DBから削除（Subject の CASCADE で Exam 以下も消える。student は共有なので残す）----
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            deleted, per_model = Subject.objects.using(DEFAULT_DB_ALIAS).filter(fsyear=fsyear).delete()
+        self.stdout.write(self.style.SUCCESS(f"作業DBから削除: {deleted} 行"))
+        for name, cnt in sorted(per_model.items()):
+            self.stdout.write(f"  {name:28s} {cnt}")
+
+        default = connections[DEFAULT_DB_ALIAS]
+        if default.vendor == "sqlite" and not default.in_atomic_block:
+            with default.cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write("作業DBを VACUUM しました")
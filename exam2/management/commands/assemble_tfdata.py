@@ -0,0 +1,61 @@
+# exam2/management/commands/assemble_tfdata.py
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2 import tfbinary, tfstore
+from exam2.tfdata import write_json_atomic
+
+
+class Command(BaseCommand):
+    help = "分割ストア（科目ごとのファイル）から従来の 1 ファイル形式の examTFdata.json を組み立てる"
+
+    def add_arguments(self, parser):
+        parser.add_argument("subjectNo", nargs="*", help="対象科目（省略時は索引にある年度の全科目）")
+        parser.add_argument(
+            "--fsyear",
+            type=int,
+            default=getattr(settings, "FSYEAR", None),
+            help="年度（既定: settings.FSYEAR）",
+        )
+        parser.add_argument(
+            "--out",
+            type=str,
+            default=None,
+            help="出力先（既定: exam2/data/export/examTFdata.json / .e2tf）",
+        )
+        parser.add_argument("--format", choices=("json", "binary"), default="json", help="出力形式")
+
+    def handle(self, *args, **options):
+        fsyear = options["fsyear"]
+        if fsyear is None:
+            raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
+
+        binary = options["format"] == "binary"
+        if options["out"]:
+            out_path = Path(options["out"])
+        else:
+            out_path = Path(settings.BASE_DIR) / "exam2" / "data" / "export" / (
+                "examTFdata.e2tf" if binary else "examTFdata.json"
+            )
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+
+        subjects = options["subjectNo"] or None
+        try:
+            root = tfstore.assemble(fsyear, subjects)
+        except (FileNotFoundError, tfstore.DeltaSegmentError) as e:
+            raise CommandError(str(e))
+        if not root["subjects"]:
+            raise CommandError(f"ストアに fsyear={fsyear} の科目がありません: {tfstore.store_dir()}")
+
+        with tfstore.locked_file(out_path):
+            if binary:
+                tfbinary.json_to_binary(root, out_path)
+            else:
+                write_json_atomic(out_path, root)
+
+        students = sum(len(block.get("students") or {}) for block in root["subjects"].values())
+        self.stdout.write(self.style.SUCCESS("組み立て完了"))
+        self.stdout.write(f"  fsyear={fsyear} subjects={len(root['subjects'])} students={students}")
+        self.stdout.write(f"  output={out_path}")
@@ -0,0 +1,47 @@
+# exam2/management/commands/check_subject_denorm.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+
+from exam2.models import Exam, StudentExam, StudentExamVersion, ExamAdjust
+
+
+MODELS = (StudentExam, StudentExamVersion, ExamAdjust)
+
+
+class Command(BaseCommand):
+    help = "subject_id（非正規化列）が exam.subject_id と一致しているか検査する（--fix で修正）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="NULL / 不一致の行を exam.subject_id で更新する",
+        )
+
+    def handle(self, *args, **options):
+        subject_of_exam = Subquery(
+            Exam.objects.filter(id=OuterRef("exam_id")).values("subject_id")[:1]
+        )
+
+        total = 0
+        for model in MODELS:
+            bad = model.objects.filter(
+                Q(subject__isnull=True) | ~Q(subject_id=F("exam__subject_id"))
+            )
+            cnt = bad.count()
+            total += cnt
+            if not cnt:
+                self.stdout.write(f"{model.__name__}: OK")
+                continue
+
+            self.stdout.write(self.style.WARNING(f"{model.__name__}: 不一致 {cnt} 件"))
+            if options["fix"]:
+                with transaction.atomic():
+                    fixed = model.objects.filter(id__in=bad.values("id")).update(subject_id=subject_of_exam)
+                self.stdout.write(self.style.SUCCESS(f"  修正しました: {fixed} 件"))
+
+        if total == 0:
+            self.stdout.write(self.style.SUCCESS("subject_id はすべて一致しています"))
+        elif not options["fix"]:
+            self.stdout.write("--fix を付けると exam.subject_id で更新します")
@@ -3,6 +3,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
+from exam2.catalog import invalidates_catalog
 from exam2.models import Subject, Exam
 
 
@@ -18,6 +19,7 @@ class Command(BaseCommand):
             help="年度（省略時: settings.FSYEAR）",
         )
 
+    @invalidates_catalog
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
         fsyear = options["fsyear"]
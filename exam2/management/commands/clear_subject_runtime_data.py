@@ -2,7 +2,7 @@
 # -------------------------------------------------------
 # 目的：
 #   ルールB（解答入力前のA/B入れ替え）向けに、
-#   「実行時データ（StudentExam / ExamAdjust）」だけを対象科目・年度の範囲でクリアする。
+#   「実行時データ（StudentExam / ExamAdjust / AnswerSheet）」だけを対象科目・年度の範囲でクリアする。
 #
 # 仕様：
 #   - デフォルトは dry-run（削除しない）
@@ -10,6 +10,7 @@
 #   - 安全ガード：
 #       StudentExam の tf!=0 または hosei!=0 が1件でもあれば拒否（--force で上書き可能）
 #       ExamAdjust が存在し、（補正値フィールドがあれば）合計が0でない場合も拒否（--force で上書き可能）
+#       packed 運用では AnswerSheet に 0 以外のセルがあっても拒否（--force で上書き可能）
 #
 # 使い方：
 #   python manage.py clear_subject_runtime_data 2022101 --fsyear 2025
@@ -26,11 +27,12 @@ from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.db.models import Sum
 
-from exam2.models import Subject, Exam, StudentExam, ExamAdjust
+from exam2.answersheet import is_graded, use_packed_storage
+from exam2.models import Subject, Exam, StudentExam, ExamAdjust, AnswerSheet
 
 
 class Command(BaseCommand):
-    help = "Clear runtime data (StudentExam, ExamAdjust) for a subject/year (safe for swap before answering)."
+    help = "Clear runtime data (StudentExam, ExamAdjust, AnswerSheet) for a subject/year (safe for swap before answering)."
 
     def add_arguments(self, parser):
         parser.add_argument("subjectNo", type=str, help="科目コード（subjectNo）")
@@ -92,12 +94,22 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("No Exam found under this subject. Nothing to clear."))
             return
 
-        se_qs = StudentExam.objects.filter(exam_id__in=exam_ids)
-        adj_qs = ExamAdjust.objects.filter(exam_id__in=exam_ids)
+        # subject_id（非正規化列）で絞る。未補完（NULL）の行だけは exam 経由で拾う
+        se_qs = StudentExam.objects.filter(StudentExam.subject_filter(subject))
+        adj_qs = ExamAdjust.objects.filter(ExamAdjust.subject_filter(subject))
 
         se_count = se_qs.count()
         adj_count = adj_qs.count()
 
+        # AnswerSheet（packed）も実行時データ。rows 運用では使われていないので件数だけ
+        packed = use_packed_storage()
+        sheet_qs = AnswerSheet.objects.filter(exam_id__in=exam_ids)
+        sheet_count = sheet_qs.count()
+        sheet_graded = (
+            sum(1 for values in sheet_qs.values_list("tf_bits", "hosei").iterator() if is_graded(values))
+            if packed else None
+        )
+
         # --- 安全ガード判定（解答/採点が始まっていないか）---
         # StudentExam に tf/hosei がある前提だが、存在しない場合はスキップ
         se_tf_nonzero = None
@@ -128,6 +140,9 @@ class Command(BaseCommand):
         self.stdout.write(f"Exam count: {len(exam_ids)}")
         self.stdout.write(f"StudentExam rows: {se_count}")
         self.stdout.write(f"ExamAdjust rows: {adj_count}")
+        self.stdout.write(f"AnswerSheet rows: {sheet_count}")
+        if sheet_graded is not None:
+            self.stdout.write(f"AnswerSheet graded rows: {sheet_graded}")
 
         if se_tf_nonzero is not None:
             self.stdout.write(f"StudentExam tf!=0 rows: {se_tf_nonzero}")
@@ -151,6 +166,8 @@ class Command(BaseCommand):
             guard_violations.append("StudentExam.tf has non-zero rows")
         if se_hosei_nonzero is not None and se_hosei_nonzero > 0:
             guard_violations.append("StudentExam.hosei has non-zero rows")
+        if sheet_graded:
+            guard_violations.append("AnswerSheet has non-zero cells")
 
         # Adjust は「合計0」方針が使えるならそれで判定、無理なら存在自体で警告
         if adj_value_field is not None:
@@ -175,11 +192,16 @@ class Command(BaseCommand):
             # 依存関係により順序を付ける（一般に StudentExam / ExamAdjust はどちらでもOKだが安全に両方削除）
             deleted_adj = adj_qs.delete()
             deleted_se = se_qs.delete()
+            deleted_sheet = sheet_qs.delete()
 
         self.stdout.write(self.style.SUCCESS("Deleted runtime data successfully."))
         self.stdout.write(f"ExamAdjust delete() result: {deleted_adj}")
         self.stdout.write(f"StudentExam delete() result: {deleted_se}")
+        self.stdout.write(f"AnswerSheet delete() result: {deleted_sheet}")
         self.stdout.write("Next steps (typical):")
         self.stdout.write(f"  1) load_student_exam_version {subject_no} --fsyear {fsyear} --clear-existing")
-        self.stdout.write(f"  2) load_student_exam {subject_no} --fsyear {fsyear}")
-        self.stdout.write(f"  3) load_exam_adjust {subject_no} --fsyear {fsyear}")
\ No newline at end of file
+        if packed:
+            self.stdout.write(f"  2) provision_delta {subject_no} --fsyear {fsyear}  (AnswerSheet / ExamAdjust)")
+        else:
+            self.stdout.write(f"  2) load_student_exam {subject_no} --fsyear {fsyear}")
+            self.stdout.write(f"  3) load_exam_adjust {subject_no} --fsyear {fsyear}")
\ No newline at end of file
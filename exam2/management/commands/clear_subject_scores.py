@@ -2,8 +2,10 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.utils import timezone
 
-from exam2.models import Subject, Exam, StudentExam, ExamAdjust
+from exam2.answersheet import clear_sheets, use_packed_storage
+from exam2.models import Subject, Exam, StudentExam, ExamAdjust, AnswerSheet
 
 
 class Command(BaseCommand):
@@ -35,11 +37,13 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("Exam が存在しません"))
             return
 
-        se_qs = StudentExam.objects.filter(exam__in=exams)
-        ea_qs = ExamAdjust.objects.filter(exam__in=exams)
+        se_qs = StudentExam.objects.filter(StudentExam.subject_filter(subject))
+        ea_qs = ExamAdjust.objects.filter(ExamAdjust.subject_filter(subject))
 
         se_cnt = se_qs.count()
         ea_cnt = ea_qs.count()
+        packed = use_packed_storage()
+        sheet_cnt = AnswerSheet.objects.filter(exam__in=exams).count() if packed else 0
 
         self.stdout.write("")
         self.stdout.write("===== ゼロクリア対象の確認 =====")
@@ -52,6 +56,8 @@ class Command(BaseCommand):
         self.stdout.write(f"対象 Exam 数       : {exams.count()}")
         self.stdout.write(f"StudentExam 件数  : {se_cnt}")
         self.stdout.write(f"ExamAdjust 件数   : {ea_cnt}")
+        if packed:
+            self.stdout.write(f"AnswerSheet 件数  : {sheet_cnt}")
         self.stdout.write("")
         self.stdout.write("※ レコードは削除されません。値のみ 0 にリセットされます。")
         self.stdout.write("")
@@ -62,9 +68,12 @@ class Command(BaseCommand):
             return
 
         with transaction.atomic():
-            se_updated = se_qs.update(TF=0, hosei=0)
-            ea_updated = ea_qs.update(adjust=0)
+            now = timezone.now()
+            se_updated = se_qs.update(TF=0, hosei=0, earned=0, updated_at=now)
+            ea_updated = ea_qs.update(adjust=0, updated_at=now)
+            sheet_updated = clear_sheets(exams.values_list("id", flat=True)) if packed else 0
 
         self.stdout.write(self.style.SUCCESS(
             f"ゼロクリア完了: StudentExam={se_updated} 件, ExamAdjust={ea_updated} 件"
+            + (f", AnswerSheet={sheet_updated} 件" if packed else "")
         ))
\ No newline at end of file
@@ -0,0 +1,53 @@
+# exam2/management/commands/convert_tfdata.py
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2 import tfbinary
+from exam2.tfdata import write_json_atomic
+
+
+class Command(BaseCommand):
+    help = "examTFdata を JSON ⇔ バイナリ（.e2tf）で相互変換する（DB は使わない）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("src", type=str, help="変換元（形式は中身で判定）")
+        parser.add_argument("dst", type=str, help="変換先（既存なら置き換え）")
+        parser.add_argument(
+            "--to",
+            choices=("json", "binary"),
+            default=None,
+            help="変換先の形式（省略時は変換元の反対）",
+        )
+
+    def handle(self, *args, **options):
+        src, dst = Path(options["src"]), Path(options["dst"])
+        if not src.exists():
+            raise CommandError(f"変換元がありません: {src}")
+        if src.resolve() == dst.resolve():
+            raise CommandError("変換元と変換先が同じファイルです")
+
+        src_binary = tfbinary.is_binary(src)
+        to = options["to"] or ("json" if src_binary else "binary")
+        dst.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            if src_binary:
+                root = tfbinary.binary_to_json(src)
+            else:
+                with src.open("r", encoding="utf-8") as f:
+                    root = json.load(f)
+
+            if to == "binary":
+                tfbinary.json_to_binary(root, dst)
+            else:
+                write_json_atomic(dst, root)
+        except ValueError as e:  # JSONDecodeError / 形式の不整合
+            raise CommandError(f"変換できません: {e}")
+
+        subjects = root.get("subjects") or {}
+        students = sum(len(block.get("students") or {}) for block in subjects.values())
+        self.stdout.write(self.style.SUCCESS("変換完了"))
+        self.stdout.write(f"  {'binary' if src_binary else 'json'} → {to}: subjects={len(subjects)} students={students}")
+        self.stdout.write(f"  {src} ({src.stat().st_size:,} bytes) → {dst} ({dst.stat().st_size:,} bytes)")
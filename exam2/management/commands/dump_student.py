@@ -1,40 +1,45 @@
-import csv
+# exam2/management/commands/dump_student.py
 from django.core.management.base import BaseCommand
-from exam2.models import Student
+
+from exam2.replica import reporting_command
+from exam2.tabledump import CHUNK_SIZE, FORMATS, TABLES, dump, is_stdout, open_output
 
 
 class Command(BaseCommand):
-    help = "student テーブルを CSV にエクスポートする"
+    help = "student テーブルを CSV（/ TSV / JSON Lines）にエクスポートする（load_student で読める形）"
 
     def add_arguments(self, parser):
         parser.add_argument(
             "--out",
             default="student.csv",
-            help="出力 CSV ファイル名（default: student.csv）"
+            help="出力ファイル名（default: student.csv、- なら標準出力）"
+        )
+        parser.add_argument("--format", choices=FORMATS, default="csv", help="出力形式（default: csv）")
+        parser.add_argument("--subject", type=str, default=None, help="この科目に割り当てられた学生だけ（subjectNo）")
+        parser.add_argument("--fsyear", type=int, default=None, help="この年度の科目に割り当てられた学生だけ")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help=f"1 回に読む行数（default: {CHUNK_SIZE}）")
+        parser.add_argument(
+            "--primary",
+            action="store_true",
+            help="レプリカが設定されていても primary を読む",
         )
 
+    @reporting_command
     def handle(self, *args, **options):
         outfile = options["out"]
 
-        qs = Student.objects.all().order_by("id")
-
-        if not qs.exists():
-            self.stdout.write(self.style.WARNING("student データが存在しません"))
+        with open_output(outfile, self.stdout) as f:
+            count = dump(
+                TABLES["student"], f,
+                fmt=options["format"], subjectNo=options["subject"], fsyear=options["fsyear"],
+                chunk_size=options["chunk_size"],
+            )
+
+        # 標準出力に流したときはデータに混ざらないよう stderr に書く
+        report = self.stderr if is_stdout(outfile) else self.stdout
+        if not count:
+            report.write(self.style.WARNING("student データが存在しません"))
             return
-
-        fields = [
-            "id", "entyear", "stdNo", "email",
-            "name1", "name2", "nickname",
-            "gender", "COO", "enrolled"
-        ]
-
-        with open(outfile, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(fields)
-
-            for s in qs:
-                writer.writerow([getattr(s, f) for f in fields])
-
-        self.stdout.write(self.style.SUCCESS(
-            f"student を CSV 出力しました: {outfile}（{qs.count()} 件）"
-        ))
\ No newline at end of file
+        report.write(self.style.SUCCESS(
+            f"student を {options['format'].upper()} 出力しました: {outfile}（{count} 件）"
+        ))
@@ -0,0 +1,39 @@
+# exam2/management/commands/dump_table.py
+from django.core.management.base import BaseCommand
+
+from exam2.replica import reporting_command
+from exam2.tabledump import CHUNK_SIZE, FORMATS, TABLES, dump, is_stdout, open_output
+
+
+class Command(BaseCommand):
+    help = (
+        "student / StudentExam / ExamAdjust / StudentExamVersion を CSV / TSV / JSON Lines にストリーミング出力する"
+        "（stdNo・q_no・version は JOIN で解決）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("table", choices=sorted(TABLES), help="出力するテーブル")
+        parser.add_argument("--out", default="-", help="出力ファイル（default: - = 標準出力）")
+        parser.add_argument("--format", choices=FORMATS, default="csv", help="出力形式（default: csv）")
+        parser.add_argument("--subject", type=str, default=None, help="科目で絞る（subjectNo）")
+        parser.add_argument("--fsyear", type=int, default=None, help="年度で絞る")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help=f"1 回に読む行数（default: {CHUNK_SIZE}）")
+        parser.add_argument(
+            "--primary",
+            action="store_true",
+            help="レプリカが設定されていても primary を読む",
+        )
+
+    @reporting_command
+    def handle(self, *args, **options):
+        outfile = options["out"]
+        with open_output(outfile, self.stdout) as f:
+            count = dump(
+                TABLES[options["table"]], f,
+                fmt=options["format"], subjectNo=options["subject"], fsyear=options["fsyear"],
+                chunk_size=options["chunk_size"],
+            )
+
+        # 標準出力に流したときはデータに混ざらないよう stderr に書く
+        report = self.stderr if is_stdout(outfile) else self.stdout
+        report.write(self.style.SUCCESS(f"{options['table']}: {count} 行（{options['format']}） → {outfile}"))
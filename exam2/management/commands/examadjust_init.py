@@ -1,5 +1,8 @@
-from django.core.management.base import BaseCommand
-from exam2.models import Exam, ExamAdjust, StudentExamVersion, Subject
+# exam2/management/commands/examadjust_init.py
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.bulkprovision import BATCH_SIZE, BulkProvisionError, assigned_pairs, provision_exam_adjusts, resolve_subject
+from exam2.pgcopy import copy_enabled
 
 
 class Command(BaseCommand):
@@ -9,59 +12,29 @@ class Command(BaseCommand):
         parser.add_argument("subject_no", type=str, help="科目コード 例: 2030402")
         parser.add_argument("fsyear", type=int, help="年度 例: 2025")
         parser.add_argument("term", type=int, help="期 例: 2")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"1 回の投入行数（default: {BATCH_SIZE}）")
+        parser.add_argument("--dry-run", action="store_true", help="作成予定件数だけ表示する")
+        parser.add_argument("--no-copy", action="store_true", help="PostgreSQL でも COPY を使わず bulk_create で作成する")
 
     def handle(self, *args, **options):
-        subject_no = options["subject_no"]
-        fsyear = options["fsyear"]
-        term    = options["term"]
-
-        # --- Subject ---
         try:
-            subject = Subject.objects.get(subjectNo=subject_no)
-        except Subject.DoesNotExist:
-            self.stderr.write(self.style.ERROR(f"Subject {subject_no} が見つかりません"))
-            return
-
-        # --- 対象 Exam（A/B 全部） ---
-        exams = Exam.objects.filter(subject=subject, fsyear=fsyear, term=term)
-
-        if not exams.exists():
-            self.stderr.write(self.style.ERROR("対象 Exam がありません"))
-            return
-
-        self.stdout.write(self.style.SUCCESS(f"対象 Exam 件数: {exams.count()}件"))
-
-        total_created = 0
-
-        for exam in exams:
-            version = exam.version
-            self.stdout.write(self.style.SUCCESS(
-                f"\n--- Exam {exam.id} (version={version}) ---"
-            ))
-
-            # --- version 別に学生を取得 ---
-            sev_list = StudentExamVersion.objects.filter(exam=exam)
-            students = [sev.student for sev in sev_list]
-
-            self.stdout.write(f"対象学生: {len(students)} 名")
-
-            created_cnt = 0
-
-            for student in students:
-                _, created = ExamAdjust.objects.get_or_create(
-                    exam=exam,
-                    student=student,
-                    defaults={"adjust": 0}
-                )
-                if created:
-                    created_cnt += 1
-
-            total_created += created_cnt
-
-            self.stdout.write(self.style.SUCCESS(
-                f"Exam {exam.id} で新規作成 {created_cnt} 件"
-            ))
-
-        self.stdout.write(self.style.SUCCESS(
-            f"\n=== 全 Exam 合計 新規作成 {total_created} 件 完了 ==="
-        ))
\ No newline at end of file
+            subject = resolve_subject(options["subject_no"], options["fsyear"], options["term"])
+        except BulkProvisionError as e:
+            raise CommandError(str(e))
+
+        pairs = assigned_pairs(subject)
+        if not pairs:
+            raise CommandError("StudentExamVersion が 0 件です（先に load_student_exam_version を実行してください）")
+        self.stdout.write(self.style.SUCCESS(f"対象 Exam 件数: {len({exam_id for _, exam_id in pairs})}件"))
+        self.stdout.write(f"対象学生: {len(pairs)} 名")
+
+        stats = provision_exam_adjusts(
+            subject, pairs,
+            batch_size=options["batch_size"],
+            use_copy=copy_enabled() and not options["no_copy"],
+            dry_run=options["dry_run"],
+        )
+
+        head = "DRY-RUN OK" if options["dry_run"] else "ExamAdjust 作成完了"
+        self.stdout.write(self.style.SUCCESS(f"\n=== {head}: 新規作成 {stats.inserted} 件 ==="))
+        self.stdout.write(f"  {stats.summary()}")
@@ -1,6 +1,8 @@
 import json
+from datetime import datetime, timedelta
 from pathlib import Path
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
@@ -12,6 +14,16 @@ from exam2.models import (
     StudentExamVersion,
     StudentExam,
     ExamAdjust,
+    AnswerSheet,
+    ExportWatermark,
+)
+from exam2 import tfbinary, tfstore
+from exam2.answersheet import use_packed_storage, sheet_cells
+from exam2.replica import pin_primary, reporting_command
+from exam2.services import use_sparse_rows
+from exam2.tfdata import DELTA_SCOPE_LIMIT, write_json_atomic
+from exam2.yearbatch import (
+    ORDERS, default_dir, default_workers, run_subjects, subject_file, write_report, year_subjects,
 )
 
 
@@ -19,7 +31,7 @@ class Command(BaseCommand):
     help = "Export subject scoring data (StudentExam TF/hosei as array + ExamAdjust.adjust) to exam2/data/export/examTFdata.json"
 
     def add_arguments(self, parser):
-        parser.add_argument("subjectNo", type=str, help="Subject number (e.g. 1010401)")
+        parser.add_argument("subjectNo", type=str, nargs="?", help="Subject number (e.g. 1010401)")
         parser.add_argument(
             "--fsyear",
             type=int,
@@ -37,24 +49,103 @@ class Command(BaseCommand):
             action="store_true",
             help="If StudentExam for some questions is missing, fill TF=0,hosei=0 instead of raising error.",
         )
+        parser.add_argument(
+            "--out",
+            type=str,
+            default=None,
+            help="Write into this single file, merging other subjects already in it "
+            "(default: the segmented store, exam2/data/export/<fsyear>/examTFdata_<subjectNo>.json + index.json).",
+        )
+        parser.add_argument(
+            "--format",
+            choices=("json", "binary"),
+            default="json",
+            help="json: examTFdata.json / binary: compact .e2tf (TF bitset + varint hosei; see exam2/tfbinary.py).",
+        )
+        parser.add_argument(
+            "--primary",
+            action="store_true",
+            help="Read from the primary database even if a fresh replica is configured.",
+        )
+
+        # 差分（前回 export からの変更分だけ）
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help="Export only students changed since the last --delta export to --target (first run exports all). "
+            "Without --out each delta goes to its own file under <store>/<fsyear>/delta/ (import with --delta).",
+        )
+        parser.add_argument(
+            "--since",
+            type=str,
+            default=None,
+            help="Export only students changed after this ISO datetime (implies --delta, ignores the watermark).",
+        )
+        parser.add_argument(
+            "--target",
+            type=str,
+            default="default",
+            help="Watermark name for --delta (one per consumer of the export).",
+        )
+        parser.add_argument(
+            "--overlap",
+            type=int,
+            default=60,
+            help="Seconds to re-export before the watermark (clock skew / replica lag / in-flight writes).",
+        )
+
+        # 年度まとめて（科目ごとに別プロセス・別ファイル）
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Export every subject of --fsyear into <out-dir>/examTFdata_<subjectNo>.json (.e2tf) in parallel.",
+        )
+        parser.add_argument(
+            "--out-dir",
+            type=str,
+            default=None,
+            help="Directory for --all (default: the segmented store, exam2/data/export/<fsyear>/).",
+        )
+        parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes for --all.")
+        parser.add_argument(
+            "--order",
+            choices=ORDERS,
+            default="size",
+            help="Subject order for --all (size: largest first).",
+        )
 
+    @reporting_command
     def handle(self, *args, **options):
+        # watermark は読み始める前の時刻にする（読んでいる間の変更は次回の delta に入る）
+        started = timezone.now()
         subjectNo = options["subjectNo"]
         fsyear = options["fsyear"]
         term_opt = options["term"]
         fill_missing = options["fill_missing"]
 
+        # sparse 運用では行が無い = 0 なので常に 0 埋め
+        sparse = use_sparse_rows()
+        fill_missing = fill_missing or sparse
+
         if fsyear is None:
             raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
 
         fsyear = int(fsyear)
+        delta_mode = options["delta"] or bool(options["since"])
+
+        if options["all"]:
+            return self.export_year(fsyear, options)
+        if not subjectNo:
+            raise CommandError("subjectNo を指定するか --all を付けてください。")
 
         # -------------------------
         # 出力先ファイル
         # -------------------------
-        out_dir = Path(settings.BASE_DIR) / "exam2" / "data" / "export"
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_path = out_dir / "examTFdata.json"
+        # --out が無ければ分割ストア（科目ごとのファイル + 索引）に書く
+        binary = options["format"] == "binary"
+        out_path = Path(options["out"]) if options["out"] else None
+        if out_path is not None:
+            out_path.parent.mkdir(parents=True, exist_ok=True)
 
         # -------------------------
         # Subject を年度込みで確定（term は Subject 側）
@@ -73,7 +164,7 @@ class Command(BaseCommand):
             )
 
         # -------------------------
-        # Exams 取得（subject だけでOK）
+        # Exams / Questions 取得（subject 単位で 1 回ずつ）
         # -------------------------
         exams = list(Exam.objects.filter(subject=subject).order_by("version"))
         if not exams:
@@ -81,18 +172,19 @@ class Command(BaseCommand):
 
         exam_by_version = {e.version: e for e in exams}
 
+        # ★ 並びの定義（重要）：export/import の両方で必ず同じ order_by を使うこと！
+        questions_by_exam = {}
+        for q in Question.objects.filter(exam__in=exams).order_by("exam_id", "gyo", "retu", "id"):
+            questions_by_exam.setdefault(q.exam_id, []).append(q)
+
         # -------------------------
         # version ごとの question_order を作る（＝配列の並び定義）
-        # 並びは export/import の両方で必ず同じ order_by を使うこと！
         # -------------------------
         exams_json = {}
         questions_by_version = {}
 
         for v, e in exam_by_version.items():
-            # ★ 並びの定義（重要）
-            q_list = list(
-                Question.objects.filter(exam=e).order_by("gyo", "retu", "id")
-            )
+            q_list = questions_by_exam.get(e.id)
             if not q_list:
                 raise CommandError(f"Question not found for exam_id={e.id} version={v}")
 
@@ -114,72 +206,116 @@ class Command(BaseCommand):
                 "question_order": question_order,    # ★ 配列の並び定義
             }
 
+        # question_id → 配列上の位置
+        position = {
+            q.id: i for q_list in questions_by_version.values() for i, q in enumerate(q_list)
+        }
+        exam_version = {e.id: e.version for e in exams}
+        packed = use_packed_storage()
+
+        # -------------------------
+        # delta：since 以降に変わった学生だけに絞る（since が無ければ全件）
+        # -------------------------
+        since = self.delta_since(subject, options) if delta_mode else None
+        changed = changed_students(subject, since, packed) if since is not None else None
+
+        def scoped(qs):
+            if changed is not None and len(changed) <= DELTA_SCOPE_LIMIT:
+                return qs.filter(student_id__in=changed)
+            return qs
+
         # -------------------------
         # StudentExamVersion から「学生→その学生のexam(version)」を確定
         # -------------------------
-        sev_qs = (
-            StudentExamVersion.objects.filter(exam__subject=subject)
-            .select_related("student", "exam")
+        sev_rows = list(
+            scoped(StudentExamVersion.objects.filter(subject=subject))
             .order_by("student__stdNo")
+            .values_list("student_id", "student__stdNo", "student__nickname", "exam_id")
         )
+        if changed is not None:
+            sev_rows = [row for row in sev_rows if row[0] in changed]
+        for student_id, stdNo, _, exam_id in sev_rows:
+            if exam_id not in exam_version:
+                raise CommandError(
+                    f"Unexpected exam for student={stdNo} (exam_id={exam_id})"
+                )
+
+        # ExamAdjust（無ければ0）は 1 回で引く
+        adjust_map = {
+            (student_id, exam_id): int(adjust or 0)
+            for student_id, exam_id, adjust in (
+                scoped(ExamAdjust.objects.filter(subject=subject)).values_list("student_id", "exam_id", "adjust")
+            )
+        }
+
+        # -------------------------
+        # 解答配列：科目の全セルを 1 クエリで流し読みして組み立てる
+        # -------------------------
+        answers_by_pair = {}   # (student_id, exam_id) → [{"TF", "hosei"} or None, ...]
+        if packed:
+            # packed 運用：AnswerSheet（1学生1行）から展開する
+            for sheet in scoped(AnswerSheet.objects.filter(exam__subject=subject)).iterator(chunk_size=500):
+                q_list = questions_by_version.get(exam_version.get(sheet.exam_id))
+                if q_list is None or sheet.question_count != len(q_list):
+                    continue  # 下の学生ループで「無い／一致しない」として止める
+                tf_list, hosei_list = sheet_cells(sheet)
+                answers_by_pair[(sheet.student_id, sheet.exam_id)] = [
+                    {"TF": tf, "hosei": h} for tf, h in zip(tf_list, hosei_list)
+                ]
+        else:
+            cells = (
+                scoped(StudentExam.objects.filter(subject=subject))
+                .order_by("student_id", "exam_id")
+                .values_list("student_id", "exam_id", "question_id", "TF", "hosei")
+                .iterator(chunk_size=5000)
+            )
+            for student_id, exam_id, question_id, tf, hosei in cells:
+                pair = (student_id, exam_id)
+                answers = answers_by_pair.get(pair)
+                if answers is None:
+                    version = exam_version[exam_id]
+                    answers = answers_by_pair[pair] = [None] * len(questions_by_version[version])
+                answers[position[question_id]] = {"TF": int(tf), "hosei": int(hosei or 0)}
 
         students_json = {}
         total_students = 0
         total_answers = 0
         total_missing = 0
 
-        for sev in sev_qs:
-            stu = sev.student
-            exam = sev.exam
-            version = exam.version
-
-            if version not in questions_by_version:
-                raise CommandError(
-                    f"Unexpected version={version} for student={stu.stdNo} (exam_id={exam.id})"
-                )
-
+        for student_id, stdNo, nickname, exam_id in sev_rows:
+            version = exam_version[exam_id]
             q_list = questions_by_version[version]
+            answers_arr = answers_by_pair.get((student_id, exam_id))
 
-            # StudentExam を辞書化（question_id -> record）
-            se_qs = (
-                StudentExam.objects.filter(student=stu, exam=exam)
-                .select_related("question")
-            )
-            se_by_qid = {se.question_id: se for se in se_qs}
-
-            answers_arr = []
-            missing = 0
-
-            # ★ question_order の順で answers 配列を構築（q_no に依存しない）
-            for q in q_list:
-                se = se_by_qid.get(q.id)
-                if se is None:
-                    if fill_missing:
-                        answers_arr.append({"TF": 0, "hosei": 0})
-                        missing += 1
-                        continue
+            if packed:
+                if answers_arr is None:
                     raise CommandError(
-                        "StudentExam が不足しています。"
-                        f" student={stu.stdNo} exam_id={exam.id} version={version} question_id={q.id}"
-                        "（--fill-missing を付けると 0 埋めで継続します）"
+                        f"AnswerSheet が無いか問題数が一致しません: student={stdNo} exam_id={exam_id}"
+                        "（verify_answer_sheets で確認してください）"
                     )
+                missing = 0
+            else:
+                answers_arr = answers_arr or [None] * len(q_list)
+                missing = 0
+                # ★ question_order の順で answers 配列を構築（q_no に依存しない）
+                for i, cell in enumerate(answers_arr):
+                    if cell is not None:
+                        continue
+                    if not fill_missing:
+                        raise CommandError(
+                            "StudentExam が不足しています。"
+                            f" student={stdNo} exam_id={exam_id} version={version} question_id={q_list[i].id}"
+                            "（--fill-missing を付けると 0 埋めで継続します）"
+                        )
+                    answers_arr[i] = {"TF": 0, "hosei": 0}
+                    if not sparse:
+                        missing += 1
 
-                answers_arr.append(
-                    {
-                        "TF": int(se.TF),
-                        "hosei": int(se.hosei or 0),
-                    }
-                )
-
-            # ExamAdjust（無ければ0）
-            adj = ExamAdjust.objects.filter(student=stu, exam=exam).first()
-            adjust_val = int(adj.adjust) if adj else 0
-
-            students_json[stu.stdNo] = {
-                "nickname": stu.nickname,
+            students_json[stdNo] = {
+                "nickname": nickname,
                 "version": version,      # A / B
                 "answers": answers_arr,  # ★ 配列
-                "adjust": adjust_val,
+                "adjust": adjust_map.get((student_id, exam_id), 0),
             }
 
             total_students += 1
@@ -195,12 +331,52 @@ class Command(BaseCommand):
             "fsyear": int(subject.fsyear),
             "term": int(subject.term or 0),
             "exams": exams_json,          # version -> {hash, question_order, ...}
-            "students": students_json,    # stdNo -> {version, answers[], adjust}
         }
+        if since is not None:
+            # import は students より前のキーだけを先に読むので、students の前に置く
+            subject_block["delta"] = {
+                "since": timezone.localtime(since).isoformat(),
+                "until": timezone.localtime(started).isoformat(),
+                "target": options["target"],
+            }
+        subject_block["students"] = students_json    # stdNo -> {version, answers[], adjust}
+
+        meta = {
+            "exported_at": timezone.localtime().isoformat(),
+            "tool_version": "examProj2-phase2-array",
+        }
+        if out_path is None:
+            out_path = tfstore.write_segment(fsyear, subjectNo, subject_block, meta, options["format"])
+        else:
+            # 1 ファイルに複数科目：同じファイルへの同時 export で互いの科目を消さないようロックする
+            with tfstore.locked_file(out_path):
+                if binary:
+                    # 既存ファイルの他科目はレコードのまま写し、subjects[subjectNo] だけ置き換える
+                    if out_path.exists() and not tfbinary.is_binary(out_path):
+                        raise CommandError(f"--format=binary ですが既存の出力先がバイナリ形式ではありません: {out_path}")
+                    tfbinary.write_subject(out_path, subjectNo, subject_block, meta)
+                else:
+                    self.write_json(out_path, subjectNo, subject_block, meta)
+
+        # ファイルが書けてから watermark を進める（失敗したら次回も同じ since から）
+        if delta_mode:
+            with pin_primary():
+                ExportWatermark.objects.update_or_create(
+                    subject=subject, target=options["target"], defaults={"exported_at": started},
+                )
 
-        # -------------------------
-        # 既存JSONを読み込み → subjects[subjectNo] を置換 → 保存
-        # -------------------------
+        self.stdout.write(self.style.SUCCESS("Export completed"))
+        self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term={term}")
+        if delta_mode:
+            self.stdout.write(
+                f"  delta: target={options['target']} since="
+                + (timezone.localtime(since).isoformat() if since is not None else "(none: full export)")
+            )
+        self.stdout.write(f"  students={total_students} answers={total_answers} missing={total_missing}")
+        self.stdout.write(f"  output={out_path}")
+
+    def write_json(self, out_path, subjectNo, subject_block, meta):
+        """既存JSONを読み込み → subjects[subjectNo] を置換 → 保存"""
         if out_path.exists():
             try:
                 with out_path.open("r", encoding="utf-8") as f:
@@ -211,17 +387,86 @@ class Command(BaseCommand):
             root = {}
 
         root.setdefault("meta", {})
-        root["meta"]["exported_at"] = timezone.localtime().isoformat()
-        root["meta"]["tool_version"] = "examProj2-phase2-array"
+        root["meta"].update(meta)
         root.setdefault("subjects", {})
 
         # ★ 仕様：同一subjectNoは置き換え
         root["subjects"][subjectNo] = subject_block
 
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(root, f, ensure_ascii=False, indent=2)
+        # 途中で落ちても既存ファイルを壊さないよう、一時ファイルに書いてから置き換える
+        write_json_atomic(out_path, root)
+
+    def delta_since(self, subject, options):
+        """--since、無ければ watermark − overlap。初回（watermark 無し）は None = 全件"""
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                try:
+                    since = datetime.fromisoformat(options["since"])
+                except ValueError:
+                    raise CommandError(f"--since の形式が不正です（ISO 8601）: {options['since']}")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            return since
+
+        # watermark はレプリカではなく primary で読む（進めた直後の値を確実に見る）
+        with pin_primary():
+            exported_at = (
+                ExportWatermark.objects.filter(subject=subject, target=options["target"])
+                .values_list("exported_at", flat=True).first()
+            )
+        if exported_at is None:
+            return None
+        return exported_at - timedelta(seconds=max(0, options["overlap"]))
 
-        self.stdout.write(self.style.SUCCESS("Export completed"))
-        self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term={term}")
-        self.stdout.write(f"  students={total_students} answers={total_answers} missing={total_missing}")
-        self.stdout.write(f"  output={out_path}")
\ No newline at end of file
+    def export_year(self, fsyear, options):
+        # --out-dir が無ければ各科目は分割ストアへ（索引もそのとき更新される）
+        out_dir = Path(options["out_dir"]) if options["out_dir"] else default_dir(fsyear)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        subjects = year_subjects(fsyear, options["order"])
+        if not subjects:
+            raise CommandError(f"Subject not found for fsyear={fsyear}")
+
+        def options_for(subjectNo):
+            return {
+                "fsyear": fsyear,
+                "term": None,   # 科目ごとに Subject.term を使う
+                "fill_missing": options["fill_missing"],
+                "primary": options["primary"],
+                "out": str(subject_file(out_dir, subjectNo, options["format"])) if options["out_dir"] else None,
+                "format": options["format"],
+                **{k: options[k] for k in ("delta", "since", "target", "overlap")},
+            }
+
+        def on_result(result):
+            mark = "ok" if result["ok"] else "FAILED"
+            self.stdout.write(f"  [{mark}] {result['subjectNo']} ({result['seconds']}s)")
+
+        summary_path = out_dir / "export_summary.json"
+        summary = run_subjects(
+            "export_subject_scores", subjects, options_for,
+            workers=options["workers"], summary_path=summary_path, fsyear=fsyear, on_result=on_result,
+        )
+
+        self.stdout.write(self.style.SUCCESS("Export (all subjects) completed"))
+        write_report(self, summary, summary_path)
+        if summary["failed"]:
+            raise CommandError(f"{len(summary['failed'])} subject(s) failed (see {summary_path})")
+
+
+def changed_students(subject, since, packed) -> set:
+    """科目内で since より後に StudentExam / ExamAdjust / StudentExamVersion（packed は AnswerSheet）が変わった学生"""
+    cells = (
+        AnswerSheet.objects.filter(exam__subject=subject, updated_at__gt=since)
+        if packed
+        else StudentExam.objects.filter(subject=subject, updated_at__gt=since)
+    )
+    changed = set()
+    for qs in (
+        cells,
+        ExamAdjust.objects.filter(subject=subject, updated_at__gt=since),
+        StudentExamVersion.objects.filter(subject=subject, updated_at__gt=since),
+    ):
+        changed.update(qs.order_by().values_list("student_id", flat=True).distinct())
+    return changed
@@ -1,5 +1,6 @@
 import json
 from django.core.management.base import BaseCommand
+from exam2.catalog import invalidates_catalog
 from exam2.models import Subject, Exam
 
 
@@ -13,6 +14,7 @@ class Command(BaseCommand):
             help="インポートする JSON ファイルのパス（answer_XXXX.json）",
         )
 
+    @invalidates_catalog
     def handle(self, *args, **options):
         json_path = options["json_path"]
         self.stdout.write(self.style.WARNING(f"--- JSON 読み込み開始: {json_path} ---"))
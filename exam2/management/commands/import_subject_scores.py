@@ -1,34 +1,57 @@
-import json
 from pathlib import Path
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.utils import timezone
 
+from exam2.answersheet import SheetLayout, fill_sheet, sheet_cells, use_packed_storage
+from exam2.dbwrite import WriteBusy, run_write
 from exam2.models import (
     Subject, Exam, Question, Student,
-    StudentExamVersion, StudentExam, ExamAdjust
+    StudentExamVersion, StudentExam, ExamAdjust, AnswerSheet
 )
+from exam2.pgcopy import copy_enabled, copy_rows
+from exam2.scoring import earned_points
+from exam2.services import use_sparse_rows
+from exam2 import tfstore
+from exam2.tfdata import DELTA_SCOPE_LIMIT, open_subject_block
+from exam2.yearbatch import (
+    ORDERS, default_dir, default_workers, find_subject_file, run_subjects, subject_file, write_report, year_subjects,
+)
+
+
+STUDENT_BATCH = 1000   # stdNo → Student の解決を何人ずつ 1 クエリにするか
+BATCH_SIZE = 1000      # bulk_update / bulk_create の batch_size
 
 
 class Command(BaseCommand):
     help = "Import subject scoring data (TF/hosei array + adjust) from exam2/data/export/examTFdata.json"
 
     def add_arguments(self, parser):
-        parser.add_argument("subjectNo", type=str)
+        parser.add_argument("subjectNo", type=str, nargs="?")
         parser.add_argument("--fsyear", type=int, default=getattr(settings, "FSYEAR", None))
-        parser.add_argument("--json", type=str, default=None, help="Path to examTFdata.json (default: exam2/data/export/examTFdata.json)")
+        parser.add_argument("--json", type=str, default=None, help="Path to examTFdata.json or its binary form (.e2tf, detected by content) "
+                            "(default: the subject's file in the segmented store, else exam2/data/export/examTFdata.json)")
 
         # 安全系
         parser.add_argument("--dry-run", action="store_true", help="Validate only (no DB write).")
         parser.add_argument("--force-hash", action="store_true", help="Ignore problem_hash mismatch and continue.")
         parser.add_argument("--force-order", action="store_true", help="Ignore question_order mismatch and continue.")
-        parser.add_argument("--fill-missing", action="store_true", help="Create missing StudentExam rows if not exist.")
+        parser.add_argument("--fill-missing", action="store_true", help="Create missing StudentExam rows (AnswerSheet in packed storage) if not exist.")
         parser.add_argument("--skip-adjust", action="store_true", help="Do not import ExamAdjust.adjust.")
+        parser.add_argument("--no-copy", action="store_true", help="Do not use COPY on PostgreSQL (ORM bulk_update/bulk_create).")
+        parser.add_argument("--delta", action="store_true", help="Import export --delta output: the subject's pending delta files "
+                            "from the segmented store in watermark order (or the --json delta file). Without it delta files are refused.")
 
         # term は Subject.term を正とし、オプションで不一致検出だけ
         parser.add_argument("--term", type=int, default=None, help="Optional check: if given, must match Subject.term")
 
+        # 年度まとめて（export_subject_scores --all の出力ディレクトリを科目ごとに並列で取り込む）
+        parser.add_argument("--all", action="store_true", help="Import every subject of --fsyear from <json-dir>/examTFdata_<subjectNo>.json (or .e2tf).")
+        parser.add_argument("--json-dir", type=str, default=None, help="Directory for --all (default: exam2/data/export/<fsyear>/).")
+        parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes for --all.")
+        parser.add_argument("--order", choices=ORDERS, default="size", help="Subject order for --all (size: largest first).")
+
     def handle(self, *args, **opts):
         subjectNo = opts["subjectNo"]
         fsyear = opts["fsyear"]
@@ -36,23 +59,57 @@ class Command(BaseCommand):
             raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
         fsyear = int(fsyear)
 
+        if opts["all"]:
+            return self.import_year(fsyear, opts)
+        if not subjectNo:
+            raise CommandError("subjectNo を指定するか --all を付けてください。")
+
+        if opts["delta"] and not opts["json"]:
+            return self.import_delta_chain(subjectNo, fsyear, opts)
+
         # ---- JSON 読み込み ----
+        # 既定：分割ストアの索引からこの科目のファイルだけを引く（無ければ従来の 1 ファイル）
         if opts["json"]:
             json_path = Path(opts["json"])
         else:
-            json_path = Path(settings.BASE_DIR) / "exam2" / "data" / "export" / "examTFdata.json"
+            json_path = (
+                tfstore.find_segment(fsyear, subjectNo)
+                or Path(settings.BASE_DIR) / "exam2" / "data" / "export" / "examTFdata.json"
+            )
 
         if not json_path.exists():
             raise CommandError(f"JSON not found: {json_path}")
 
-        with json_path.open("r", encoding="utf-8") as f:
-            root = json.load(f)
+        with open_subject_block(json_path, subjectNo) as (block, students_iter):
+            if block is None:
+                raise CommandError(f"subjectNo={subjectNo} not found in JSON: {json_path}")
+            return self.import_block(subjectNo, fsyear, json_path, block, students_iter, opts)
 
-        subjects = root.get("subjects") or {}
-        block = subjects.get(subjectNo)
-        if not block:
-            raise CommandError(f"subjectNo={subjectNo} not found in JSON: {json_path}")
+    def import_delta_chain(self, subjectNo, fsyear, opts):
+        """分割ストアにある科目の差分を、前回取り込んだ until より後のものから古い順に取り込む"""
+        applied = tfstore.delta_applied(fsyear, subjectNo)
+        try:
+            chain = tfstore.delta_chain(fsyear, subjectNo, after=applied)
+        except tfstore.DeltaChainError as e:
+            raise CommandError(str(e))
+        if not chain:
+            self.stdout.write(self.style.SUCCESS(
+                f"取り込む差分はありません: subjectNo={subjectNo} fsyear={fsyear}（取り込み済み until={applied}）"
+            ))
+            return
 
+        for entry in chain:
+            json_path = entry["path"]
+            if not json_path.exists():
+                raise CommandError(f"差分のファイルがありません: {json_path}")
+            with open_subject_block(json_path, subjectNo) as (block, students_iter):
+                if block is None:
+                    raise CommandError(f"subjectNo={subjectNo} not found in JSON: {json_path}")
+                self.import_block(subjectNo, fsyear, json_path, block, students_iter, opts)
+            if not opts["dry_run"]:
+                tfstore.mark_delta_applied(fsyear, subjectNo, entry["until"])
+
+    def import_block(self, subjectNo, fsyear, json_path, block, students_iter, opts):
         # ---- Subject を確定（Phase3）----
         try:
             subject = Subject.objects.get(subjectNo=subjectNo, fsyear=fsyear)
@@ -65,22 +122,24 @@ class Command(BaseCommand):
             raise CommandError(f"term mismatch: option={term_opt} but Subject.term={term_db} (subjectNo={subjectNo} fsyear={fsyear})")
 
         exams_json = block.get("exams") or {}
-        students_json = block.get("students") or {}
-
         if not exams_json:
             raise CommandError("JSON exams is empty.")
-        if not students_json:
-            self.stdout.write(self.style.WARNING("JSON students is empty. (no scoring data)"))
 
-        # ---- Exam を version で取得 ----
+        # ---- Exam / Question を科目単位でまとめて取得 ----
+        exams_db = {e.version: e for e in Exam.objects.filter(subject=subject)}
         exam_by_version = {}
-        questions_by_version = {}
+        for v in exams_json:
+            if v not in exams_db:
+                raise CommandError(f"Exam not found in DB: subject={subjectNo}({fsyear}) version={v}")
+            exam_by_version[v] = exams_db[v]
+
+        questions_by_exam = {}
+        for q in Question.objects.filter(exam__in=exam_by_version.values()).order_by("exam_id", "gyo", "retu", "id"):
+            questions_by_exam.setdefault(q.exam_id, []).append(q)
 
+        questions_by_version = {}
         for v, exinfo in exams_json.items():
-            try:
-                exam = Exam.objects.get(subject=subject, version=v)
-            except Exam.DoesNotExist:
-                raise CommandError(f"Exam not found in DB: subject={subjectNo}({fsyear}) version={v}")
+            exam = exam_by_version[v]
 
             # hash チェック
             json_hash = exinfo.get("problem_hash") or ""
@@ -91,10 +150,8 @@ class Command(BaseCommand):
                     "止めます（--force-hash で無視可能）"
                 )
 
-            exam_by_version[v] = exam
-
             # Question 並び（export/import共通の定義）
-            q_list = list(Question.objects.filter(exam=exam).order_by("gyo", "retu", "id"))
+            q_list = questions_by_exam.get(exam.id) or []
             if not q_list:
                 raise CommandError(f"No questions for exam_id={exam.id} version={v}")
 
@@ -127,24 +184,93 @@ class Command(BaseCommand):
                             "（DB側の q_no 修正 or --force-order を検討）"
                         )
 
-        # ---- dry-run ならここで終了 ----
-        if opts["dry_run"]:
-            self.stdout.write(self.style.SUCCESS("DRY-RUN OK (validated). No DB writes."))
-            return
+        # sparse 運用：行が無いセルは 0 扱い。0 以外のセルだけ作成する
+        sparse = use_sparse_rows()
+        # packed 運用：StudentExam ではなく AnswerSheet（1学生×1試験で1行）に書く
+        packed = use_packed_storage()
+        layouts = {
+            v: SheetLayout(tuple(q.id for q in q_list), tuple(int(q.points or 0) for q in q_list))
+            for v, q_list in questions_by_version.items()
+        }
+        skip_adjust = opts["skip_adjust"]
+
+        # ---- delta（export --delta の出力）：ファイルにある学生の行だけ読む。無い学生には触れない ----
+        delta = block.get("delta")
+        if delta and not opts["delta"]:
+            # 差分を全体として取り込むと、ファイルに無い学生の分を「全体はこれ」と誤って扱う
+            raise CommandError(
+                f"差分（delta）のファイルです: {json_path}（since={delta.get('since')} until={delta.get('until')}）。"
+                "--delta を付けて取り込んでください"
+            )
+        if opts["delta"] and not delta:
+            raise CommandError(f"--delta ですが差分（delta）のファイルではありません: {json_path}")
+        scope = None
+        if delta:
+            students_iter = list(students_iter)
+            self.stdout.write(
+                f"  delta: since={delta.get('since')} until={delta.get('until')} students={len(students_iter)}"
+            )
+            if len(students_iter) <= DELTA_SCOPE_LIMIT:
+                scope = list(
+                    Student.objects.filter(stdNo__in=[stdNo for stdNo, _ in students_iter]).values_list("id", flat=True)
+                )
 
-        # ---- 反映（atomic）----
-        updated_se = 0
-        created_se = 0
-        updated_adj = 0
-        created_adj = 0
-        updated_sev = 0
-        created_sev = 0
-
-        with transaction.atomic():
-            for stdNo, sinfo in students_json.items():
-                try:
-                    student = Student.objects.get(stdNo=stdNo)
-                except Student.DoesNotExist:
+        def scoped(qs):
+            return qs.filter(student_id__in=scope) if scope is not None else qs
+
+        # ---- 科目の既存行をまとめて読む（以降の差分はメモリ上で作る）----
+        sev_by_student = {}   # student_id → [(sev_id, exam_id), ...]
+        for sev_id, student_id, exam_id in (
+            scoped(StudentExamVersion.objects.filter(subject=subject))
+            .order_by("id").values_list("id", "student_id", "exam_id")
+        ):
+            sev_by_student.setdefault(student_id, []).append((sev_id, exam_id))
+
+        se_by_key, sheet_by_key = {}, {}
+        if packed:
+            sheet_by_key = {
+                (sheet.student_id, sheet.exam_id): sheet
+                for sheet in scoped(AnswerSheet.objects.filter(exam_id__in=[e.id for e in exams_db.values()]))
+            }
+        else:
+            se_by_key = {
+                (student_id, exam_id, question_id): (se_id, TF, hosei, earned)
+                for se_id, student_id, exam_id, question_id, TF, hosei, earned in (
+                    scoped(StudentExam.objects.filter(subject=subject))
+                    .values_list("id", "student_id", "exam_id", "question_id", "TF", "hosei", "earned")
+                )
+            }
+        adj_by_key = {}
+        if not skip_adjust:
+            adj_by_key = {
+                (student_id, exam_id): (adj_id, adjust)
+                for adj_id, student_id, exam_id, adjust in (
+                    scoped(ExamAdjust.objects.filter(subject=subject))
+                    .values_list("id", "student_id", "exam_id", "adjust")
+                )
+            }
+
+        counts = {
+            name: {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+            for name in ("StudentExamVersion", "AnswerSheet" if packed else "StudentExam", "ExamAdjust")
+        }
+        sev_create, sev_update, sev_delete = [], [], []
+        se_create, se_update = [], []
+        adj_create, adj_update = [], []
+        sheet_create, sheet_update = [], []
+        se_rows, adj_rows = [], []   # COPY 用（変化のあった行だけ）
+        now = timezone.now()         # bulk_update / COPY では auto_now が効かないので updated_at を明示する
+
+        # ---- 学生は JSON から順に読み、STUDENT_BATCH 人ずつ 1 クエリで解決する ----
+        students_json = 0
+        for batch in _batched(students_iter, STUDENT_BATCH):
+            student_ids = dict(
+                Student.objects.filter(stdNo__in=[stdNo for stdNo, _ in batch]).values_list("stdNo", "id")
+            )
+            for stdNo, sinfo in batch:
+                students_json += 1
+                student_id = student_ids.get(stdNo)
+                if student_id is None:
                     raise CommandError(f"Student not found in DB: stdNo={stdNo}")
 
                 version = sinfo.get("version")
@@ -161,66 +287,219 @@ class Command(BaseCommand):
                         f"json={len(answers)} db_questions={len(q_list)}"
                     )
 
-                # StudentExamVersion を (student, subject) 単位で確定させる
-                sev_qs = StudentExamVersion.objects.filter(student=student, exam__subject=subject)
-                if sev_qs.exists():
-                    # 既存が複数でも全部更新（変な状態を一掃）
-                    n = sev_qs.update(exam=exam)
-                    updated_sev += n
+                # StudentExamVersion を (student, subject) 単位で 1 行に確定させる
+                rows = sev_by_student.get(student_id)
+                c = counts["StudentExamVersion"]
+                if not rows:
+                    sev_create.append(StudentExamVersion(student_id=student_id, exam=exam, subject=subject))
+                    c["created"] += 1
                 else:
-                    StudentExamVersion.objects.create(student=student, exam=exam)
-                    created_sev += 1
-
-                # 既存 StudentExam を辞書化
-                se_qs = StudentExam.objects.filter(student=student, exam=exam)
-                se_by_qid = {se.question_id: se for se in se_qs}
-
-                to_update = []
-                to_create = []
-
-                for q, a in zip(q_list, answers):
-                    TF = int(a.get("TF", 0))
-                    hosei = int(a.get("hosei", 0) or 0)
-
-                    se = se_by_qid.get(q.id)
-                    if se is None:
+                    keep_id, keep_exam_id = next(((i, e) for i, e in rows if e == exam.id), rows[0])
+                    dup = [i for i, _ in rows if i != keep_id]
+                    sev_delete.extend(dup)
+                    c["deleted"] += len(dup)
+                    if keep_exam_id == exam.id:
+                        c["unchanged"] += 1
+                    else:
+                        sev_update.append(StudentExamVersion(id=keep_id, exam_id=exam.id, updated_at=now))
+                        c["updated"] += 1
+
+                if packed:
+                    # AnswerSheet：学生 × 試験の配列を丸ごと比べて、変わったものだけ書く
+                    c = counts["AnswerSheet"]
+                    layout = layouts[version]
+                    tf_list = [1 if int(a.get("TF", 0)) else 0 for a in answers]
+                    hosei_list = [int(a.get("hosei", 0) or 0) for a in answers]
+                    sheet = sheet_by_key.get((student_id, exam.id))
+                    if sheet is None:
                         if not opts["fill_missing"]:
                             raise CommandError(
-                                f"StudentExam missing stdNo={stdNo} exam_id={exam.id} question_id={q.id} "
-                                "（--fill-missing で作成可能）"
+                                f"AnswerSheet missing stdNo={stdNo} exam_id={exam.id} （--fill-missing で作成可能）"
                             )
-                        to_create.append(StudentExam(student=student, exam=exam, question=q, TF=TF, hosei=hosei))
+                        sheet_create.append(
+                            fill_sheet(AnswerSheet(student_id=student_id, exam_id=exam.id), layout, tf_list, hosei_list)
+                        )
+                        c["created"] += 1
+                    elif sheet.question_count == len(layout) and sheet_cells(sheet) == (tf_list, hosei_list):
+                        c["unchanged"] += 1
                     else:
-                        if se.TF != TF or int(se.hosei or 0) != hosei:
-                            se.TF = TF
-                            se.hosei = hosei
-                            to_update.append(se)
+                        sheet_update.append(fill_sheet(sheet, layout, tf_list, hosei_list))
+                        c["updated"] += 1
+                else:
+                    # StudentExam
+                    c = counts["StudentExam"]
+                    for q, a in zip(q_list, answers):
+                        TF = int(a.get("TF", 0))
+                        hosei = int(a.get("hosei", 0) or 0)
+                        earned = earned_points(TF, q.points)
+
+                        current = se_by_key.get((student_id, exam.id, q.id))
+                        if current is None:
+                            if sparse and not (TF or hosei):
+                                continue
+                            if not sparse and not opts["fill_missing"]:
+                                raise CommandError(
+                                    f"StudentExam missing stdNo={stdNo} exam_id={exam.id} question_id={q.id} "
+                                    "（--fill-missing で作成可能）"
+                                )
+                            se_create.append(StudentExam(
+                                student_id=student_id, exam=exam, subject=subject, question=q,
+                                TF=TF, hosei=hosei, earned=earned,
+                            ))
+                            se_rows.append((student_id, exam.id, subject.id, q.id, TF, hosei, earned, now))
+                            c["created"] += 1
+                            continue
+
+                        se_id, cur_tf, cur_hosei, cur_earned = current
+                        if cur_tf == TF and int(cur_hosei or 0) == hosei and cur_earned == earned:
+                            c["unchanged"] += 1
+                            continue
+                        se_update.append(StudentExam(id=se_id, TF=TF, hosei=hosei, earned=earned, updated_at=now))
+                        se_rows.append((student_id, exam.id, subject.id, q.id, TF, hosei, earned, now))
+                        c["updated"] += 1
 
-                if to_create:
-                    StudentExam.objects.bulk_create(to_create, ignore_conflicts=False)
-                    created_se += len(to_create)
+                # ExamAdjust
+                if skip_adjust:
+                    continue
+                c = counts["ExamAdjust"]
+                adjust = int(sinfo.get("adjust", 0) or 0)
+                current = adj_by_key.get((student_id, exam.id))
+                if current is None:
+                    adj_create.append(ExamAdjust(student_id=student_id, exam=exam, subject=subject, adjust=adjust))
+                    adj_rows.append((student_id, exam.id, subject.id, adjust, now))
+                    c["created"] += 1
+                elif int(current[1] or 0) != adjust:
+                    adj_update.append(ExamAdjust(id=current[0], adjust=adjust, updated_at=now))
+                    adj_rows.append((student_id, exam.id, subject.id, adjust, now))
+                    c["updated"] += 1
+                else:
+                    c["unchanged"] += 1
 
-                if to_update:
-                    StudentExam.objects.bulk_update(to_update, ["TF", "hosei"])
-                    updated_se += len(to_update)
+        if not students_json:
+            self.stdout.write(self.style.WARNING("JSON students is empty. (no scoring data)"))
 
-                # ExamAdjust
-                if not opts["skip_adjust"]:
-                    adjust = int(sinfo.get("adjust", 0) or 0)
-                    obj, created = ExamAdjust.objects.get_or_create(
-                        student=student, exam=exam, defaults={"adjust": adjust}
+        # ---- dry-run なら差分だけ表示して終了 ----
+        if opts["dry_run"]:
+            self.stdout.write(self.style.SUCCESS("DRY-RUN OK (validated). No DB writes."))
+            self.write_counts(subjectNo, fsyear, term_db, json_path, counts)
+            return
+
+        # ---- 反映（1 トランザクション）：テーブルごとに bulk 1 回ずつ ----
+        # PostgreSQL: StudentExam / ExamAdjust は変化のあった行だけ COPY + ON CONFLICT で upsert する
+        use_copy = copy_enabled() and not opts["no_copy"]
+
+        def apply():
+            if sev_delete:
+                StudentExamVersion.objects.filter(id__in=sev_delete).delete()
+            if sev_update:
+                StudentExamVersion.objects.bulk_update(sev_update, ["exam", "updated_at"], batch_size=BATCH_SIZE)
+            if sev_create:
+                StudentExamVersion.objects.bulk_create(sev_create, batch_size=BATCH_SIZE)
+            if sheet_update:
+                AnswerSheet.objects.bulk_update(
+                    sheet_update,
+                    ["question_count", "tf_bits", "hosei", "score", "hosei_total", "total", "updated_at"],
+                    batch_size=BATCH_SIZE,
+                )
+            if sheet_create:
+                AnswerSheet.objects.bulk_create(sheet_create, batch_size=BATCH_SIZE)
+
+            if use_copy:
+                if se_rows:
+                    copy_rows(
+                        StudentExam,
+                        ("student", "exam", "subject", "question", "TF", "hosei", "earned", "updated_at"),
+                        se_rows,
+                        conflict_fields=("student", "exam", "question"),
+                        update_fields=("TF", "hosei", "earned", "updated_at"),
                     )
-                    if created:
-                        created_adj += 1
-                    else:
-                        if int(obj.adjust or 0) != adjust:
-                            obj.adjust = adjust
-                            obj.save(update_fields=["adjust"])
-                            updated_adj += 1
+                if adj_rows:
+                    copy_rows(
+                        ExamAdjust,
+                        ("student", "exam", "subject", "adjust", "updated_at"),
+                        adj_rows,
+                        conflict_fields=("exam", "student"),
+                        update_fields=("adjust", "updated_at"),
+                    )
+            else:
+                if se_update:
+                    StudentExam.objects.bulk_update(se_update, ["TF", "hosei", "earned", "updated_at"], batch_size=BATCH_SIZE)
+                if se_create:
+                    StudentExam.objects.bulk_create(se_create, batch_size=BATCH_SIZE)
+                if adj_update:
+                    ExamAdjust.objects.bulk_update(adj_update, ["adjust", "updated_at"], batch_size=BATCH_SIZE)
+                if adj_create:
+                    ExamAdjust.objects.bulk_create(adj_create, batch_size=BATCH_SIZE)
+
+        # sqlite では BEGIN IMMEDIATE で始め、ロック競合は再試行する（--all で並列に取り込むとき用）
+        try:
+            run_write(apply)
+        except WriteBusy as e:
+            raise CommandError(f"書き込みロックが取れませんでした（再実行してください）: {e}")
 
         self.stdout.write(self.style.SUCCESS("Import completed"))
+        self.write_counts(subjectNo, fsyear, term_db, json_path, counts)
+
+    def import_year(self, fsyear, opts):
+        json_dir = Path(opts["json_dir"]) if opts["json_dir"] else default_dir(fsyear)
+        if not json_dir.is_dir():
+            raise CommandError(f"JSON directory not found: {json_dir}")
+
+        subjects = year_subjects(fsyear, opts["order"])
+        if opts["delta"] and not opts["json_dir"]:
+            # --delta で --json-dir が無ければ、科目ごとに分割ストアの差分を流す（json は渡さない）
+            files, missing = dict.fromkeys(subjects), []
+        else:
+            files = {s: find_subject_file(json_dir, s) for s in subjects}
+            missing = [s for s in subjects if files[s] is None]
+        subjects = [s for s in subjects if s not in missing]
+        for subjectNo in missing:
+            self.stdout.write(self.style.WARNING(f"  [skip] {subjectNo}: {subject_file(json_dir, subjectNo).name} がありません"))
+        if not subjects:
+            raise CommandError(f"No examTFdata_<subjectNo>.json for fsyear={fsyear} in {json_dir}")
+
+        def options_for(subjectNo):
+            return {
+                "fsyear": fsyear,
+                "json": str(files[subjectNo]) if files[subjectNo] is not None else None,
+                **{k: opts[k] for k in (
+                    "dry_run", "force_hash", "force_order", "fill_missing", "skip_adjust", "no_copy", "delta",
+                )},
+            }
+
+        def on_result(result):
+            mark = "ok" if result["ok"] else "FAILED"
+            self.stdout.write(f"  [{mark}] {result['subjectNo']} ({result['seconds']}s)")
+
+        summary_path = json_dir / "import_summary.json"
+        summary = run_subjects(
+            "import_subject_scores", subjects, options_for,
+            workers=opts["workers"], summary_path=summary_path, fsyear=fsyear, on_result=on_result,
+        )
+
+        self.stdout.write(self.style.SUCCESS("Import (all subjects) completed"))
+        if missing:
+            self.stdout.write(f"  skipped(no file)={len(missing)}")
+        write_report(self, summary, summary_path)
+        if summary["failed"]:
+            raise CommandError(f"{len(summary['failed'])} subject(s) failed (see {summary_path})")
+
+    def write_counts(self, subjectNo, fsyear, term_db, json_path, counts):
         self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term(DB)={term_db}")
-        self.stdout.write(f"  StudentExam: created={created_se} updated={updated_se}")
-        self.stdout.write(f"  ExamAdjust:  created={created_adj} updated={updated_adj}")
-        self.stdout.write(f"  StudentExamVersion: created={created_sev} updated={updated_sev}")
-        self.stdout.write(f"  json={json_path}")
\ No newline at end of file
+        for name, c in counts.items():
+            self.stdout.write(
+                f"  {name + ':':<20} created={c['created']} updated={c['updated']}"
+                f" unchanged={c['unchanged']} deleted={c['deleted']}"
+            )
+        self.stdout.write(f"  json={json_path}")
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -3,8 +3,10 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.utils import timezone
 
 from exam2.models import Subject, StudentExamVersion, ExamAdjust
+from exam2.pgcopy import copy_enabled, copy_rows
 
 
 class Command(BaseCommand):
@@ -34,6 +36,12 @@ class Command(BaseCommand):
             help="bulk_create の batch_size（default: 2000）",
         )
 
+        parser.add_argument(
+            "--no-copy",
+            action="store_true",
+            help="PostgreSQL でも COPY を使わず bulk_create で作成する",
+        )
+
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
         fsyear = options["fsyear"]
@@ -53,7 +61,7 @@ class Command(BaseCommand):
         # ---- StudentExamVersion（このsubjectの割当）----
         sevs = (
             StudentExamVersion.objects
-            .filter(exam__subject=subject)
+            .filter(subject=subject)
             .select_related("student", "exam")
             .order_by("student__stdNo")
         )
@@ -70,6 +78,20 @@ class Command(BaseCommand):
             self.stdout.write("  ExamAdjust は student×exam ごとに 1 件（既存は get_or_create でスキップ）")
             return
 
+        if copy_enabled() and not options["no_copy"]:
+            # PostgreSQL: 一時テーブルへ COPY → ON CONFLICT DO NOTHING
+            now = timezone.now()
+            inserted = copy_rows(
+                ExamAdjust,
+                ("exam", "subject", "student", "adjust", "updated_at"),
+                ((exam_id, subject.id, student_id, 0, now) for student_id, exam_id in sevs.values_list("student_id", "exam_id")),
+                conflict_fields=("exam", "student"),
+            )
+            self.stdout.write(self.style.SUCCESS("ExamAdjust 作成完了（COPY・既存はスキップ）"))
+            self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term(DB)={subject.term}")
+            self.stdout.write(f"  inserted={inserted}")
+            return
+
         created_attempted = 0
         buf = []
 
@@ -78,6 +100,7 @@ class Command(BaseCommand):
                 buf.append(
                     ExamAdjust(
                         exam=sev.exam,
+                        subject=subject,
                         student=sev.student,
                         adjust=0
                     )
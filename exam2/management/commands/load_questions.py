@@ -1,13 +1,18 @@
 # exam2/management/commands/load_questions.py
 import json
-import sys
 from pathlib import Path
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
+from exam2 import examconfig
+from exam2.catalog import invalidate as invalidate_catalog, invalidates_catalog
 from exam2.models import Subject, Exam, Question
+from exam2.pgcopy import copy_enabled, copy_rows, instance_rows
+from exam2.questionsync import (
+    QUESTION_FIELDS, QuestionJsonError, json_problem_hash, parse_cells, reconcile_exam, record_checksum,
+)
 
 
 class Command(BaseCommand):
@@ -35,7 +40,22 @@ class Command(BaseCommand):
         parser.add_argument(
             "--clear-existing",
             action="store_true",
-            help="既存の Question を exam 単位で削除してから再作成する（推奨）",
+            help="既存の Question を exam 単位で削除してから再作成する（StudentExam も連鎖削除されるので採点後は --reconcile を使う）",
+        )
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            help="既存の Question と (gyo, retu) で突き合わせ、変わったセルだけ更新・追加・削除する（採点データは残る）",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="--reconcile で problem_hash と内容チェックサムが前回と同じでも突き合わせを行う",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="--reconcile の差分件数だけ表示して書き込まない",
         )
 
         # 暫定：q_no 置換パッチ（本来はJSON側修正が筋）
@@ -45,11 +65,25 @@ class Command(BaseCommand):
             help="既知の q_no 誤りを補正して登録する（例: 14-1① の重複修正）",
         )
 
+        parser.add_argument(
+            "--no-copy",
+            action="store_true",
+            help="PostgreSQL でも COPY を使わず bulk_create で作成する",
+        )
+
+    @invalidates_catalog
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
         fsyear_opt = options["fsyear"]
         clear_existing = options["clear_existing"]
+        reconcile = options["reconcile"]
         fix_qno = options["fix_qno"]
+        use_copy = copy_enabled() and not options["no_copy"]
+
+        if clear_existing and reconcile:
+            raise CommandError("--clear-existing と --reconcile は同時に指定できません")
+        if options["dry_run"] and not reconcile:
+            raise CommandError("--dry-run は --reconcile と一緒に指定してください")
 
         # ------------------------
         # fsyear の特定
@@ -57,7 +91,7 @@ class Command(BaseCommand):
         fsyear = fsyear_opt if fsyear_opt is not None else getattr(settings, "FSYEAR", None)
 
         # ------------------------
-        # JSON パス決定（utils.py の動的解決を利用）
+        # JSON パス決定（examconfig：上書きファイル → utils.py の YAML 解決）
         # ------------------------
         if options["json"]:
             json_path = Path(options["json"])
@@ -67,21 +101,10 @@ class Command(BaseCommand):
                     "fsyear が特定できないため、YAML から JSON パスを逆引きできません。--fsyear を指定してください。"
                 )
 
-            # 5つ上の階層（/TTC）から utils.py の場所を計算してインポート
             try:
-                current_file = Path(__file__).resolve()
-                ttc_root = current_file.parents[4]
-                ttc_utilpath = ttc_root / "@TTC" / "util"
-
-                if str(ttc_utilpath) not in sys.path:
-                    sys.path.insert(0, str(ttc_utilpath))
-
-                import utils
-
-                # 動的キー取得関数を使って "ans_json" を取得
-                json_path = utils.get_exam_config_path(subjectNo, str(fsyear), "ans_json")
-            except Exception as e:
-                raise CommandError(f"utils.py を経由した YAML からのパス取得に失敗しました: {e}")
+                json_path = examconfig.config_path(subjectNo, fsyear, "ans_json")
+            except examconfig.ExamConfigError as e:
+                raise CommandError(str(e))
 
         if not json_path.exists():
             raise CommandError(f"JSON ファイルが見つかりません: {json_path}")
@@ -121,7 +144,7 @@ class Command(BaseCommand):
         if not exams:
             raise CommandError("Exam が存在しません（先に load_subject_base.py を実行してください）")
 
-        def fix_label(version: str, gyo: int, retu: int, label: str) -> str:
+        def fix_label(gyo: int, retu: int, label: str) -> str:
             if not fix_qno:
                 return label
             if label == "14-1①" and gyo == 6 and retu == 1:
@@ -130,6 +153,7 @@ class Command(BaseCommand):
 
         total_created = 0
         total_deleted = 0
+        total_updated = 0
 
         # ========================
         # version ループ（A/B）
@@ -148,59 +172,54 @@ class Command(BaseCommand):
             if len(questions) < 2:
                 raise CommandError(f"questions が不足しています: version={version}")
 
-            if clear_existing:
-                deleted, _ = Question.objects.filter(exam=exam).delete()
-                total_deleted += deleted
-
-            base_height = questions[0].get("height")
-            if not base_height:
-                raise CommandError(f"base height が取得できません: version={version}")
+            try:
+                cells = parse_cells(questions, fix_label=fix_label)
+            except QuestionJsonError as e:
+                raise CommandError(f"{e}: version={version}")
 
             self.stdout.write(f"\n--- Exam {version} (exam_id={exam.id}) ---")
 
-            to_create = []
-
-            for gyo_idx, qblock in enumerate(questions[1:], start=1):
-                widths = qblock.get("width") or []
-                labels = qblock.get("label") or []
-                answers = qblock.get("answer") or []
-                heights = qblock.get("height") or []
-                points = qblock.get("point") or []
-                koumokus = qblock.get("koumoku") or []
-
-                count = len(labels)
-
-                if not all(len(lst) == count for lst in [widths, answers, heights, points, koumokus]):
-                    raise CommandError(f"配列長不一致: version={version}, gyo={gyo_idx}")
-
-                for i in range(count):
-                    retu = i + 1
-                    label = str(labels[i] or "").strip()
-                    label = fix_label(version, gyo_idx, retu, label)
-
-                    try:
-                        h_ratio = int(int(heights[i]) / int(base_height))
-                    except Exception:
-                        h_ratio = 1
-                    if h_ratio <= 0:
-                        h_ratio = 1
-
-                    to_create.append(
-                        Question(
-                            exam=exam,
-                            q_no=label,
-                            bunrui=str(koumokus[i] or "").strip(),
-                            points=int(points[i] or 0),
-                            answer=str(answers[i] or ""),
-                            width=int(widths[i] or 1),
-                            height=h_ratio,
-                            gyo=gyo_idx,
-                            retu=retu,
-                        )
-                    )
+            if reconcile:
+                result = reconcile_exam(
+                    exam, cells,
+                    problem_hash=json_problem_hash(data, vdata),
+                    force=options["force"],
+                    dry_run=options["dry_run"],
+                    copy=copy_rows if use_copy else None,
+                )
+                if result["skipped"]:
+                    self.stdout.write(f"Exam {version}: problem_hash / 内容チェックサムが前回と同じ（skip）")
+                    continue
+                total_created += result["created"]
+                total_updated += result["updated"]
+                total_deleted += result["deleted"]
+                self.stdout.write(self.style.SUCCESS(
+                    f"Exam {version}: created={result['created']} updated={result['updated']} "
+                    f"deleted={result['deleted']} unchanged={result['unchanged']} rescored={result['rescored']}"
+                ))
+                if result["remapped"]:
+                    self.stdout.write(f"  AnswerSheet を新しい並びに移し替え: {result['remapped']} 件")
+                if result["provisioned"]:
+                    self.stdout.write(f"  追加した問題の StudentExam を作成: {result['provisioned']} 件")
+                continue
+
+            to_create = [
+                Question(exam=exam, gyo=gyo, retu=retu, **cell)
+                for (gyo, retu), cell in cells.items()
+            ]
 
             with transaction.atomic():
-                Question.objects.bulk_create(to_create, batch_size=2000)
+                if clear_existing:
+                    deleted, _ = Question.objects.filter(exam=exam).delete()
+                    total_deleted += deleted
+                # 既存に追加した場合は DB の内容が JSON と一致しないので、チェックサムは空にする
+                appended = not clear_existing and Question.objects.filter(exam=exam).exists()
+                if use_copy:
+                    copy_rows(Question, QUESTION_FIELDS, instance_rows(to_create, QUESTION_FIELDS))
+                else:
+                    Question.objects.bulk_create(to_create, batch_size=2000)
+                invalidate_catalog()   # bulk は signal を通らない（exam → Question の並びを捨てる）
+                record_checksum(exam, None if appended else cells, json_problem_hash(data, vdata))
                 total_created += len(to_create)
 
             self.stdout.write(self.style.SUCCESS(f"Exam {version}: Question 作成 {len(to_create)} 件"))
@@ -208,4 +227,11 @@ class Command(BaseCommand):
         if clear_existing:
             self.stdout.write(self.style.WARNING(f"削除総数（概算）: {total_deleted}"))
 
+        if reconcile:
+            head = "DRY-RUN（書き込みなし）" if options["dry_run"] else "Question 差分反映"
+            self.stdout.write(self.style.SUCCESS(
+                f"\n=== {head}: created={total_created} updated={total_updated} deleted={total_deleted} ==="
+            ))
+            return
+
         self.stdout.write(self.style.SUCCESS(f"\n=== Question 作成総数: {total_created} ==="))
\ No newline at end of file
@@ -1,12 +1,13 @@
-# exam2/management/commands/load_students.py
+# exam2/management/commands/load_student.py
 
-import csv
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from exam2.catalog import invalidates_catalog
 from exam2.models import Student
+from exam2.roster import BATCH_SIZE, RosterError, apply_roster, plan_roster, read_csv
 
 
 class Command(BaseCommand):
-    help = "CSV から student テーブルを再構築する（全削除→再ロード）"
+    help = "CSV から student テーブルを再構築する（全削除→再ロード。--sync なら差分だけ反映）"
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -24,20 +25,41 @@ class Command(BaseCommand):
             action="store_true",
             help="確認プロンプトを省略して実行する"
         )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="全削除せず id で突き合わせ、追加・変わった列の更新だけ行う（採点データがあっても安全）"
+        )
+        parser.add_argument(
+            "--deactivate-missing",
+            action="store_true",
+            help="--sync で CSV に無い在籍中の学生を enrolled=False にする（行は消さない）"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help=f"bulk_create / bulk_update の batch_size（default: {BATCH_SIZE}）"
+        )
 
+    @invalidates_catalog
     def handle(self, *args, **options):
         csv_path = options["csv_path"]
         dry_run = options["dry_run"]
         auto_yes = options["yes"]
 
+        if options["deactivate_missing"] and not options["sync"]:
+            raise CommandError("--deactivate-missing は --sync と一緒に指定してください")
+        if options["sync"]:
+            return self.sync(csv_path, options)
+
         # -------------------------
         # CSV 読み込み
         # -------------------------
-        rows = []
-        with open(csv_path, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                rows.append(row)
+        try:
+            rows = list(read_csv(csv_path))
+        except RosterError as e:
+            raise CommandError(str(e))
 
         if not rows:
             self.stdout.write(self.style.WARNING("CSV にデータがありません"))
@@ -76,37 +98,57 @@ class Command(BaseCommand):
         deleted, _ = Student.objects.all().delete()
         self.stdout.write(f"削除件数: {deleted}")
 
-        def parse_bool(v, default=True):
-            if v is None:
-                return default
-            v = str(v).strip().lower()
-            if v in ("1", "true", "t", "yes", "y"):
-                return True
-            if v in ("0", "false", "f", "no", "n"):
-                return False
-            return default
-
         # -------------------------
         # 作成（bulk_create）
         # -------------------------
-        students = []
-        for r in rows:
-            students.append(Student(
-                id=int(r["id"]),
-                entyear=int(r["entyear"]),
-                stdNo=r["stdNo"],
-                email=r["email"],
-                name1=r["name1"],
-                name2=r["name2"],
-                nickname=r["nickname"],
-                gender=r["gender"],
-                COO=r["COO"],
-                enrolled = parse_bool(r.get("enrolled"), default=True)
-                #enrolled=bool(int(r["enrolled"])) if r["enrolled"] is not None else True,
-            ))
-
-        Student.objects.bulk_create(students)
+        students = [Student(**r) for r in rows]
+        Student.objects.bulk_create(students, batch_size=options["batch_size"])
 
         self.stdout.write(
             self.style.SUCCESS(f"student 再ロード完了: {len(students)} 件")
-        )
\ No newline at end of file
+        )
+
+    def sync(self, csv_path, options):
+        # CSV は 1 行ずつ読みながら、1 クエリで取った既存の student と突き合わせる
+        try:
+            plan = plan_roster(read_csv(csv_path))
+        except RosterError as e:
+            raise CommandError(str(e))
+
+        deactivate = options["deactivate_missing"]
+        self.stdout.write("===================================")
+        self.stdout.write(" student 差分反映（--sync）")
+        self.stdout.write("-----------------------------------")
+        self.stdout.write(f"CSV の student 件数 : {plan.csv_rows}")
+        self.stdout.write(f"追加               : {len(plan.to_create)}")
+        self.stdout.write(
+            f"更新               : {len(plan.to_update)}"
+            + (" (" + ", ".join(f"{f}={n}" for f, n in sorted(plan.field_changes.items())) + ")" if plan.field_changes else "")
+        )
+        self.stdout.write(f"変更なし           : {plan.unchanged}")
+        self.stdout.write(
+            f"CSV に無い在籍者   : {len(plan.missing_ids)}"
+            + ("（enrolled=False にする）" if deactivate else "（そのまま。--deactivate-missing で enrolled=False）")
+        )
+        self.stdout.write(f"CSV に無い非在籍者 : {plan.already_inactive}")
+        self.stdout.write(f"CSV ファイル        : {csv_path}")
+        self.stdout.write("===================================")
+        for line in plan.samples:
+            self.stdout.write(f"  {line}")
+
+        if plan.conflicts:
+            for line in plan.conflicts[:20]:
+                self.stdout.write(self.style.ERROR(f"  CONFLICT {line}"))
+            raise CommandError(
+                f"conflict が {len(plan.conflicts)} 件あります（id は採点データから参照されるため書き換えません）。CSV を確認してください"
+            )
+
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING("[DRY-RUN] 実際の追加・更新は行いません"))
+            return
+
+        deactivated = apply_roster(plan, deactivate_missing=deactivate, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"student 差分反映完了: created={len(plan.to_create)} updated={len(plan.to_update)}"
+            f" unchanged={plan.unchanged} deactivated={deactivated}"
+        ))
\ No newline at end of file
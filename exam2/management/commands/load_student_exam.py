@@ -2,18 +2,24 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.utils import timezone
 
+from exam2.answersheet import use_packed_storage
+from exam2.bulkprovision import assigned_pairs, provision_answer_sheets
 from exam2.models import Subject, Question, StudentExamVersion, StudentExam
+from exam2.pgcopy import copy_enabled, copy_rows
+from exam2.services import use_sparse_rows
 
 
 class Command(BaseCommand):
-    help = "StudentExam を高速に作成（TF=0, hosei=0）(Phase3対応)"
+    help = "StudentExam を高速に作成（TF=0, hosei=0）(Phase3対応。packed 運用では AnswerSheet)"
 
     def add_arguments(self, parser):
         parser.add_argument("subjectNo", type=str)
         parser.add_argument("--fsyear", type=int, default=getattr(settings, "FSYEAR", None))
         parser.add_argument("--batch-size", type=int, default=2000)
         parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument("--no-copy", action="store_true", help="PostgreSQL でも COPY を使わず bulk_create で作成する")
 
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
@@ -32,7 +38,7 @@ class Command(BaseCommand):
 
         sevs = (
             StudentExamVersion.objects
-            .filter(exam__subject=subject)
+            .filter(subject=subject)
             .select_related("student", "exam")
             .order_by("student__stdNo")
         )
@@ -40,7 +46,28 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("StudentExamVersion が 0 件です（先に load_student_exam_version を実行してください）"))
             return
 
-        exam_ids = list(sevs.values_list("exam_id", flat=True).distinct())
+        if use_packed_storage():
+            # packed 運用：StudentExam の代わりに全セル 0 の AnswerSheet を (student, exam) ごとに作る
+            stats = provision_answer_sheets(
+                subject, assigned_pairs(subject),
+                batch_size=batch_size,
+                use_copy=copy_enabled() and not options["no_copy"],
+                dry_run=dry_run,
+            )
+            head = "DRY-RUN OK" if dry_run else "AnswerSheet 作成完了（既存はスキップ）"
+            self.stdout.write(self.style.SUCCESS(head))
+            self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term(DB)={subject.term}")
+            self.stdout.write(f"  {stats.summary()}")
+            return
+
+        if use_sparse_rows():
+            self.stdout.write(self.style.WARNING(
+                "EXAM2_SPARSE_STUDENT_EXAM=True のため StudentExam は事前作成しません（採点時に作成されます）"
+            ))
+            self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} StudentExamVersion={sevs.count()} 件")
+            return
+
+        exam_ids = list(sevs.order_by().values_list("exam_id", flat=True).distinct())
 
         # ★ N+1問題：Question を 1回で取り、exam_id で束ねる
         questions_by_exam_id = {eid: [] for eid in exam_ids}
@@ -59,6 +86,25 @@ class Command(BaseCommand):
             self.stdout.write("  ※ StudentExam に (student, exam, question) のユニーク制約がある前提です（ignore_conflicts運用）")
             return
 
+        if copy_enabled() and not options["no_copy"]:
+            # PostgreSQL: 一時テーブルへ COPY → ON CONFLICT DO NOTHING
+            now = timezone.now()
+            rows = (
+                (student_id, exam_id, subject.id, q.id, 0, 0, 0, now)
+                for student_id, exam_id in sevs.values_list("student_id", "exam_id")
+                for q in questions_by_exam_id.get(exam_id) or []
+            )
+            inserted = copy_rows(
+                StudentExam,
+                ("student", "exam", "subject", "question", "TF", "hosei", "earned", "updated_at"),
+                rows,
+                conflict_fields=("student", "exam", "question"),
+            )
+            self.stdout.write(self.style.SUCCESS("StudentExam 作成完了（COPY・既存はスキップ）"))
+            self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term(DB)={subject.term}")
+            self.stdout.write(f"  planned={planned} inserted={inserted}")
+            return
+
         total_attempted = 0
         buf = []
 
@@ -72,6 +118,7 @@ class Command(BaseCommand):
                     buf.append(StudentExam(
                         student=sev.student,
                         exam=sev.exam,
+                        subject=subject,
                         question=q,
                         TF=0,
                         hosei=0,
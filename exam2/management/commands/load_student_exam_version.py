@@ -1,18 +1,15 @@
 # exam2/management/commands/load_student_exam_version.py
 
 from pathlib import Path
-import yaml
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-from django.apps import apps
 
-from exam2.models import Subject, Exam, Student, StudentExamVersion
-
-
-BASE_DIR = Path(apps.get_app_config("exam2").path)
-DEFAULT_YAML = BASE_DIR / "data" / "studentVersion.yaml"
+from exam2.models import Subject, Exam, StudentExamVersion
+from exam2.pipeline import (
+    DEFAULT_VERSION_YAML as DEFAULT_YAML,
+    ProvisionError, apply_version_plan, plan_versions, read_version_yaml, subject_version_map,
+)
 
 
 class Command(BaseCommand):
@@ -63,10 +60,6 @@ class Command(BaseCommand):
         if not yaml_path.exists():
             raise CommandError(f"YAML が存在しません: {yaml_path}")
 
-        # ---------- YAML 読み込み ----------
-        with yaml_path.open("r", encoding="utf-8") as f:
-            version_data = yaml.safe_load(f) or {}
-
         # ---------- Subject（Phase3） ----------
         try:
             subject = Subject.objects.get(subjectNo=subjectNo, fsyear=fsyear)
@@ -76,98 +69,56 @@ class Command(BaseCommand):
         nenji = int(subject.nenji)
         term_db = int(subject.term or 0)
 
-        # YAML構造: version_data[fsyear][nenji][version] = [stdNo...]
-        # nenjiキーが文字列の場合もあるので両対応
-        # fkey = str(fsyear)
-        # if fkey not in version_data:
-        #     raise CommandError(f"YAML に fsyear={fsyear} のブロックがありません: {yaml_path}")
-
-        nenji_map = version_data.get(fsyear) or version_data.get(str(fsyear)) or {}
-        if not nenji_map:
-            raise CommandError(f"YAML に fsyear={fsyear} のブロックがありません: {yaml_path}")
-
-        grade_map = nenji_map.get(nenji) or nenji_map.get(str(nenji))
-        if not grade_map:
-            raise CommandError(f"YAML に nenji={nenji} のブロックがありません（fsyear={fsyear}）: {yaml_path}")
-
-        # ★追加：subjectNo を1段掘る（新YAML）
-        vmap = grade_map.get(subjectNo) or grade_map.get(str(subjectNo))
-        if not vmap:
-            raise CommandError(
-                f"YAML に subjectNo={subjectNo} のブロックがありません（fsyear={fsyear}, nenji={nenji}）: {yaml_path}"
-            )
+        # YAML構造: version_data[fsyear][nenji][subjectNo][version] = [stdNo...]（キーは int / str 両対応）
+        try:
+            vmap = subject_version_map(read_version_yaml(yaml_path), fsyear, nenji, subjectNo, yaml_path)
+        except ProvisionError as e:
+            raise CommandError(str(e))
 
         # ---------- Exam（subject×version）を準備 ----------
         exams = {e.version: e for e in Exam.objects.filter(subject=subject)}
         if not exams:
             raise CommandError(f"Exam が存在しません（先に load_subject_base を実行）: subjectNo={subjectNo} fsyear={fsyear}")
 
+        # ---------- 既存割当との差分（メモリ上で計算） ----------
+        plan = plan_versions(subject, exams, vmap, clear_existing=clear_existing)
+
         # 対象versionがDBに無い場合は警告
-        for version in vmap.keys():
-            if version not in exams:
-                self.stdout.write(self.style.WARNING(f"DBに Exam がありません: version={version}（skip対象）"))
+        for version in plan.skipped_versions:
+            self.stdout.write(self.style.WARNING(f"DBに Exam がありません: version={version}（skip対象）"))
 
-        # ---------- dry-run 検証 ----------
-        if dry_run:
-            missing_students = []
-            used = 0
-            for version, student_list in vmap.items():
-                if version not in exams:
-                    continue
-                for stdNo in student_list or []:
-                    used += 1
-                    if not Student.objects.filter(stdNo=str(stdNo)).exists():
-                        missing_students.append(str(stdNo))
-
-            self.stdout.write(self.style.SUCCESS("DRY-RUN OK (validated)"))
+        missing_students = plan.missing_students
+        untouched_count = sum(len(rows) for rows in plan.untouched.values())
+
+        def write_summary(title):
+            self.stdout.write(self.style.SUCCESS(title))
             self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term(DB)={term_db} nenji={nenji}")
-            self.stdout.write(f"  YAML students referenced={used}")
+            self.stdout.write(f"  YAML students referenced={len(plan.wanted)} matched={len(plan.student_ids)}")
+            self.stdout.write(
+                "  by version: " + (", ".join(f"{v}={n}" for v, n in sorted(plan.per_version.items())) or "-")
+            )
+            if clear_existing:
+                self.stdout.write(f"  deleted(existing)={deleted_count}")
+            self.stdout.write(
+                f"  created={len(plan.to_create)} updated={len(plan.to_update)} unchanged={plan.unchanged}"
+                f" deleted(duplicates)={len(plan.duplicate_ids)} not_in_yaml(kept)={untouched_count}"
+            )
+            self.stdout.write(
+                f"  skipped_exam_versions={len(plan.skipped_versions)} skipped_students={len(missing_students)}"
+            )
             if missing_students:
-                self.stdout.write(self.style.WARNING(f"  Missing students in DB: {missing_students[:20]} ... (total {len(missing_students)})"))
+                self.stdout.write(self.style.WARNING(
+                    f"  Missing students in DB: {missing_students[:20]} ... (total {len(missing_students)})"
+                ))
+            self.stdout.write(f"  yaml={yaml_path}")
+
+        # ---------- dry-run ----------
+        if dry_run:
+            deleted_count = StudentExamVersion.objects.filter(subject=subject).count() if clear_existing else 0
+            write_summary("DRY-RUN OK (validated, no changes written)")
             return
 
         # ---------- 反映 ----------
-        created_count = 0
-        updated_count = 0
-        deleted_count = 0
-        skipped_exam_count = 0
-        skipped_student_count = 0
+        deleted_count = apply_version_plan(subject, plan, clear_existing=clear_existing)
 
-        with transaction.atomic():
-            if clear_existing:
-                deleted_count, _ = StudentExamVersion.objects.filter(exam__subject=subject).delete()
-
-            for version, student_list in vmap.items():
-                if version not in exams:
-                    skipped_exam_count += 1
-                    continue
-
-                exam = exams[version]
-                student_list = student_list or []
-
-                for stdNo in student_list:
-                    stdNo = str(stdNo)
-
-                    student = Student.objects.filter(stdNo=stdNo).first()
-                    if not student:
-                        skipped_student_count += 1
-                        self.stdout.write(self.style.WARNING(f"Student 不存在: {stdNo}（skip）"))
-                        continue
-
-                    # その学生のこの subject に対する既存割当を探して更新（複数あっても掃除）
-                    qs = StudentExamVersion.objects.filter(student=student, exam__subject=subject)
-                    # すでに同じexamなら更新しない
-                    n = qs.exclude(exam=exam).update(exam=exam)
-                    updated_count += n
-
-                    if not qs.exists():
-                        StudentExamVersion.objects.create(student=student, exam=exam)
-                        created_count += 1
-
-        self.stdout.write(self.style.SUCCESS("StudentExamVersion 作成/更新完了"))
-        self.stdout.write(f"  subjectNo={subjectNo} fsyear={fsyear} term(DB)={term_db} nenji={nenji}")
-        if clear_existing:
-            self.stdout.write(f"  deleted(existing)={deleted_count}")
-        self.stdout.write(f"  created={created_count} updated={updated_count}")
-        self.stdout.write(f"  skipped_exam_versions={skipped_exam_count} skipped_students={skipped_student_count}")
-        self.stdout.write(f"  yaml={yaml_path}")
\ No newline at end of file
+        write_summary("StudentExamVersion 作成/更新完了")
@@ -1,11 +1,12 @@
 # exam2/management/commands/load_subject_base.py
 import json
-import sys
 from pathlib import Path
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
+from exam2 import examconfig
+from exam2.catalog import invalidates_catalog
 from exam2.models import Subject, Exam
 
 
@@ -36,27 +37,13 @@ class Command(BaseCommand):
             help="既存 Exam の problem_hash が違う場合も JSON に合わせて更新する（デフォルトは空だけ補完）",
         )
 
+    @invalidates_catalog
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
         update_subject = options["update_subject"]
         update_hash = options["update_hash"]
         fsyear_opt = options["fsyear"]
 
-        # -----------------------------
-        # utils.py パス設定とインポート
-        # -----------------------------
-        try:
-            current_file = Path(__file__).resolve()
-            ttc_root = current_file.parents[4]
-            ttc_utilpath = ttc_root / "@TTC" / "util"
-
-            if str(ttc_utilpath) not in sys.path:
-                sys.path.insert(0, str(ttc_utilpath))
-
-            import utils
-        except Exception as e:
-            raise CommandError(f"utils.py のインポートに失敗しました: {e}")
-
         # -----------------------------
         # fsyear の自動解決
         # -----------------------------
@@ -64,10 +51,10 @@ class Command(BaseCommand):
             fsyear = fsyear_opt
         else:
             try:
-                # 引数にも settings にもない場合、dirinfo.yaml のトップにある現在のデフォルト値を拾う
-                fsyear = int(utils.get_current_fsyear())
-            except Exception as e:
-                raise CommandError(f"dirinfo.yaml から fsyear を自動特定できませんでした: {e}")
+                # 引数にも settings にもない場合、上書きファイル / dirinfo.yaml の現在の年度を拾う
+                fsyear = examconfig.current_fsyear()
+            except examconfig.ExamConfigError as e:
+                raise CommandError(str(e))
 
         # -----------------------------
         # JSON パス決定
@@ -76,10 +63,9 @@ class Command(BaseCommand):
             json_path = Path(options["json"])
         else:
             try:
-                # 動的キー取得関数を使って "ans_json" のフルパスを取得
-                json_path = utils.get_exam_config_path(subjectNo, str(fsyear), "ans_json")
-            except Exception as e:
-                raise CommandError(f"共通設定ファイル(YAML)からのパス自動取得に失敗しました: {e}")
+                json_path = examconfig.config_path(subjectNo, fsyear, "ans_json")
+            except examconfig.ExamConfigError as e:
+                raise CommandError(str(e))
 
         if not json_path.exists():
             raise CommandError(f"JSON ファイルが存在しません: {json_path}")
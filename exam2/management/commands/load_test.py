@@ -1,24 +1,30 @@
-import sys
-from pathlib import Path
+# exam2/management/commands/load_test.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
-# py1.py の場所を起点にする
-current_file = Path(__file__).resolve()
+from exam2 import examconfig
 
-# 5つ上の階層（/TTC）を一発で取得
-ttc_root = current_file.parents[4]
-ttc_utilpath = ttc_root / "@TTC" / "util"  # フォルダ名に@がある場合は含めます
 
-# 3. sys.path は「文字列のリスト」を期待するため、str() で変換して検索パスの先頭に追加する
-if str(ttc_utilpath) not in sys.path:
-    sys.path.insert(0, str(ttc_utilpath))
+class Command(BaseCommand):
+    help = "試験設定（YAML / 上書きファイル）からのパス解決を確認する"
 
-# 4. インポートを実行する（ファイル名が utils.py の場合）
-import utils
+    def add_arguments(self, parser):
+        parser.add_argument("subjectNo", nargs="*", help="確認する科目（省略時は年度だけ表示）")
+        parser.add_argument(
+            "--fsyear",
+            type=int,
+            default=getattr(settings, "FSYEAR", None),
+            help="年度（省略時は settings.FSYEAR、未設定なら上書きファイル / dirinfo.yaml）",
+        )
+        parser.add_argument("--key", type=str, default="ans_json", help="解決するキー（既定: ans_json）")
 
-# ─── これで準備完了です ───
-# 先ほど作った共通関数を呼び出す例：
-try:
-    ans_json_path = utils.get_exam_config_path("1020701", "2026", "ans_json")
-    print(f"成功しました！ パス: {ans_json_path}")
-except AttributeError:
-    print("utils.py は読み込めましたが、関数名が未定義か間違っています。")
\ No newline at end of file
+    def handle(self, *args, **options):
+        try:
+            fsyear = options["fsyear"] if options["fsyear"] is not None else examconfig.current_fsyear()
+            self.stdout.write(f"fsyear={fsyear}")
+            for subjectNo in options["subjectNo"]:
+                path = examconfig.config_path(subjectNo, fsyear, options["key"])
+                mark = "" if path.exists() else "  ※ ファイルがありません"
+                self.stdout.write(self.style.SUCCESS(f"{subjectNo} {options['key']}: {path}") + mark)
+        except examconfig.ExamConfigError as e:
+            raise CommandError(str(e))
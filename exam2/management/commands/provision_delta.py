@@ -0,0 +1,124 @@
+# exam2/management/commands/provision_delta.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.answersheet import use_packed_storage
+from exam2.bulkprovision import BATCH_SIZE, fill_gaps, find_gaps
+from exam2.models import Subject
+from exam2.pgcopy import copy_enabled
+from exam2.services import use_sparse_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "割当（StudentExamVersion）はあるのに StudentExam / ExamAdjust が無い学生の分だけ作る"
+        "（packed 運用では StudentExam の代わりに AnswerSheet）。"
+        "--prune で割当の無い StudentExam / ExamAdjust を消す"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("subjectNo", nargs="*", help="対象科目（複数可）")
+        parser.add_argument(
+            "--fsyear",
+            type=int,
+            default=getattr(settings, "FSYEAR", None),
+            help="年度（省略時: settings.FSYEAR）",
+        )
+        parser.add_argument("--all", action="store_true", help="年度の全科目を 1 回の走査で")
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="割当の無い StudentExam / ExamAdjust を削除する（採点済みの行は残す）",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="--prune で採点済み（TF / hosei / adjust が 0 以外）の行も削除する",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="件数だけ表示する（書き込まない）")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"1 回の投入行数（default: {BATCH_SIZE}）")
+        parser.add_argument("--no-copy", action="store_true", help="PostgreSQL でも COPY を使わず bulk_create で作成する")
+
+    def handle(self, *args, **options):
+        fsyear = options["fsyear"]
+        if fsyear is None:
+            raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
+        fsyear = int(fsyear)
+        if options["force"] and not options["prune"]:
+            raise CommandError("--force は --prune と一緒に指定してください")
+
+        subjectNos = list(dict.fromkeys(options["subjectNo"]))
+        if options["all"]:
+            if subjectNos:
+                raise CommandError("subjectNo と --all は同時に指定できません")
+            scope = {"subject__fsyear": fsyear}
+        elif subjectNos:
+            subjects = list(Subject.objects.filter(fsyear=fsyear, subjectNo__in=subjectNos))
+            unknown = sorted(set(subjectNos) - {s.subjectNo for s in subjects})
+            if unknown:
+                raise CommandError(f"Subject が存在しません: subjectNo={', '.join(unknown)} fsyear={fsyear}")
+            scope = {"subject__in": subjects}
+        else:
+            raise CommandError("subjectNo を指定するか --all を付けてください。")
+
+        packed = use_packed_storage()
+        sparse = use_sparse_rows()
+        if packed:
+            self.stdout.write("EXAM2_ANSWER_STORAGE=packed のため StudentExam の代わりに AnswerSheet の欠けを見ます")
+        elif sparse:
+            self.stdout.write(self.style.WARNING(
+                "EXAM2_SPARSE_STUDENT_EXAM=True のため StudentExam の欠けは見ません（採点時に作成されます）"
+            ))
+
+        reports = find_gaps(scope, student_exam=not (sparse or packed), answer_sheet=packed)
+        head = "DRY-RUN" if options["dry_run"] else "provision_delta"
+        if not reports:
+            self.stdout.write(self.style.SUCCESS(f"{head}: 欠け・割当の無い行はありません（fsyear={fsyear}）"))
+            return
+
+        use_copy = copy_enabled() and not options["no_copy"]
+        totals = {"student_exam": 0, "exam_adjust": 0, "answer_sheet": 0, "deleted": 0}
+        for rep in reports.values():
+            fill_gaps(
+                rep,
+                prune=options["prune"], force=options["force"], dry_run=options["dry_run"],
+                batch_size=options["batch_size"], use_copy=use_copy,
+            )
+            self.write_report(rep, options)
+            for key in ("student_exam", "exam_adjust", "answer_sheet"):
+                if key in rep.stats:
+                    totals[key] += rep.stats[key].inserted
+            totals["deleted"] += sum(o["deleted"] for o in rep.orphans.values())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{head}: subjects={len(reports)} StudentExam inserted={totals['student_exam']}"
+            f" ExamAdjust inserted={totals['exam_adjust']}"
+            + (f" AnswerSheet inserted={totals['answer_sheet']}" if packed else "")
+            + f" deleted={totals['deleted']}"
+        ))
+
+    def write_report(self, rep, options):
+        subject = rep.subject
+        self.stdout.write(f"--- {subject.subjectNo} (fsyear={subject.fsyear}) ---")
+        for key, label, missing in (
+            ("student_exam", "StudentExam", rep.missing_student_exam),
+            ("exam_adjust", "ExamAdjust", rep.missing_exam_adjust),
+            ("answer_sheet", "AnswerSheet", rep.missing_answer_sheet),
+        ):
+            if missing:
+                self.stdout.write(f"  {label} 欠け: {len(missing)} 割当  {rep.stats[key].summary()}")
+        for key, label in (("student_exam", "StudentExam"), ("exam_adjust", "ExamAdjust")):
+            orphan = rep.orphans.get(key)
+            if not orphan:
+                continue
+            line = (
+                f"  割当の無い {label}: rows={orphan['rows']} students={len(orphan['students'])}"
+                f" graded={orphan['graded']}"
+            )
+            if options["prune"]:
+                line += f" deleted={orphan['deleted']}"
+                if orphan["graded"] and not options["force"]:
+                    line += "（採点済みは残した。消すなら --force）"
+                self.stdout.write(self.style.WARNING(line) if orphan["graded"] else line)
+            else:
+                self.stdout.write(line + "（--prune で削除）")
@@ -0,0 +1,166 @@
+# exam2/management/commands/provision_subject.py
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.catalog import invalidates_catalog
+from exam2.pgcopy import copy_enabled
+from exam2.pipeline import (
+    DEFAULT_VERSION_YAML, STAGES, ProvisionError, Provisioning, read_version_yaml, yaml_subjects,
+)
+from exam2.yearbatch import default_dir, default_workers, run_subjects, write_report, year_subjects
+
+
+class Command(BaseCommand):
+    help = (
+        "科目の準備（load_subject_base → load_questions → load_student_exam_version → load_student_exam"
+        " → load_exam_adjust）を 1 プロセス・科目ごとに 1 トランザクションで実行する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("subjectNo", nargs="*", help="対象科目（複数可）")
+        parser.add_argument(
+            "--fsyear",
+            type=int,
+            default=getattr(settings, "FSYEAR", None),
+            help="年度（省略時: settings.FSYEAR）",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="年度の全科目（割当 YAML に載っている科目 + DB にある科目）",
+        )
+        parser.add_argument(
+            "--json",
+            type=str,
+            default=None,
+            help="解答 JSON（科目 1 つのときだけ。省略時は YAML から自動解決）",
+        )
+        parser.add_argument(
+            "--yaml",
+            type=str,
+            default=str(DEFAULT_VERSION_YAML),
+            help="version 割当 YAML（default: exam2/data/studentVersion.yaml）",
+        )
+        parser.add_argument(
+            "--stages",
+            type=str,
+            default=",".join(STAGES),
+            help=f"実行する段（カンマ区切り。default: {','.join(STAGES)}）",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="全段を実行して件数を表示し、最後にトランザクションを巻き戻す",
+        )
+        parser.add_argument(
+            "--no-copy",
+            action="store_true",
+            help="PostgreSQL でも COPY を使わず bulk_create で作成する",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=default_workers(),
+            help="科目が複数のときのプロセス数（1 ならこのプロセスで順に実行）",
+        )
+        parser.add_argument(
+            "--summary",
+            type=str,
+            default=None,
+            help="複数科目の結果の出力先（default: exam2/data/export/<fsyear>/provision_summary.json）",
+        )
+
+    @invalidates_catalog
+    def handle(self, *args, **options):
+        fsyear = options["fsyear"]
+        if fsyear is None:
+            raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
+        fsyear = int(fsyear)
+
+        stages = [s.strip() for s in options["stages"].split(",") if s.strip()]
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            raise CommandError(f"未知の stage: {', '.join(unknown)}（{', '.join(STAGES)}）")
+
+        subjects = list(dict.fromkeys(options["subjectNo"]))
+        if options["all"]:
+            if subjects:
+                raise CommandError("subjectNo と --all は同時に指定できません")
+            subjects = self.year_subjects(fsyear, options["yaml"])
+            if not subjects:
+                raise CommandError(f"fsyear={fsyear} の科目がありません（YAML にも DB にも）")
+        if not subjects:
+            raise CommandError("subjectNo を指定するか --all を付けてください。")
+        if options["json"] and len(subjects) > 1:
+            raise CommandError("--json は科目 1 つのときだけ指定できます")
+
+        if len(subjects) == 1:
+            return self.provision_one(subjects[0], fsyear, stages, options)
+        return self.provision_many(subjects, fsyear, stages, options)
+
+    def year_subjects(self, fsyear, yaml_path):
+        listed = []
+        if Path(yaml_path).exists():
+            try:
+                listed = yaml_subjects(read_version_yaml(yaml_path), fsyear)
+            except ProvisionError as e:
+                raise CommandError(str(e))
+        return sorted(set(listed) | set(year_subjects(fsyear)))
+
+    def provision_one(self, subjectNo, fsyear, stages, options):
+        prov = Provisioning(
+            subjectNo, fsyear,
+            json_path=options["json"],
+            version_yaml=options["yaml"],
+            use_copy=copy_enabled() and not options["no_copy"],
+        )
+        try:
+            results = prov.run(stages, dry_run=options["dry_run"])
+        except ProvisionError as e:
+            raise CommandError(f"{subjectNo}: {e}")
+
+        head = "DRY-RUN（巻き戻し済み）" if options["dry_run"] else "provision 完了"
+        self.stdout.write(self.style.SUCCESS(f"{head}: subjectNo={subjectNo} fsyear={fsyear}"))
+        for result in results:
+            rows = " ".join(f"{k}={v}" for k, v in result["rows"].items())
+            self.stdout.write(f"  {result['stage']:<22} {result['seconds']:>8.3f}s  {rows}")
+        self.stdout.write(f"  total {sum(r['seconds'] for r in results):.3f}s")
+        for warning in prov.warnings:
+            self.stdout.write(self.style.WARNING(f"  {warning}"))
+
+    def provision_many(self, subjects, fsyear, stages, options):
+        # 割当 YAML はプールを作る前に読んでおく（fork した子はこのキャッシュを使う）
+        if "student_exam_version" in stages:
+            try:
+                read_version_yaml(options["yaml"])
+            except ProvisionError as e:
+                raise CommandError(str(e))
+
+        def options_for(subjectNo):
+            return {
+                "fsyear": fsyear,
+                "yaml": options["yaml"],
+                "stages": ",".join(stages),
+                "dry_run": options["dry_run"],
+                "no_copy": options["no_copy"],
+            }
+
+        def on_result(result):
+            mark = "ok" if result["ok"] else "FAILED"
+            self.stdout.write(f"  [{mark}] {result['subjectNo']} ({result['seconds']}s)")
+            for line in result["output"][1:]:
+                self.stdout.write(f"    {line.strip()}")
+
+        summary_path = Path(options["summary"]) if options["summary"] else default_dir(fsyear) / "provision_summary.json"
+        summary_path.parent.mkdir(parents=True, exist_ok=True)
+        summary = run_subjects(
+            "provision_subject", subjects, options_for,
+            workers=options["workers"], summary_path=summary_path, fsyear=fsyear, on_result=on_result,
+        )
+
+        self.stdout.write(self.style.SUCCESS("provision（複数科目）完了"))
+        write_report(self, summary, summary_path)
+        if summary["failed"]:
+            raise CommandError(f"{len(summary['failed'])} subject(s) failed (see {summary_path})")
@@ -1,10 +1,12 @@
 import json
-from django.core.management.base import BaseCommand
-from exam2.models import Subject, Exam, Question
+from django.core.management.base import BaseCommand, CommandError
+from exam2.catalog import invalidates_catalog
+from exam2.models import Exam
+from exam2.questionsync import QuestionJsonError, json_problem_hash, parse_cells, reconcile_exam
 
 
 class Command(BaseCommand):
-    help = "answer_xxxx.json から Question を生成（既存は上書き、削除しない）"
+    help = "answer_xxxx.json から Question を生成（既存は (gyo, retu) で突き合わせて上書き、削除しない）"
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -12,7 +14,13 @@ class Command(BaseCommand):
             type=str,
             help="JSON ファイルのパス（answer_XXXX.json）",
         )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="problem_hash と内容チェックサムが前回と同じでも突き合わせを行う",
+        )
 
+    @invalidates_catalog
     def handle(self, *args, **options):
         json_path = options["json_path"]
 
@@ -35,14 +43,12 @@ class Command(BaseCommand):
             meta = question_blocks[0]
             subjectNo = meta["subject"]
             fsyear = meta["fsyear"]
-            term = int(meta["nenji"])
 
-            # Exam を取得
+            # Exam を取得（Subject は subjectNo + fsyear で一意）
             try:
                 exam = Exam.objects.get(
                     subject__subjectNo=subjectNo,
-                    fsyear=fsyear,
-                    term=term,
+                    subject__fsyear=fsyear,
                     version=version,
                 )
             except Exam.DoesNotExist:
@@ -51,43 +57,28 @@ class Command(BaseCommand):
 
             self.stdout.write(self.style.SUCCESS(f"Exam: {exam}"))
 
-            # ----------- Question の登録 -----------
-            for block_index, qblock in enumerate(question_blocks[1:], start=1):
-                gyo = block_index
-
-                labels = qblock["label"]
-                answers = qblock["answer"]
-                widths = qblock["width"]
-                heights = qblock["height"]
-                points = qblock["point"]
-                koumokues = qblock["koumoku"]
-
-                for idx in range(len(labels)):
-                    retu = idx + 1
-
-                    obj, created = Question.objects.get_or_create(
-                        exam=exam,
-                        q_no=labels[idx],
-                        gyo=gyo,
-                        retu=retu,
-                        defaults={
-                            "bunrui": koumokues[idx],
-                            "points": points[idx],
-                            "width": int(widths[idx]),
-                            "height": int(heights[idx]),
-                            "answer": answers[idx],
-                        }
-                    )
-
-                    # 作成されなかった（既存があった）場合は上書き
-                    if not created:
-                        obj.bunrui = koumokues[idx]
-                        obj.points = points[idx]
-                        obj.width = int(widths[idx])
-                        obj.height = int(heights[idx])
-                        obj.answer = answers[idx]
-                        obj.save()
-
-                self.stdout.write(self.style.SUCCESS(f"  gyo={gyo} を更新"))
-
-        self.stdout.write(self.style.SUCCESS("--- Question import 完了 ---"))
\ No newline at end of file
+            # ----------- Question の登録（差分だけ bulk で反映）-----------
+            try:
+                cells = parse_cells(question_blocks, height_ratio=False)
+            except QuestionJsonError as e:
+                raise CommandError(f"{e}: version={version}")
+
+            result = reconcile_exam(
+                exam, cells,
+                problem_hash=json_problem_hash(data, version_block),
+                delete_missing=False,
+                force=options["force"],
+            )
+            if result["skipped"]:
+                self.stdout.write("  problem_hash / 内容チェックサムが前回と同じ（skip）")
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"  created={result['created']} updated={result['updated']} unchanged={result['unchanged']}"
+                f" rescored={result['rescored']}"
+            ))
+            if result["remapped"]:
+                self.stdout.write(f"  AnswerSheet を新しい並びに移し替え: {result['remapped']} 件")
+            if result["provisioned"]:
+                self.stdout.write(f"  追加した問題の StudentExam を作成: {result['provisioned']} 件")
+
+        self.stdout.write(self.style.SUCCESS("--- Question import 完了 ---"))
@@ -0,0 +1,38 @@
+# exam2/management/commands/recompute_earned.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.models import Subject, Question
+from exam2.scoring import recompute_earned
+
+
+class Command(BaseCommand):
+    help = "StudentExam.earned（TF=1 の points）を Question.points から付け直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("subjectNo", type=str)
+        parser.add_argument(
+            "--fsyear",
+            type=int,
+            default=getattr(settings, "FSYEAR", None),
+            help="年度（省略時: settings.FSYEAR）",
+        )
+
+    def handle(self, *args, **options):
+        subjectNo = options["subjectNo"]
+        fsyear = options["fsyear"]
+        if fsyear is None:
+            raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
+        fsyear = int(fsyear)
+
+        try:
+            subject = Subject.objects.get(subjectNo=subjectNo, fsyear=fsyear)
+        except Subject.DoesNotExist:
+            raise CommandError(f"Subject が存在しません: subjectNo={subjectNo} fsyear={fsyear}")
+
+        question_ids = list(Question.objects.filter(exam__subject=subject).values_list("id", flat=True))
+        updated = recompute_earned(question_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"earned 再計算: subjectNo={subjectNo} fsyear={fsyear} questions={len(question_ids)} rows={updated}"
+        ))
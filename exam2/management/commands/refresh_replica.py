@@ -0,0 +1,58 @@
+# exam2/management/commands/refresh_replica.py
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from exam2.replica import replica_lag, replica_options, stamp_path
+
+
+class Command(BaseCommand):
+    help = "SQLite の読み取りレプリカ（集計・出力用のコピー）を作業DBから作り直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--status", action="store_true", help="作り直さずにレプリカの遅れだけ表示する")
+        parser.add_argument("--pages", type=int, default=1000, help="backup 1 ステップあたりのページ数")
+
+    def handle(self, *args, **options):
+        opts = replica_options()
+        alias = opts["alias"]
+        if alias not in connections.settings:
+            raise CommandError(f"DATABASES に {alias!r} がありません（settings の EXAM2_REPLICA を確認してください）")
+
+        if options["status"]:
+            lag = replica_lag(alias)
+            state = "使用不可" if lag is None or lag > opts["max_staleness"] else "使用中"
+            lag_text = "不明" if lag is None else f"{lag:.1f}s"
+            self.stdout.write(f"{alias}: lag={lag_text} max_staleness={opts['max_staleness']}s → {state}")
+            return
+
+        source = connections[DEFAULT_DB_ALIAS]
+        replica = connections[alias]
+        if source.vendor != "sqlite" or replica.vendor != "sqlite":
+            raise CommandError("refresh_replica は SQLite 同士のみ対応です（PostgreSQL はスタンバイ側のレプリケーションを使用）")
+
+        target = Path(str(replica.settings_dict["NAME"]).split("?")[0].removeprefix("file:"))
+        tmp = target.with_name(target.name + ".tmp")
+
+        started = time.perf_counter()
+        source.ensure_connection()
+        dest = sqlite3.connect(tmp)
+        try:
+            # 作業DBを止めずにページ単位でコピーする（途中で書き込みがあれば backup が追従する）
+            source.connection.backup(dest, pages=options["pages"])
+            # 読み取り専用で開くので WAL をやめておく（-shm を作れないため）
+            dest.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            dest.close()
+
+        replica.close()
+        os.replace(tmp, target)
+        stamp_path(alias).touch()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"レプリカ更新: {target} ({target.stat().st_size // 1024} KiB, {time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,25 @@
+# exam2/management/commands/show_db_pragmas.py
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from exam2.dbprofile import effective_pragmas, get_profile
+
+
+class Command(BaseCommand):
+    help = "SQLite 接続の実効 PRAGMA と settings.SQLITE_PROFILE を並べて表示する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="対象の DB エイリアス（既定: default）")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            self.stdout.write(self.style.WARNING(f"{options['database']} は sqlite ではありません（vendor={connection.vendor}）"))
+            return
+
+        profile = get_profile()
+        self.stdout.write(f"database : {connection.settings_dict['NAME']}")
+        self.stdout.write(f"{'pragma':14s} {'effective':>12s} {'profile':>12s}")
+        for name, value in effective_pragmas(connection).items():
+            expected = profile.get(name, "-")
+            self.stdout.write(f"{name:14s} {str(value):>12s} {str(expected):>12s}")
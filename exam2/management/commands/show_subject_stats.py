@@ -5,13 +5,20 @@ from exam2.models import (
     Subject, Exam, Question,
     StudentExam, ExamAdjust
 )
+from exam2.replica import reporting_command
 
 class Command(BaseCommand):
     help = "指定 subject の試験・採点・調整の統計情報を表示する"
 
     def add_arguments(self, parser):
         parser.add_argument("subjectNo", type=str)
+        parser.add_argument(
+            "--primary",
+            action="store_true",
+            help="レプリカが設定されていても primary を読む",
+        )
 
+    @reporting_command
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
 
@@ -20,10 +27,10 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR("Subject が存在しません"))
             return
 
-        exams = Exam.objects.filter(subject=subject)
+        exams = Exam.objects.filter(subject=subject).order_by("version")
         questions = Question.objects.filter(exam__in=exams)
-        student_exams = StudentExam.objects.filter(exam__in=exams)
-        exam_adjusts = ExamAdjust.objects.filter(exam__in=exams)
+        student_exams = StudentExam.objects.filter(subject=subject)
+        exam_adjusts = ExamAdjust.objects.filter(subject=subject)
 
         self.stdout.write("=" * 40)
         self.stdout.write("Subject Statistics")
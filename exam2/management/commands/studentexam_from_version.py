@@ -1,74 +1,57 @@
-from django.core.management.base import BaseCommand
-from exam2.models import Exam, Question, StudentExam, StudentExamVersion, Subject
+# exam2/management/commands/studentexam_from_version.py
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.answersheet import use_packed_storage
+from exam2.bulkprovision import (
+    BATCH_SIZE, BulkProvisionError, assigned_pairs, provision_answer_sheets, provision_student_exams, resolve_subject,
+)
+from exam2.pgcopy import copy_enabled
+from exam2.services import use_sparse_rows
 
 
 class Command(BaseCommand):
-    help = "StudentExamVersion をもとに StudentExam を作成（学生 × 試験 × 問題）"
+    help = "StudentExamVersion をもとに StudentExam を作成（学生 × 試験 × 問題。packed 運用では AnswerSheet）"
 
     def add_arguments(self, parser):
         parser.add_argument("subject_no", type=str, help="科目コード 例: 2030402")
         parser.add_argument("fsyear", type=int, help="年度 例: 2025")
         parser.add_argument("term", type=int, help="期 例: 2")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"1 回の投入行数（default: {BATCH_SIZE}）")
+        parser.add_argument("--dry-run", action="store_true", help="作成予定件数だけ表示する")
+        parser.add_argument("--no-copy", action="store_true", help="PostgreSQL でも COPY を使わず bulk_create で作成する")
 
     def handle(self, *args, **options):
-        subject_no = options["subject_no"]
-        fsyear = options["fsyear"]
-        term = options["term"]
-
-        # --- Subject 取得 ---
-        try:
-            subject = Subject.objects.get(subjectNo=subject_no)
-        except Subject.DoesNotExist:
-            self.stderr.write(self.style.ERROR(f"Subject {subject_no} が見つかりません"))
-            return
-
-        # --- 対象 Exam 取得（A/B/C ... すべて） ---
-        exams = Exam.objects.filter(subject=subject, fsyear=fsyear, term=term)
-
-        if not exams.exists():
-            self.stderr.write(self.style.ERROR("対象 Exam がありません"))
-            return
-
-        self.stdout.write(self.style.SUCCESS(f"対象 Exam 件数: {exams.count()} 件"))
-
-        created_count_total = 0
-
-        for exam in exams:
-            version = exam.version
-
-            # --- この version を受ける学生を取得 ---
-            sev_list = StudentExamVersion.objects.filter(exam=exam).select_related("student")
-            students = [sev.student for sev in sev_list]
-
-            self.stdout.write(self.style.SUCCESS(
-                f"--- Exam {exam.id} (version={version}) ---"
-            ))
-            self.stdout.write(f"対象学生: {len(students)} 名")
-
-            # --- Question 取得 ---
-            questions = exam.questions.all()
-            self.stdout.write(f"問題数: {questions.count()} 問")
-
-            created_count = 0
-
-            # --- 学生 × 問題 で StudentExam を作成 ---
-            for student in students:
-                for q in questions:
-                    _, created = StudentExam.objects.get_or_create(
-                        student=student,
-                        exam=exam,
-                        question=q,
-                        defaults={"TF": 0, "hosei": 0}
-                    )
-                    if created:
-                        created_count += 1
-
-            created_count_total += created_count
-
-            self.stdout.write(self.style.SUCCESS(
-                f"→ Exam {exam.id} で新規作成 {created_count} 件"
+        packed = use_packed_storage()
+        if use_sparse_rows() and not packed:
+            self.stdout.write(self.style.WARNING(
+                "EXAM2_SPARSE_STUDENT_EXAM=True のため StudentExam は事前作成しません（採点時に作成されます）"
             ))
+            return
 
-        self.stdout.write(self.style.SUCCESS(
-            f"=== 全体で新規作成 {created_count_total} 件 完了 ==="
-        ))
\ No newline at end of file
+        try:
+            subject = resolve_subject(options["subject_no"], options["fsyear"], options["term"])
+        except BulkProvisionError as e:
+            raise CommandError(str(e))
+
+        # --- version 割当（学生 × exam）---
+        pairs = assigned_pairs(subject)
+        if not pairs:
+            raise CommandError("StudentExamVersion が 0 件です（先に load_student_exam_version を実行してください）")
+        versions = {}
+        for _, exam_id in pairs:
+            versions[exam_id] = versions.get(exam_id, 0) + 1
+        self.stdout.write(self.style.SUCCESS(f"対象 Exam 件数: {len(versions)} 件"))
+        for exam_id, count in sorted(versions.items()):
+            self.stdout.write(f"  Exam {exam_id}: 対象学生 {count} 名")
+
+        provision = provision_answer_sheets if packed else provision_student_exams
+        stats = provision(
+            subject, pairs,
+            batch_size=options["batch_size"],
+            use_copy=copy_enabled() and not options["no_copy"],
+            dry_run=options["dry_run"],
+        )
+
+        head = "DRY-RUN OK" if options["dry_run"] else f"{'AnswerSheet' if packed else 'StudentExam'} 作成完了"
+        self.stdout.write(self.style.SUCCESS(f"=== {head}: 全体で新規作成 {stats.inserted} 件 ==="))
+        self.stdout.write(f"  {stats.summary()}")
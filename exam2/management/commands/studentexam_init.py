@@ -1,58 +1,64 @@
-from django.core.management.base import BaseCommand
-from exam2.models import Subject, Student, Exam, Question, StudentExam
+# exam2/management/commands/studentexam_init.py
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.answersheet import use_packed_storage
+from exam2.bulkprovision import (
+    BATCH_SIZE, BulkProvisionError, grade_student_ids, provision_answer_sheets, provision_student_exams,
+    question_ids_by_exam, resolve_subject,
+)
+from exam2.models import Exam
+from exam2.pgcopy import copy_enabled
+from exam2.services import use_sparse_rows
 
 
 class Command(BaseCommand):
-    help = "指定された subjectNo / fsyear / term に対して StudentExam を一括作成する"
+    help = "指定された subjectNo / fsyear / term に対して StudentExam を一括作成する（対象学年の全学生 × 全 Exam。packed 運用では AnswerSheet）"
 
     def add_arguments(self, parser):
         parser.add_argument("subjectNo", type=str, help="科目コード（例: 1010401）")
         parser.add_argument("fsyear", type=int, help="年度（例: 2025）")
         parser.add_argument("term", type=int, help="期（例: 1）")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"1 回の投入行数（default: {BATCH_SIZE}）")
+        parser.add_argument("--dry-run", action="store_true", help="作成予定件数だけ表示する")
+        parser.add_argument("--no-copy", action="store_true", help="PostgreSQL でも COPY を使わず bulk_create で作成する")
 
     def handle(self, *args, **options):
         subjectNo = options["subjectNo"]
         fsyear = options["fsyear"]
         term = options["term"]
 
-        try:
-            subject = Subject.objects.get(subjectNo=subjectNo)
-        except Subject.DoesNotExist:
-            self.stdout.write(self.style.ERROR(f"Subject {subjectNo} が見つかりません"))
+        packed = use_packed_storage()
+        if use_sparse_rows() and not packed:
+            self.stdout.write(self.style.WARNING(
+                "EXAM2_SPARSE_STUDENT_EXAM=True のため StudentExam は事前作成しません（採点時に作成されます）"
+            ))
             return
 
-        target_nenji = subject.nenji
-        self.stdout.write(f"科目 {subjectNo} / 対象学年 {target_nenji}")
+        try:
+            subject = resolve_subject(subjectNo, fsyear, term)
+        except BulkProvisionError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"科目 {subjectNo} / 対象学年 {subject.nenji}")
 
-        # 対象学生（学年を計算： fsyear - entyear + 1）
-        students = [
-            stu for stu in Student.objects.all()
-            if (fsyear - stu.entyear + 1) == target_nenji
-        ]
-        self.stdout.write(f"対象学生: {len(students)}名")
+        # 対象学生（学年 = fsyear - entyear + 1 を SQL で絞る）
+        student_ids = grade_student_ids(fsyear, subject.nenji)
+        self.stdout.write(f"対象学生: {len(student_ids)}名")
 
         # 対象 Exam（A/B/C など複数あれば全部）
-        exams = Exam.objects.filter(subject=subject, fsyear=fsyear, term=term)
-        self.stdout.write(f"対象試験数: {exams.count()}件")
-
-        created_count = 0
-
-        for exam in exams:
-            self.stdout.write(f"--- Exam {exam.id} (version={exam.version}) を処理中 ---")
-
-            questions = Question.objects.filter(exam=exam)
-
-            for stu in students:
-                for q in questions:
-                    obj, created = StudentExam.objects.get_or_create(
-                        student=stu,
-                        exam=exam,
-                        question=q,
-                        defaults={"TF": 0, "hosei": 0}
-                    )
-                    if created:
-                        created_count += 1
-
-        self.stdout.write(self.style.SUCCESS(
-            f"StudentExam 作成完了: 新規 {created_count} 件"
-        ))
\ No newline at end of file
+        exam_ids = list(Exam.objects.filter(subject=subject).order_by("version").values_list("id", flat=True))
+        self.stdout.write(f"対象試験数: {len(exam_ids)}件")
+
+        provision = provision_answer_sheets if packed else provision_student_exams
+        stats = provision(
+            subject,
+            ((student_id, exam_id) for exam_id in exam_ids for student_id in student_ids),
+            question_ids=question_ids_by_exam(exam_ids),
+            batch_size=options["batch_size"],
+            use_copy=copy_enabled() and not options["no_copy"],
+            dry_run=options["dry_run"],
+        )
+
+        head = "DRY-RUN OK" if options["dry_run"] else f"{'AnswerSheet' if packed else 'StudentExam'} 作成完了"
+        self.stdout.write(self.style.SUCCESS(f"{head}: 新規 {stats.inserted} 件"))
+        self.stdout.write(f"  {stats.summary()}")
+
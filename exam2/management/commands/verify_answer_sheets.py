@@ -0,0 +1,123 @@
+# exam2/management/commands/verify_answer_sheets.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from exam2.answersheet import (
+    build_answer_sheets,
+    exam_layouts,
+    sheet_cells,
+    use_packed_storage,
+    write_back_rows,
+)
+from exam2.models import Subject, StudentExam, StudentExamVersion, AnswerSheet
+
+
+class Command(BaseCommand):
+    help = "AnswerSheet（packed）と StudentExam（rows）の内容が一致しているか検証する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("subjectNo", type=str)
+        parser.add_argument(
+            "--fsyear",
+            type=int,
+            default=getattr(settings, "FSYEAR", None),
+            help="年度（省略時: settings.FSYEAR）",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="検証後、StudentExam から AnswerSheet を作り直す（rows → packed）",
+        )
+        parser.add_argument(
+            "--write-back",
+            action="store_true",
+            help="検証後、AnswerSheet の内容を StudentExam に書き戻す（packed → rows）",
+        )
+        parser.add_argument("--limit", type=int, default=20, help="表示する不一致の最大件数")
+
+    def handle(self, *args, **options):
+        subjectNo = options["subjectNo"]
+        fsyear = options["fsyear"]
+        if fsyear is None:
+            raise CommandError("fsyear が未指定です。--fsyear を指定するか settings.FSYEAR を設定してください。")
+        fsyear = int(fsyear)
+
+        if options["rebuild"] and options["write_back"]:
+            raise CommandError("--rebuild と --write-back は同時に指定できません。")
+
+        try:
+            subject = Subject.objects.get(subjectNo=subjectNo, fsyear=fsyear)
+        except Subject.DoesNotExist:
+            raise CommandError(f"Subject が存在しません: subjectNo={subjectNo} fsyear={fsyear}")
+
+        sev_pairs = set(
+            StudentExamVersion.objects.filter(subject=subject).values_list("student_id", "exam_id")
+        )
+        sheets = {
+            (s.student_id, s.exam_id): s
+            for s in AnswerSheet.objects.filter(exam__subject=subject)
+        }
+        layouts = exam_layouts({eid for _, eid in sev_pairs} | {eid for _, eid in sheets})
+
+        cells = {}
+        for student_id, exam_id, qid, tf, hosei in (
+            StudentExam.objects.filter(subject=subject)
+            .values_list("student_id", "exam_id", "question_id", "TF", "hosei")
+        ):
+            cells[(student_id, exam_id, qid)] = (tf, int(hosei or 0))
+
+        problems = []
+        for pair in sorted(sev_pairs - set(sheets)):
+            problems.append(f"AnswerSheet 不足: student_id={pair[0]} exam_id={pair[1]}")
+        for pair in sorted(set(sheets) - sev_pairs):
+            problems.append(f"AnswerSheet 余剰（SEV 割当なし）: student_id={pair[0]} exam_id={pair[1]}")
+
+        checked = 0
+        for (student_id, exam_id), sheet in sorted(sheets.items()):
+            layout = layouts[exam_id]
+            if sheet.question_count != len(layout):
+                problems.append(
+                    f"問題数不一致: student_id={student_id} exam_id={exam_id} "
+                    f"sheet={sheet.question_count} questions={len(layout)}"
+                )
+                continue
+
+            tf_list, hosei_list = sheet_cells(sheet)
+            score = 0
+            for i, qid in enumerate(layout.question_ids):
+                tf, hosei = cells.get((student_id, exam_id, qid), (0, 0))
+                if (tf, hosei) != (tf_list[i], hosei_list[i]):
+                    problems.append(
+                        f"セル不一致: student_id={student_id} exam_id={exam_id} question_id={qid} "
+                        f"rows=(TF={tf}, hosei={hosei}) sheet=(TF={tf_list[i]}, hosei={hosei_list[i]})"
+                    )
+                if tf_list[i]:
+                    score += layout.points[i]
+
+            if (sheet.score, sheet.hosei_total, sheet.total) != (score, sum(hosei_list), score + sum(hosei_list)):
+                problems.append(
+                    f"集計キャッシュ不一致: student_id={student_id} exam_id={exam_id} "
+                    f"cached=({sheet.score}, {sheet.hosei_total}, {sheet.total})"
+                )
+            checked += 1
+
+        self.stdout.write(f"subjectNo={subjectNo} fsyear={fsyear} storage={'packed' if use_packed_storage() else 'rows'}")
+        self.stdout.write(f"  SEV={len(sev_pairs)} AnswerSheet={len(sheets)} checked={checked}")
+
+        if problems:
+            self.stdout.write(self.style.WARNING(f"  不一致 {len(problems)} 件"))
+            for line in problems[: options["limit"]]:
+                self.stdout.write(f"    {line}")
+        else:
+            self.stdout.write(self.style.SUCCESS("  一致しました"))
+
+        if options["rebuild"]:
+            result = build_answer_sheets(subject)
+            self.stdout.write(self.style.SUCCESS(
+                f"AnswerSheet 再構築: created={result['created']} updated={result['updated']} deleted={result['deleted']}"
+            ))
+        elif options["write_back"]:
+            result = write_back_rows(subject)
+            self.stdout.write(self.style.SUCCESS(
+                f"StudentExam 書き戻し: created={result['created']} updated={result['updated']}"
+            ))
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam2', '0015_alter_subject_fsyear_alter_subject_term'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='exam',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='examadjust',
+            index=models.Index(fields=['student', 'exam'], name='ix_adjust_student_exam'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['exam', 'gyo', 'retu'], name='ix_question_exam_gyo_retu'),
+        ),
+        migrations.AddIndex(
+            model_name='studentexam',
+            index=models.Index(fields=['exam', 'student'], name='ix_se_exam_student'),
+        ),
+        migrations.AddIndex(
+            model_name='studentexam',
+            index=models.Index(condition=models.Q(('TF', 1)), fields=['exam'], name='ix_se_exam_tf1'),
+        ),
+        migrations.AddIndex(
+            model_name='studentexam',
+            index=models.Index(condition=models.Q(('hosei', 0), _negated=True), fields=['exam'], name='ix_se_exam_hosei_nz'),
+        ),
+        migrations.AddIndex(
+            model_name='studentexamversion',
+            index=models.Index(fields=['exam', 'student'], name='ix_sev_exam_student'),
+        ),
+    ]
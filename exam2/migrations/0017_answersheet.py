@@ -0,0 +1,106 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:23
+
+import sys
+from array import array
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+# exam2.answersheet の pack_tf / pack_hosei の写し（この時点の形式で固定する。アプリ側を変えても追従しない）
+def pack_tf(values):
+    values = list(values)
+    buf = bytearray((len(values) + 7) // 8)
+    for i, v in enumerate(values):
+        if v:
+            buf[i >> 3] |= 1 << (i & 7)
+    return bytes(buf)
+
+
+def pack_hosei(values):
+    arr = array("h", (int(v or 0) for v in values))
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def build_sheets(apps, schema_editor):
+    """既存の SEV 割当ごとに StudentExam から AnswerSheet を作る（無いセルは 0）"""
+    Question = apps.get_model("exam2", "Question")
+    StudentExam = apps.get_model("exam2", "StudentExam")
+    StudentExamVersion = apps.get_model("exam2", "StudentExamVersion")
+    AnswerSheet = apps.get_model("exam2", "AnswerSheet")
+    db = schema_editor.connection.alias
+
+    layouts = {}
+    for exam_id, qid, points in (
+        Question.objects.using(db).order_by("exam_id", "gyo", "retu", "id").values_list("exam_id", "id", "points")
+    ):
+        layouts.setdefault(exam_id, []).append((qid, int(points or 0)))
+
+    now = timezone.now()
+    buf = []
+    for exam_id, layout in layouts.items():
+        cells = {}
+        for student_id, qid, tf, hosei in (
+            StudentExam.objects.using(db).filter(exam_id=exam_id).values_list("student_id", "question_id", "TF", "hosei")
+        ):
+            cells[(student_id, qid)] = (1 if tf else 0, int(hosei or 0))
+
+        for student_id in StudentExamVersion.objects.using(db).filter(exam_id=exam_id).values_list("student_id", flat=True):
+            pairs = [cells.get((student_id, qid), (0, 0)) for qid, _ in layout]
+            score = sum(p for (_, p), (tf, _) in zip(layout, pairs) if tf)
+            hosei_total = sum(h for _, h in pairs)
+            buf.append(AnswerSheet(
+                student_id=student_id,
+                exam_id=exam_id,
+                question_count=len(layout),
+                tf_bits=pack_tf(tf for tf, _ in pairs),
+                hosei=pack_hosei(h for _, h in pairs),
+                score=score,
+                hosei_total=hosei_total,
+                total=score + hosei_total,
+                updated_at=now,
+            ))
+
+        if len(buf) >= 500:
+            AnswerSheet.objects.using(db).bulk_create(buf)
+            buf.clear()
+
+    if buf:
+        AnswerSheet.objects.using(db).bulk_create(buf)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam2', '0016_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerSheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_count', models.IntegerField(default=0)),
+                ('tf_bits', models.BinaryField(default=b'')),
+                ('hosei', models.BinaryField(default=b'')),
+                ('score', models.IntegerField(default=0)),
+                ('hosei_total', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='exam2.exam')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='exam2.student')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='answersheet',
+            index=models.Index(fields=['exam', 'student'], name='ix_sheet_exam_student'),
+        ),
+        migrations.AddConstraint(
+            model_name='answersheet',
+            constraint=models.UniqueConstraint(fields=('student', 'exam'), name='uq_answersheet_student_exam'),
+        ),
+        migrations.RunPython(build_sheets, migrations.RunPython.noop),
+    ]
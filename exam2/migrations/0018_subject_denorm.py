@@ -0,0 +1,41 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_subject(apps, schema_editor):
+    """exam.subject_id を各テーブルの subject_id に複製する"""
+    Exam = apps.get_model("exam2", "Exam")
+    db = schema_editor.connection.alias
+    subject_of_exam = models.Subquery(
+        Exam.objects.using(db).filter(id=models.OuterRef("exam_id")).values("subject_id")[:1]
+    )
+    for name in ("StudentExam", "StudentExamVersion", "ExamAdjust"):
+        apps.get_model("exam2", name).objects.using(db).update(subject_id=subject_of_exam)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam2', '0017_answersheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='examadjust',
+            name='subject',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='exam2.subject'),
+        ),
+        migrations.AddField(
+            model_name='studentexam',
+            name='subject',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='exam2.subject'),
+        ),
+        migrations.AddField(
+            model_name='studentexamversion',
+            name='subject',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='exam2.subject'),
+        ),
+        migrations.RunPython(fill_subject, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:28
+
+from django.db import migrations, models
+
+
+def fill_earned(apps, schema_editor):
+    """TF=1 の行に question.points を入れる（それ以外は default の 0）"""
+    Question = apps.get_model("exam2", "Question")
+    StudentExam = apps.get_model("exam2", "StudentExam")
+    db = schema_editor.connection.alias
+    points_of_question = models.Subquery(
+        Question.objects.using(db).filter(id=models.OuterRef("question_id")).values("points")[:1]
+    )
+    StudentExam.objects.using(db).filter(TF=1).update(earned=points_of_question)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam2', '0018_subject_denorm'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='studentexam',
+            name='ix_se_exam_student',
+        ),
+        migrations.AddField(
+            model_name='studentexam',
+            name='earned',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='studentexam',
+            index=models.Index(fields=['exam', 'student', 'earned', 'hosei'], name='ix_se_exam_student_score'),
+        ),
+        migrations.RunPython(fill_earned, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam2', '0019_studentexam_earned'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(default='default', max_length=50)),
+                ('exported_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='examadjust',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='studentexam',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='studentexamversion',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='examadjust',
+            index=models.Index(fields=['subject', 'updated_at'], name='ix_adjust_subject_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='studentexam',
+            index=models.Index(fields=['subject', 'updated_at'], name='ix_se_subject_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='studentexamversion',
+            index=models.Index(fields=['subject', 'updated_at'], name='ix_sev_subject_updated'),
+        ),
+        migrations.AddField(
+            model_name='exportwatermark',
+            name='subject',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='exam2.subject'),
+        ),
+        migrations.AddConstraint(
+            model_name='exportwatermark',
+            constraint=models.UniqueConstraint(fields=('subject', 'target'), name='uq_watermark_subject_target'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exam2', '0020_change_stamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exam',
+            name='content_checksum',
+            field=models.CharField(blank=True, default='', help_text='最後に反映した Question 内容（並び・配点・正答…）の md5（load_questions --reconcile の空振り判定）', max_length=32),
+        ),
+    ]
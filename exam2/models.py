@@ -34,13 +34,18 @@ class Exam(models.Model):
         max_length=32, null=True, blank=True, db_index=True,
         help_text="問題内容を一意に識別するハッシュ（answers_xxxx.json の metainfo.hash）"
     )
+    content_checksum = models.CharField(
+        max_length=32, blank=True, default="",
+        help_text="最後に反映した Question 内容（並び・配点・正答…）の md5（load_questions --reconcile の空振り判定）"
+    )
 
     class Meta:
         # subject が年度込みになるので、これでOK
         constraints = [
             models.UniqueConstraint(fields=["subject", "version"], name="uq_exam_subject_version"),
         ]
-        ordering = ["subject__subjectNo", "subject__fsyear", "subject__term", "version"]
+        # ★ subject__* での既定 ordering は全クエリに Subject JOIN を持ち込むので外す
+        #    並びが必要な箇所は order_by("version") などを明示すること
 
     def __str__(self):
         return f"{self.subject.subjectNo}-{self.version} {self.title}"
@@ -72,6 +77,10 @@ class Question(models.Model):
 
     class Meta:
         ordering = ["gyo", "retu"]
+        indexes = [
+            # exam 単位で gyo/retu 順に並べる（採点画面・export/import の並び定義）
+            models.Index(fields=["exam", "gyo", "retu"], name="ix_question_exam_gyo_retu"),
+        ]
 
     def __str__(self):
         return f"{self.q_no} ({self.exam})"
@@ -95,33 +104,167 @@ class Student(models.Model):
     def __str__(self):
         return f"{self.stdNo}:{self.nickname}"
 
-class ExamAdjust(models.Model):
+class SubjectDenormMixin(models.Model):
+    """
+    exam.subject_id を subject_id に複製して持つテーブル用（Exam 経由の JOIN を省くため）
+
+    save() では未設定なら exam から補完する。
+    bulk_create / update() は save() を通らないので、呼び出し側で subject を渡すこと。
+    ずれは check_subject_denorm で検出・修正できる。
+    """
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def subject_filter(subject) -> models.Q:
+        """subject の行。subject_id が未補完（NULL）の行も exam 経由で拾う（ゼロクリア・削除で取りこぼさない）"""
+        return models.Q(subject=subject) | models.Q(subject__isnull=True, exam__subject=subject)
+
+    def save(self, *args, **kwargs):
+        if self.subject_id is None and self.exam_id is not None:
+            self.subject_id = Exam.objects.values_list("subject_id", flat=True).get(pk=self.exam_id)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "subject" not in update_fields:
+                kwargs["update_fields"] = list(update_fields) + ["subject"]
+        super().save(*args, **kwargs)
+
+
+class ChangeStampMixin(models.Model):
+    """
+    行の最終更新時刻（export_subject_scores --delta で「前回から変わった学生」を選ぶ基準）
+
+    save(update_fields=...) でも updated_at を更新する。
+    bulk_update / update() / COPY は auto_now が効かないので、呼び出し側で updated_at を設定すること。
+    """
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "updated_at" not in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["updated_at"]
+        super().save(*args, **kwargs)
+
+
+class ExamAdjust(ChangeStampMixin, SubjectDenormMixin):
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     adjust = models.IntegerField(default=0)
 
     class Meta:
         unique_together = ("exam", "student")
+        indexes = [
+            # unique(exam, student) の逆向き：学生起点の参照用
+            models.Index(fields=["student", "exam"], name="ix_adjust_student_exam"),
+            # delta export：科目内で基準時刻以降に変わった行
+            models.Index(fields=["subject", "updated_at"], name="ix_adjust_subject_updated"),
+        ]
 
 
-class StudentExamVersion(models.Model):
+class StudentExamVersion(ChangeStampMixin, SubjectDenormMixin):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
 
     class Meta:
         unique_together = ('student', 'exam')
+        indexes = [
+            # exam__subject / exam_id 起点で学生一覧を引く
+            models.Index(fields=["exam", "student"], name="ix_sev_exam_student"),
+            models.Index(fields=["subject", "updated_at"], name="ix_sev_subject_updated"),
+        ]
 
     def __str__(self):
         return f"{self.student.stdNo} → {self.exam}"
 
 
-class StudentExam(models.Model):
+class StudentExam(ChangeStampMixin, SubjectDenormMixin):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
 
     TF = models.IntegerField(default=0)
     hosei = models.IntegerField(default=0)
+    # TF=1 のときの question.points（集計で Question を JOIN しないための保持列）
+    # bulk_create / bulk_update / update() では呼び出し側で設定すること
+    earned = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("student", "exam", "question")
+        indexes = [
+            # exam 起点（結果一覧・exam-students）。earned/hosei まで含めて集計をインデックスだけで済ませる
+            models.Index(fields=["exam", "student", "earned", "hosei"], name="ix_se_exam_student_score"),
+            # 統計・安全ガード用の部分インデックス（TF=1 / hosei<>0 の行だけ）
+            models.Index(fields=["exam"], condition=models.Q(TF=1), name="ix_se_exam_tf1"),
+            models.Index(fields=["exam"], condition=~models.Q(hosei=0), name="ix_se_exam_hosei_nz"),
+            models.Index(fields=["subject", "updated_at"], name="ix_se_subject_updated"),
+        ]
+
+    def save(self, *args, points=None, **kwargs):
+        """
+        earned を付け直して保存する。TF=0 なら Question は見ない。
+        points を渡すか question を select_related しておけば追加クエリは無い
+        """
+        if not self.TF:
+            self.earned = 0
+        else:
+            self.earned = int((self.question.points if points is None else points) or 0)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "earned" not in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["earned"]
+        super().save(*args, **kwargs)
+
+
+class AnswerSheet(models.Model):
+    """
+    StudentExam の (student, exam) 1行パック版（settings.EXAM2_ANSWER_STORAGE = "packed" で使用）
+
+    セルの並びは export/import と同じ Question の (gyo, retu, id) 順。
+    - tf_bits : TF のビット列（セル i → byte i//8 の bit i%8）
+    - hosei   : int16 リトルエンディアン配列
+    - score / hosei_total / total : 集計キャッシュ（adjust は含めない）
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
+
+    question_count = models.IntegerField(default=0)
+    tf_bits = models.BinaryField(default=b"")
+    hosei = models.BinaryField(default=b"")
+
+    score = models.IntegerField(default=0)
+    hosei_total = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["student", "exam"], name="uq_answersheet_student_exam"),
+        ]
+        indexes = [
+            models.Index(fields=["exam", "student"], name="ix_sheet_exam_student"),
+        ]
+
+    def __str__(self):
+        return f"{self.student_id} → {self.exam_id} ({self.total})"
+
+
+class ExportWatermark(models.Model):
+    """
+    export_subject_scores --delta の基準時刻（科目 × 出力先ごと）
+    次回の delta は exported_at（から overlap 秒前）以降に変わった学生だけを出す。
+    """
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    target = models.CharField(max_length=50, default="default")
+    exported_at = models.DateTimeField()
 
     class Meta:
-        unique_together = ("student", "exam", "question")
\ No newline at end of file
+        constraints = [
+            models.UniqueConstraint(fields=["subject", "target"], name="uq_watermark_subject_target"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject.subjectNo}({self.subject.fsyear}) → {self.target}: {self.exported_at}"
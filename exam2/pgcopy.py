@@ -0,0 +1,142 @@
+# exam2/pgcopy.py
+"""
+PostgreSQL の COPY による一括投入（load_* / import_subject_scores の高速経路）。
+
+- 競合を考えない投入: COPY table FROM STDIN で本テーブルへ直接流す
+- 競合がありうる投入: 一時テーブルに COPY → INSERT ... SELECT ... ON CONFLICT
+  （DO NOTHING か、値が変わった列だけ DO UPDATE）
+
+行はジェネレータのまま text 形式にエンコードしてストリームするので、
+bulk_create のように全モデルインスタンスをメモリに持たない。
+sqlite など postgresql 以外では copy_enabled() が False になり、呼び出し側は従来の bulk_create を使う。
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+def copy_enabled(using=None) -> bool:
+    """postgresql 接続で、settings.EXAM2_PG_COPY が無効化されていなければ True"""
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    return connection.vendor == "postgresql" and getattr(settings, "EXAM2_PG_COPY", True)
+
+
+# =========================
+# text 形式へのエンコード
+# =========================
+
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def encode_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    return str(value).translate(_ESCAPES)
+
+
+def encode_row(row) -> str:
+    return "\t".join(encode_value(v) for v in row) + "\n"
+
+
+class RowStream:
+    """rows（タプルのイテラブル）を COPY ... FROM STDIN 用の read() で読めるようにする"""
+
+    def __init__(self, rows, chunk_rows: int = 5000):
+        self._rows = iter(rows)
+        self._chunk_rows = chunk_rows
+        self._buf = ""
+        self.count = 0
+
+    def _fill(self, size):
+        parts = [self._buf]
+        length = len(self._buf)
+        for _ in range(self._chunk_rows):
+            if size >= 0 and length >= size:
+                break
+            try:
+                line = encode_row(next(self._rows))
+            except StopIteration:
+                break
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+        self._buf = "".join(parts)
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0 or size >= len(self._buf):
+            out, self._buf = self._buf, ""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    readline = read
+
+
+# =========================
+# 投入
+# =========================
+
+def _columns(model, fields):
+    return [model._meta.get_field(f).column for f in fields]
+
+
+def instance_rows(objs, fields):
+    """未保存のモデルインスタンス列を fields 順のタプル列にする（FK は *_id を読む）"""
+    for obj in objs:
+        yield tuple(getattr(obj, obj._meta.get_field(f).attname) for f in fields)
+
+
+def copy_rows(model, fields, rows, *, conflict_fields=None, update_fields=None, using=None) -> int:
+    """
+    rows（fields 順のタプル）を model のテーブルへ COPY で投入する。
+
+    conflict_fields 無し : 本テーブルへ直接 COPY（流した行数を返す）
+    conflict_fields 有り : 一時テーブル経由で INSERT ... ON CONFLICT
+        update_fields 無し → DO NOTHING（新規に入った行数を返す）
+        update_fields 有り → 値が異なる行だけ DO UPDATE（新規 + 更新の行数を返す）
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    qn = connection.ops.quote_name
+
+    table = qn(model._meta.db_table)
+    columns = _columns(model, fields)
+    col_sql = ", ".join(qn(c) for c in columns)
+    stream = RowStream(rows)
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if not conflict_fields:
+            cursor.copy_expert(f"COPY {table} ({col_sql}) FROM STDIN", stream)
+            return stream.count
+
+        tmp = qn(f"_copy_{model._meta.db_table}")
+        cursor.execute(f"DROP TABLE IF EXISTS {tmp}")
+        cursor.execute(
+            f"CREATE TEMP TABLE {tmp} ON COMMIT DROP AS SELECT {col_sql} FROM {table} WITH NO DATA"
+        )
+        cursor.copy_expert(f"COPY {tmp} ({col_sql}) FROM STDIN", stream)
+
+        conflict_sql = ", ".join(qn(c) for c in _columns(model, conflict_fields))
+        if update_fields:
+            upd = [qn(c) for c in _columns(model, update_fields)]
+            set_sql = ", ".join(f"{c} = EXCLUDED.{c}" for c in upd)
+            changed_sql = (
+                f"({', '.join(f'{table}.{c}' for c in upd)}) IS DISTINCT FROM "
+                f"({', '.join(f'EXCLUDED.{c}' for c in upd)})"
+            )
+            action = f"DO UPDATE SET {set_sql} WHERE {changed_sql}"
+        else:
+            action = "DO NOTHING"
+
+        cursor.execute(
+            f"INSERT INTO {table} ({col_sql}) SELECT {col_sql} FROM {tmp} "
+            f"ON CONFLICT ({conflict_sql}) {action}"
+        )
+        return cursor.rowcount
@@ -0,0 +1,440 @@
+# exam2/pipeline.py
+"""
+科目の provisioning（provision_subject）。
+
+従来は load_subject_base → load_questions → load_student_exam_version → load_student_exam → load_exam_adjust
+を順に実行し、そのたびに Subject を引き直し、解答 JSON / 割当 YAML を読み直し、同じ行を取り直していた。
+
+- 5 段を 1 プロセス・1 トランザクションで流す（途中で失敗したら科目ごと元に戻る）
+- 段の間は Provisioning（科目ごとのキャッシュ）で受け渡す:
+  Subject / Exam（version → Exam）/ 解答 JSON / Exam ごとの Question id / 割当（student_id, exam_id）
+  段を選んで実行したときは、前の段の結果が無ければ DB から 1 回だけ引く
+- 割当 YAML はプロセス内で mtime が変わるまで読み直さない
+  （provision_subject --all はプールを作る前に親で読むので、fork した子は読まない）
+- 段ごとの所要時間と件数を返す
+
+Question は questionsync.reconcile_exam で突き合わせるので、何度流しても採点データは消えない。
+"""
+
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import examconfig
+from .answersheet import use_packed_storage
+from .bulkprovision import provision_answer_sheets, provision_exam_adjusts, provision_student_exams, question_ids_by_exam
+from .models import Exam, Student, StudentExamVersion, Subject
+from .pgcopy import copy_enabled, copy_rows
+from .questionsync import QuestionJsonError, json_problem_hash, parse_cells, reconcile_exam
+from .services import use_sparse_rows
+
+
+STAGES = ("subject_base", "questions", "student_exam_version", "student_exam", "exam_adjust")
+DEFAULT_VERSION_YAML = Path(__file__).resolve().parent / "data" / "studentVersion.yaml"
+
+
+class ProvisionError(Exception):
+    pass
+
+
+# =========================
+# 割当 YAML（studentVersion.yaml）
+# =========================
+
+_yaml_cache = {}   # str(path) → ((mtime_ns, size), data)
+
+
+def read_version_yaml(path) -> dict:
+    """割当 YAML を読む（mtime が変わるまではプロセス内で使い回す）"""
+    path = Path(path)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        raise ProvisionError(f"YAML が存在しません: {path}")
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _yaml_cache.get(str(path))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with path.open("r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    _yaml_cache[str(path)] = (stamp, data)
+    return data
+
+
+def _pick(mapping, key):
+    # YAML のキーは int / str どちらでも書けるので両対応
+    return mapping.get(key) or mapping.get(str(key)) or mapping.get(_as_int(key))
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def subject_version_map(version_data, fsyear, nenji, subjectNo, yaml_path="") -> dict:
+    """YAML 構造 version_data[fsyear][nenji][subjectNo][version] = [stdNo...] から {version: [stdNo...]}"""
+    nenji_map = _pick(version_data, int(fsyear))
+    if not nenji_map:
+        raise ProvisionError(f"YAML に fsyear={fsyear} のブロックがありません: {yaml_path}")
+
+    grade_map = _pick(nenji_map, int(nenji))
+    if not grade_map:
+        raise ProvisionError(f"YAML に nenji={nenji} のブロックがありません（fsyear={fsyear}）: {yaml_path}")
+
+    vmap = _pick(grade_map, str(subjectNo))
+    if not vmap:
+        raise ProvisionError(
+            f"YAML に subjectNo={subjectNo} のブロックがありません（fsyear={fsyear}, nenji={nenji}）: {yaml_path}"
+        )
+    return vmap
+
+
+def yaml_subjects(version_data, fsyear) -> list[str]:
+    """YAML の年度ブロックに載っている subjectNo（全学年）"""
+    nenji_map = _pick(version_data, int(fsyear)) or {}
+    return sorted({str(subjectNo) for grade_map in nenji_map.values() for subjectNo in (grade_map or {})})
+
+
+# =========================
+# StudentExamVersion の差分
+# =========================
+
+@dataclass
+class VersionPlan:
+    wanted: dict                  # stdNo → version（同じ学生が複数 version にいれば後勝ち）
+    student_ids: dict             # stdNo → student_id（DB にいる学生だけ）
+    exam_ids: dict                # version → exam_id
+    to_create: list = field(default_factory=list)
+    to_update: list = field(default_factory=list)
+    duplicate_ids: list = field(default_factory=list)
+    unchanged: int = 0
+    untouched: dict = field(default_factory=dict)   # YAML に無い既存割当 student_id → [(sev_id, exam_id)]
+    per_version: dict = field(default_factory=dict)
+    skipped_versions: list = field(default_factory=list)
+
+    @property
+    def missing_students(self) -> list:
+        return [stdNo for stdNo in self.wanted if stdNo not in self.student_ids]
+
+    def assignments(self) -> list:
+        """反映後の (student_id, exam_id)（YAML に無い既存割当も含む）"""
+        pairs = [
+            (self.student_ids[stdNo], self.exam_ids[version])
+            for stdNo, version in self.wanted.items()
+            if stdNo in self.student_ids
+        ]
+        pairs.extend((student_id, exam_id) for student_id, rows in self.untouched.items() for _, exam_id in rows)
+        return pairs
+
+
+def plan_versions(subject, exams: dict, vmap: dict, *, clear_existing: bool = False) -> VersionPlan:
+    """YAML の割当（vmap）と既存の StudentExamVersion の差分をメモリ上で計算する（クエリ 2 本）"""
+    skipped = [version for version in vmap if version not in exams]
+    wanted = {}
+    for version, student_list in vmap.items():
+        if version not in exams:
+            continue
+        for stdNo in student_list or []:
+            wanted[str(stdNo)] = version
+
+    # stdNo → student_id は 1 クエリで引く
+    student_ids = dict(Student.objects.filter(stdNo__in=list(wanted)).values_list("stdNo", "id"))
+
+    existing = {}  # student_id → [(sev_id, exam_id), ...]（id 順）
+    if not clear_existing:
+        for sev_id, student_id, exam_id in (
+            StudentExamVersion.objects.filter(subject=subject)
+            .order_by("id")
+            .values_list("id", "student_id", "exam_id")
+        ):
+            existing.setdefault(student_id, []).append((sev_id, exam_id))
+
+    plan = VersionPlan(
+        wanted=wanted, student_ids=student_ids,
+        exam_ids={version: exam.id for version, exam in exams.items()}, skipped_versions=skipped,
+    )
+    now = timezone.now()  # bulk_update では auto_now が効かないため
+    for stdNo, version in wanted.items():
+        student_id = student_ids.get(stdNo)
+        if student_id is None:
+            continue
+        exam_id = plan.exam_ids[version]
+        plan.per_version[version] = plan.per_version.get(version, 0) + 1
+
+        rows = existing.pop(student_id, None)
+        if not rows:
+            plan.to_create.append(StudentExamVersion(student_id=student_id, exam_id=exam_id, subject=subject))
+            continue
+
+        # この subject に複数の割当があれば、目的の exam の行（無ければ最古の行）だけ残す
+        keep_id, keep_exam_id = next(((i, e) for i, e in rows if e == exam_id), rows[0])
+        plan.duplicate_ids.extend(i for i, _ in rows if i != keep_id)
+        if keep_exam_id == exam_id:
+            plan.unchanged += 1
+        else:
+            plan.to_update.append(StudentExamVersion(id=keep_id, exam_id=exam_id, updated_at=now))
+
+    # YAML に載っていない既存割当は残す（--clear-existing で作り直し）
+    plan.untouched = existing
+    return plan
+
+
+def apply_version_plan(subject, plan: VersionPlan, *, clear_existing: bool = False) -> int:
+    """plan を書き込む。戻り値は --clear-existing で消した件数"""
+    deleted = 0
+    with transaction.atomic():
+        if clear_existing:
+            deleted, _ = StudentExamVersion.objects.filter(subject=subject).delete()
+        if plan.duplicate_ids:
+            StudentExamVersion.objects.filter(id__in=plan.duplicate_ids).delete()
+        if plan.to_update:
+            StudentExamVersion.objects.bulk_update(plan.to_update, ["exam", "updated_at"], batch_size=1000)
+        if plan.to_create:
+            StudentExamVersion.objects.bulk_create(plan.to_create, batch_size=1000)
+    return deleted
+
+
+# =========================
+# 1 科目の pipeline
+# =========================
+
+class Provisioning:
+    """
+    1 科目分の provisioning。段（stage_<名前>）の間で使う値をこのインスタンスに持つ。
+
+        prov = Provisioning("1010401", 2025)
+        results = prov.run()   # [{"stage", "seconds", "rows"}, ...]
+    """
+
+    def __init__(self, subjectNo, fsyear, *, json_path=None, version_yaml=None, use_copy=None, fix_label=None):
+        self.subjectNo = str(subjectNo)
+        self.fsyear = int(fsyear)
+        self.json_path = Path(json_path) if json_path else None
+        self.version_yaml = Path(version_yaml) if version_yaml else DEFAULT_VERSION_YAML
+        self.use_copy = copy_enabled() if use_copy is None else use_copy
+        self.fix_label = fix_label
+        self.warnings = []
+
+        self._answer = None
+        self._subject = None
+        self._exams = None
+        self._question_ids = None   # exam_id → [question_id, ...]
+        self._assignments = None    # [(student_id, exam_id), ...]
+
+    # ---- 共有キャッシュ（無ければ DB / ファイルから 1 回だけ） ----
+
+    def answer_json(self) -> dict:
+        if self._answer is None:
+            path = self.json_path
+            if path is None:
+                try:
+                    path = examconfig.config_path(self.subjectNo, self.fsyear, "ans_json")
+                except examconfig.ExamConfigError as e:
+                    raise ProvisionError(str(e))
+            if not path.exists():
+                raise ProvisionError(f"JSON ファイルが存在しません: {path}")
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            versions = data.get("versions") or []
+            if not versions:
+                raise ProvisionError("JSON に versions が存在しません")
+            if not versions[0].get("questions"):
+                raise ProvisionError("JSON の versions[0].questions が空です")
+            json_subject = versions[0]["questions"][0].get("subject") or ""
+            if json_subject != self.subjectNo:
+                raise ProvisionError(f"subjectNo 不一致: 引数={self.subjectNo}, JSON={json_subject}")
+            self.json_path = path
+            self._answer = data
+        return self._answer
+
+    def subject(self):
+        if self._subject is None:
+            try:
+                self._subject = Subject.objects.get(subjectNo=self.subjectNo, fsyear=self.fsyear)
+            except Subject.DoesNotExist:
+                raise ProvisionError(f"Subject が存在しません: subjectNo={self.subjectNo} fsyear={self.fsyear}")
+        return self._subject
+
+    def exams(self) -> dict:
+        if self._exams is None:
+            self._exams = {e.version: e for e in Exam.objects.filter(subject=self.subject()).order_by("version")}
+        if not self._exams:
+            raise ProvisionError(f"Exam が存在しません: subjectNo={self.subjectNo} fsyear={self.fsyear}")
+        return self._exams
+
+    def question_ids(self) -> dict:
+        if self._question_ids is None:
+            self._question_ids = question_ids_by_exam([e.id for e in self.exams().values()])
+        return self._question_ids
+
+    def assignments(self) -> list:
+        if self._assignments is None:
+            self._assignments = list(
+                StudentExamVersion.objects.filter(subject=self.subject()).values_list("student_id", "exam_id")
+            )
+        return self._assignments
+
+    # ---- 実行 ----
+
+    def run(self, stages=STAGES, *, dry_run: bool = False) -> list:
+        """stages を順に 1 トランザクションで実行する。dry_run なら最後に巻き戻す"""
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            raise ProvisionError(f"未知の stage: {', '.join(unknown)}（{', '.join(STAGES)}）")
+
+        results = []
+        with transaction.atomic():
+            for name in STAGES:
+                if name not in stages:
+                    continue
+                started = time.perf_counter()
+                rows = getattr(self, f"stage_{name}")()
+                results.append({"stage": name, "seconds": round(time.perf_counter() - started, 3), "rows": rows})
+            if dry_run:
+                transaction.set_rollback(True)
+        return results
+
+    # ---- 段 ----
+
+    def stage_subject_base(self) -> dict:
+        """Subject と version ごとの Exam を作る（既存なら空の problem_hash だけ補完）"""
+        data = self.answer_json()
+        meta = data["versions"][0]["questions"][0]
+
+        term = getattr(settings, "TERM", None)
+        if term is None:
+            raise ProvisionError("settings.TERM が未設定です（term を Subject.term に保存するため必要）")
+
+        subject, created = Subject.objects.get_or_create(
+            subjectNo=self.subjectNo,
+            fsyear=self.fsyear,
+            defaults={"name": meta.get("title") or "", "nenji": int(meta.get("nenji") or 0), "term": int(term)},
+        )
+        self._subject = subject
+
+        exams = {e.version: e for e in Exam.objects.filter(subject=subject)}
+        exams_created = hash_filled = 0
+        for vdata in data["versions"]:
+            version = vdata.get("version")
+            if not version:
+                raise ProvisionError("versions[].version がありません")
+            problem_hash = json_problem_hash(data, vdata)
+
+            exam = exams.get(version)
+            if exam is None:
+                exams[version] = Exam.objects.create(
+                    subject=subject, version=version, title=subject.name, problem_hash=problem_hash,
+                )
+                exams_created += 1
+            elif problem_hash and not exam.problem_hash:
+                exam.problem_hash = problem_hash
+                exam.save(update_fields=["problem_hash"])
+                hash_filled += 1
+            elif problem_hash and exam.problem_hash != problem_hash:
+                self.warnings.append(f"Exam {version}: problem_hash が一致しません（load_subject_base --update-hash）")
+        self._exams = exams
+
+        return {
+            "subject": "created" if created else "existing",
+            "exams": len(exams),
+            "exams_created": exams_created,
+            "hash_filled": hash_filled,
+        }
+
+    def stage_questions(self) -> dict:
+        """解答 JSON の各 version を Question に突き合わせる（reconcile_exam）"""
+        data = self.answer_json()
+        exams = self.exams()
+        totals = {
+            "created": 0, "updated": 0, "deleted": 0, "unchanged": 0, "remapped": 0, "provisioned": 0,
+            "skipped_exams": 0,
+        }
+        for vdata in data["versions"]:
+            version = vdata.get("version")
+            exam = exams.get(version)
+            if exam is None:
+                self.warnings.append(f"Exam が見つかりません: version={version}（skip）")
+                continue
+            questions = vdata.get("questions") or []
+            if len(questions) < 2:
+                raise ProvisionError(f"questions が不足しています: version={version}")
+            try:
+                cells = parse_cells(questions, fix_label=self.fix_label)
+            except QuestionJsonError as e:
+                raise ProvisionError(f"{e}: version={version}")
+
+            result = reconcile_exam(
+                exam, cells,
+                problem_hash=json_problem_hash(data, vdata),
+                copy=copy_rows if self.use_copy else None,
+            )
+            if result["skipped"]:
+                totals["skipped_exams"] += 1
+            for key in ("created", "updated", "deleted", "unchanged", "remapped", "provisioned"):
+                totals[key] += result[key]
+
+        self._question_ids = None   # 作り直した可能性があるので次に使うときに引き直す
+        return totals
+
+    def stage_student_exam_version(self) -> dict:
+        """割当 YAML から StudentExamVersion を差分反映（YAML に無い既存割当は残す）"""
+        subject = self.subject()
+        vmap = subject_version_map(
+            read_version_yaml(self.version_yaml), self.fsyear, int(subject.nenji), self.subjectNo, self.version_yaml,
+        )
+        exams = self.exams()
+        plan = plan_versions(subject, exams, vmap)
+        for version in plan.skipped_versions:
+            self.warnings.append(f"DBに Exam がありません: version={version}（skip）")
+        if plan.missing_students:
+            self.warnings.append(
+                f"Missing students in DB: {plan.missing_students[:20]} ... (total {len(plan.missing_students)})"
+            )
+        apply_version_plan(subject, plan)
+        self._assignments = plan.assignments()
+
+        return {
+            "created": len(plan.to_create),
+            "updated": len(plan.to_update),
+            "unchanged": plan.unchanged,
+            "duplicates": len(plan.duplicate_ids),
+            "missing_students": len(plan.missing_students),
+        }
+
+    def stage_student_exam(self) -> dict:
+        """
+        割当 × Question の StudentExam（TF=0）のうち無いものを作る（bulkprovision）。
+        packed 運用では割当ごとの AnswerSheet（全セル 0）を作る
+        """
+        if use_packed_storage():
+            stats = provision_answer_sheets(
+                self.subject(), self.assignments(), question_ids=self.question_ids(), use_copy=self.use_copy,
+            )
+            return {"storage": "packed", **_stats_rows(stats)}
+        if use_sparse_rows():
+            return {"skipped": "EXAM2_SPARSE_STUDENT_EXAM"}
+        stats = provision_student_exams(
+            self.subject(), self.assignments(), question_ids=self.question_ids(), use_copy=self.use_copy,
+        )
+        return _stats_rows(stats)
+
+    def stage_exam_adjust(self) -> dict:
+        """割当ごとの ExamAdjust（adjust=0）のうち無いものを作る（bulkprovision）"""
+        stats = provision_exam_adjusts(self.subject(), self.assignments(), use_copy=self.use_copy)
+        return _stats_rows(stats)
+
+
+def _stats_rows(stats) -> dict:
+    return {
+        "target": stats.target, "existing": stats.existing, "inserted": stats.inserted,
+        "rows_per_sec": round(stats.rows_per_sec),
+    }
@@ -0,0 +1,201 @@
+# exam2/questionsync.py
+"""
+answer_xxxx.json（versions[].questions）→ Question の差分反映（load_questions --reconcile / question_import）。
+
+- JSON のセルと既存の Question を (gyo, retu) で突き合わせる
+  変わった列だけ bulk_update / 新しいセルだけ作成 / JSON に無いセルだけ削除
+  （Question を消さないので、残ったセルの StudentExam = 採点結果はそのまま）
+- points が変わった Question は recompute_earned で earned を付け直す（bulk_update は signal を通らないため）
+- JSON の problem_hash + 内容のチェックサム（Exam.content_checksum）が前回と同じなら exam ごと何もしない
+- packed 運用で問題の並びが変わったら、同じトランザクションで AnswerSheet のセルを question_id で移し替える
+- rows 運用（packed でも sparse でもない）で問題を追加したら、割当済みの学生に新しい問題の
+  StudentExam（TF=0, hosei=0）を同じトランザクションで作る（export の欠け・採点画面の抜けを出さない）
+- 書き込んだら catalog（exam → Question の並び / points）を捨てる
+
+セルの形（cells）: {(gyo, retu): {"q_no", "bunrui", "points", "answer", "width", "height"}}
+"""
+
+import hashlib
+import json
+
+from django.db import transaction
+
+from .answersheet import exam_layouts, remap_sheets, use_packed_storage
+from .bulkprovision import provision_student_exams
+from .catalog import invalidate as invalidate_catalog
+from .models import Question, StudentExamVersion
+from .pgcopy import instance_rows
+from .scoring import recompute_earned
+from .services import use_sparse_rows
+
+
+CELL_FIELDS = ("q_no", "bunrui", "points", "answer", "width", "height")
+QUESTION_FIELDS = ("exam", "q_no", "bunrui", "points", "answer", "width", "height", "gyo", "retu")
+
+
+class QuestionJsonError(ValueError):
+    pass
+
+
+def json_problem_hash(data: dict, vdata: dict) -> str:
+    """version 先頭の metainfo.hash、無ければ JSON 先頭の hash（load_subject_base と同じ決め方）"""
+    def meta_hash(questions):
+        return ((questions[0] if questions else {}).get("metainfo") or {}).get("hash") or ""
+
+    versions = data.get("versions") or [{}]
+    return meta_hash(vdata.get("questions") or []) or meta_hash(versions[0].get("questions") or [])
+
+
+def parse_cells(questions, *, height_ratio: bool = True, fix_label=None) -> dict:
+    """
+    questions（[meta, 行1, 行2, ...]）→ cells。
+    height_ratio=True なら height を先頭（meta）の height に対する比にする（load_questions の扱い）。
+    """
+    base_height = (questions[0] or {}).get("height") if questions else None
+    if height_ratio and not base_height:
+        raise QuestionJsonError("base height が取得できません")
+
+    cells = {}
+    for gyo, qblock in enumerate(questions[1:], start=1):
+        labels = qblock.get("label") or []
+        columns = [qblock.get(k) or [] for k in ("width", "answer", "height", "point", "koumoku")]
+        if not all(len(col) == len(labels) for col in columns):
+            raise QuestionJsonError(f"配列長不一致: gyo={gyo}")
+        widths, answers, heights, points, koumokus = columns
+
+        for i, label in enumerate(labels):
+            retu = i + 1
+            label = str(label or "").strip()
+            if fix_label:
+                label = fix_label(gyo, retu, label)
+
+            if height_ratio:
+                try:
+                    height = int(int(heights[i]) / int(base_height))
+                except Exception:
+                    height = 1
+                if height <= 0:
+                    height = 1
+            else:
+                height = int(heights[i] or 0)
+
+            cells[(gyo, retu)] = {
+                "q_no": label,
+                "bunrui": str(koumokus[i] or "").strip(),
+                "points": int(points[i] or 0),
+                "answer": str(answers[i] or ""),
+                "width": int(widths[i] or 1),
+                "height": height,
+            }
+    return cells
+
+
+def content_checksum(cells: dict, problem_hash: str = "") -> str:
+    """problem_hash + セルの並び・内容の md5（problem_hash と同じ 32 桁）"""
+    canonical = [[gyo, retu, *(cells[(gyo, retu)][f] for f in CELL_FIELDS)] for gyo, retu in sorted(cells)]
+    payload = json.dumps([problem_hash or "", canonical], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def reconcile_exam(exam, cells: dict, *, problem_hash: str = "", delete_missing: bool = True,
+                   force: bool = False, dry_run: bool = False, copy=None) -> dict:
+    """
+    exam の Question を cells に合わせる。戻り値は件数と状態:
+        {"skipped", "created", "updated", "deleted", "unchanged", "rescored", "layout_changed", "remapped",
+         "provisioned"}
+    provisioned は追加した問題のために作った StudentExam の数（dry_run では作る予定の数）
+    copy: PostgreSQL で作成を COPY にするとき pgcopy.copy_rows を渡す
+    """
+    checksum = content_checksum(cells, problem_hash)
+    result = {
+        "skipped": False, "created": 0, "updated": 0, "deleted": 0, "unchanged": 0,
+        "rescored": 0, "layout_changed": False, "remapped": 0, "provisioned": 0, "checksum": checksum,
+    }
+    if not force and exam.content_checksum == checksum:
+        result["skipped"] = True
+        result["unchanged"] = len(cells)
+        return result
+
+    existing, duplicates = {}, []
+    for q in Question.objects.filter(exam=exam).order_by("gyo", "retu", "id"):
+        key = (q.gyo, q.retu)
+        if key in existing:
+            duplicates.append(q.id)  # 同じ位置に 2 行目以降：残すのは id の小さい方
+        else:
+            existing[key] = q
+
+    to_create, to_update, update_fields, rescore = [], [], set(), []
+    for key, cell in cells.items():
+        q = existing.get(key)
+        if q is None:
+            to_create.append(Question(exam=exam, gyo=key[0], retu=key[1], **cell))
+            continue
+        changed = [f for f in CELL_FIELDS if getattr(q, f) != cell[f]]
+        if not changed:
+            result["unchanged"] += 1
+            continue
+        if "points" in changed:
+            rescore.append(q.id)
+        for f in changed:
+            setattr(q, f, cell[f])
+        update_fields.update(changed)
+        to_update.append(q)
+
+    missing = [q.id for key, q in existing.items() if key not in cells]
+    to_delete = duplicates + (missing if delete_missing else [])
+
+    result.update(
+        created=len(to_create), updated=len(to_update), deleted=len(to_delete), rescored=len(rescore),
+        layout_changed=bool(to_create or to_delete),
+    )
+    # 追加した問題のセルを作るのは rows 運用だけ（packed は remap、sparse は行を作らない）
+    provision_rows = bool(to_create) and not use_packed_storage() and not use_sparse_rows()
+    if dry_run:
+        if provision_rows:
+            result["provisioned"] = len(to_create) * StudentExamVersion.objects.filter(exam=exam).count()
+        return result
+
+    with transaction.atomic():
+        old_ids = list(Question.objects.filter(exam=exam).values_list("id", flat=True)) if provision_rows else None
+        # 並びが変わる前のレイアウト（AnswerSheet のセル位置はこれに対応している）
+        old_layout = exam_layouts([exam.id])[exam.id] if result["layout_changed"] and use_packed_storage() else None
+        if to_delete:
+            Question.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            Question.objects.bulk_update(to_update, sorted(update_fields), batch_size=1000)
+        if to_create:
+            if copy is not None:
+                copy(Question, QUESTION_FIELDS, instance_rows(to_create, QUESTION_FIELDS))
+            else:
+                Question.objects.bulk_create(to_create, batch_size=2000)
+        # bulk 系は signal を通らないので、catalog の並び（question_points）はここで捨てる
+        invalidate_catalog()
+        if old_layout is not None:
+            result["remapped"] = remap_sheets(exam.id, old_layout)
+        if provision_rows:
+            # COPY では作った Question の id が返らないので、前から無かった id を引く
+            new_ids = list(
+                Question.objects.filter(exam=exam).exclude(id__in=old_ids)
+                .order_by("gyo", "retu", "id").values_list("id", flat=True)
+            )
+            result["provisioned"] = provision_student_exams(
+                exam.subject,
+                StudentExamVersion.objects.filter(exam=exam).values_list("student_id", "exam_id"),
+                question_ids={exam.id: new_ids},
+                use_copy=copy is not None,
+            ).inserted
+        if rescore:
+            recompute_earned(rescore)
+        # JSON に無いセルを残した場合は DB の内容が JSON と一致しないので、次回も突き合わせる
+        record_checksum(exam, cells if delete_missing or not missing else None, problem_hash)
+
+    return result
+
+
+def record_checksum(exam, cells, problem_hash: str = "") -> None:
+    """
+    reconcile を通さずに作り直したとき用：次回の --reconcile が空振りできるようチェックサムだけ記録
+    cells=None は「DB の内容が分からない」= 次回は必ず突き合わせる
+    """
+    exam.content_checksum = content_checksum(cells, problem_hash) if cells is not None else ""
+    exam.save(update_fields=["content_checksum"])
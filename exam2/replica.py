@@ -0,0 +1,179 @@
+# exam2/replica.py
+"""
+集計・出力系の読み込みをレプリカへ振り向けるルータ。
+
+- 対象: reporting_reads() の中（ReportingReadMixin を付けた API、--primary を付けない集計コマンド）
+- レプリカ: settings.EXAM2_REPLICA["alias"] の DB
+    SQLite … refresh_replica で作る読み取り専用コピー（refresh 時刻をスタンプファイルで管理）
+    PostgreSQL … ストリーミングレプリケーションのスタンバイ（pg_last_xact_replay_timestamp で遅れを見る）
+- 遅れが max_staleness 秒を超えたら primary を読む
+- 書き込み直後のリクエスト（cookie）や ?primary=1 / X-Exam2-Primary ヘッダは primary に固定する
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+
+DEFAULTS = {
+    "alias": "replica",
+    "max_staleness": 30,   # 秒。これより古いレプリカは使わない
+    "pin_seconds": 10,     # 書き込み後、この秒数は同じブラウザの読み込みを primary に固定
+    "lag_cache": 2,        # 秒。遅れの確認結果をプロセス内で使い回す
+}
+
+PIN_COOKIE = "exam2_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_reporting = ContextVar("exam2_reporting", default=False)
+_pinned = ContextVar("exam2_pinned", default=False)
+
+_lag_lock = threading.Lock()
+_lag_cache = {}  # alias → (checked_at, lag)
+
+
+def replica_options() -> dict:
+    return {**DEFAULTS, **(getattr(settings, "EXAM2_REPLICA", None) or {})}
+
+
+def stamp_path(alias) -> Path:
+    """SQLite レプリカの refresh 時刻を記録するファイル"""
+    return Path(str(connections.settings[alias]["NAME"]).split("?")[0].removeprefix("file:") + ".refreshed")
+
+
+# =========================
+# コンテキスト
+# =========================
+
+@contextmanager
+def reporting_reads():
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+@contextmanager
+def pin_primary(pinned=True):
+    token = _pinned.set(bool(pinned))
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+# =========================
+# 遅れ
+# =========================
+
+def measure_lag(alias):
+    """レプリカの遅れ（秒）。測れなければ None"""
+    connection = connections[alias]
+    if connection.vendor == "sqlite":
+        path = stamp_path(alias)
+        return time.time() - path.stat().st_mtime if path.exists() else None
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT CASE WHEN pg_is_in_recovery() "
+                "THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) ELSE 0 END"
+            )
+            row = cursor.fetchone()
+        return float(row[0]) if row and row[0] is not None else None
+    return None
+
+
+def replica_lag(alias):
+    opts = replica_options()
+    now = time.monotonic()
+    with _lag_lock:
+        cached = _lag_cache.get(alias)
+        if cached and now - cached[0] < opts["lag_cache"]:
+            return cached[1]
+    try:
+        lag = measure_lag(alias)
+    except Exception:
+        lag = None  # 接続できないレプリカは使わない
+    with _lag_lock:
+        _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def usable_replica():
+    """いま読み込みに使ってよいレプリカのエイリアス（無ければ None）"""
+    if not _reporting.get() or _pinned.get():
+        return None
+    opts = replica_options()
+    alias = opts["alias"]
+    if alias not in connections.settings:
+        return None
+    lag = replica_lag(alias)
+    if lag is None or lag > opts["max_staleness"]:
+        return None
+    return alias
+
+
+# =========================
+# ルータ / ミドルウェア / View mixin
+# =========================
+
+class ReplicaRouter:
+    """reporting_reads() 中の exam2 の読み込みを、十分に新しいレプリカへ"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != "exam2":
+            return None
+        return usable_replica()
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_options()["alias"]:
+            return False  # レプリカは primary の複製なので migrate しない
+        return None
+
+
+class ReplicaPinMiddleware:
+    """書き込み直後は primary を読ませる（cookie）。?primary=1 / X-Exam2-Primary でも固定"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = (
+            request.COOKIES.get(PIN_COOKIE)
+            or request.GET.get("primary") == "1"
+            or request.headers.get("X-Exam2-Primary")
+        )
+        with pin_primary(pinned):
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, "1", max_age=replica_options()["pin_seconds"], samesite="Lax")
+        return response
+
+
+class ReportingReadMixin:
+    """集計系 API 用：リクエスト全体をレプリカ読み込みの対象にする"""
+
+    def dispatch(self, request, *args, **kwargs):
+        with reporting_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+def reporting_command(handle):
+    """集計コマンドの handle 用：--primary が無ければレプリカ読み込みの対象にする"""
+
+    @wraps(handle)
+    def wrapper(self, *args, **options):
+        if options.get("primary"):
+            return handle(self, *args, **options)
+        with reporting_reads():
+            return handle(self, *args, **options)
+
+    return wrapper
@@ -0,0 +1,158 @@
+# exam2/roster.py
+"""
+student テーブルと名簿 CSV の差分反映（load_student --sync）。
+
+従来の load_student は student を全削除して CSV を bulk_create していた。
+採点系のテーブル（StudentExam / ExamAdjust / StudentExamVersion …）が student を参照するので、
+採点が始まってからは遅いうえに危険（削除が連鎖する / 参照が切れる）。
+
+- 既存の student は 1 クエリで {id: 値} にしておき、CSV は 1 行ずつ読みながら突き合わせる
+- 突き合わせは id。stdNo が別の id で既にあるなど、id を変えないと合わない行は conflict として
+  何も書かずに止める（id は採点データから参照されているので書き換えない）
+- 新規は bulk_create、変わった列だけ bulk_update、CSV に無い学生は
+  deactivate_missing=True のときだけ enrolled=False にする（行は消さない）
+- 同じ CSV で 2 回流しても 2 回目は何も変わらない
+"""
+
+import csv
+from dataclasses import dataclass, field
+
+from django.db import transaction
+
+from .models import Student
+
+
+SYNC_FIELDS = ("entyear", "stdNo", "email", "name1", "name2", "nickname", "gender", "COO", "enrolled")
+REQUIRED_COLUMNS = ("id", "entyear", "stdNo", "email", "name1", "name2", "nickname", "gender", "COO")
+BATCH_SIZE = 1000
+
+
+class RosterError(ValueError):
+    pass
+
+
+def parse_bool(v, default=True):
+    if v is None:
+        return default
+    v = str(v).strip().lower()
+    if v in ("1", "true", "t", "yes", "y"):
+        return True
+    if v in ("0", "false", "f", "no", "n"):
+        return False
+    return default
+
+
+def parse_row(r: dict) -> dict:
+    """CSV の 1 行 → Student の値（id / entyear は int、enrolled は無ければ True）"""
+    try:
+        return {
+            "id": int(r["id"]),
+            "entyear": int(r["entyear"]),
+            "stdNo": r["stdNo"].strip(),
+            "email": r["email"],
+            "name1": r["name1"],
+            "name2": r["name2"],
+            "nickname": r["nickname"],
+            "gender": r["gender"],
+            "COO": r["COO"],
+            "enrolled": parse_bool(r.get("enrolled"), default=True),
+        }
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise RosterError(f"CSV の行を解釈できません: {e}: {r}")
+
+
+def read_csv(path):
+    """CSV を 1 行ずつ dict で返す（列が足りなければ RosterError）"""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or ())]
+        if missing:
+            raise RosterError(f"CSV に列がありません: {', '.join(missing)}")
+        for row in reader:
+            yield parse_row(row)
+
+
+@dataclass
+class RosterPlan:
+    to_create: list = field(default_factory=list)
+    to_update: list = field(default_factory=list)
+    update_fields: set = field(default_factory=set)
+    field_changes: dict = field(default_factory=dict)   # 列 → 変わった人数
+    samples: list = field(default_factory=list)         # 表示用 "stdNo: 列 旧 → 新"
+    unchanged: int = 0
+    missing_ids: list = field(default_factory=list)     # CSV に無い在籍中の学生
+    already_inactive: int = 0                            # CSV に無く、既に enrolled=False
+    conflicts: list = field(default_factory=list)
+    csv_rows: int = 0
+
+
+def plan_roster(rows, *, sample_limit: int = 20) -> RosterPlan:
+    """rows（parse_row 済みの dict のイテラブル）と student テーブルの差分（クエリ 1 本）"""
+    existing = {
+        values[0]: dict(zip(SYNC_FIELDS, values[1:]))
+        for values in Student.objects.values_list("id", *SYNC_FIELDS)
+    }
+    id_by_stdNo = {values["stdNo"]: sid for sid, values in existing.items()}
+
+    plan = RosterPlan()
+    seen_ids, seen_stdNos = set(), {}
+    for row in rows:
+        plan.csv_rows += 1
+        sid, stdNo = row["id"], row["stdNo"]
+
+        if sid in seen_ids:
+            plan.conflicts.append(f"CSV 内で id が重複: id={sid}")
+            continue
+        if stdNo in seen_stdNos:
+            plan.conflicts.append(f"CSV 内で stdNo が重複: stdNo={stdNo}（id={seen_stdNos[stdNo]}, {sid}）")
+            continue
+        seen_ids.add(sid)
+        seen_stdNos[stdNo] = sid
+
+        owner = id_by_stdNo.get(stdNo)
+        if owner is not None and owner != sid:
+            plan.conflicts.append(f"stdNo={stdNo} は DB では id={owner}、CSV では id={sid}")
+            continue
+
+        current = existing.get(sid)
+        if current is None:
+            plan.to_create.append(Student(**row))
+            continue
+
+        changed = [f for f in SYNC_FIELDS if current[f] != row[f]]
+        if not changed:
+            plan.unchanged += 1
+            continue
+        for f in changed:
+            plan.field_changes[f] = plan.field_changes.get(f, 0) + 1
+            if len(plan.samples) < sample_limit:
+                plan.samples.append(f"{current['stdNo']}: {f} {current[f]!r} → {row[f]!r}")
+        plan.update_fields.update(changed)
+        plan.to_update.append(Student(**row))
+
+    for sid, values in existing.items():
+        if sid in seen_ids:
+            continue
+        if values["enrolled"]:
+            plan.missing_ids.append(sid)
+        else:
+            plan.already_inactive += 1
+    return plan
+
+
+def apply_roster(plan: RosterPlan, *, deactivate_missing: bool = False, batch_size: int = BATCH_SIZE) -> int:
+    """plan を書き込む（1 トランザクション）。戻り値は enrolled=False にした人数"""
+    if plan.conflicts:
+        raise RosterError(f"conflict が {len(plan.conflicts)} 件あるため反映できません")
+    deactivated = 0
+    with transaction.atomic():
+        if plan.to_update:
+            Student.objects.bulk_update(plan.to_update, sorted(plan.update_fields), batch_size=batch_size)
+        if plan.to_create:
+            Student.objects.bulk_create(plan.to_create, batch_size=batch_size)
+        if deactivate_missing and plan.missing_ids:
+            for start in range(0, len(plan.missing_ids), batch_size):
+                deactivated += Student.objects.filter(
+                    id__in=plan.missing_ids[start:start + batch_size], enrolled=True,
+                ).update(enrolled=False)
+    return deactivated
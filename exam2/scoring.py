@@ -0,0 +1,76 @@
+# exam2/scoring.py
+"""
+採点集計（score / hosei）をまとめて取るためのヘルパ。
+
+views の結果一覧・調整一覧で学生ごとに aggregate していたものを
+exam 単位の GROUP BY 1 回に置き換える。
+score は StudentExam.earned（TF=1 の points を保持した列）の合計で、Question は JOIN しない。
+settings.EXAM2_ANSWER_STORAGE = "packed" のときは AnswerSheet のキャッシュ列を読む。
+"""
+
+from django.db.models import Sum, Case, When, Value, OuterRef, Subquery
+
+from .answersheet import use_packed_storage, rescore_sheets
+from .models import Question, StudentExam, AnswerSheet
+
+
+def score_totals(exam_ids, student_ids=None) -> dict:
+    """
+    (student_id, exam_id) → (score, hosei)
+    score は TF=1 の points 合計、hosei は hosei 合計（adjust は含めない）。
+    行が無い組み合わせは結果に含まれない（呼び出し側で 0 扱い）。
+    """
+    exam_ids = list(exam_ids)
+    if not exam_ids:
+        return {}
+
+    if use_packed_storage():
+        qs = AnswerSheet.objects.filter(exam_id__in=exam_ids)
+        if student_ids is not None:
+            qs = qs.filter(student_id__in=list(student_ids))
+        return {
+            (sid, eid): (score, hosei)
+            for sid, eid, score, hosei in qs.values_list("student_id", "exam_id", "score", "hosei_total")
+        }
+
+    qs = StudentExam.objects.filter(exam_id__in=exam_ids)
+    if student_ids is not None:
+        qs = qs.filter(student_id__in=list(student_ids))
+
+    rows = (
+        qs.values("student_id", "exam_id")
+        .order_by()
+        .annotate(score=Sum("earned"), hosei_sum=Sum("hosei"))
+    )
+    return {
+        (r["student_id"], r["exam_id"]): (r["score"] or 0, r["hosei_sum"] or 0)
+        for r in rows
+    }
+
+
+def earned_points(tf, points) -> int:
+    """StudentExam.earned の値（TF=1 なら points、それ以外は 0）"""
+    return int(points or 0) if int(tf or 0) else 0
+
+
+def recompute_earned(question_ids) -> int:
+    """
+    Question.points 変更後に、その問題の StudentExam.earned を 1 回の UPDATE で付け直す。
+    packed 運用では AnswerSheet の集計キャッシュも作り直す。
+    """
+    question_ids = list(question_ids)
+    if not question_ids:
+        return 0
+
+    points_of_question = Subquery(
+        Question.objects.filter(id=OuterRef("question_id")).values("points")[:1]
+    )
+    updated = StudentExam.objects.filter(question_id__in=question_ids).update(
+        earned=Case(When(TF=1, then=points_of_question), default=Value(0))
+    )
+
+    if use_packed_storage():
+        rescore_sheets(
+            Question.objects.filter(id__in=question_ids).values_list("exam_id", flat=True).distinct()
+        )
+    return updated
@@ -2,7 +2,9 @@
 
 from dataclasses import dataclass
 
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 
 from .models import (
     Subject,
@@ -13,6 +15,9 @@ from .models import (
     StudentExamVersion,
     ExamAdjust,
 )
+from . import catalog
+from .answersheet import CellError, use_packed_storage, reset_sheet
+from .scoring import earned_points
 
 
 @dataclass
@@ -24,6 +29,120 @@ class VersionChangeResult:
     created_student_exam_count: int
 
 
+def use_sparse_rows() -> bool:
+    """
+    settings.EXAM2_SPARSE_STUDENT_EXAM が True なら StudentExam を事前作成しない。
+    行が無いセルは TF=0, hosei=0 とみなし、最初の書き込みで作成する。
+    """
+    return bool(getattr(settings, "EXAM2_SPARSE_STUDENT_EXAM", False))
+
+
+def synthesize_cells(exam_id: int, student_id: int, rows: list[dict]) -> list[dict]:
+    """
+    StudentExamSerializer 形式の rows に、行が無い Question の既定セル（id=None）を補う。
+    並びは gyo, retu, id 順。
+    """
+    by_qid = {r["question"]: r for r in rows}
+    out = []
+    for qid, _ in catalog.question_points(exam_id):
+        out.append(by_qid.get(qid) or {
+            "id": None,
+            "student": student_id,
+            "exam": exam_id,
+            "question": qid,
+            "TF": 0,
+            "hosei": 0,
+        })
+    return out
+
+
+def _cell_key(item) -> tuple:
+    try:
+        return int(item["student"]), int(item["exam"]), int(item["question"])
+    except KeyError as e:
+        raise CellError(f"{e.args[0]} が必要です: {item}")
+    except (TypeError, ValueError):
+        raise CellError(f"student / exam / question は整数で指定してください: {item}")
+
+
+def upsert_student_exam_cells(items: list[dict]) -> list[dict]:
+    """
+    id を持たないセル [{student, exam, question, TF?, hosei?}, ...] を upsert する。
+    既存行は更新、無ければ作成。作成した行の {question, id} を返す。
+
+    (student, exam, question) は「question が exam の問題」かつ「student が exam に割り当て済み」を
+    1 クエリで確かめ、合わないセルが 1 つでもあれば何も書かずに CellError。
+    同じセルへの最初の書き込みが同時に来ても IntegrityError にしない（ignore_conflicts で入れて引き直す）。
+    """
+    keys = {_cell_key(i) for i in items}
+    if not keys:
+        return []
+
+    # 割当（StudentExamVersion）→ exam → questions を 1 本の JOIN で引く
+    valid = {
+        (sid, eid, qid): (subject_id, points)
+        for sid, eid, qid, subject_id, points in StudentExamVersion.objects.filter(
+            student_id__in={k[0] for k in keys},
+            exam_id__in={k[1] for k in keys},
+            exam__questions__id__in={k[2] for k in keys},
+        ).values_list("student_id", "exam_id", "exam__questions__id", "exam__subject_id", "exam__questions__points")
+    }
+    invalid = sorted(keys - valid.keys())
+    if invalid:
+        raise CellError(
+            "割当の無い学生か、exam に属さない question です: "
+            + ", ".join(f"student={s} exam={e} question={q}" for s, e, q in invalid[:10])
+        )
+
+    def lookup(keyset):
+        return StudentExam.objects.filter(
+            student_id__in={k[0] for k in keyset},
+            exam_id__in={k[1] for k in keyset},
+            question_id__in={k[2] for k in keyset},
+        )
+
+    with transaction.atomic():
+        existing = {(se.student_id, se.exam_id, se.question_id): se for se in lookup(keys)}
+
+        to_create = {}
+        for item in items:
+            key = _cell_key(item)
+            se = existing.get(key) or to_create.get(key)
+            if se is None:
+                se = StudentExam(
+                    student_id=key[0], exam_id=key[1], question_id=key[2],
+                    subject_id=valid[key][0], TF=0, hosei=0,
+                )
+                to_create[key] = se
+            if "TF" in item:
+                se.TF = item["TF"]
+            if "hosei" in item:
+                se.hosei = item["hosei"]
+            se.earned = earned_points(se.TF, valid[key][1])
+
+        # 読んでから入れるまでに別の書き込みが同じセルを作っていても衝突させない
+        StudentExam.objects.bulk_create(list(to_create.values()), ignore_conflicts=True)
+
+        # ignore_conflicts では id が返らないので引き直す。先に作られていた行はこちらの値で上書きする
+        to_update = dict(existing)
+        if to_create:
+            for row in lookup(to_create):
+                key = (row.student_id, row.exam_id, row.question_id)
+                mine = to_create.get(key)
+                if mine is None:
+                    continue
+                mine.pk = row.pk
+                if (row.TF, row.hosei, row.earned) != (mine.TF, mine.hosei, mine.earned):
+                    to_update[key] = mine
+
+        now = timezone.now()
+        for se in to_update.values():
+            se.updated_at = now  # bulk_update では auto_now が効かないため
+        StudentExam.objects.bulk_update(list(to_update.values()), ["TF", "hosei", "earned", "updated_at"])
+
+    return [{"question": se.question_id, "id": se.pk} for se in to_create.values()]
+
+
 def get_current_exam_version(subject: Subject, student: Student) -> str | None:
     """
     指定科目における学生の現在のA/B版を返す。
@@ -31,7 +150,7 @@ def get_current_exam_version(subject: Subject, student: Student) -> str | None:
     """
     sev = (
         StudentExamVersion.objects
-        .filter(student=student, exam__subject=subject)
+        .filter(student=student, subject=subject)
         .select_related("exam")
         .order_by("exam__version")
         .first()
@@ -83,56 +202,63 @@ def change_student_exam_version(
                 created_student_exam_count=question_count,
             )
 
-        # この科目に属するA/B試験
-        subject_exams = Exam.objects.filter(subject=subject)
-
-        # 旧データを削除
+        # 旧データを削除（subject_id で直接絞る）
         StudentExamVersion.objects.filter(
             student=student,
-            exam__in=subject_exams,
+            subject=subject,
         ).delete()
 
         StudentExam.objects.filter(
             student=student,
-            exam__in=subject_exams,
+            subject=subject,
         ).delete()
 
         ExamAdjust.objects.filter(
             student=student,
-            exam__in=subject_exams,
+            subject=subject,
         ).delete()
 
         # 新しい版を割り当て
         StudentExamVersion.objects.create(
             student=student,
             exam=new_exam,
+            subject=subject,
         )
 
         # 新しい版の問題に合わせて StudentExam を作り直す
-        questions = list(
-            Question.objects
-            .filter(exam=new_exam)
-            .order_by("gyo", "retu", "id")
-        )
-
-        StudentExam.objects.bulk_create([
-            StudentExam(
-                student=student,
-                exam=new_exam,
-                question=q,
-                TF=0,
-                hosei=0,
+        # sparse 運用では作らない（最初の採点時に作成される）
+        questions = []
+        if not use_sparse_rows():
+            questions = list(
+                Question.objects
+                .filter(exam=new_exam)
+                .order_by("gyo", "retu", "id")
             )
-            for q in questions
-        ])
+
+            StudentExam.objects.bulk_create([
+                StudentExam(
+                    student=student,
+                    exam=new_exam,
+                    subject=subject,
+                    question=q,
+                    TF=0,
+                    hosei=0,
+                )
+                for q in questions
+            ])
 
         # 試験全体補正も 0 で作り直す
         ExamAdjust.objects.create(
             student=student,
             exam=new_exam,
+            subject=subject,
             adjust=0,
         )
 
+        # packed 運用なら AnswerSheet も新しい版で 0 から作り直す
+        if use_packed_storage():
+            reset_sheet(student.id, new_exam)
+
         return VersionChangeResult(
             subject=subject,
             student=student,
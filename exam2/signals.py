@@ -0,0 +1,59 @@
+# exam2/signals.py
+"""
+モデル保存時の付随処理。
+
+- DB 接続ができたら SQLite の接続プロファイル（PRAGMA）を適用する
+- Question.points が変わったら StudentExam.earned（と packed の AnswerSheet 集計）を付け直す
+  ※ Question.objects.update() / bulk_update() は signal を通らないので
+    その場合は recompute_earned コマンドを実行すること
+- Subject / Exam / Question / Student を save / delete したら参照キャッシュ（catalog）を捨てる
+  （無いこと（None）もキャッシュするので、削除後に古いエントリを返し続けないように）
+  ※ delete の receiver はこの 4 つ（件数の少ないマスタ）だけに付ける。
+    StudentExam などに付けると QuerySet.delete() が高速削除できなくなる。
+    bulk 系（update / bulk_create）はコマンド側の @invalidates_catalog で捨てる
+"""
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, pre_save, post_save
+from django.dispatch import receiver
+
+from .catalog import invalidate as invalidate_catalog
+from .dbprofile import apply_profile
+from .models import Exam, Question, Student, Subject
+from .scoring import recompute_earned
+
+
+@receiver(connection_created)
+def apply_sqlite_profile(sender, connection, **kwargs):
+    apply_profile(connection)
+
+
+@receiver(pre_save, sender=Question)
+def remember_question_points(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        instance._old_points = None
+        return
+    instance._old_points = (
+        Question.objects.filter(pk=instance.pk).values_list("points", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Question)
+def refresh_earned_on_points_change(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    old = getattr(instance, "_old_points", None)
+    if old is not None and old != instance.points:
+        recompute_earned([instance.pk])
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Exam)
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Exam)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Student)
+def drop_catalog_on_change(sender, **kwargs):
+    invalidate_catalog()
@@ -0,0 +1,14 @@
+-- student テーブル（PostgreSQL 用。Django 側は managed=False）
+-- 列名は Django が引用符付きで参照するので、大文字を含む列は引用符で作成する
+CREATE TABLE IF NOT EXISTS student (
+    id INTEGER PRIMARY KEY,
+    entyear INTEGER NOT NULL,
+    "stdNo" VARCHAR(8) NOT NULL UNIQUE,
+    email VARCHAR(254),
+    name1 VARCHAR(255),
+    name2 VARCHAR(255),
+    nickname VARCHAR(255),
+    gender VARCHAR(1),
+    "COO" VARCHAR(50),
+    enrolled BOOLEAN NOT NULL DEFAULT TRUE
+);
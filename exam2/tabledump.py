@@ -0,0 +1,166 @@
+# exam2/tabledump.py
+"""
+student / 採点系テーブルのストリーミング出力（dump_student / dump_table）。
+
+- values_list(...).iterator(chunk_size=...) で読み、1 行ずつ書く（モデルインスタンスも全件のリストも作らない）
+  → テーブルの大きさに関係なくメモリは一定
+- stdNo / q_no / version / subjectNo は JOIN した列として同じ SELECT で引く（行ごとの参照クエリを出さない）
+- 件数は書いた行を数える（別の count() は出さない）
+- 形式: csv / tsv / jsonl（JSON Lines: 1 行 1 オブジェクト）。出力先はファイルか stdout（"-"）
+
+    with open_output("student.csv") as f:
+        count = dump(TABLES["student"], f, fmt="csv", fsyear=2025)
+"""
+
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from django.db.models import Exists, OuterRef
+
+from .models import ExamAdjust, Student, StudentExam, StudentExamVersion
+from .tfdata import atomic_output
+
+
+FORMATS = ("csv", "tsv", "jsonl")
+CHUNK_SIZE = 2000
+
+
+@dataclass(frozen=True)
+class Table:
+    model: type
+    columns: tuple            # ((出力名, values_list の lookup), ...)
+    order_by: tuple
+    subject_lookup: str = "subject"   # 科目 / 年度で絞るときの起点（Student は割当経由）
+
+    @property
+    def headers(self) -> list:
+        return [name for name, _ in self.columns]
+
+    def queryset(self, *, subjectNo=None, fsyear=None):
+        qs = self.model.objects.all()
+        if self.model is Student:
+            if subjectNo is not None or fsyear is not None:
+                # 割当（StudentExamVersion）がある学生。JOIN で行が増えないよう EXISTS にする
+                sev = StudentExamVersion.objects.filter(student=OuterRef("pk"))
+                if subjectNo is not None:
+                    sev = sev.filter(subject__subjectNo=subjectNo)
+                if fsyear is not None:
+                    sev = sev.filter(subject__fsyear=int(fsyear))
+                qs = qs.filter(Exists(sev))
+        else:
+            if subjectNo is not None:
+                qs = qs.filter(**{f"{self.subject_lookup}__subjectNo": subjectNo})
+            if fsyear is not None:
+                qs = qs.filter(**{f"{self.subject_lookup}__fsyear": int(fsyear)})
+        return qs.order_by(*self.order_by).values_list(*(lookup for _, lookup in self.columns))
+
+
+TABLES = {
+    "student": Table(
+        model=Student,
+        columns=tuple((f, f) for f in (
+            "id", "entyear", "stdNo", "email", "name1", "name2", "nickname", "gender", "COO", "enrolled",
+        )),
+        order_by=("id",),
+    ),
+    "student_exam": Table(
+        model=StudentExam,
+        columns=(
+            ("subjectNo", "subject__subjectNo"),
+            ("fsyear", "subject__fsyear"),
+            ("version", "exam__version"),
+            ("stdNo", "student__stdNo"),
+            ("q_no", "question__q_no"),
+            ("gyo", "question__gyo"),
+            ("retu", "question__retu"),
+            ("TF", "TF"),
+            ("hosei", "hosei"),
+            ("earned", "earned"),
+            ("updated_at", "updated_at"),
+        ),
+        order_by=("subject_id", "exam_id", "student_id", "question_id"),
+    ),
+    "exam_adjust": Table(
+        model=ExamAdjust,
+        columns=(
+            ("subjectNo", "subject__subjectNo"),
+            ("fsyear", "subject__fsyear"),
+            ("version", "exam__version"),
+            ("stdNo", "student__stdNo"),
+            ("adjust", "adjust"),
+            ("updated_at", "updated_at"),
+        ),
+        order_by=("subject_id", "exam_id", "student_id"),
+    ),
+    "student_exam_version": Table(
+        model=StudentExamVersion,
+        columns=(
+            ("subjectNo", "subject__subjectNo"),
+            ("fsyear", "subject__fsyear"),
+            ("stdNo", "student__stdNo"),
+            ("version", "exam__version"),
+            ("updated_at", "updated_at"),
+        ),
+        order_by=("subject_id", "student_id", "exam_id"),
+    ),
+}
+
+
+# =========================
+# 書き出し
+# =========================
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def write_rows(out, headers, rows, fmt: str = "csv") -> int:
+    """rows（タプルのイテラブル）を out（テキストのファイル）に 1 行ずつ書く。戻り値は行数"""
+    count = 0
+    if fmt == "jsonl":
+        for row in rows:
+            line = json.dumps(
+                {h: _json_value(v) for h, v in zip(headers, row)}, ensure_ascii=False, separators=(",", ":"),
+            )
+            out.write(line + "\n")   # 1 行 1 回の write（BaseCommand の stdout でも空行が入らない）
+            count += 1
+        return count
+    if fmt not in ("csv", "tsv"):
+        raise ValueError(f"未知の形式: {fmt}（{', '.join(FORMATS)}）")
+
+    writer = csv.writer(out, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow(_json_value(v) for v in row)
+        count += 1
+    return count
+
+
+def dump(table: Table, out, *, fmt: str = "csv", subjectNo=None, fsyear=None, chunk_size: int = CHUNK_SIZE) -> int:
+    """table を絞り込んで out に書く（読みはサーバ側カーソル / chunk_size 行ずつ）"""
+    rows = table.queryset(subjectNo=subjectNo, fsyear=fsyear).iterator(chunk_size=chunk_size)
+    return write_rows(out, table.headers, rows, fmt)
+
+
+def is_stdout(path) -> bool:
+    return path in (None, "-")
+
+
+@contextmanager
+def open_output(path, stdout=None):
+    """
+    path が "-" / None なら stdout（既定 sys.stdout）。
+    それ以外は同じディレクトリの一時ファイルに書いて最後に置き換える（途中で失敗しても既存のファイルを壊さない）
+    """
+    if is_stdout(path):
+        yield stdout or sys.stdout
+        return
+
+    with atomic_output(path) as f:
+        yield f
@@ -1,3 +1,2145 @@
-from django.test import TestCase
+# exam2/tests.py
+import tempfile
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import OperationalError, connection
+from django.db.models import OuterRef, Subquery
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from .models import (
+    Subject,
+    Exam,
+    Question,
+    Student,
+    StudentExam,
+    StudentExamVersion,
+    ExamAdjust,
+    AnswerSheet,
+)
+
+
+_catalog_settings = None
+_catalog_tmp = None
+
+
+def setUpModule():
+    """catalog の stamp（invalidate のたびに touch される）をリポジトリ直下に作らない"""
+    global _catalog_settings, _catalog_tmp
+    from django.conf import settings
+
+    _catalog_tmp = tempfile.TemporaryDirectory()
+    _catalog_settings = override_settings(EXAM2_CATALOG={
+        **getattr(settings, "EXAM2_CATALOG", {}), "stamp": f"{_catalog_tmp.name}/catalog.stamp",
+    })
+    _catalog_settings.enable()
+
+
+def tearDownModule():
+    _catalog_settings.disable()
+    _catalog_tmp.cleanup()
+
+
+class StudentTableMixin:
+    """
+    student テーブルは managed=False なので、テストDBには migrate で作られない。
+    TestCase のトランザクションに入る前に作成し、終了後に削除する。
+    PostgreSQL では student_postgres.sql で作ったテーブルがテストDBにもあるので、その場合は作らない。
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._created_student = Student._meta.db_table not in connection.introspection.table_names()
+        if cls._created_student:
+            with connection.schema_editor() as editor:
+                editor.create_model(Student)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls._created_student:
+            with connection.schema_editor() as editor:
+                editor.delete_model(Student)
+
+
+def make_subject_fixture(*, subjectNo="1010401", fsyear=2025, students=3, rows=2, cols=3):
+    """Subject + A/B Exam + Question + SEV/StudentExam/ExamAdjust の最小データを作る"""
+    subject = Subject.objects.create(subjectNo=subjectNo, fsyear=fsyear, term=1, name="テスト科目", nenji=1)
+    exams = {
+        v: Exam.objects.create(subject=subject, title=subject.name, version=v)
+        for v in ("A", "B")
+    }
+
+    questions = {}
+    for v, exam in exams.items():
+        questions[v] = [
+            Question.objects.create(exam=exam, q_no=f"{g}-{r}", gyo=g, retu=r, points=2)
+            for g in range(1, rows + 1)
+            for r in range(1, cols + 1)
+        ]
+
+    student_list = []
+    for i in range(students):
+        stu = Student.objects.create(
+            id=fsyear * 1000 + i,
+            entyear=fsyear,
+            stdNo=f"{fsyear % 100}367{i:03d}",
+            email=f"s{i}@example.com",
+            name1="姓",
+            name2="名",
+            nickname=f"nick{i}",
+            gender="M",
+            COO="JP",
+        )
+        exam = exams["A" if i % 2 == 0 else "B"]
+        StudentExamVersion.objects.create(student=stu, exam=exam, subject=subject)
+        StudentExam.objects.bulk_create([
+            StudentExam(
+                student=stu, exam=exam, subject=subject, question=q,
+                TF=(j % 2), hosei=0, earned=q.points * (j % 2),
+            )
+            for j, q in enumerate(questions[exam.version])
+        ])
+        ExamAdjust.objects.create(student=stu, exam=exam, subject=subject, adjust=0)
+        student_list.append(stu)
+
+    return subject, exams, questions, student_list
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN は SQLite 専用")
+class QueryPlanTests(StudentTableMixin, TestCase):
+    """
+    ホットなクエリについて EXPLAIN QUERY PLAN を取り、
+    exam2 のテーブルを全件スキャンしていないことを確認する（SQLite 前提）。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+        cls.exam = cls.exams["A"]
+        cls.student = cls.students[0]
+
+    def query_plan(self, qs):
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, qs):
+        plan = self.query_plan(qs)
+        scans = [
+            line for line in plan
+            if line.startswith("SCAN ") and not line.startswith("SCAN CONSTANT ROW")
+        ]
+        self.assertEqual(scans, [], msg="full scan detected:\n" + "\n".join(plan))
+
+    def hot_queries(self):
+        subject = self.subject
+        exam = self.exam
+        student = self.student
+
+        return {
+            # Subject の特定（ほぼ全リクエストの入口）
+            "subject_by_no_year": Subject.objects.filter(subjectNo=subject.subjectNo, fsyear=subject.fsyear),
+            # 科目内の A/B
+            "exams_of_subject": Exam.objects.filter(subject=subject).order_by("version"),
+            # 採点画面の問題一覧
+            "questions_of_exam": Question.objects.filter(exam=exam).order_by("gyo", "retu", "id"),
+            # /api/student-exams/?exam=&student_stdno=
+            "student_exams_of_sheet": (
+                StudentExam.objects.filter(exam=exam, student__stdNo=student.stdNo)
+                .select_related("student", "exam", "question")
+                .order_by("question__gyo", "question__retu", "question_id")
+            ),
+            "student_exams_by_student_exam": StudentExam.objects.filter(student=student, exam=exam),
+            # 結果一覧（exam 起点）
+            "student_exams_of_exam": StudentExam.objects.filter(exam=exam).select_related("student", "question"),
+            "students_of_exam": StudentExam.objects.filter(exam=exam).values_list("student_id", flat=True).distinct(),
+            # 科目単位の SEV（examadjust_subject / export / load_*）
+            "sev_of_subject": (
+                StudentExamVersion.objects.filter(exam__subject=subject)
+                .select_related("student", "exam")
+                .order_by("student__stdNo")
+            ),
+            "sev_of_student_subject": StudentExamVersion.objects.filter(student=student, exam__subject=subject),
+            # 非正規化した subject_id での科目絞り込み
+            "student_exams_of_subject": StudentExam.objects.filter(subject=subject).values("id"),
+            "sev_of_subject_denorm": StudentExamVersion.objects.filter(subject=subject, student=student),
+            "adjust_of_subject": ExamAdjust.objects.filter(subject=subject),
+            "sev_of_exam": StudentExamVersion.objects.filter(exam=exam).select_related("student", "exam"),
+            # ExamAdjust
+            "adjust_by_student_exam": ExamAdjust.objects.filter(student=student, exam=exam),
+            "adjust_of_exam": ExamAdjust.objects.filter(exam=exam),
+            "adjust_of_student": ExamAdjust.objects.filter(student=student),
+            # 統計系（部分インデックス）
+            "stats_tf1": StudentExam.objects.filter(exam__in=Exam.objects.filter(subject=subject), TF=1).values("id"),
+            "stats_hosei_nonzero": (
+                StudentExam.objects.filter(exam__in=Exam.objects.filter(subject=subject))
+                .exclude(hosei=0).values("id")
+            ),
+            # 学生→版 の相関サブクエリ
+            "sev_version_subquery": Student.objects.filter(id=student.id).annotate(
+                version=Subquery(
+                    StudentExamVersion.objects.filter(student=OuterRef("pk"), exam__subject=subject)
+                    .values("exam__version")[:1]
+                )
+            ),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, qs in self.hot_queries().items():
+            with self.subTest(query=name):
+                self.assertNoFullScan(qs)
+
+    def test_exam_default_ordering_does_not_join_subject(self):
+        sql = str(Exam.objects.filter(subject=self.subject).query)
+        self.assertNotIn("JOIN", sql.upper())
+
+    def test_subject_stats_lists_versions_in_order(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        # 既定 ordering が無いので、並びが必要な箇所は order_by("version") を明示している
+        subject = Subject.objects.create(subjectNo="3030303", fsyear=2025, term=1, name="逆順")
+        for version in ("B", "A"):
+            Exam.objects.create(subject=subject, title="T", version=version)
+        out = StringIO()
+        call_command("show_subject_stats", "3030303", "--primary", stdout=out)
+        self.assertIn("Versions   : A, B", out.getvalue())
+
+
+class SubjectDenormTests(StudentTableMixin, TestCase):
+    """StudentExam / SEV / ExamAdjust の subject 非正規化列"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+
+    def test_save_fills_subject_from_exam(self):
+        exam = self.exams["A"]
+        stu = self.students[1]  # B 版の学生に A のセルを足す（unique 衝突を避ける）
+        se = StudentExam.objects.create(student=stu, exam=exam, question=self.questions["A"][0])
+        self.assertEqual(se.subject_id, exam.subject_id)
+
+    def test_check_command_detects_and_fixes_mismatch(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        StudentExam.objects.filter(student=self.students[0]).update(subject=None)
+        out = StringIO()
+        call_command("check_subject_denorm", stdout=out)
+        self.assertIn("StudentExam", out.getvalue())
+
+        call_command("check_subject_denorm", "--fix", stdout=StringIO())
+        self.assertFalse(StudentExam.objects.filter(subject__isnull=True).exists())
+
+    def test_clear_commands_include_rows_without_subject(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+
+        stu = self.students[0]
+        StudentExam.objects.filter(student=stu).update(subject=None, hosei=5)
+        ExamAdjust.objects.filter(student=stu).update(subject=None, adjust=3)
+        # 別科目の NULL 行は対象外
+        other = make_subject_fixture(subjectNo="2020202", fsyear=2024, students=1)[0]
+        StudentExam.objects.filter(subject=other).update(subject=None, hosei=7)
+
+        with mock.patch("builtins.input", return_value="y"):
+            call_command("clear_subject_scores", self.subject.subjectNo, fsyear=2025, stdout=StringIO())
+        self.assertFalse(StudentExam.objects.filter(student=stu).exclude(TF=0, hosei=0).exists())
+        self.assertEqual(ExamAdjust.objects.get(student=stu).adjust, 0)
+        self.assertTrue(StudentExam.objects.filter(exam__subject=other, hosei=7).exists())
+
+        call_command("clear_subject_runtime_data", self.subject.subjectNo, fsyear=2025, execute=True,
+                     stdout=StringIO())
+        self.assertFalse(StudentExam.objects.filter(exam__subject=self.subject).exists())
+        self.assertFalse(ExamAdjust.objects.filter(exam__subject=self.subject).exists())
+        self.assertEqual(StudentExam.objects.filter(exam__subject=other).count(), 6)
+
+
+class AnswerSheetTests(StudentTableMixin, TestCase):
+    """AnswerSheet（packed）の pack 形式・セル id・互換アダプタ・verify_answer_sheets"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .answersheet import build_answer_sheets
+
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+        StudentExam.objects.filter(student=cls.students[0], question=cls.questions["A"][1]).update(hosei=-3)
+        build_answer_sheets(cls.subject)
+
+    def test_pack_round_trip(self):
+        from .answersheet import pack_hosei, pack_tf, unpack_hosei, unpack_tf
+
+        for n in (0, 1, 7, 8, 9, 17):
+            tf = [(i * 7) % 3 == 0 for i in range(n)]
+            hosei = [(-1) ** i * (i * 1111) for i in range(n)]
+            self.assertEqual(len(pack_tf(tf)), (n + 7) // 8)
+            self.assertEqual(unpack_tf(pack_tf(tf), n), [int(v) for v in tf])
+            self.assertEqual(unpack_hosei(pack_hosei(hosei), n), hosei)
+        self.assertEqual(pack_tf([1, 0, 0, 0, 0, 0, 0, 0, 1]), b"\x01\x01")
+        self.assertEqual(pack_hosei([1, -1, 32767, -32768]), b"\x01\x00\xff\xff\xff\x7f\x00\x80")
+        # 短いデータ（問題を足した後など）は 0 で埋める
+        self.assertEqual(unpack_tf(b"\x03", 10), [1, 1] + [0] * 8)
+        self.assertEqual(unpack_hosei(pack_hosei([5]), 3), [5, 0, 0])
+        with self.assertRaises(OverflowError):
+            pack_hosei([40000])
+
+    def test_cell_id_bounds(self):
+        from .answersheet import CELL_ID_STRIDE, cell_id, split_cell_id
+
+        self.assertEqual(CELL_ID_STRIDE, 1000)
+        self.assertEqual(cell_id(12, 0), 12000)
+        self.assertEqual(cell_id(12, 999), 12999)
+        self.assertEqual(split_cell_id("12999"), (12, 999))
+        self.assertEqual(split_cell_id(13000), (13, 0))
+        for bad in (-1, CELL_ID_STRIDE):
+            with self.assertRaises(ValueError):
+                cell_id(12, bad)
+
+    def test_adapter_list_get_update(self):
+        from . import catalog
+        from .answersheet import PackedStudentExamAdapter, cell_id
+
+        adapter = PackedStudentExamAdapter()
+        stu, exam = self.students[0], self.exams["A"]
+        sheet = AnswerSheet.objects.get(student=stu, exam=exam)
+        self.assertEqual((sheet.score, sheet.hosei_total, sheet.total), (6, -3, 3))
+
+        catalog.invalidate()
+        with self.assertNumQueries(2):
+            cells = adapter.list_cells(exam_id=exam.id, student_stdno=stu.stdNo)
+        with self.assertNumQueries(1):   # Question の並びは catalog から
+            adapter.list_cells(exam_id=exam.id, student_stdno=stu.stdNo)
+        self.assertEqual(
+            [(c["id"], c["question"], c["TF"], c["hosei"]) for c in cells],
+            [
+                (cell_id(sheet.id, j), q.id, j % 2, -3 if j == 1 else 0)
+                for j, q in enumerate(self.questions["A"])
+            ],
+        )
+        self.assertEqual(adapter.get_cell(cells[1]["id"]), cells[1])
+        self.assertIsNone(adapter.get_cell(cell_id(sheet.id, len(cells))))
+        self.assertIsNone(adapter.get_cell(cell_id(sheet.id + 999, 0)))
+
+        self.assertEqual(adapter.update_cells([
+            {"id": cells[0]["id"], "TF": 1},
+            {"id": cells[1]["id"], "TF": 0, "hosei": 4},
+        ]), 1)
+        sheet.refresh_from_db()
+        self.assertEqual((sheet.score, sheet.hosei_total, sheet.total), (6, 4, 10))
+        self.assertEqual(adapter.get_cell(cells[1]["id"])["hosei"], 4)
+
+        with self.assertRaises(KeyError):
+            adapter.update_cells([{"id": cell_id(sheet.id, len(cells)), "TF": 1}])
+        with self.assertRaises(KeyError):
+            adapter.update_cells([{"id": cell_id(sheet.id + 999, 0), "TF": 1}])
+
+    def test_verify_answer_sheets(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("verify_answer_sheets", self.subject.subjectNo, "--fsyear", "2025", stdout=out)
+        self.assertIn("SEV=3 AnswerSheet=3 checked=3", out.getvalue())
+        self.assertIn("一致しました", out.getvalue())
+
+        q = self.questions["B"][0]
+        StudentExam.objects.filter(student=self.students[1], question=q).update(TF=1)
+        AnswerSheet.objects.filter(student=self.students[2]).delete()
+        out = StringIO()
+        call_command("verify_answer_sheets", self.subject.subjectNo, "--fsyear", "2025", "--rebuild", stdout=out)
+        text = out.getvalue()
+        self.assertIn("不一致 2 件", text)
+        self.assertIn(f"AnswerSheet 不足: student_id={self.students[2].id}", text)
+        self.assertIn(f"question_id={q.id} rows=(TF=1, hosei=0) sheet=(TF=0, hosei=0)", text)
+        self.assertIn("created=1 updated=2 deleted=0", text)
+
+        out = StringIO()
+        call_command("verify_answer_sheets", self.subject.subjectNo, "--fsyear", "2025", stdout=out)
+        self.assertIn("一致しました", out.getvalue())
+
+
+class EarnedColumnTests(StudentTableMixin, TestCase):
+    """StudentExam.earned（TF=1 の points 保持列）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+
+    def test_score_totals_use_earned(self):
+        from .scoring import score_totals
+
+        totals = score_totals([e.id for e in self.exams.values()])
+        # 6 問中 TF=1 が 3 問、各 2 点
+        self.assertEqual(totals[(self.students[0].id, self.exams["A"].id)], (6, 0))
+
+    def test_save_sets_earned(self):
+        se = StudentExam.objects.select_related("question").filter(student=self.students[0], TF=0).first()
+        se.TF = 1
+        se.save(update_fields=["TF"])
+        se.refresh_from_db()
+        self.assertEqual(se.earned, se.question.points)
+
+    def test_save_does_not_query_question(self):
+        se = StudentExam.objects.filter(student=self.students[0], TF=1).first()
+        se.TF = 0
+        with self.assertNumQueries(1):          # UPDATE だけ（TF=0 なら points は要らない）
+            se.save(update_fields=["TF"])
+        se.TF = 1
+        with self.assertNumQueries(1):          # 呼び出し側が points を渡せば Question を引かない
+            se.save(update_fields=["TF"], points=7)
+        self.assertEqual(StudentExam.objects.get(pk=se.pk).earned, 7)
+
+    def test_bulk_update_fetches_cells_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        cells = list(StudentExam.objects.filter(student=self.students[0]).order_by("id"))
+
+        def selects(items):
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.patch("/api/student-exams/bulk_update/", items, content_type="application/json")
+            self.assertEqual(res.status_code, 200)
+            return sum(1 for q in ctx.captured_queries if q["sql"].lstrip().upper().startswith("SELECT"))
+
+        one = selects([{"id": cells[0].id, "TF": 1}])
+        many = selects([{"id": se.id, "TF": 1} for se in cells])
+        self.assertEqual(one, many)
+        self.assertEqual(
+            set(StudentExam.objects.filter(student=self.students[0]).values_list("earned", flat=True)), {2}
+        )
+
+    def test_points_change_recomputes_earned(self):
+        q = self.questions["A"][1]  # j=1 → TF=1
+        q.points = 5
+        q.save()
+        self.assertEqual(
+            set(StudentExam.objects.filter(question=q, TF=1).values_list("earned", flat=True)), {5}
+        )
+
+
+class SqliteProfileTests(SimpleTestCase):
+    """SQLite 接続プロファイル（exam2/dbprofile.py）"""
+
+    def test_rejects_unknown_key_and_bad_value(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from .dbprofile import pragma_statements
+
+        with self.assertRaisesMessage(ImproperlyConfigured, "未対応"):
+            pragma_statements({"journal_mode": "WAL", "page_size": 4096})
+        with self.assertRaisesMessage(ImproperlyConfigured, "journal_mode"):
+            pragma_statements({"journal_mode": "FAST"})
+        with self.assertRaises(ValueError):
+            pragma_statements({"busy_timeout": "soon"})
+        self.assertEqual(
+            pragma_statements({"synchronous": "normal", "busy_timeout": "100", "cache_size": None}),
+            ["PRAGMA busy_timeout = 100", "PRAGMA synchronous = NORMAL"],
+        )
+
+    def test_new_connection_gets_profile(self):
+        import os
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+        from .dbprofile import effective_pragmas
+
+        profile = {"journal_mode": "WAL", "synchronous": "OFF", "busy_timeout": 1234}
+        with tempfile.TemporaryDirectory() as tmp, override_settings(SQLITE_PROFILE=profile):
+            conn = DatabaseWrapper(
+                {**connection.settings_dict, "NAME": os.path.join(tmp, "profile.sqlite3")}, alias="profile_test",
+            )
+            try:
+                conn.ensure_connection()   # connection_created → signals.apply_sqlite_profile
+                pragmas = effective_pragmas(conn)
+            finally:
+                conn.close()
+        self.assertEqual(str(pragmas["journal_mode"]).upper(), "WAL")
+        self.assertEqual(pragmas["synchronous"], "OFF")
+        self.assertEqual(pragmas["busy_timeout"], 1234)
+
+
+class RunWriteTests(StudentTableMixin, TransactionTestCase):
+    """exam2/dbwrite.py の再試行（TestCase の atomic の外で動かすため TransactionTestCase）"""
+
+    @override_settings(EXAM2_WRITE={"base_delay": 0.001, "max_delay": 0.002, "retries": 3})
+    def test_retries_lock_errors_then_succeeds(self):
+        from .dbwrite import run_write, write_metrics
+
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError("database is locked")
+            return "done"
+
+        write_metrics.reset()
+        self.assertEqual(run_write(flaky), "done")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(write_metrics.snapshot()["retries"], 2)
+
+    @override_settings(EXAM2_WRITE={"base_delay": 0.001, "max_delay": 0.002, "retries": 2})
+    def test_gives_up_with_write_busy(self):
+        from .dbwrite import run_write, WriteBusy
+
+        def always_locked():
+            raise OperationalError("database is locked")
+
+        with self.assertRaises(WriteBusy):
+            run_write(always_locked)
+
+
+class PgCopyEncodingTests(SimpleTestCase):
+    """exam2/pgcopy.py の COPY text 形式エンコード（DB 不要）"""
+
+    def test_encode_row_escapes_and_nulls(self):
+        from .pgcopy import encode_row
+
+        self.assertEqual(encode_row((1, None, "a\tb\\c", True)), "1\t\\N\ta\\tb\\\\c\tt\n")
+
+    def test_row_stream_reads_in_chunks(self):
+        from .pgcopy import RowStream, encode_row
+
+        rows = [(i, f"q{i}") for i in range(100)]
+        stream = RowStream(rows, chunk_rows=7)
+        out = []
+        while True:
+            chunk = stream.read(50)
+            if not chunk:
+                break
+            out.append(chunk)
+        self.assertEqual("".join(out), "".join(encode_row(r) for r in rows))
+        self.assertEqual(stream.count, 100)
+
+
+@skipUnless(connection.vendor == "postgresql", "PostgreSQL 専用（EXAM2_DB_ENGINE=postgresql で実行）")
+class PgCopyTests(StudentTableMixin, TestCase):
+    """
+    exam2/pgcopy.py の COPY 投入と ON CONFLICT マージを実 DB で確認する。
+
+    student テーブルは exam2/student_postgres.sql で作る前提（migrate が FK を張るため）。
+    テストDB は template1 から作られるので、先に template1 にも流しておく:
+        psql -d template1 -f exam2/student_postgres.sql
+        EXAM2_DB_ENGINE=postgresql python manage.py test exam2.tests.PgCopyTests
+    """
+
+    STUDENT_FIELDS = ("id", "entyear", "stdNo", "email", "name1", "name2", "nickname", "gender", "COO")
+
+    def student_row(self, i, email=None):
+        return (9000 + i, 2025, f"25999{i:03d}", email or f"p{i}@example.com", "姓", "名\tタブ", f"n{i}", "F", "JP")
+
+    def test_student_table_matches_model(self):
+        columns = {c.name for c in connection.introspection.get_table_description(connection.cursor(), "student")}
+        self.assertEqual(columns, {f.column for f in Student._meta.concrete_fields})
+
+    def test_copy_plain_and_conflict(self):
+        from .pgcopy import copy_enabled, copy_rows
+
+        self.assertTrue(copy_enabled())
+        self.assertEqual(copy_rows(Student, self.STUDENT_FIELDS, (self.student_row(i) for i in range(3))), 3)
+        stu = Student.objects.get(id=9001)
+        self.assertEqual((stu.stdNo, stu.name2, stu.enrolled), ("25999001", "名\tタブ", True))
+
+        # DO NOTHING: 既存 2 行 + 新規 1 行 → 1
+        rows = [self.student_row(1), self.student_row(2, email="changed@example.com"), self.student_row(3)]
+        self.assertEqual(copy_rows(Student, self.STUDENT_FIELDS, rows, conflict_fields=("id",)), 1)
+        self.assertEqual(Student.objects.get(id=9002).email, "p2@example.com")
+
+        # DO UPDATE: 値が変わった行だけ（9001 は同じなので数えない）
+        self.assertEqual(
+            copy_rows(Student, self.STUDENT_FIELDS, rows, conflict_fields=("id",), update_fields=("email",)), 1,
+        )
+        self.assertEqual(Student.objects.get(id=9002).email, "changed@example.com")
+        self.assertEqual(Student.objects.filter(id__gte=9000).count(), 4)
+
+    def test_student_exam_merge_like_import(self):
+        from django.utils import timezone
+        from .pgcopy import copy_rows
+
+        subject, exams, questions, students = make_subject_fixture(students=2)
+        exam, stu = exams["A"], students[0]
+        now = timezone.now()
+        fields = ("student", "exam", "subject", "question", "TF", "hosei", "earned", "updated_at")
+        rows = [(stu.id, exam.id, subject.id, q.id, 1, -2, q.points, now) for q in questions["A"][:2]]
+
+        # 2 回目は同じ値なので 0 件（一時テーブルは同じトランザクション内でも作り直せる）
+        for expected in (2, 0):
+            self.assertEqual(copy_rows(
+                StudentExam, fields, rows,
+                conflict_fields=("student", "exam", "question"),
+                update_fields=("TF", "hosei", "earned"),
+            ), expected)
+        self.assertEqual(
+            list(StudentExam.objects.filter(student=stu, exam=exam).order_by("question__gyo", "question__retu")
+                 .values_list("TF", "hosei", "earned")[:3]),
+            [(1, -2, 2), (1, -2, 2), (0, 0, 0)],
+        )
+        self.assertEqual(StudentExam.objects.filter(student=stu, exam=exam).count(), len(questions["A"]))
+
+
+class ArchiveFsyearTests(StudentTableMixin, TestCase):
+    """archive_fsyear と年度ルータ"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(fsyear=2024)
+
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_archive_moves_year_and_routes_reads(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db import DEFAULT_DB_ALIAS
+        from django.utils import timezone
+        from .archive import ArchivedYearReadOnly, unregister_archive, use_fsyear
+        from .models import ExportWatermark
+
+        cells = StudentExam.objects.count()
+        exported_at = timezone.now()
+        ExportWatermark.objects.create(subject=self.subject, target="gakumu", exported_at=exported_at)
+        with override_settings(EXAM2_ARCHIVE_DIR=self.tmpdir.name, FSYEAR=2026):
+            self.addCleanup(unregister_archive, 2024)
+            call_command("archive_fsyear", "2024", stdout=StringIO())
+
+            self.assertFalse(Subject.objects.using(DEFAULT_DB_ALIAS).filter(fsyear=2024).exists())
+            self.assertEqual(StudentExam.objects.count(), 0)
+
+            with use_fsyear(2024):
+                self.assertEqual(Subject.objects.filter(fsyear=2024).count(), 1)
+                self.assertEqual(StudentExam.objects.count(), cells)
+                mark = ExportWatermark.objects.get(subject__fsyear=2024)
+                self.assertEqual((mark.target, mark.exported_at), ("gakumu", exported_at))
+                with self.assertRaises(ArchivedYearReadOnly):
+                    ExamAdjust.objects.filter(subject__fsyear=2024).update(adjust=1)
+
+            res = self.client.get(f"/api/examadjust_subject/?subjectNo={self.subject.subjectNo}&fsyear=2024")
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(len(res.json()["students"]), len(self.students))
+
+            years = self.client.get("/api/fsyears/").json()["years"]
+            self.assertIn({"fsyear": 2024, "archived": True}, years)
+
+    def test_exam_page_apis_follow_fsyear_header(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .archive import unregister_archive
+
+        exam = self.exams["A"]
+        student = StudentExamVersion.objects.filter(exam=exam).select_related("student").first().student
+        with override_settings(EXAM2_ARCHIVE_DIR=self.tmpdir.name, FSYEAR=2026):
+            self.addCleanup(unregister_archive, 2024)
+            call_command("archive_fsyear", "2024", stdout=StringIO())
+
+            # exam_page.js は URL の fsyear を X-Fsyear で送る。無ければ作業DBを見るので 404
+            self.assertEqual(self.client.get(f"/api/exams/{exam.id}/").status_code, 404)
+            urls = [
+                f"/api/exams/{exam.id}/",
+                f"/api/exam-students/?exam_id={exam.id}",
+                f"/api/student-exams/?exam={exam.id}&student_stdno={student.stdNo}",
+                f"/api/examresult/?wexamid={exam.id}",
+            ]
+            for url in urls:
+                with self.subTest(url=url):
+                    res = self.client.get(url, HTTP_X_FSYEAR="2024")
+                    self.assertEqual(res.status_code, 200)
+                    self.assertTrue(res.json())
+
+            # examadjust_page.js の更新も X-Fsyear 付きなので、アーカイブ年度は 409 で止まる
+            res = self.client.post(
+                "/api/exam-adjust-update-subject/",
+                {"subjectNo": self.subject.subjectNo, "fsyear": 2024,
+                 "items": [{"stdNo": student.stdNo, "exam_id": exam.id, "adjust": 1}]},
+                content_type="application/json", HTTP_X_FSYEAR="2024",
+            )
+            self.assertEqual(res.status_code, 409)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """集計系の読み込みをレプリカへ振り向けるルータ"""
+
+    alias = "replica_test"
+
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+        from django.db import DEFAULT_DB_ALIAS, connections
+        from . import replica
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        name = Path(tmpdir.name) / "db_replica.sqlite3"
+        configured = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            self.alias: {"ENGINE": "django.db.backends.sqlite3", "NAME": f"file:{name}?mode=ro"},
+        })
+        connections.settings[self.alias] = configured[self.alias]
+        self.addCleanup(connections.settings.pop, self.alias)
+        replica._lag_cache.clear()
+        self.addCleanup(replica._lag_cache.clear)
+
+    def route(self):
+        from .replica import ReplicaRouter
+
+        return ReplicaRouter().db_for_read(StudentExam)
+
+    def test_reporting_reads_use_fresh_replica_only(self):
+        from .replica import pin_primary, reporting_reads, stamp_path, _lag_cache
+
+        with override_settings(EXAM2_REPLICA={"alias": self.alias, "max_staleness": 30, "lag_cache": 0}):
+            with reporting_reads():
+                self.assertIsNone(self.route())          # 未 refresh（スタンプ無し）は primary
+                stamp_path(self.alias).touch()
+                _lag_cache.clear()
+                self.assertEqual(self.route(), self.alias)
+                with pin_primary():
+                    self.assertIsNone(self.route())      # 書き込み直後は primary
+            self.assertIsNone(self.route())              # 集計以外の読み込みは primary
+
+        with override_settings(EXAM2_REPLICA={"alias": self.alias, "max_staleness": -1, "lag_cache": 0}):
+            with reporting_reads():
+                self.assertIsNone(self.route())          # 遅れが上限を超えたら primary
+
+
+class CatalogCacheTests(StudentTableMixin, TestCase):
+    """マスタ参照キャッシュ（exam2/catalog.py）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+
+    def setUp(self):
+        from . import catalog
+
+        catalog.invalidate()
+        catalog.catalog.reset_stats()
+
+    def test_repeated_lookups_skip_queries(self):
+        from . import catalog
+
+        with self.assertNumQueries(3):
+            catalog.subject_or_404(self.subject.subjectNo, self.subject.fsyear)
+            catalog.exams_by_version(self.subject.id)
+            catalog.student_id(self.students[0].stdNo)
+        with self.assertNumQueries(0):
+            subject = catalog.subject_or_404(self.subject.subjectNo, str(self.subject.fsyear))
+            self.assertEqual(subject.pk, self.subject.pk)
+            self.assertEqual(list(catalog.exams_by_version(self.subject.id)), ["A", "B"])
+            self.assertEqual(catalog.student_id(self.students[0].stdNo), self.students[0].id)
+
+        stats = catalog.catalog.snapshot()
+        self.assertEqual(stats["kinds"]["subject"], {"hits": 1, "misses": 1})
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_save_and_stamp_invalidate(self):
+        import os
+        import tempfile
+        from django.http import Http404
+        from . import catalog
+
+        with self.assertRaises(Http404):
+            catalog.subject_or_404("9999999", self.subject.fsyear)
+        Subject.objects.create(subjectNo="9999999", fsyear=self.subject.fsyear, term=1, name="new")
+        self.assertEqual(catalog.subject_or_404("9999999", self.subject.fsyear).name, "new")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            stamp = os.path.join(tmp, "catalog.stamp")
+            with override_settings(EXAM2_CATALOG={"stamp": stamp, "check_interval": 0}):
+                catalog.invalidate()
+                catalog.exams_by_version(self.subject.id)
+                Exam.objects.filter(subject=self.subject, version="A").update(title="renamed")
+                self.assertNotEqual(catalog.exams_by_version(self.subject.id)["A"].title, "renamed")
+
+                # 別プロセス（コマンド）が stamp を更新した
+                st = os.stat(stamp)
+                os.utime(stamp, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+                self.assertEqual(catalog.exams_by_version(self.subject.id)["A"].title, "renamed")
+
+    def test_question_layout_is_cached(self):
+        from .answersheet import exam_layouts
+        from .questionsync import reconcile_exam
+        from .services import synthesize_cells
+
+        exam = self.exams["A"]
+        with self.assertNumQueries(1):
+            layout = exam_layouts([exam.id])[exam.id]
+        self.assertEqual(layout.question_ids, tuple(q.id for q in self.questions["A"]))
+        self.assertEqual(layout.points, (2,) * 6)
+        with self.assertNumQueries(0):
+            exam_layouts([exam.id])
+            cells = synthesize_cells(exam.id, self.students[0].id, [])
+        self.assertEqual([c["question"] for c in cells], list(layout.question_ids))
+
+        # reconcile（bulk 書き込み）の後は新しい並び
+        cells = {
+            (q.gyo, q.retu): {f: getattr(q, f) for f in ("q_no", "bunrui", "points", "answer", "width", "height")}
+            for q in self.questions["A"]
+        }
+        cells[(3, 1)] = {**cells[(1, 1)], "q_no": "3-1", "points": 5}
+        reconcile_exam(exam, cells)
+        layout = exam_layouts([exam.id])[exam.id]
+        self.assertEqual((len(layout), layout.points[-1]), (7, 5))
+
+        # Question の save でも捨てる
+        q = self.questions["A"][0]
+        q.points = 4
+        q.save()
+        self.assertEqual(exam_layouts([exam.id])[exam.id].points[0], 4)
+
+    def test_delete_invalidates(self):
+        from django.db.models.deletion import Collector
+        from django.http import Http404
+        from . import catalog
+        from .answersheet import exam_layouts
+
+        exam = self.exams["A"]
+        stu = self.students[0]
+        self.assertEqual(catalog.exam_or_404(exam.id).pk, exam.pk)
+        self.assertEqual(catalog.student_id(stu.stdNo), stu.id)
+        self.assertEqual(len(exam_layouts([exam.id])[exam.id]), 6)
+
+        self.questions["A"][0].delete()
+        self.assertEqual(len(exam_layouts([exam.id])[exam.id]), 5)
+        Exam.objects.filter(pk=exam.pk).delete()
+        with self.assertRaises(Http404):
+            catalog.exam_or_404(exam.id)
+        Student.objects.filter(pk=stu.pk).delete()
+        self.assertIsNone(catalog.student_id(stu.stdNo))
+        self.subject.delete()
+        with self.assertRaises(Http404):
+            catalog.subject_or_404(self.subject.subjectNo, self.subject.fsyear)
+
+        # 採点データ側には receiver が無い（高速削除のまま）
+        for model in (StudentExam, ExamAdjust, StudentExamVersion, AnswerSheet):
+            self.assertTrue(Collector(using="default").can_fast_delete(model.objects.all()), model)
+
+    def test_size_bound(self):
+        from . import catalog
+
+        with override_settings(EXAM2_CATALOG={"maxsize": 2}):
+            for stu in self.students[:3]:
+                catalog.student_id(stu.stdNo)
+            stats = catalog.catalog.snapshot()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 1)
+
+
+class LoadStudentExamVersionTests(StudentTableMixin, TestCase):
+    """load_student_exam_version の差分反映"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+        cls.extra = Student.objects.create(
+            id=9999, entyear=2025, stdNo="25367999", email="x@example.com",
+            name1="姓", name2="名", nickname="extra", gender="F", COO="JP",
+        )
+
+    def test_applies_diff_in_bulk(self):
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+
+        s0, s1, s2 = (s.stdNo for s in self.students)
+        body = (
+            "2025:\n  1:\n    \"1010401\":\n"
+            f"      A: [\"{s1}\", \"{s2}\"]\n"
+            f"      B: [\"{s0}\", \"{self.extra.stdNo}\", \"99999999\"]\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "versions.yaml"
+            path.write_text(body, encoding="utf-8")
+
+            out = StringIO()
+            call_command("load_student_exam_version", "1010401", fsyear=2025, yaml=str(path), dry_run=True, stdout=out)
+            self.assertIn("created=1 updated=2 unchanged=1", out.getvalue())
+            self.assertEqual(StudentExamVersion.objects.filter(subject=self.subject).count(), 3)
+
+            out = StringIO()
+            with self.assertNumQueries(8):
+                call_command("load_student_exam_version", "1010401", fsyear=2025, yaml=str(path), stdout=out)
+
+        self.assertIn("skipped_students=1", out.getvalue())
+        assigned = dict(
+            StudentExamVersion.objects.filter(subject=self.subject)
+            .values_list("student__stdNo", "exam__version")
+        )
+        self.assertEqual(assigned, {s0: "B", s1: "A", s2: "A", self.extra.stdNo: "B"})
+
+
+class TfDataStreamTests(SimpleTestCase):
+    """examTFdata.json の逐次読み込み（exam2/tfdata.py）"""
+
+    def test_reads_values_across_chunk_boundaries(self):
+        import io
+        import json
+        from .tfdata import JsonStream
+
+        root = {
+            "meta": {"vals": [1, 2.5e10, -3, True, None, "a\"b\\\\ああ"]},
+            "subjects": {"1": {"students": {f"s{i}": {"n": 12345678901234} for i in range(20)}}},
+        }
+        text = json.dumps(root, ensure_ascii=False, indent=1)
+        for chunk in (1, 3, 64):
+            stream = JsonStream(io.StringIO(text), chunk_size=chunk)
+            self.assertEqual(dict(stream.iter_items()), root)
+
+    def test_atomic_output_keeps_old_file_on_error(self):
+        import os
+        from .tfdata import atomic_output
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.bin")
+            with atomic_output(path, "wb") as f:
+                f.write(b"old")
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+            with self.assertRaises(RuntimeError):
+                with atomic_output(path, "wb") as f:
+                    f.write(b"new")
+                    raise RuntimeError("boom")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"old")
+            self.assertEqual(os.listdir(tmp), ["out.bin"])
+
+
+class ImportSubjectScoresTests(StudentTableMixin, TestCase):
+    """import_subject_scores：科目単位の先読み + 差分反映"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+
+    def block(self):
+        exams = {
+            v: {"question_order": [{"gyo": q.gyo, "retu": q.retu, "q_no": q.q_no} for q in qs]}
+            for v, qs in self.questions.items()
+        }
+        students = {}
+        for i, stu in enumerate(self.students):
+            v = "A" if i % 2 == 0 else "B"
+            answers = [{"TF": j % 2, "hosei": 0} for j in range(len(self.questions[v]))]
+            students[stu.stdNo] = {"version": v, "answers": answers, "adjust": 0}
+        return {"subjects": {self.subject.subjectNo: {"exams": exams, "students": students}}}
+
+    def run_import(self, root, **opts):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "examTFdata.json"
+            path.write_text(json.dumps(root), encoding="utf-8")
+            out = StringIO()
+            call_command(
+                "import_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                json=str(path), no_copy=True, stdout=out, **opts,
+            )
+        return out.getvalue()
+
+    def test_applies_only_changed_cells(self):
+        root = self.block()
+        stu = self.students[0]
+        entry = root["subjects"][self.subject.subjectNo]["students"][stu.stdNo]
+        entry["answers"][0] = {"TF": 1, "hosei": 2}
+        entry["adjust"] = 5
+
+        out = self.run_import(root, dry_run=True)
+        self.assertIn("created=0 updated=1 unchanged=17", out)
+        self.assertFalse(StudentExam.objects.filter(student=stu, hosei=2).exists())
+
+        # 読み込み 7 + 書き込み（StudentExam / ExamAdjust）
+        with self.assertNumQueries(9):
+            out = self.run_import(root)
+        self.assertRegex(out, r"StudentExamVersion: +created=0 updated=0 unchanged=3 deleted=0")
+
+        q0 = self.questions["A"][0]
+        cell = StudentExam.objects.get(student=stu, question=q0)
+        self.assertEqual((cell.TF, cell.hosei, cell.earned), (1, 2, q0.points))
+        self.assertEqual(ExamAdjust.objects.get(student=stu).adjust, 5)
+
+    def test_unknown_student_aborts_without_writes(self):
+        from django.core.management.base import CommandError
+
+        root = self.block()
+        students = root["subjects"][self.subject.subjectNo]["students"]
+        students["99999999"] = dict(next(iter(students.values())))
+        with self.assertRaises(CommandError):
+            self.run_import(root)
+
+
+class ExportSubjectScoresTests(StudentTableMixin, TestCase):
+    """export_subject_scores：学生数に依存しないクエリ数 + import との往復"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=4)
+
+    def test_constant_queries_and_round_trip(self):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "examTFdata.json"
+            # Subject / Exam / Question / SEV / ExamAdjust / StudentExam の 6 クエリ
+            with self.assertNumQueries(6):
+                call_command(
+                    "export_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                    out=str(path), primary=True, stdout=StringIO(),
+                )
+            block = json.loads(path.read_text(encoding="utf-8"))["subjects"][self.subject.subjectNo]
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()), ["examTFdata.json"])
+
+            stu = self.students[1]
+            self.assertEqual(block["students"][stu.stdNo]["version"], "B")
+            self.assertEqual(
+                [a["TF"] for a in block["students"][stu.stdNo]["answers"]],
+                [j % 2 for j in range(len(self.questions["B"]))],
+            )
+
+            out = StringIO()
+            call_command(
+                "import_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                json=str(path), no_copy=True, stdout=out,
+            )
+        self.assertRegex(out.getvalue(), r"StudentExam: +created=0 updated=0 unchanged=24 ")
+
+
+class DeltaExportTests(StudentTableMixin, TestCase):
+    """export_subject_scores --delta：watermark 以降に変わった学生だけ + import はその学生だけ突き合わせる"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=4)
+
+    def test_only_changed_students_after_watermark(self):
+        import json
+        import tempfile
+        from datetime import timedelta
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from django.utils import timezone
+        from .models import ExportWatermark
+
+        def export(path):
+            call_command(
+                "export_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                out=str(path), delta=True, target="sis", primary=True, stdout=StringIO(),
+            )
+            return json.loads(path.read_text(encoding="utf-8"))["subjects"][self.subject.subjectNo]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # 初回は watermark が無いので全件
+            block = export(Path(tmp) / "full.json")
+            self.assertNotIn("delta", block)
+            self.assertEqual(len(block["students"]), 4)
+            self.assertTrue(ExportWatermark.objects.filter(subject=self.subject, target="sis").exists())
+
+            # 既存行を watermark より前にしてから 1 セルだけ変える
+            past = timezone.now() - timedelta(hours=2)
+            for model in (StudentExam, StudentExamVersion, ExamAdjust):
+                model.objects.filter(subject=self.subject).update(updated_at=past)
+            ExportWatermark.objects.filter(subject=self.subject).update(exported_at=past + timedelta(hours=1))
+            stu = self.students[2]
+            se = StudentExam.objects.filter(student=stu).order_by("question__gyo", "question__retu").first()
+            se.TF = 1 - se.TF
+            se.save(update_fields=["TF"])
+
+            path = Path(tmp) / "delta.json"
+            block = export(path)
+            self.assertEqual(list(block["students"]), [stu.stdNo])
+            self.assertEqual(block["delta"]["target"], "sis")
+            self.assertEqual(block["students"][stu.stdNo]["answers"][0]["TF"], se.TF)
+
+            # 差分を全体として取り込むのは断る
+            with self.assertRaisesMessage(CommandError, "--delta を付けて"):
+                call_command(
+                    "import_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                    json=str(path), no_copy=True, stdout=StringIO(),
+                )
+            out = StringIO()
+            call_command(
+                "import_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                json=str(path), delta=True, no_copy=True, stdout=out,
+            )
+        self.assertIn("delta: since=", out.getvalue())
+        self.assertRegex(out.getvalue(), r"StudentExam: +created=0 updated=0 unchanged=6 ")
+
+    def test_store_keeps_each_delta_and_chains_them(self):
+        import json
+        import tempfile
+        from datetime import timedelta
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from django.utils import timezone
+        from . import tfstore
+        from .models import ExportWatermark
+
+        subjectNo = self.subject.subjectNo
+
+        def export():
+            call_command(
+                "export_subject_scores", subjectNo, fsyear=2025, delta=True, target="sis", primary=True,
+                stdout=StringIO(),
+            )
+
+        def touch(stu):
+            # 既存行を watermark より前にしてから stu のセルを 1 つ変える
+            past = timezone.now() - timedelta(hours=2)
+            for model in (StudentExam, StudentExamVersion, ExamAdjust):
+                model.objects.filter(subject=self.subject).update(updated_at=past)
+            ExportWatermark.objects.filter(subject=self.subject).update(exported_at=past + timedelta(hours=1))
+            se = StudentExam.objects.filter(student=stu).order_by("question__gyo", "question__retu").first()
+            se.TF = 1 - se.TF
+            se.save(update_fields=["TF"])
+            return se.TF
+
+        with tempfile.TemporaryDirectory() as tmp, self.settings(EXAM2_TFSTORE_DIR=tmp):
+            export()   # 初回は全件 → 全体のファイル
+            full = tfstore.segment_path(2025, subjectNo)
+            full_text = full.read_text(encoding="utf-8")
+
+            tf1 = touch(self.students[1])
+            export()
+            tf2 = touch(self.students[2])
+            export()
+
+            # 全体のファイルはそのまま、差分は 2 つ別々に残る
+            self.assertEqual(full.read_text(encoding="utf-8"), full_text)
+            chain = tfstore.delta_chain(2025, subjectNo)
+            self.assertEqual([e["students"] for e in chain], [1, 1])
+            self.assertTrue(all(Path(e["path"]).parent == tfstore.year_dir(2025) / "delta" for e in chain))
+            self.assertEqual(len(tfstore.assemble(2025)["subjects"][subjectNo]["students"]), 4)
+
+            # 取り込む側：一度 0 に戻してから、全体 → 差分の順に流す
+            StudentExam.objects.filter(student__in=self.students[1:3]).update(TF=0)
+            call_command("import_subject_scores", subjectNo, fsyear=2025, no_copy=True, stdout=StringIO())
+            out = StringIO()
+            call_command("import_subject_scores", subjectNo, fsyear=2025, delta=True, no_copy=True, stdout=out)
+            self.assertEqual(out.getvalue().count("Import completed"), 2)
+            for stu, tf in ((self.students[1], tf1), (self.students[2], tf2)):
+                first = StudentExam.objects.filter(student=stu).order_by("question__gyo", "question__retu").first()
+                self.assertEqual(first.TF, tf)
+            self.assertEqual(tfstore.delta_applied(2025, subjectNo), chain[-1]["until"])
+
+            # 取り込み済みの差分は 2 回目は流さない
+            out = StringIO()
+            call_command("import_subject_scores", subjectNo, fsyear=2025, delta=True, no_copy=True, stdout=out)
+            self.assertIn("取り込む差分はありません", out.getvalue())
+
+            # 全体のファイルが差分になっていたら assemble / 全体の取り込みは断る
+            block = json.loads(Path(chain[0]["path"]).read_text(encoding="utf-8"))
+            full.write_text(json.dumps(block), encoding="utf-8")
+            with self.assertRaises(tfstore.DeltaSegmentError):
+                tfstore.assemble(2025)
+            with self.assertRaisesMessage(CommandError, "差分（delta）のファイルです"):
+                call_command("assemble_tfdata", subjectNo, fsyear=2025, out=str(Path(tmp) / "a.json"),
+                             stdout=StringIO())
+            with self.assertRaisesMessage(CommandError, "--delta を付けて"):
+                call_command("import_subject_scores", subjectNo, fsyear=2025, no_copy=True, stdout=StringIO())
+
+    def test_delta_chain_detects_gap(self):
+        import tempfile
+        from . import tfstore
+
+        block = {"exams": {}, "students": {}}
+        with tempfile.TemporaryDirectory() as tmp, self.settings(EXAM2_TFSTORE_DIR=tmp):
+            for since, until in (
+                ("2025-06-01T09:00:00+09:00", "2025-06-01T10:00:00+09:00"),
+                ("2025-06-01T11:00:00+09:00", "2025-06-01T12:00:00+09:00"),   # 10:00〜11:00 が抜けている
+            ):
+                tfstore.write_segment(2025, "1010401", {**block, "delta": {"since": since, "until": until}}, {})
+            with self.assertRaises(tfstore.DeltaChainError):
+                tfstore.delta_chain(2025, "1010401")
+            # 1 本目を取り込み済みでも、取り込んだ until と 2 本目の since の間が抜けている
+            with self.assertRaises(tfstore.DeltaChainError):
+                tfstore.delta_chain(2025, "1010401", after="2025-06-01T10:00:00+09:00")
+            self.assertEqual(tfstore.delta_chain(2025, "1010401", after="2025-06-01T12:00:00+09:00"), [])
+
+
+class BinaryScoreFormatTests(StudentTableMixin, TestCase):
+    """export_subject_scores --format=binary：JSON 版と同じ内容 + convert_tfdata + import の往復"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=4)
+        se = StudentExam.objects.filter(student=cls.students[0]).order_by("id").first()
+        se.hosei = -3
+        se.save(update_fields=["hosei"])
+        ExamAdjust.objects.filter(student=cls.students[1]).update(adjust=200)
+
+    def test_round_trip_matches_json(self):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        from . import tfbinary
+
+        def export(path, fmt):
+            call_command(
+                "export_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                out=str(path), format=fmt, primary=True, stdout=StringIO(),
+            )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path, bin_path = Path(tmp) / "tf.json", Path(tmp) / "tf.e2tf"
+            export(json_path, "json")
+            export(bin_path, "binary")
+            self.assertTrue(tfbinary.is_binary(bin_path))
+            self.assertLess(bin_path.stat().st_size, json_path.stat().st_size)
+
+            expected = json.loads(json_path.read_text(encoding="utf-8"))["subjects"]
+            self.assertEqual(tfbinary.binary_to_json(bin_path)["subjects"], expected)
+
+            # JSON → バイナリ → JSON でも同じ
+            call_command("convert_tfdata", str(json_path), str(Path(tmp) / "c.e2tf"), stdout=StringIO())
+            call_command("convert_tfdata", str(Path(tmp) / "c.e2tf"), str(Path(tmp) / "c.json"), stdout=StringIO())
+            converted = json.loads((Path(tmp) / "c.json").read_text(encoding="utf-8"))["subjects"]
+            self.assertEqual(converted, expected)
+
+            out = StringIO()
+            call_command(
+                "import_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                json=str(bin_path), no_copy=True, stdout=out,
+            )
+        self.assertRegex(out.getvalue(), r"StudentExam: +created=0 updated=0 unchanged=24 ")
+        self.assertRegex(out.getvalue(), r"ExamAdjust: +created=0 updated=0 unchanged=4 ")
+
+
+class SegmentedStoreTests(StudentTableMixin, TestCase):
+    """export_subject_scores（--out 無し）→ 分割ストア + 索引、import は索引から 1 ファイル、assemble_tfdata"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+        cls.other, _, _, _ = make_subject_fixture(subjectNo="1010402", students=0)
+
+    def test_segments_index_and_assemble(self):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        from . import tfstore
+
+        with tempfile.TemporaryDirectory() as tmp, self.settings(EXAM2_TFSTORE_DIR=tmp):
+            for subject in (self.subject, self.other):
+                call_command(
+                    "export_subject_scores", subject.subjectNo, fsyear=subject.fsyear,
+                    primary=True, stdout=StringIO(),
+                )
+            # 再 export しても自分のファイルだけが置き換わる
+            call_command(
+                "export_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                format="binary", primary=True, stdout=StringIO(),
+            )
+
+            year = Path(tmp) / str(self.subject.fsyear)
+            self.assertEqual(
+                sorted(p.name for p in year.iterdir() if not p.name.startswith(".")),
+                ["examTFdata_1010401.e2tf", "examTFdata_1010402.json"],
+            )
+            index = tfstore.read_index()["segments"]
+            self.assertEqual(index["2025/1010401"]["format"], "binary")
+            self.assertEqual(index["2025/1010401"]["students"], 3)
+            self.assertEqual(tfstore.find_segment(2025, "1010401"), year / "examTFdata_1010401.e2tf")
+
+            out = StringIO()
+            call_command(
+                "import_subject_scores", self.subject.subjectNo, fsyear=self.subject.fsyear,
+                no_copy=True, stdout=out,
+            )
+            self.assertIn("examTFdata_1010401.e2tf", out.getvalue())
+            self.assertRegex(out.getvalue(), r"StudentExam: +created=0 updated=0 unchanged=18 ")
+
+            legacy = Path(tmp) / "examTFdata.json"
+            call_command("assemble_tfdata", fsyear=2025, out=str(legacy), stdout=StringIO())
+            root = json.loads(legacy.read_text(encoding="utf-8"))
+        self.assertEqual(list(root["subjects"]), ["1010401", "1010402"])
+        self.assertEqual(len(root["subjects"]["1010401"]["students"]), 3)
+
+
+class QuestionReconcileTests(StudentTableMixin, TestCase):
+    """load_questions --reconcile：(gyo, retu) で突き合わせ、採点行を残して差分だけ反映"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(rows=2, cols=3)
+
+    def answer_json(self, path, points, labels=None, cols=3):
+        import json
+
+        rows = []
+        for g in range(1, 3):
+            rows.append({
+                "label": [(labels or {}).get((g, r), f"{g}-{r}") for r in range(1, cols + 1)],
+                "width": [1] * cols,
+                "answer": ["a"] * cols,
+                "height": [60] * cols,
+                "point": [points.get((g, r), 2) for r in range(1, cols + 1)],
+                "koumoku": ["選択"] * cols,
+            })
+        meta = {"subject": self.subject.subjectNo, "height": 60, "metainfo": {"hash": "h1"}}
+        data = {"versions": [{"version": "A", "questions": [meta, *rows]}]}
+        path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    def reconcile(self, path, **kw):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command(
+            "load_questions", self.subject.subjectNo, fsyear=self.subject.fsyear,
+            json=str(path), reconcile=True, no_copy=True, stdout=out, **kw,
+        )
+        return out.getvalue()
+
+    def test_reconcile_keeps_grading_rows(self):
+        import tempfile
+        from pathlib import Path
+
+        exam = self.exams["A"]
+        se_ids = set(StudentExam.objects.filter(exam=exam).values_list("id", flat=True))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "answer.json"
+            self.answer_json(path, points={})
+            out = self.reconcile(path)
+            self.assertIn("updated=6", out)   # answer / bunrui / height が JSON に揃う
+            self.assertEqual(set(StudentExam.objects.filter(exam=exam).values_list("id", flat=True)), se_ids)
+
+            # 同じ JSON をもう一度：problem_hash もチェックサムも同じなので skip
+            self.assertIn("skip", self.reconcile(path))
+
+            # 1-2 の配点変更 + 2-3 を削除（2 列目の行だけ 2 列に）
+            q12 = Question.objects.get(exam=exam, gyo=1, retu=2)
+            self.answer_json(path, points={(1, 2): 5}, labels={(2, 1): "2-1x"})
+            import json
+            data = json.loads(path.read_text(encoding="utf-8"))
+            for key in ("label", "width", "answer", "height", "point", "koumoku"):
+                data["versions"][0]["questions"][2][key].pop()
+            path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+            out = self.reconcile(path)
+        self.assertIn("created=0 updated=2 deleted=1 unchanged=3 rescored=1", out)
+        self.assertEqual(Question.objects.filter(exam=exam).count(), 5)
+        self.assertEqual(Question.objects.get(exam=exam, gyo=2, retu=1).q_no, "2-1x")
+        # 1-2 の採点行は残り、earned は新しい配点で付け直されている
+        self.assertEqual(
+            set(StudentExam.objects.filter(question=q12).values_list("TF", "earned")),
+            {(1, 5)},
+        )
+        self.assertEqual(StudentExam.objects.filter(exam=exam).count(), len(se_ids) - 2)
+
+    @override_settings(EXAM2_ANSWER_STORAGE="packed")
+    def test_packed_layout_change_remaps_sheets(self):
+        import json
+        import tempfile
+        from pathlib import Path
+        from .answersheet import PackedStudentExamAdapter, build_answer_sheets
+
+        exam, stu = self.exams["A"], self.students[0]
+        for j, q in enumerate(self.questions["A"]):
+            StudentExam.objects.filter(student=stu, question=q).update(hosei=10 + j)
+        build_answer_sheets(self.subject)
+        before = {q.id: (j % 2, 10 + j) for j, q in enumerate(self.questions["A"])}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "answer.json"
+            self.answer_json(path, points={})
+            # 1 行目に 1-4 を追加、2-3 を削除（1-4 が旧 2-1 の位置に入る）
+            data = json.loads(path.read_text(encoding="utf-8"))
+            row1, row2 = data["versions"][0]["questions"][1:3]
+            for key, value in (("label", "1-4"), ("width", 1), ("answer", "a"), ("height", 60), ("point", 3),
+                               ("koumoku", "選択")):
+                row1[key].append(value)
+                row2[key].pop()
+            path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            out = self.reconcile(path)
+        self.assertIn("created=1", out)
+        self.assertIn("移し替え: 2 件", out)
+
+        adapter = PackedStudentExamAdapter()
+        cells = adapter.list_cells(exam_id=exam.id, student_id=stu.id)
+        q14 = Question.objects.get(exam=exam, gyo=1, retu=4)
+        q23 = self.questions["A"][5]
+        self.assertEqual(
+            {c["question"]: (c["TF"], c["hosei"]) for c in cells},
+            {**{qid: v for qid, v in before.items() if qid != q23.id}, q14.id: (0, 0)},
+        )
+        self.assertEqual([c["question"] for c in cells][3], q14.id)
+
+        # 追加したセル（旧レイアウトには無い位置）も採点できる
+        adapter.update_cells([{"id": cells[3]["id"], "TF": 1}])
+        sheet = AnswerSheet.objects.get(student=stu, exam=exam)
+        self.assertEqual(sheet.question_count, 6)
+        self.assertEqual(sheet.score, 2 + 2 + 3)   # 1-2, 2-1（TF=1 のまま）+ 1-4
+        self.assertEqual(sheet.hosei_total, sum(h for qid, (_, h) in before.items() if qid != q23.id))
+
+
+    def test_rows_mode_provisions_added_questions(self):
+        import json
+        import tempfile
+        from pathlib import Path
+
+        exam = self.exams["A"]
+        assigned = list(StudentExamVersion.objects.filter(exam=exam).values_list("student_id", flat=True))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "answer.json"
+            self.answer_json(path, points={})
+            data = json.loads(path.read_text(encoding="utf-8"))
+            row1 = data["versions"][0]["questions"][1]
+            for key, value in (("label", "1-4"), ("width", 1), ("answer", "a"), ("height", 60), ("point", 3),
+                               ("koumoku", "選択")):
+                row1[key].append(value)
+            path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            with self.settings(EXAM2_SPARSE_STUDENT_EXAM=True):
+                sparse_out = self.reconcile(path)
+            q14 = Question.objects.get(exam=exam, gyo=1, retu=4)
+            self.assertNotIn("追加した問題", sparse_out)
+            self.assertFalse(StudentExam.objects.filter(question=q14).exists())
+
+            # rows 運用：割当済みの学生に新しい問題のセルを作る（既存セルには触れない）
+            q14.delete()
+            Exam.objects.filter(pk=exam.pk).update(content_checksum="")   # 前回と同じ内容でも突き合わせる
+            before = StudentExam.objects.count()
+            out = self.reconcile(path)
+        self.assertIn(f"追加した問題の StudentExam を作成: {len(assigned)} 件", out)
+        q14 = Question.objects.get(exam=exam, gyo=1, retu=4)
+        self.assertEqual(
+            sorted(StudentExam.objects.filter(question=q14, TF=0, hosei=0, subject=self.subject)
+                   .values_list("student_id", flat=True)),
+            sorted(assigned),
+        )
+        self.assertEqual(StudentExam.objects.count(), before + len(assigned))
+
+
+class ExamConfigTests(SimpleTestCase):
+    """examconfig：上書きファイル優先、utils は遅延 import、結果は YAML の mtime が変わるまで覚える"""
+
+    def test_override_helper_and_memo(self):
+        import os
+        import sys
+        import tempfile
+        from pathlib import Path
+        from . import examconfig
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / "util").mkdir()
+            (tmp / "util" / "exam2_fake_utils.py").write_text(
+                "calls = []\n"
+                "def get_exam_config_path(subjectNo, fsyear, key):\n"
+                "    calls.append(subjectNo)\n"
+                "    return f'/ttc/{fsyear}/{subjectNo}/{key}.json'\n"
+                "def get_current_fsyear():\n"
+                "    return '2026'\n",
+                encoding="utf-8",
+            )
+            override = tmp / "examconfig.local.yaml"
+            override.write_text('subjects:\n  "1010401":\n    2025:\n      ans_json: a/answer.json\n', encoding="utf-8")
+            opts = {
+                "util_dir": tmp / "util", "module": "exam2_fake_utils",
+                "override": override, "dirinfo": None, "watch": [],
+            }
+
+            try:
+                with self.settings(EXAM2_EXAM_CONFIG=opts):
+                    examconfig.clear_cache()
+                    self.assertEqual(examconfig.config_path("1010401", 2025), tmp / "a" / "answer.json")
+                    self.assertNotIn("exam2_fake_utils", sys.modules)   # 上書きだけで済めば import しない
+
+                    self.assertEqual(examconfig.current_fsyear(), 2026)
+                    for _ in range(3):
+                        self.assertEqual(examconfig.config_path("1020701", 2025), Path("/ttc/2025/1020701/ans_json.json"))
+                    helper = sys.modules["exam2_fake_utils"]
+                    self.assertEqual(helper.calls, ["1020701"])
+
+                    # 上書きファイルが変わったら覚えていた結果を捨てる
+                    override.write_text('fsyear: 2024\n', encoding="utf-8")
+                    os.utime(override, ns=(1, 1))
+                    self.assertEqual(examconfig.current_fsyear(), 2024)
+                    examconfig.config_path("1020701", 2025)
+                    self.assertEqual(helper.calls, ["1020701", "1020701"])
+            finally:
+                examconfig.clear_cache()
+                sys.modules.pop("exam2_fake_utils", None)
+                if str(tmp / "util") in sys.path:
+                    sys.path.remove(str(tmp / "util"))
+
+    def test_dirinfo_parsed_once_for_all_subjects(self):
+        import os
+        import tempfile
+        from pathlib import Path
+        from unittest import mock
+        from . import examconfig
+
+        self.assertIn(examconfig.config_options()["dirinfo"], examconfig.config_options()["watch"])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            dirinfo = tmp / "dirinfo.yaml"
+            dirinfo.write_text(
+                "fsyear: 2025\n"
+                "subjects:\n"
+                + "".join(f'  "10{i}":\n    2025:\n      ans_json: ans/{i}.json\n' for i in range(5)),
+                encoding="utf-8",
+            )
+            opts = {
+                "util_dir": tmp / "no_util", "module": "exam2_missing_utils",
+                "override": tmp / "none.yaml", "dirinfo": dirinfo, "watch": [],
+            }
+            parse = mock.Mock(wraps=examconfig.yaml.safe_load)
+            try:
+                with self.settings(EXAM2_EXAM_CONFIG=opts), mock.patch.object(examconfig.yaml, "safe_load", parse):
+                    examconfig.clear_cache()
+                    self.assertEqual(examconfig.current_fsyear(), 2025)
+                    for i in range(5):
+                        self.assertEqual(examconfig.config_path(f"10{i}", 2025), tmp / "ans" / f"{i}.json")
+                    self.assertEqual(parse.call_count, 1)   # 科目ごとに読み直さない（utils も import しない）
+
+                    # dirinfo.yaml は常に監視し、変わったら 1 回だけ読み直す
+                    dirinfo.write_text('subjects:\n  "100":\n    2025:\n      ans_json: /x/100.json\n', encoding="utf-8")
+                    os.utime(dirinfo, ns=(1, 1))
+                    self.assertEqual(examconfig.config_path("100", 2025), Path("/x/100.json"))
+                    self.assertEqual(parse.call_count, 2)
+                    with self.assertRaises(examconfig.ExamConfigError):
+                        examconfig.config_path("101", 2025)   # 無い科目は utils に聞く（ここでは import 失敗）
+            finally:
+                examconfig.clear_cache()
+
+
+class YearBatchTests(StudentTableMixin, TestCase):
+    """export / import_subject_scores --all（年度内の全科目）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+        Subject.objects.create(subjectNo="1099999", fsyear=cls.subject.fsyear, term=1, name="Exam なし")
+
+    def test_all_subjects_write_files_and_summary(self):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = StringIO()
+            with self.assertRaisesMessage(CommandError, "1 subject(s) failed"):
+                call_command(
+                    "export_subject_scores", all=True, fsyear=self.subject.fsyear,
+                    out_dir=tmp, workers=1, order="subjectNo", primary=True, stdout=out,
+                )
+            summary = json.loads((Path(tmp) / "export_summary.json").read_text(encoding="utf-8"))
+            self.assertEqual([r["subjectNo"] for r in summary["results"]], ["1010401", "1099999"])
+            self.assertEqual(summary["succeeded"], 1)
+            self.assertEqual(summary["failed"][0]["subjectNo"], "1099999")
+            self.assertTrue((Path(tmp) / "examTFdata_1010401.json").exists())
+
+            out = StringIO()
+            call_command(
+                "import_subject_scores", all=True, fsyear=self.subject.fsyear,
+                json_dir=tmp, workers=1, no_copy=True, stdout=out,
+            )
+            self.assertIn("[skip] 1099999", out.getvalue())
+            summary = json.loads((Path(tmp) / "import_summary.json").read_text(encoding="utf-8"))
+        self.assertEqual(summary["succeeded"], 1)
+        self.assertTrue(any("unchanged=18" in line for line in summary["results"][0]["output"]))
+
+
+class ProvisionSubjectTests(StudentTableMixin, TestCase):
+    """provision_subject：5 段を 1 トランザクションで、段の間は同じキャッシュを使う"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.students = [
+            Student.objects.create(
+                id=2025000 + i, entyear=2025, stdNo=f"25367{i:03d}", email=f"s{i}@example.com",
+                name1="姓", name2="名", nickname=f"nick{i}", gender="M", COO="JP",
+            )
+            for i in range(3)
+        ]
+
+    def write_inputs(self, tmp, subjectNo="1010401"):
+        import json
+
+        rows = [
+            {
+                "label": [f"{g}-{r}" for r in range(1, 4)], "width": [1] * 3, "answer": ["a"] * 3,
+                "height": [60] * 3, "point": [2] * 3, "koumoku": ["選択"] * 3,
+            }
+            for g in range(1, 3)
+        ]
+        meta = {"subject": subjectNo, "title": "テスト科目", "nenji": 1, "height": 60, "metainfo": {"hash": "h1"}}
+        data = {"versions": [{"version": v, "questions": [meta, *rows]} for v in ("A", "B")]}
+        answer = tmp / "answer.json"
+        answer.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+        s0, s1, s2 = (s.stdNo for s in self.students)
+        versions = tmp / "versions.yaml"
+        versions.write_text(
+            f'2025:\n  1:\n    "{subjectNo}":\n      A: ["{s0}", "{s2}"]\n      B: ["{s1}", "99999999"]\n',
+            encoding="utf-8",
+        )
+        return answer, versions
+
+    def provision(self, answer, versions, **kw):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command(
+            "provision_subject", "1010401", fsyear=2025, json=str(answer), yaml=str(versions),
+            no_copy=True, stdout=out, **kw,
+        )
+        return out.getvalue()
+
+    def test_pipeline_is_idempotent_and_atomic(self):
+        import tempfile
+        from pathlib import Path
+        from django.core.management.base import CommandError
+
+        with tempfile.TemporaryDirectory() as tmp:
+            answer, versions = self.write_inputs(Path(tmp))
+
+            out = self.provision(answer, versions, dry_run=True)
+            self.assertIn("student_exam_version", out)
+            self.assertFalse(Subject.objects.filter(subjectNo="1010401").exists())
+
+            out = self.provision(answer, versions)
+            self.assertIn("missing_students=1", out)
+            subject = Subject.objects.get(subjectNo="1010401", fsyear=2025)
+            self.assertEqual(Question.objects.filter(exam__subject=subject).count(), 12)
+            assigned = dict(
+                StudentExamVersion.objects.filter(subject=subject).values_list("student__stdNo", "exam__version")
+            )
+            self.assertEqual(assigned, {"25367000": "A", "25367001": "B", "25367002": "A"})
+            self.assertEqual(StudentExam.objects.filter(subject=subject).count(), 18)
+            self.assertEqual(ExamAdjust.objects.filter(subject=subject).count(), 3)
+
+            # 2 回目：Question は空振り、採点行はそのまま
+            StudentExam.objects.filter(subject=subject).update(TF=1)
+            out = self.provision(answer, versions)
+            self.assertIn("skipped_exams=2", out)
+            self.assertEqual(StudentExam.objects.filter(subject=subject, TF=1).count(), 18)
+
+            # 後の段で失敗したら前の段の書き込みも残らない
+            versions.write_text("2025:\n  1:\n    \"1020701\": {A: []}\n", encoding="utf-8")
+            answer2 = Path(tmp) / "answer2.json"
+            answer2.write_text(answer.read_text(encoding="utf-8").replace("1010401", "1010402"), encoding="utf-8")
+            from django.core.management import call_command
+            with self.assertRaisesMessage(CommandError, "subjectNo=1010402 のブロックがありません"):
+                call_command(
+                    "provision_subject", "1010402", fsyear=2025, json=str(answer2), yaml=str(versions), no_copy=True,
+                )
+            self.assertFalse(Subject.objects.filter(subjectNo="1010402").exists())
+
+            # 複数科目：解答 JSON は examconfig の上書きファイルから（割当 YAML を使わない段だけ）
+            import json
+            from io import StringIO
+            from . import examconfig
+            override = Path(tmp) / "examconfig.local.yaml"
+            override.write_text(
+                f'subjects:\n  "1010401":\n    2025:\n      ans_json: {answer}\n'
+                f'  "1010402":\n    2025:\n      ans_json: {answer2}\n',
+                encoding="utf-8",
+            )
+            summary_path = Path(tmp) / "summary.json"
+            opts = {"override": override, "watch": []}
+            try:
+                with self.settings(EXAM2_EXAM_CONFIG=opts):
+                    examconfig.clear_cache()
+                    call_command(
+                        "provision_subject", "1010401", "1010402", fsyear=2025, yaml=str(versions),
+                        stages="subject_base,questions", workers=1, summary=str(summary_path),
+                        no_copy=True, stdout=StringIO(),
+                    )
+            finally:
+                examconfig.clear_cache()
+            summary = json.loads(summary_path.read_text(encoding="utf-8"))
+        self.assertEqual(summary["succeeded"], 2)
+        self.assertEqual(Question.objects.filter(exam__subject__subjectNo="1010402").count(), 12)
+
+
+class BulkProvisionTests(StudentTableMixin, TestCase):
+    """studentexam_init / studentexam_from_version / examadjust_init：既存との差分だけを一括作成"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=3, rows=2, cols=3)
+
+    def run_command(self, name, *args, **kw):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command(name, self.subject.subjectNo, self.subject.fsyear, self.subject.term, no_copy=True, stdout=out, **kw)
+        return out.getvalue()
+
+    def test_only_missing_rows_are_inserted(self):
+        from django.core.management.base import CommandError
+
+        first = self.students[0]
+        StudentExam.objects.filter(student=first).delete()
+        ExamAdjust.objects.filter(student=first).delete()
+
+        out = self.run_command("studentexam_from_version", dry_run=True)
+        self.assertIn("target=18 existing=12 inserted=6", out)
+        self.assertEqual(StudentExam.objects.filter(subject=self.subject).count(), 12)
+
+        with self.assertNumQueries(8):   # Subject / 割当 / Question / 既存 + savepoint ×2 + INSERT ×2（4 行ずつ）
+            out = self.run_command("studentexam_from_version", batch_size=4)
+        self.assertIn("inserted=6 batches=2", out)
+        self.assertIn("rows/sec", out)
+        self.assertEqual(StudentExam.objects.filter(student=first, TF=0).count(), 6)
+
+        # 学年の全学生 × 全 Exam（割当を見ない従来の挙動）
+        out = self.run_command("studentexam_init")
+        self.assertIn("target=36 existing=18 inserted=18", out)
+
+        out = self.run_command("examadjust_init")
+        self.assertIn("target=3 existing=2 inserted=1", out)
+        self.assertIn("target=3 existing=3 inserted=0", self.run_command("examadjust_init"))
+
+        with self.assertRaisesMessage(CommandError, "term 不一致"):
+            from django.core.management import call_command
+            call_command("examadjust_init", self.subject.subjectNo, self.subject.fsyear, 2)
+
+
+class LoadStudentSyncTests(StudentTableMixin, TestCase):
+    """load_student --sync：id で突き合わせて差分だけ反映（採点データは残る）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=3)
+
+    def write_csv(self, path, rows):
+        import csv
+
+        cols = ["id", "entyear", "stdNo", "email", "name1", "name2", "nickname", "gender", "COO", "enrolled"]
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(cols)
+            writer.writerows(rows)
+
+    def row(self, stu, **kw):
+        values = {
+            "id": stu.id, "entyear": stu.entyear, "stdNo": stu.stdNo, "email": stu.email, "name1": stu.name1,
+            "name2": stu.name2, "nickname": stu.nickname, "gender": stu.gender, "COO": stu.COO, "enrolled": 1,
+        }
+        values.update(kw)
+        return list(values.values())
+
+    def sync(self, path, **kw):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("load_student", str(path), sync=True, stdout=out, **kw)
+        return out.getvalue()
+
+    def test_sync_applies_diff_and_is_idempotent(self):
+        import tempfile
+        from pathlib import Path
+        from django.core.management.base import CommandError
+
+        s0, s1, s2 = self.students
+        se_count = StudentExam.objects.count()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "student.csv"
+            self.write_csv(path, [
+                self.row(s0),
+                self.row(s1, nickname="renamed", email="new@example.com"),
+                [2025900, 2025, "25367900", "n@example.com", "姓", "名", "new", "F", "JP", ""],
+            ])
+
+            with self.assertNumQueries(1):
+                out = self.sync(path, dry_run=True)
+            self.assertIn("更新               : 1 (email=1, nickname=1)", out)
+            self.assertFalse(Student.objects.filter(id=2025900).exists())
+
+            out = self.sync(path, deactivate_missing=True)
+            self.assertIn("created=1 updated=1 unchanged=1 deactivated=1", out)
+            self.assertEqual(Student.objects.get(id=s1.id).nickname, "renamed")
+            self.assertFalse(Student.objects.get(id=s2.id).enrolled)
+            self.assertTrue(Student.objects.get(id=2025900).enrolled)
+            self.assertEqual(StudentExam.objects.count(), se_count)
+
+            # 2 回目は何も変わらない
+            out = self.sync(path, deactivate_missing=True)
+            self.assertIn("created=0 updated=0 unchanged=3 deactivated=0", out)
+
+            # stdNo が DB の別の id と重なる行があれば何も書かない
+            self.write_csv(path, [self.row(s0, nickname="x"), [2025901, 2025, s1.stdNo, "e", "a", "b", "c", "M", "JP", 1]])
+            with self.assertRaisesMessage(CommandError, "conflict が 1 件"):
+                self.sync(path)
+        self.assertEqual(Student.objects.get(id=s0.id).nickname, s0.nickname)
+
+
+class ProvisionDeltaTests(StudentTableMixin, TestCase):
+    """provision_delta：割当と StudentExam / ExamAdjust のずれを anti-join で見つけ、その学生の分だけ反映"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=3, rows=2, cols=3)
+
+    def test_fills_late_students_and_prunes_orphans(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .bulkprovision import find_gaps
+
+        exam_a, exam_b = self.exams["A"], self.exams["B"]
+        late = Student.objects.create(
+            id=2025500, entyear=2025, stdNo="25367500", email="l@example.com",
+            name1="姓", name2="名", nickname="late", gender="F", COO="JP",
+        )
+        StudentExamVersion.objects.create(student=late, exam=exam_a, subject=self.subject)
+        # 後から A に 1 問追加（A の既存学生 2 人も 1 セルずつ欠ける）
+        Question.objects.create(exam=exam_a, q_no="3-1", gyo=3, retu=1, points=2)
+        # students[0] は A の割当なのに B の行がある（1 行は採点済み）
+        q_b = self.questions["B"]
+        StudentExam.objects.create(student=self.students[0], exam=exam_b, subject=self.subject, question=q_b[0], TF=1)
+        StudentExam.objects.create(student=self.students[0], exam=exam_b, subject=self.subject, question=q_b[1])
+
+        with self.assertNumQueries(5):   # 欠け ×2 / 割当の無い行 ×2 / Subject
+            reports = find_gaps({"subject__fsyear": 2025})
+        rep = reports[self.subject.id]
+        self.assertEqual(len(rep.missing_student_exam), 3)
+        self.assertEqual(rep.missing_exam_adjust, [(late.id, exam_a.id)])
+        self.assertEqual(rep.orphans["student_exam"]["rows"], 2)
+
+        out = StringIO()
+        call_command("provision_delta", fsyear=2025, all=True, prune=True, no_copy=True, stdout=out)
+        self.assertIn("StudentExam inserted=9 ExamAdjust inserted=1 deleted=1", out.getvalue())
+        self.assertIn("採点済みは残した", out.getvalue())
+        self.assertEqual(StudentExam.objects.filter(student=late).count(), 7)
+        self.assertEqual(StudentExam.objects.filter(exam=exam_b, student=self.students[0]).count(), 1)
+
+        out = StringIO()
+        call_command("provision_delta", self.subject.subjectNo, fsyear=2025, prune=True, force=True, stdout=out)
+        self.assertIn("deleted=1", out.getvalue())
+        self.assertEqual(find_gaps({"subject": self.subject}), {})
+
+
+class TableDumpTests(StudentTableMixin, TestCase):
+    """dump_table / dump_student：1 クエリでストリーミング出力（stdNo / q_no は JOIN で解決）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=3, rows=2, cols=3)
+        make_subject_fixture(subjectNo="1020701", fsyear=2024, students=0)
+
+    def test_streams_joined_rows_in_each_format(self):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+
+        out, err = StringIO(), StringIO()
+        with self.assertNumQueries(1):
+            call_command(
+                "dump_table", "student_exam", format="jsonl", subject="1010401", fsyear=2025, chunk_size=5,
+                stdout=out, stderr=err,
+            )
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 18)
+        first = json.loads(lines[0])
+        self.assertEqual(
+            {k: first[k] for k in ("subjectNo", "version", "stdNo", "q_no", "TF")},
+            {"subjectNo": "1010401", "version": "A", "stdNo": self.students[0].stdNo, "q_no": "1-1", "TF": 0},
+        )
+        self.assertIn("18 行", err.getvalue())
+
+        out = StringIO()
+        call_command("dump_table", "exam_adjust", format="tsv", fsyear=2025, stdout=out, stderr=StringIO())
+        rows = [line.split("\t") for line in out.getvalue().splitlines()]
+        self.assertEqual(rows[0], ["subjectNo", "fsyear", "version", "stdNo", "adjust", "updated_at"])
+        self.assertEqual([(r[2], r[3]) for r in rows[1:]], [  # exam → 学生の順
+            ("A", self.students[0].stdNo), ("A", self.students[2].stdNo), ("B", self.students[1].stdNo),
+        ])
+
+        # dump_student の CSV はそのまま load_student --sync で読める（差分なし）
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "student.csv"
+            out = StringIO()
+            call_command("dump_student", out=str(path), subject="1010401", stdout=out)
+            self.assertIn("3 件", out.getvalue())
+            out = StringIO()
+            call_command("load_student", str(path), sync=True, dry_run=True, stdout=out)
+        self.assertIn("変更なし           : 3", out.getvalue())
+
+
+@override_settings(EXAM2_ANSWER_STORAGE="packed")
+class PackedStorageRoutingTests(StudentTableMixin, TestCase):
+    """packed 運用：取り込み・ゼロクリア・実行時データ削除・provisioning が AnswerSheet を書く"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .answersheet import build_answer_sheets
+
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture(students=4)
+        build_answer_sheets(cls.subject)
+
+    def cells(self, student):
+        from .answersheet import sheet_cells
+
+        return sheet_cells(AnswerSheet.objects.get(student=student))
+
+    def test_export_import_round_trip(self):
+        import json
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+
+        stu = self.students[0]
+        before = list(StudentExam.objects.order_by("id").values_list("TF", "hosei"))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "examTFdata.json"
+            call_command(
+                "export_subject_scores", self.subject.subjectNo, fsyear=2025, out=str(path), primary=True,
+                stdout=StringIO(),
+            )
+            root = json.loads(path.read_text(encoding="utf-8"))
+            root["subjects"][self.subject.subjectNo]["students"][stu.stdNo]["answers"][0] = {"TF": 1, "hosei": 2}
+            path.write_text(json.dumps(root), encoding="utf-8")
+
+            out = StringIO()
+            call_command(
+                "import_subject_scores", self.subject.subjectNo, fsyear=2025, json=str(path), no_copy=True, stdout=out,
+            )
+            self.assertRegex(out.getvalue(), r"AnswerSheet: +created=0 updated=1 unchanged=3 ")
+
+            call_command(
+                "export_subject_scores", self.subject.subjectNo, fsyear=2025, out=str(path), primary=True,
+                stdout=StringIO(),
+            )
+            again = json.loads(path.read_text(encoding="utf-8"))["subjects"][self.subject.subjectNo]
+        self.assertEqual(again["students"][stu.stdNo]["answers"][0], {"TF": 1, "hosei": 2})
+        tf_list, hosei_list = self.cells(stu)
+        self.assertEqual((tf_list[:2], hosei_list[0]), ([1, 1], 2))
+        sheet = AnswerSheet.objects.get(student=stu)
+        self.assertEqual((sheet.score, sheet.total), (8, 10))
+        # StudentExam（rows）は触らない
+        self.assertEqual(list(StudentExam.objects.order_by("id").values_list("TF", "hosei")), before)
+
+    def test_clear_scores_resets_sheets(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+
+        with mock.patch("builtins.input", return_value="y"):
+            out = StringIO()
+            call_command("clear_subject_scores", self.subject.subjectNo, fsyear=2025, stdout=out)
+        self.assertIn("AnswerSheet=4 件", out.getvalue())
+        self.assertEqual(AnswerSheet.objects.count(), 4)
+        for stu in self.students:
+            tf_list, hosei_list = self.cells(stu)
+            self.assertEqual((sum(tf_list), sum(hosei_list)), (0, 0))
+        self.assertFalse(AnswerSheet.objects.exclude(total=0).exists())
+
+    def test_clear_runtime_data_guards_sheets(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+
+        StudentExam.objects.update(TF=0, hosei=0, earned=0)   # rows 側は未採点、AnswerSheet だけ採点済み
+        with self.assertRaisesMessage(CommandError, "AnswerSheet has non-zero cells"):
+            call_command("clear_subject_runtime_data", self.subject.subjectNo, fsyear=2025, execute=True,
+                         stdout=StringIO())
+        self.assertEqual(AnswerSheet.objects.count(), 4)
+
+        out = StringIO()
+        call_command("clear_subject_runtime_data", self.subject.subjectNo, fsyear=2025, execute=True, force=True,
+                     stdout=out)
+        self.assertFalse(AnswerSheet.objects.exists())
+        self.assertIn(f"provision_delta {self.subject.subjectNo}", out.getvalue())
+
+    def test_provisioning_creates_sheets(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .pipeline import Provisioning
+
+        late = Student.objects.create(
+            id=2025500, entyear=2025, stdNo="25367500", email="l@example.com",
+            name1="姓", name2="名", nickname="late", gender="F", COO="JP",
+        )
+        StudentExamVersion.objects.create(student=late, exam=self.exams["B"], subject=self.subject)
+        se_count = StudentExam.objects.count()
+
+        out = StringIO()
+        call_command("provision_delta", self.subject.subjectNo, fsyear=2025, no_copy=True, stdout=out)
+        self.assertIn("ExamAdjust inserted=1 AnswerSheet inserted=1", out.getvalue())
+        sheet = AnswerSheet.objects.get(student=late)
+        self.assertEqual((sheet.exam_id, sheet.question_count, sheet.total), (self.exams["B"].id, 6, 0))
+        self.assertEqual(self.cells(late), ([0] * 6, [0] * 6))
+        self.assertEqual(StudentExam.objects.count(), se_count)
+
+        # provision_subject の student_exam 段 / studentexam_from_version も AnswerSheet を作る
+        AnswerSheet.objects.filter(student__in=self.students[:2]).delete()
+        results = Provisioning(self.subject.subjectNo, 2025, use_copy=False).run(["student_exam"])
+        self.assertEqual(results[0]["rows"]["inserted"], 2)
+        AnswerSheet.objects.filter(student=late).delete()
+        out = StringIO()
+        call_command("studentexam_from_version", self.subject.subjectNo, "2025", "1", no_copy=True, stdout=out)
+        self.assertIn("AnswerSheet 作成完了: 全体で新規作成 1 件", out.getvalue())
+        self.assertEqual(AnswerSheet.objects.count(), 5)
+        self.assertEqual(StudentExam.objects.count(), se_count)
+
+    def test_load_student_exam_and_init_create_sheets(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        se_count = StudentExam.objects.count()
+        AnswerSheet.objects.all().delete()
+        out = StringIO()
+        call_command("load_student_exam", self.subject.subjectNo, fsyear=2025, no_copy=True, stdout=out)
+        self.assertIn("AnswerSheet 作成完了", out.getvalue())
+        self.assertEqual(AnswerSheet.objects.count(), 4)
+        self.assertEqual(self.cells(self.students[0]), ([0] * 6, [0] * 6))
+
+        # studentexam_init は対象学年の全学生 × 全 Exam
+        out = StringIO()
+        call_command("studentexam_init", self.subject.subjectNo, "2025", "1", no_copy=True, stdout=out)
+        self.assertIn("AnswerSheet 作成完了: 新規 4 件", out.getvalue())
+        self.assertEqual(AnswerSheet.objects.count(), 8)
+        self.assertEqual(StudentExam.objects.count(), se_count)
+
+    def test_packed_cell_api_rejects_bad_input(self):
+        from .answersheet import cell_id
+
+        stu = self.students[0]
+        sheet = AnswerSheet.objects.get(student=stu)
+        before = self.cells(stu)
+        first = cell_id(sheet.id, 0)
+
+        def patch(url, payload):
+            return self.client.patch(url, payload, content_type="application/json")
+
+        self.assertEqual(patch("/api/student-exams/abc/", {"TF": 1}).status_code, 404)
+        self.assertEqual(patch(f"/api/student-exams/{first}/", {"hosei": 40000}).status_code, 400)
+        self.assertEqual(patch(f"/api/student-exams/{first}/", {"TF": "x"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/student-exams/abc/").status_code, 404)
+
+        url = "/api/student-exams/bulk_update/"
+        for payload, code in (
+            ([{"id": "abc", "TF": 1}], 404),
+            ([{"id": first, "hosei": -40000}], 400),
+            ([{"id": first, "TF": 1}, {"id": cell_id(sheet.id, 1), "hosei": "x"}], 400),
+            ([first], 400),
+        ):
+            with self.subTest(payload=payload):
+                self.assertEqual(patch(url, payload).status_code, code)
+        self.assertEqual(self.cells(stu), before)
+
+        # 並びより短い sheet（移し替え前など）：question_count 以上のセル位置は Not found
+        AnswerSheet.objects.filter(pk=sheet.pk).update(question_count=4)
+        self.assertEqual(patch(f"/api/student-exams/{cell_id(sheet.id, 5)}/", {"TF": 1}).status_code, 404)
+        self.assertEqual(self.client.get(f"/api/student-exams/{cell_id(sheet.id, 5)}/").status_code, 404)
+        self.assertEqual(patch(url, [{"id": cell_id(sheet.id, 4), "TF": 1}]).status_code, 404)
+        res = patch(f"/api/student-exams/{cell_id(sheet.id, 3)}/", {"hosei": 7})
+        self.assertEqual((res.status_code, res.json()["hosei"]), (200, 7))
+
+
+@override_settings(EXAM2_SPARSE_STUDENT_EXAM=True)
+class SparseCellUpsertTests(StudentTableMixin, TestCase):
+    """sparse 運用：id の無いセルの upsert（/api/student-exams/bulk_update/）"""
+
+    URL = "/api/student-exams/bulk_update/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject, cls.exams, cls.questions, cls.students = make_subject_fixture()
+        StudentExam.objects.all().delete()   # sparse：行は最初の書き込みで作る
+
+    def cell(self, stu, version, j, **values):
+        return {"student": stu.id, "exam": self.exams[version].id, "question": self.questions[version][j].id, **values}
+
+    def patch(self, payload):
+        return self.client.patch(self.URL, payload, content_type="application/json")
+
+    def test_creates_then_updates_cells(self):
+        stu = self.students[0]
+        res = self.patch([self.cell(stu, "A", 0, TF=1), self.cell(stu, "A", 1, TF=1, hosei=3)])
+        self.assertEqual(res.status_code, 200)
+        created = {c["question"]: c["id"] for c in res.json()["created"]}
+        rows = {se.question_id: se for se in StudentExam.objects.filter(student=stu)}
+        self.assertEqual(created, {qid: se.pk for qid, se in rows.items()})
+        q0, q1 = (self.questions["A"][j].id for j in (0, 1))
+        self.assertEqual((rows[q0].TF, rows[q0].earned, rows[q0].subject_id), (1, 2, self.subject.id))
+        self.assertEqual((rows[q1].hosei, rows[q1].earned), (3, 2))
+
+        # 2 回目は既存行の更新（行は増えない、id も変わらない）
+        res = self.patch([self.cell(stu, "A", 0, TF=0)])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["created"], [])
+        self.assertEqual(StudentExam.objects.filter(student=stu).count(), 2)
+        self.assertEqual(StudentExam.objects.get(pk=created[q0]).earned, 0)
+
+    def test_concurrent_first_write_does_not_conflict(self):
+        from unittest import mock
+        from .services import upsert_student_exam_cells
+
+        stu = self.students[0]
+        question = self.questions["A"][0]
+        bulk_create = StudentExam.objects.bulk_create
+
+        def racing(objs, **kwargs):
+            # 読んだ後・入れる前に別の書き込みが同じセルを作った
+            StudentExam.objects.create(
+                student=stu, exam=self.exams["A"], subject=self.subject, question=question, TF=0, hosei=5,
+            )
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(StudentExam.objects, "bulk_create", side_effect=racing):
+            created = upsert_student_exam_cells([self.cell(stu, "A", 0, TF=1)])
+
+        se = StudentExam.objects.get(student=stu, question=question)
+        self.assertEqual(created, [{"question": question.id, "id": se.pk}])
+        self.assertEqual((se.TF, se.hosei, se.earned), (1, 0, 2))
+
+    def test_rejects_mismatched_or_incomplete_cells(self):
+        stu_a, stu_b = self.students[0], self.students[1]
+        wrong_exam = self.cell(stu_a, "A", 0, TF=1)
+        wrong_exam["question"] = self.questions["B"][0].id        # B の問題を A として送る
+        unknown_exam = self.cell(stu_a, "A", 0, TF=1)
+        unknown_exam["exam"] = 999999
+        missing = self.cell(stu_a, "A", 0, TF=1)
+        del missing["question"]
+
+        for payload in (
+            [self.cell(stu_a, "A", 1, TF=1), wrong_exam],            # 正しいセルも書かれない
+            [self.cell(stu_b, "A", 0, TF=1)],                        # B 割当の学生に A のセル
+            [unknown_exam],
+            [missing],
+            [{"exam": self.exams["A"].id, "question": self.questions["A"][0].id}],
+            {"student": stu_a.id},
+        ):
+            with self.subTest(payload=payload):
+                res = self.patch(payload)
+                self.assertEqual(res.status_code, 400)
+                self.assertIn("error", res.json())
+        self.assertFalse(StudentExam.objects.exists())
+
+    @override_settings(EXAM2_SPARSE_STUDENT_EXAM=False)
+    def test_id_less_cells_need_sparse_mode(self):
+        res = self.patch([self.cell(self.students[0], "A", 0, TF=1)])
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(StudentExam.objects.exists())
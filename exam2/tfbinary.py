@@ -0,0 +1,282 @@
+# exam2/tfbinary.py
+"""
+examTFdata のバイナリ版（export_subject_scores --format=binary / convert_tfdata）。
+
+JSON 版（tfdata.py）と同じ内容を、セルごとの {"TF": .., "hosei": ..} を持たずに詰めて書く。
+
+    MAGIC "E2TF" | format version (u16) | 予約 (u16) | header 長 (u32) | header（UTF-8 JSON）| 学生レコード…
+
+header:
+    {"format_version": 1, "meta": {...},
+     "subjects": {subjectNo: {<JSON 版の subject ブロックから students を除いたもの>,
+                              "records": {"offset", "length", "count"}}}}
+    question_order（exams[version]）も header に入るので、レコード側は配列の長さを持たない。
+
+学生レコード（offset は header の直後からのバイト位置）:
+    stdNo（varint 長 + UTF-8）| nickname（varint 長+1 + UTF-8、0 は null）
+    | version（exams のキー順の番号、varint）| adjust（zigzag varint）
+    | TF ビット列（(問題数 + 7) // 8 バイト、LSB 先頭 = answersheet.pack_tf と同じ）
+    | hosei（問題数ぶんの zigzag varint）
+
+読み込みは mmap したファイルを memoryview で直接デコードする（ファイル全体を read しない）。
+open_subject_block は tfdata.open_subject_block と同じ (header, students) を返すので、
+import_subject_scores は JSON / バイナリを意識しない（tfdata 側が MAGIC で振り分ける）。
+"""
+
+import json
+import mmap
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+
+from .answersheet import pack_tf
+from .tfdata import atomic_output
+
+
+MAGIC = b"E2TF"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<4sHHI")   # magic, version, reserved, header 長
+
+
+def is_binary(path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+# =========================
+# varint
+# =========================
+
+def _put_uvarint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _put_svarint(out: bytearray, value: int) -> None:
+    _put_uvarint(out, (-value << 1) - 1 if value < 0 else value << 1)   # zigzag
+
+
+def _get_uvarint(buf, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _get_svarint(buf, pos: int) -> tuple[int, int]:
+    value, pos = _get_uvarint(buf, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+# =========================
+# 書き込み
+# =========================
+
+def encode_students(block: dict) -> tuple[bytes, int]:
+    """JSON 版 subject ブロックの students をレコード列にする → (bytes, 学生数)"""
+    versions = list(block.get("exams") or {})
+    version_index = {v: i for i, v in enumerate(versions)}
+    lengths = {v: len(e.get("question_order") or []) for v, e in (block.get("exams") or {}).items()}
+
+    out = bytearray()
+    count = 0
+    for stdNo, sinfo in (block.get("students") or {}).items():
+        version = sinfo.get("version")
+        if version not in version_index:
+            raise ValueError(f"exams に無い version です: student={stdNo} version={version}")
+        answers = sinfo.get("answers") or []
+        if len(answers) != lengths[version]:
+            raise ValueError(
+                f"answers の長さが question_order と一致しません: student={stdNo} "
+                f"answers={len(answers)} question_order={lengths[version]}"
+            )
+
+        raw = str(stdNo).encode("utf-8")
+        _put_uvarint(out, len(raw))
+        out += raw
+        nickname = sinfo.get("nickname")
+        if nickname is None:
+            _put_uvarint(out, 0)
+        else:
+            raw = str(nickname).encode("utf-8")
+            _put_uvarint(out, len(raw) + 1)
+            out += raw
+        _put_uvarint(out, version_index[version])
+        _put_svarint(out, int(sinfo.get("adjust", 0) or 0))
+        out += pack_tf(int((a or {}).get("TF", 0) or 0) for a in answers)
+        for a in answers:
+            _put_svarint(out, int((a or {}).get("hosei", 0) or 0))
+        count += 1
+    return bytes(out), count
+
+
+def write_binary_atomic(path, meta: dict, subjects: dict) -> None:
+    """
+    subjects: {subjectNo: (header ブロック（students 無し）, レコード bytes / memoryview, 学生数)}
+    tfdata.atomic_output で一時ファイル + fsync + rename で置き換える。
+    """
+    path = Path(path)
+    header = {"format_version": FORMAT_VERSION, "meta": meta, "subjects": {}}
+    offset = 0
+    for subjectNo, (block, records, count) in subjects.items():
+        length = len(records)
+        header["subjects"][subjectNo] = {
+            **{k: v for k, v in block.items() if k not in ("students", "records")},
+            "records": {"offset": offset, "length": length, "count": count},
+        }
+        offset += length
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    with atomic_output(path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        for _, records, _ in subjects.values():
+            f.write(records)
+
+
+def write_subject(path, subjectNo: str, block: dict, meta: dict) -> None:
+    """path の subjects[subjectNo] を block で置き換える（他の科目のレコードはそのまま写す）"""
+    path = Path(path)
+    records, count = encode_students(block)
+    if not is_binary(path):
+        write_binary_atomic(path, meta, {subjectNo: (block, records, count)})
+        return
+    with BinaryScores(path) as existing:
+        subjects = {
+            sno: (sblock, existing.raw_records(sno), sblock["records"]["count"])
+            for sno, sblock in existing.subjects.items()
+            if sno != subjectNo
+        }
+        subjects[subjectNo] = (block, records, count)
+        write_binary_atomic(path, {**existing.meta, **meta}, subjects)
+
+
+# =========================
+# 読み込み（mmap）
+# =========================
+
+class BinaryScores:
+    """バイナリファイルを mmap で開き、科目ごとのレコードを memoryview のままデコードする"""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空ファイル
+            self._file.close()
+            raise ValueError(f"バイナリ形式ではありません（空ファイル）: {path}")
+        self._view = memoryview(self._mmap)
+
+        if len(self._view) < _PREAMBLE.size:
+            self.close()
+            raise ValueError(f"バイナリ形式ではありません: {path}")
+        magic, version, _, header_len = _PREAMBLE.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"バイナリ形式ではありません: {path}")
+        if version > FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"未対応の format version です: {version}（対応: {FORMAT_VERSION} まで）")
+
+        start = _PREAMBLE.size
+        header = json.loads(bytes(self._view[start:start + header_len]).decode("utf-8"))
+        self.format_version = version
+        self.meta = header.get("meta") or {}
+        self.subjects = header.get("subjects") or {}
+        self._data_start = start + header_len
+
+    def close(self):
+        view, self._view = getattr(self, "_view", None), None
+        mm, self._mmap = getattr(self, "_mmap", None), None
+        try:
+            if view is not None:
+                view.release()
+            if mm is not None:
+                mm.close()
+        except BufferError:
+            pass  # 呼び出し側がまだレコードの memoryview を持っている：mmap は参照が切れた時に閉じられる
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def raw_records(self, subjectNo) -> memoryview:
+        rec = self.subjects[subjectNo]["records"]
+        start = self._data_start + rec["offset"]
+        return self._view[start:start + rec["length"]]
+
+    def iter_students(self, subjectNo):
+        """(stdNo, sinfo) を順に返す。sinfo は JSON 版と同じ形（answers は [{"TF", "hosei"}, ...]）"""
+        block = self.subjects[subjectNo]
+        versions = list(block.get("exams") or {})
+        lengths = [len(block["exams"][v].get("question_order") or []) for v in versions]
+        buf = self.raw_records(subjectNo)
+        end = len(buf)
+        pos = 0
+        while pos < end:
+            n, pos = _get_uvarint(buf, pos)
+            stdNo = str(buf[pos:pos + n], "utf-8")
+            pos += n
+            n, pos = _get_uvarint(buf, pos)
+            nickname = None
+            if n:
+                nickname = str(buf[pos:pos + n - 1], "utf-8")
+                pos += n - 1
+            vi, pos = _get_uvarint(buf, pos)
+            adjust, pos = _get_svarint(buf, pos)
+
+            count = lengths[vi]
+            bits = buf[pos:pos + (count + 7) // 8]
+            pos += len(bits)
+            answers = []
+            for i in range(count):
+                hosei, pos = _get_svarint(buf, pos)
+                answers.append({"TF": (bits[i >> 3] >> (i & 7)) & 1, "hosei": hosei})
+
+            yield stdNo, {"nickname": nickname, "version": versions[vi], "answers": answers, "adjust": adjust}
+
+
+@contextmanager
+def open_subject_block(path, subjectNo: str):
+    """tfdata.open_subject_block と同じ (header, students)。subjectNo が無ければ header は None"""
+    with BinaryScores(path) as scores:
+        block = scores.subjects.get(str(subjectNo))
+        if block is None:
+            yield None, iter(())
+            return
+        header = {k: v for k, v in block.items() if k != "records"}
+        yield header, scores.iter_students(str(subjectNo))
+
+
+# =========================
+# JSON ⇔ バイナリ
+# =========================
+
+def json_to_binary(root: dict, path) -> None:
+    subjects = {}
+    for subjectNo, block in (root.get("subjects") or {}).items():
+        records, count = encode_students(block)
+        subjects[subjectNo] = (block, records, count)
+    write_binary_atomic(path, root.get("meta") or {}, subjects)
+
+
+def binary_to_json(path) -> dict:
+    with BinaryScores(path) as scores:
+        root = {"meta": dict(scores.meta), "subjects": {}}
+        for subjectNo, block in scores.subjects.items():
+            out = {k: v for k, v in block.items() if k != "records"}
+            out["students"] = dict(scores.iter_students(subjectNo))
+            root["subjects"][subjectNo] = out
+    return root
@@ -0,0 +1,194 @@
+# exam2/tfdata.py
+"""
+examTFdata.json（export_subject_scores / import_subject_scores の受け渡しファイル）の読み書き。
+
+ファイル全体を json.load せず、必要な subject ブロックだけを先頭から順に読む。
+students は 1 学生ずつ取り出すので、大きなファイルでも学生 1 人分 + バッファしかメモリに持たない。
+
+    with open_subject_block(path, "1010401") as (header, students):
+        header["exams"]            # students より前に書かれたキー（exams / fsyear / term ...）
+        for stdNo, sinfo in students:
+            ...
+
+書き込みは write_json_atomic（一時ファイル + rename）で、途中で落ちても既存ファイルを壊さない。
+
+構造:
+    {"meta": {...}, "subjects": {subjectNo: {..., "exams": {...}, "students": {stdNo: {...}}}}}
+
+export_subject_scores --delta の出力は subject ブロックに "delta": {"since", "until", "target"} が付き、
+students には since 以降に変わった学生だけが入る（import はその学生だけを突き合わせる）。
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+CHUNK_SIZE = 1 << 16
+_WS = " \t\r\n"
+
+# delta の学生をこの人数までは student_id IN (...) で絞って読む（超えたら科目全体を読んでメモリで絞る）
+DELTA_SCOPE_LIMIT = 500
+
+
+class JsonStream:
+    """ファイルから JSON の値を 1 つずつ読み出す（オブジェクトはキー単位で降りていける）"""
+
+    def __init__(self, fp, chunk_size: int = CHUNK_SIZE):
+        self._fp = fp
+        self._chunk = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, min_size: int) -> bool:
+        """未読部分を残してバッファを足す。EOF なら False"""
+        if self._eof:
+            return False
+        data = self._fp.read(max(self._chunk, min_size))
+        if not data:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WS:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill(0):
+                raise ValueError("JSON が途中で終わっています")
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c not in chars:
+            raise ValueError(f"JSON の形式が不正です: {chars!r} の位置に {c!r}")
+        self._pos += 1
+        return c
+
+    def read_value(self):
+        """次の値を 1 つ読む（途中で切れていればバッファを倍々に足して読み直す）"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill(len(self._buf) - self._pos):
+                    raise
+                continue
+            # 数値・リテラルはバッファ末尾で切れていても読めてしまうので、続きがあれば読み直す
+            if end == len(self._buf) and not self._eof and self._fill(len(self._buf) - self._pos):
+                continue
+            self._pos = end
+            return value
+
+    def skip_value(self):
+        self.read_value()
+
+    def iter_keys(self):
+        """オブジェクトのキーを順に返す。呼び出し側は次のキーを受け取る前に値を読むこと"""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    def iter_items(self):
+        for key in self.iter_keys():
+            yield key, self.read_value()
+
+
+def _find_subject(stream: JsonStream, subjectNo: str) -> bool:
+    """stream を subjects[subjectNo] の値の直前まで進める"""
+    for key in stream.iter_keys():
+        if key != "subjects":
+            stream.skip_value()
+            continue
+        for sno in stream.iter_keys():
+            if sno == subjectNo:
+                return True
+            stream.skip_value()
+        return False
+    return False
+
+
+@contextmanager
+def open_subject_block(path, subjectNo: str):
+    """
+    (header, students) を返す。subjectNo が無ければ header は None。
+    students は (stdNo, sinfo) のイテレータ（with の中で読み切ること）。
+    バイナリ版（tfbinary）のファイルなら tfbinary.open_subject_block で読む。
+    """
+    from . import tfbinary
+
+    if tfbinary.is_binary(path):
+        with tfbinary.open_subject_block(path, subjectNo) as opened:
+            yield opened
+        return
+
+    with open(path, "r", encoding="utf-8") as fp:
+        stream = JsonStream(fp)
+        if not _find_subject(stream, str(subjectNo)):
+            yield None, iter(())
+            return
+
+        header = {}
+        students = iter(())
+        keys = stream.iter_keys()
+        for key in keys:
+            if key != "students":
+                header[key] = stream.read_value()
+                continue
+            if "exams" in header:
+                # 通常（export の出力順）：exams が先に来ているので学生はストリームで読む
+                students = stream.iter_items()
+                break
+            # students が exams より前にある：この subject の学生はメモリに読んでおく
+            students = iter(list(stream.iter_items()))
+
+        yield header, students
+
+
+@contextmanager
+def atomic_output(path, mode: str = "w"):
+    """
+    path と同じディレクトリの一時ファイルを開いて渡し、抜けるときに fsync してから path に置き換える。
+    例外で抜けたら一時ファイルを消す（既存の path は壊さない）。
+    mode は "w"（UTF-8・改行変換なし）か "wb"
+    """
+    if mode not in ("w", "wb"):
+        raise ValueError(f"mode は 'w' か 'wb': {mode!r}")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        text = {} if mode == "wb" else {"encoding": "utf-8", "newline": ""}
+        with os.fdopen(fd, mode, **text) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)  # mkstemp は 0600 で作るので通常のファイルと揃える
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_json_atomic(path, root, *, indent=2) -> None:
+    """同じディレクトリの一時ファイルに書き、fsync してから path に置き換える"""
+    with atomic_output(path) as f:
+        json.dump(root, f, ensure_ascii=False, indent=indent)
@@ -0,0 +1,321 @@
+# exam2/tfstore.py
+"""
+examTFdata の分割ストア（科目 × 年度ごとに 1 ファイル + 索引）。
+
+    <store>/index.json                          索引（どの科目がどのファイルに、いつ・何人分）
+    <store>/<fsyear>/examTFdata_<subjectNo>.json  1 科目分（中身は従来の examTFdata.json と同じ形）
+    <store>/<fsyear>/examTFdata_<subjectNo>.e2tf  --format=binary のとき（tfbinary）
+    <store>/<fsyear>/delta/examTFdata_<subjectNo>_<until>.json  export --delta の差分（1 回 1 ファイル）
+
+<store> は settings.EXAM2_TFSTORE_DIR（既定 exam2/data/export）。
+年度ディレクトリは export/import --all の既定ディレクトリ（yearbatch.default_dir）と同じ。
+
+- export は 1 科目のファイルだけを書く（他の科目を読み直さない）
+- 書き込みは <store>/.tfstore.lock の排他ロック中に、一時ファイル + rename で行う
+  （同じ科目を同時に export しても、ファイルと索引が食い違わない）
+- import は索引から 1 ファイルを引くだけ（他の科目は開かない）
+- 従来の 1 ファイル形式が要るときは assemble_tfdata で組み立てる
+
+差分（subject ブロックに "delta" が付いたもの）は全体のファイルを上書きしない。
+watermark（until）ごとに別ファイルにして索引の deltas に並べ、import --delta が古い順に流す。
+前の差分の until より後から始まる差分（間が抜けている）は delta_chain が DeltaChainError で止める。
+全体として読む側（assemble / delta でない import）は差分のファイルを DeltaSegmentError で断る。
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import tfbinary
+from .tfdata import write_json_atomic
+from .yearbatch import FILE_PATTERNS, subject_file
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+INDEX_NAME = "index.json"
+LOCK_NAME = ".tfstore.lock"
+INDEX_VERSION = 1
+DELTA_DIR = "delta"
+
+
+class DeltaSegmentError(ValueError):
+    """全体が要るところに差分（"delta" の付いた subject ブロック）が渡された"""
+
+
+class DeltaChainError(ValueError):
+    """差分の since が前の差分の until より後（間の変更が抜けている）"""
+
+
+def store_dir() -> Path:
+    default = Path(settings.BASE_DIR) / "exam2" / "data" / "export"
+    return Path(getattr(settings, "EXAM2_TFSTORE_DIR", None) or default)
+
+
+def year_dir(fsyear) -> Path:
+    return store_dir() / str(int(fsyear))
+
+
+def segment_path(fsyear, subjectNo, fmt: str = "json") -> Path:
+    return subject_file(year_dir(fsyear), subjectNo, fmt)
+
+
+def delta_segment_path(fsyear, subjectNo, until, fmt: str = "json") -> Path:
+    """差分 1 回分のファイル。名前に until（watermark）を入れるので前の差分を上書きしない"""
+    stamp = parse_datetime(until).astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    name = subject_file("", f"{subjectNo}_{stamp}", fmt).name
+    return year_dir(fsyear) / DELTA_DIR / name
+
+
+def _key(fsyear, subjectNo) -> str:
+    return f"{int(fsyear)}/{subjectNo}"
+
+
+def is_delta(block) -> bool:
+    return bool((block or {}).get("delta"))
+
+
+def check_full(block, path, subjectNo):
+    """全体として読むブロックが差分なら DeltaSegmentError"""
+    if is_delta(block):
+        raise DeltaSegmentError(
+            f"差分（delta）のファイルです: subjectNo={subjectNo} {path}"
+            f"（since={block['delta'].get('since')} until={block['delta'].get('until')}）"
+        )
+
+
+# =========================
+# ロック
+# =========================
+
+@contextmanager
+def _flock(lock_path):
+    """lock_path の排他ロック（プロセス間。fcntl / Windows は msvcrt）"""
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked(directory):
+    """ストア（directory/.tfstore.lock）の排他ロック"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with _flock(directory / LOCK_NAME):
+        yield
+
+
+@contextmanager
+def locked_file(path):
+    """--out の 1 ファイル用の排他ロック（ロックファイルは出力先の横に作らず一時ディレクトリに置く）"""
+    digest = hashlib.sha1(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:16]
+    with _flock(Path(tempfile.gettempdir()) / f"exam2_tfdata_{digest}.lock"):
+        yield
+
+
+# =========================
+# 索引
+# =========================
+
+def read_index() -> dict:
+    path = store_dir() / INDEX_NAME
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        index = {}
+    index.setdefault("version", INDEX_VERSION)
+    index.setdefault("segments", {})
+    index.setdefault("deltas", {})
+    return index
+
+
+def find_segment(fsyear, subjectNo):
+    """import 用：索引にある科目のファイル。索引に無ければファイルを探す（どちらも無ければ None）"""
+    entry = read_index()["segments"].get(_key(fsyear, subjectNo))
+    if entry:
+        path = store_dir() / entry["path"]
+        if path.exists():
+            return path
+    for fmt in FILE_PATTERNS:
+        path = segment_path(fsyear, subjectNo, fmt)
+        if path.exists():
+            return path
+    return None
+
+
+def delta_chain(fsyear, subjectNo, *, after=None) -> list[dict]:
+    """
+    import --delta 用：科目の差分を until の古い順に（after を渡したら until がそれより後のものだけ）。
+    各エントリの path は絶対パス。since が前の until より後なら DeltaChainError
+    """
+    root = store_dir()
+    entries = sorted(
+        read_index()["deltas"].get(_key(fsyear, subjectNo)) or [],
+        key=lambda e: parse_datetime(e["until"]),
+    )
+    if after is not None:
+        after = parse_datetime(after)
+        entries = [e for e in entries if parse_datetime(e["until"]) > after]
+
+    chain, prev_until = [], after
+    for entry in entries:
+        since = parse_datetime(entry["since"])
+        if prev_until is not None and since > prev_until:
+            raise DeltaChainError(
+                f"差分が途切れています: subjectNo={subjectNo} 前の until={prev_until.isoformat()}"
+                f" 次の since={entry['since']}（{entry['path']}）。全体を export し直してください"
+            )
+        chain.append({**entry, "path": root / entry["path"]})
+        prev_until = parse_datetime(entry["until"])
+    return chain
+
+
+def mark_delta_applied(fsyear, subjectNo, until) -> None:
+    """import --delta が until までの差分を取り込んだ（次回はそれより後の差分だけ流す）"""
+    root = store_dir()
+    with locked(root):
+        index = read_index()
+        index.setdefault("delta_applied", {})[_key(fsyear, subjectNo)] = until
+        write_json_atomic(root / INDEX_NAME, index)
+
+
+def delta_applied(fsyear, subjectNo):
+    return read_index().get("delta_applied", {}).get(_key(fsyear, subjectNo))
+
+
+def year_segments(fsyear) -> dict:
+    """{subjectNo: 索引エントリ}（subjectNo 順）"""
+    prefix = f"{int(fsyear)}/"
+    segments = read_index()["segments"]
+    return {
+        entry["subjectNo"]: entry
+        for key, entry in sorted(segments.items())
+        if key.startswith(prefix)
+    }
+
+
+# =========================
+# 書き込み
+# =========================
+
+def write_segment(fsyear, subjectNo, block: dict, meta: dict, fmt: str = "json") -> Path:
+    """1 科目分を書き、索引を更新する（ストアのロック中に行う）。差分は write_delta_segment へ"""
+    subjectNo = str(subjectNo)
+    if is_delta(block):
+        return write_delta_segment(fsyear, subjectNo, block, meta, fmt)
+    root = store_dir()
+    path = segment_path(fsyear, subjectNo, fmt)
+
+    with locked(root):
+        _write_file(path, subjectNo, block, meta, fmt)
+
+        # 形式を変えて書き直したときは古い方を消す（--all の import が古い方を拾わないように）
+        for other in FILE_PATTERNS:
+            if other != fmt:
+                stale = segment_path(fsyear, subjectNo, other)
+                if stale.exists():
+                    os.unlink(stale)
+
+        index = read_index()
+        index["segments"][_key(fsyear, subjectNo)] = {
+            "fsyear": int(fsyear),
+            "subjectNo": subjectNo,
+            "path": path.relative_to(root).as_posix(),
+            "format": fmt,
+            "exported_at": meta.get("exported_at") or timezone.localtime().isoformat(),
+            "students": len(block.get("students") or {}),
+            "bytes": path.stat().st_size,
+        }
+        index["updated_at"] = timezone.localtime().isoformat()
+        write_json_atomic(root / INDEX_NAME, index)
+    return path
+
+
+def _write_file(path, subjectNo, block, meta, fmt):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "binary":
+        records, count = tfbinary.encode_students(block)
+        tfbinary.write_binary_atomic(path, meta, {subjectNo: (block, records, count)})
+    else:
+        write_json_atomic(path, {"meta": meta, "subjects": {subjectNo: block}})
+
+
+def write_delta_segment(fsyear, subjectNo, block: dict, meta: dict, fmt: str = "json") -> Path:
+    """差分 1 回分を別ファイルに書き、索引の deltas に足す（全体のファイル・前の差分には触れない）"""
+    subjectNo = str(subjectNo)
+    delta = block["delta"]
+    root = store_dir()
+    path = delta_segment_path(fsyear, subjectNo, delta["until"], fmt)
+
+    with locked(root):
+        _write_file(path, subjectNo, block, meta, fmt)
+        index = read_index()
+        entries = index["deltas"].setdefault(_key(fsyear, subjectNo), [])
+        rel = path.relative_to(root).as_posix()
+        entries[:] = [e for e in entries if e["path"] != rel]
+        entries.append({
+            "path": rel,
+            "format": fmt,
+            "since": delta["since"],
+            "until": delta["until"],
+            "target": delta.get("target"),
+            "students": len(block.get("students") or {}),
+            "bytes": path.stat().st_size,
+        })
+        index["updated_at"] = timezone.localtime().isoformat()
+        write_json_atomic(root / INDEX_NAME, index)
+    return path
+
+
+# =========================
+# 従来形式（1 ファイル）への組み立て
+# =========================
+
+def read_segment(path, subjectNo) -> dict:
+    """1 科目分のファイルから subject ブロック（students 込み）を読む"""
+    if tfbinary.is_binary(path):
+        return tfbinary.binary_to_json(path)["subjects"][str(subjectNo)]
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["subjects"][str(subjectNo)]
+
+
+def assemble(fsyear, subjects=None) -> dict:
+    """年度の科目ファイルをまとめて従来の examTFdata.json の形にする（差分のファイルがあれば DeltaSegmentError）"""
+    entries = year_segments(fsyear)
+    wanted = list(entries) if subjects is None else [str(s) for s in subjects]
+    root = {
+        "meta": {"exported_at": timezone.localtime().isoformat(), "assembled_from": str(year_dir(fsyear))},
+        "subjects": {},
+    }
+    for subjectNo in wanted:
+        path = find_segment(fsyear, subjectNo)
+        if path is None:
+            raise FileNotFoundError(f"ストアに科目がありません: fsyear={fsyear} subjectNo={subjectNo}")
+        block = read_segment(path, subjectNo)
+        check_full(block, path, subjectNo)
+        root["subjects"][subjectNo] = block
+    return root
@@ -1,8 +1,7 @@
 # exam2/views.py
 from django.conf import settings
 from django.contrib import messages
-from django.db import models, transaction
-from django.db.models import Sum, Case, When, F, Value, IntegerField
+from django.db import DEFAULT_DB_ALIAS, models
 from django.views import View
 
 from rest_framework import status, viewsets
@@ -11,8 +10,6 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 # --- views.py 追加/置き換え用（manage_stdversion 一覧＋切替） ---
-from django.db.models.functions import Coalesce
-from django.db.models.expressions import ExpressionWrapper
 from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
@@ -37,7 +34,28 @@ from .serializers import (
     ExamAdjustSerializer,
 )
 
-from .services import change_student_exam_version
+from .services import (
+    change_student_exam_version,
+    use_sparse_rows,
+    synthesize_cells,
+    upsert_student_exam_cells,
+    CellError,
+)
+from .answersheet import use_packed_storage, PackedStudentExamAdapter, students_with_sheets
+from .scoring import score_totals
+from .dbwrite import run_write, WriteBusy, write_metrics
+from .archive import archived_years
+from .replica import ReportingReadMixin
+from . import catalog
+
+
+def write_busy_response(exc):
+    """書き込みロックが取れなかったときの応答（500 ではなく 503 で再送を促す）"""
+    return Response(
+        {"error": "他の採点者の保存と重なりました。少し待ってから再送してください", "detail": str(exc)},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
 
 # =========================
 # HTML ページ用 View
@@ -81,6 +99,29 @@ class EnvironmentAPIView(APIView):
         })
 
 
+class FsyearListAPIView(APIView):
+    """
+    GET /api/fsyears/
+    → 選択できる年度の一覧（作業DBにある年度 + アーカイブ済み年度）
+      archived=True の年度は読み取り専用（?fsyear= で年度ファイルを読む）
+    """
+    def get(self, request, *args, **kwargs):
+        working = set(
+            Subject.objects.using(DEFAULT_DB_ALIAS).order_by()
+            .values_list("fsyear", flat=True).distinct()
+        )
+        archived = set(archived_years())
+        current = getattr(settings, "FSYEAR", None)
+        if current is not None:
+            working.add(int(current))
+
+        years = [
+            {"fsyear": y, "archived": y in archived and y not in working}
+            for y in sorted(working | archived, reverse=True)
+        ]
+        return Response({"current": current, "years": years}, status=200)
+
+
 # =========================
 # 科目一覧（index 用）
 # =========================
@@ -124,8 +165,8 @@ class ExamsOfSubjectAPIView(APIView):
         if not subjectNo or fsyear is None:
             return Response({"error": "subjectNo と fsyear が必要です"}, status=400)
 
-        subject = get_object_or_404(Subject, subjectNo=subjectNo, fsyear=int(fsyear))
-        exams = Exam.objects.filter(subject=subject).order_by("version")
+        subject = catalog.subject_or_404(subjectNo, fsyear)
+        exams = catalog.exams_by_version(subject.id).values()
 
         data = [
             {
@@ -197,7 +238,7 @@ class ExamRetrieveAPIView(APIView):
     → ExamSerializer（questions含む想定）
     """
     def get(self, request, pk, *args, **kwargs):
-        exam = get_object_or_404(Exam, pk=pk)
+        exam = catalog.exam_or_404(pk)
         serializer = ExamSerializer(exam)
         return Response(serializer.data, status=200)
 
@@ -216,14 +257,20 @@ class ExamStudentListAPIView(APIView):
         if not exam_id:
             return Response({"error": "exam_id が必要です"}, status=400)
 
-        exam = get_object_or_404(Exam, pk=exam_id)
-
-        student_ids = (
-            StudentExam.objects.filter(exam=exam)
-            .values_list("student_id", flat=True)
-            .distinct()
-        )
-        students = Student.objects.filter(id__in=student_ids).order_by("stdNo")
+        exam = catalog.exam_or_404(exam_id)
+
+        if use_packed_storage():
+            students = students_with_sheets(exam.id).order_by("stdNo")
+        elif use_sparse_rows():
+            # sparse 運用では StudentExam が無い学生もいるので割当(SEV)を正とする
+            students = Student.objects.filter(studentexamversion__exam=exam).order_by("stdNo")
+        else:
+            student_ids = (
+                StudentExam.objects.filter(exam=exam)
+                .values_list("student_id", flat=True)
+                .distinct()
+            )
+            students = Student.objects.filter(id__in=student_ids).order_by("stdNo")
 
         serializer = StudentSerializer(students, many=True)
         return Response(serializer.data, status=200)
@@ -238,9 +285,73 @@ class StudentExamViewSet(viewsets.ModelViewSet):
     /api/student-exams/
       GET: exam & student で絞り込み
       PATCH: TF / hosei 更新
+    settings.EXAM2_ANSWER_STORAGE = "packed" の場合は AnswerSheet を同じ形で見せる
     """
-    queryset = StudentExam.objects.all().select_related("student", "exam", "question")
+    # 並び（question__gyo/retu）で Question は JOIN 済み。save() の earned もそこから取る（student/exam は使わない）
+    queryset = StudentExam.objects.all().select_related("question")
     serializer_class = StudentExamSerializer
+    packed_adapter = PackedStudentExamAdapter()
+
+    def list(self, request, *args, **kwargs):
+        if not use_packed_storage():
+            response = super().list(request, *args, **kwargs)
+            return self._fill_sparse_cells(request, response)
+
+        params = request.query_params
+        if not (params.get("exam") or params.get("student") or params.get("student_stdno")):
+            return Response({"error": "exam / student / student_stdno のいずれかが必要です"}, status=400)
+
+        rows = self.packed_adapter.list_cells(
+            exam_id=params.get("exam"),
+            student_id=params.get("student"),
+            student_stdno=params.get("student_stdno"),
+        )
+        return Response(rows, status=200)
+
+    def _fill_sparse_cells(self, request, response):
+        """sparse 運用：1学生×1試験の一覧なら、行の無い問題を既定セル（id=None）で補う"""
+        params = request.query_params
+        exam_id = params.get("exam")
+        if not use_sparse_rows() or not exam_id or isinstance(response.data, dict):
+            return response
+
+        student_id = params.get("student")
+        if not student_id and params.get("student_stdno"):
+            student_id = catalog.student_id(params["student_stdno"])
+        if not student_id:
+            return response
+
+        response.data = synthesize_cells(int(exam_id), int(student_id), list(response.data))
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        if not use_packed_storage():
+            return super().retrieve(request, *args, **kwargs)
+
+        row = self.packed_adapter.get_cell(kwargs["pk"])
+        if row is None:
+            return Response({"detail": "Not found."}, status=404)
+        return Response(row, status=200)
+
+    def update(self, request, *args, **kwargs):
+        # PUT / PATCH（partial_update もここを通る）
+        if not use_packed_storage():
+            try:
+                return run_write(lambda: super(StudentExamViewSet, self).update(request, *args, **kwargs))
+            except WriteBusy as e:
+                return write_busy_response(e)
+
+        item = {k: request.data[k] for k in ("TF", "hosei") if k in request.data}
+        item["id"] = kwargs["pk"]
+        try:
+            run_write(lambda: self.packed_adapter.update_cells([item]))
+        except KeyError:
+            return Response({"detail": "Not found."}, status=404)
+        except CellError as e:
+            return Response({"error": str(e)}, status=400)
+        except WriteBusy as e:
+            return write_busy_response(e)
+        return Response(self.packed_adapter.get_cell(kwargs["pk"]), status=200)
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -263,7 +374,7 @@ class StudentExamViewSet(viewsets.ModelViewSet):
 # 試験結果（採点一覧/結果画面）
 # =========================
 
-class ExamResultAPIView(APIView):
+class ExamResultAPIView(ReportingReadMixin, APIView):
     """
     GET /api/examresult/?wexamid=1
     → Exam1件の学生別集計（score/correction/adjust/total）
@@ -273,45 +384,33 @@ class ExamResultAPIView(APIView):
         if not exam_id:
             return Response({"error": "wexamid が必要です"}, status=400)
 
-        exam = get_object_or_404(Exam, pk=exam_id)
+        exam = catalog.exam_or_404(exam_id)
 
-        student_exams = (
-            StudentExam.objects.filter(exam=exam)
-            .select_related("student", "question")
-        )
-
-        result = {}
-        for se in student_exams:
-            stu = se.student
-            q = se.question
-
-            base = q.points if se.TF == 1 else 0
-            corr = se.hosei or 0
-
-            if stu.id not in result:
-                result[stu.id] = {
-                    "stdNo": stu.stdNo,
-                    "nickname": stu.nickname,
-                    "score": 0,
-                    "correction": 0,
-                }
-
-            result[stu.id]["score"] += base
-            result[stu.id]["correction"] += corr
+        # 学生ごとの score / correction は GROUP BY 1回で取る
+        totals = {
+            stu_id: v for (stu_id, _), v in score_totals([exam.id]).items()
+        }
+        student_ids = set(totals)
+        if use_sparse_rows():
+            # 行が 1 件も無い（未採点）学生も割当(SEV)から拾う
+            student_ids |= set(
+                StudentExamVersion.objects.filter(exam=exam).values_list("student_id", flat=True)
+            )
+        students = Student.objects.filter(id__in=student_ids).order_by("stdNo")
 
-        adjusts = ExamAdjust.objects.filter(exam=exam).select_related("student")
-        adjust_map = {adj.student.id: adj.adjust for adj in adjusts}
+        adjust_map = dict(
+            ExamAdjust.objects.filter(exam=exam).values_list("student_id", "adjust")
+        )
 
         students_data = []
-        for stu_id, d in result.items():
-            base = d["score"]
-            corr = d["correction"]
-            adj = adjust_map.get(stu_id, 0)
+        for stu in students:
+            base, corr = totals.get(stu.id, (0, 0))
+            adj = adjust_map.get(stu.id, 0)
             total = base + corr
 
             students_data.append({
-                "stdNo": d["stdNo"],
-                "nickname": d["nickname"],
+                "stdNo": stu.stdNo,
+                "nickname": stu.nickname,
                 "score": base,
                 "correction": corr,
                 "adjust": adj,
@@ -351,12 +450,12 @@ class ExamAdjustUpdateAPIView(APIView):
             if not (exam_id and stdNo):
                 continue
 
-            exam = get_object_or_404(Exam, pk=exam_id)
-            student = get_object_or_404(Student, stdNo=stdNo)
+            exam = catalog.exam_or_404(exam_id)
+            student_id = catalog.student_id_or_404(stdNo)
 
             obj, created = ExamAdjust.objects.get_or_create(
                 exam=exam,
-                student=student,
+                student_id=student_id,
                 defaults={"adjust": int(adjust)},
             )
             if not created:
@@ -379,7 +478,7 @@ class ExamAdjustCommentAPIView(APIView):
         exam_id = request.query_params.get("wexamid")
         if not exam_id:
             return None, Response({"error": "wexamid が必要です"}, status=400)
-        exam = get_object_or_404(Exam, pk=exam_id)
+        exam = catalog.exam_or_404(exam_id)
         return exam, None
 
     def get(self, request, *args, **kwargs):
@@ -403,22 +502,57 @@ class ExamAdjustCommentAPIView(APIView):
 def studentexam_bulk_update(request):
     """
     StudentExam の複数レコードを一括更新する
+    sparse 運用では id の無いセル {student, exam, question, TF, hosei} も受け付け、
+    無ければ作成する（作成した行は created: [{question, id}] で返す）
     """
     data = request.data  # [{id, TF, hosei}, ...]
-    for item in data:
-        obj = StudentExam.objects.get(id=item["id"])
-        if "TF" in item:
-            obj.TF = item["TF"]
-        if "hosei" in item:
-            obj.hosei = item["hosei"]
-        obj.save()
-    return Response({"status": "ok"})
+    if not isinstance(data, list):
+        return Response({"error": "配列で送ってください"}, status=400)
+
+    if use_packed_storage():
+        try:
+            run_write(lambda: PackedStudentExamAdapter().update_cells(data))
+        except KeyError as e:
+            return Response({"error": str(e)}, status=404)
+        except CellError as e:
+            return Response({"error": str(e)}, status=400)
+        except WriteBusy as e:
+            return write_busy_response(e)
+        return Response({"status": "ok"})
+
+    new_cells = [item for item in data if item.get("id") is None]
+    if new_cells and not use_sparse_rows():
+        # 事前作成の運用では id の無いセルは来ないはず（来たら行を勝手に作らない）
+        return Response({"error": "id が必要です（EXAM2_SPARSE_STUDENT_EXAM が無効）"}, status=400)
+
+    def write():
+        # 既存セルは 1 クエリでまとめて引く（points は question から。行ごとの SELECT はしない）
+        ids = [item["id"] for item in data if isinstance(item.get("id"), int)]
+        cells = StudentExam.objects.select_related("question").in_bulk(ids)
+        for item in data:
+            if item.get("id") is None:
+                continue
+            obj = cells.get(item["id"]) or StudentExam.objects.select_related("question").get(id=item["id"])
+            if "TF" in item:
+                obj.TF = item["TF"]
+            if "hosei" in item:
+                obj.hosei = item["hosei"]
+            obj.save()
+        return upsert_student_exam_cells(new_cells) if new_cells else []
+
+    try:
+        created = run_write(write)
+    except CellError as e:
+        return Response({"error": str(e)}, status=400)
+    except WriteBusy as e:
+        return write_busy_response(e)
+    return Response({"status": "ok", "created": created})
 
 
 # =========================
 # （科目ベース）学生一覧：必要なら使う
 # =========================
-class StudentsOfSubjectAPIView(APIView):
+class StudentsOfSubjectAPIView(ReportingReadMixin, APIView):
     """
     GET /api/students_of_subject/?subjectNo=1010401&fsyear=2025
     ※ term パラメータは不要（あっても無視）
@@ -434,7 +568,7 @@ class StudentsOfSubjectAPIView(APIView):
         fsyear = int(fsyear)
 
         # ★ Subject は (subjectNo, fsyear) で特定（termはSubject側）
-        subject = get_object_or_404(Subject, subjectNo=subjectNo, fsyear=fsyear)
+        subject = catalog.subject_or_404(subjectNo, fsyear)
 
         # 科目の指定学年
         target_nenji = subject.nenji
@@ -443,23 +577,31 @@ class StudentsOfSubjectAPIView(APIView):
         entyear = fsyear - target_nenji + 1
 
         # 学年の学生一覧（必要なら enrolled=True など足せます）
-        students = Student.objects.filter(entyear=entyear).order_by("stdNo")
+        students = list(Student.objects.filter(entyear=entyear).order_by("stdNo"))
+
+        # ★ 学生→受験Exam を科目単位で 1 回だけ引く（A→B 順で先勝ち）
+        exam_by_student = {}
+        for sev in (
+            StudentExamVersion.objects.filter(subject=subject)
+            .select_related("exam")
+            .order_by("exam__version")
+        ):
+            exam_by_student.setdefault(sev.student_id, sev.exam)
+
+        exam_ids = {e.id for e in exam_by_student.values()}
+        totals = score_totals(exam_ids)
+        adjust_map = {
+            (sid, eid): adj
+            for sid, eid, adj in ExamAdjust.objects.filter(subject=subject)
+            .values_list("student_id", "exam_id", "adjust")
+        }
 
         results = []
 
         for stu in students:
-            # ★ version と exam_id を学生ごとに取得（exam__fsyear/term はもう無い）
-            sev = (
-                StudentExamVersion.objects.filter(
-                    student=stu,
-                    exam__subject=subject,
-                )
-                .select_related("exam")
-                .order_by("exam__version")  # ★ A→B
-                .first()
-            )
+            exam = exam_by_student.get(stu.id)
 
-            if not sev:
+            if not exam:
                 results.append({
                     "stdNo": stu.stdNo,
                     "nickname": stu.nickname,
@@ -472,25 +614,11 @@ class StudentsOfSubjectAPIView(APIView):
                 })
                 continue
 
-            exam = sev.exam
-
             # 得点集計（points + hosei）
-            agg = StudentExam.objects.filter(student=stu, exam=exam).aggregate(
-                score=Sum(
-                    Case(
-                        When(TF=1, then=F("question__points")),
-                        default=0,
-                        output_field=IntegerField(),
-                    )
-                ),
-                hosei=Sum("hosei"),
-            )
-            score = agg["score"] or 0
-            hosei = agg["hosei"] or 0
+            score, hosei = totals.get((stu.id, exam.id), (0, 0))
 
             # adjust（無ければ 0）
-            adj = ExamAdjust.objects.filter(student=stu, exam=exam).first()
-            adjust_value = adj.adjust if adj else 0
+            adjust_value = adjust_map.get((stu.id, exam.id), 0)
 
             results.append({
                 "stdNo": stu.stdNo,
@@ -516,7 +644,7 @@ class StudentsOfSubjectAPIView(APIView):
 # （科目ベース）調整一覧：index/examadjust 共通
 # =========================
 
-class ExamAdjustSubjectAPIView(APIView):
+class ExamAdjustSubjectAPIView(ReportingReadMixin, APIView):
     """
     GET /api/examadjust_subject/?subjectNo=1010401&fsyear=2025
     ※ term は Subject.term を使う（パラメータ不要、来ても無視）
@@ -528,10 +656,11 @@ class ExamAdjustSubjectAPIView(APIView):
         if not subjectNo or fsyear is None:
             return Response({"error": "subjectNo と fsyear を指定してください"}, status=400)
 
-        subject = get_object_or_404(Subject, subjectNo=subjectNo, fsyear=int(fsyear))
+        subject = catalog.subject_or_404(subjectNo, fsyear)
 
         # 科目内のA/B exams（hash表示用）
-        exams = list(Exam.objects.filter(subject=subject).order_by("version"))
+        exams = list(catalog.exams_by_version(subject.id).values())
+        exam_by_id = {e.id: e for e in exams}
         exams_info = {
             e.version: {
                 "id": e.id,
@@ -554,36 +683,28 @@ class ExamAdjustSubjectAPIView(APIView):
 
         # 学生→受験Exam(A/B) の対応（subjectで十分）
         sev_qs = (
-            StudentExamVersion.objects.filter(exam__subject=subject)
-            .select_related("student", "exam")
+            StudentExamVersion.objects.filter(subject=subject)
+            .select_related("student")
             .order_by("student__stdNo")
         )
 
+        # 集計・adjust は科目単位で 1 回ずつ引く
+        exam_ids = [e.id for e in exams]
+        totals = score_totals(exam_ids)
+        adjust_map = {
+            (sid, eid): adj
+            for sid, eid, adj in ExamAdjust.objects.filter(subject=subject)
+            .values_list("student_id", "exam_id", "adjust")
+        }
+
         students_data = []
 
         for sev in sev_qs:
             stu = sev.student
-            exam = sev.exam  # A or B
+            exam = exam_by_id.get(sev.exam_id) or sev.exam  # A or B
 
-            score_agg = StudentExam.objects.filter(
-                student=stu,
-                exam=exam,
-            ).aggregate(
-                score=Sum(
-                    Case(
-                        When(TF=1, then=F("question__points")),
-                        default=0,
-                        output_field=IntegerField(),
-                    )
-                ),
-                hosei=Sum("hosei"),
-            )
-
-            score = score_agg["score"] or 0
-            hosei = score_agg["hosei"] or 0
-
-            adj = ExamAdjust.objects.filter(student=stu, exam=exam).first()
-            adjust = adj.adjust if adj else 0
+            score, hosei = totals.get((stu.id, exam.id), (0, 0))
+            adjust = adjust_map.get((stu.id, exam.id), 0)
 
             students_data.append({
                 "stdNo": stu.stdNo,
@@ -620,9 +741,9 @@ class ExamAdjustCommentSubjectAPIView(APIView):
         if not subjectNo or fsyear is None:
             return Response({"error": "subjectNo と fsyear が必要です"}, status=400)
 
-        subject = get_object_or_404(Subject, subjectNo=subjectNo, fsyear=int(fsyear))
+        subject = catalog.subject_or_404(subjectNo, fsyear)
 
-        exam = Exam.objects.filter(subject=subject).order_by("version").first()
+        exam = next(iter(catalog.exams_by_version(subject.id).values()), None)
         if not exam:
             return Response({"adjust_comment": ""}, status=200)
 
@@ -635,11 +756,11 @@ class ExamAdjustCommentSubjectAPIView(APIView):
         if not subjectNo or fsyear is None:
             return Response({"error": "subjectNo と fsyear が必要です"}, status=400)
 
-        subject = get_object_or_404(Subject, subjectNo=subjectNo, fsyear=int(fsyear))
+        subject = catalog.subject_or_404(subjectNo, fsyear)
 
         comment = request.data.get("adjust_comment", "")
 
-        for e in Exam.objects.filter(subject=subject):
+        for e in catalog.exams_by_version(subject.id).values():
             e.adjust_comment = comment
             e.save(update_fields=["adjust_comment"])
 
@@ -677,55 +798,92 @@ class ExamAdjustUpdateSubjectAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        subject = get_object_or_404(Subject, subjectNo=subjectNo, fsyear=int(fsyear))
-
-        with transaction.atomic():
-            for item in items:
-                exam_id = item.get("exam_id")
-                stdNo = item.get("stdNo")
-                adjust_raw = item.get("adjust", 0)
-
-                if not exam_id or not stdNo:
-                    continue
-
-                # adjust を安全に int 化（失敗したら 0）
-                try:
-                    adjust = int(adjust_raw)
-                except (TypeError, ValueError):
-                    adjust = 0
+        subject = catalog.subject_or_404(subjectNo, fsyear)
 
-                # UIが min=0 ならサーバも合わせる（必要なら外してください）
-                if adjust < 0:
-                    adjust = 0
+        # 検証と参照は書き込みトランザクションの外で済ませる（ロック保持を短くする）
+        rows = []
+        for item in items:
+            exam_id = item.get("exam_id")
+            stdNo = item.get("stdNo")
+            adjust_raw = item.get("adjust", 0)
 
-                exam = get_object_or_404(Exam, pk=exam_id)
+            if not exam_id or not stdNo:
+                continue
 
-                # safety：別科目の exam が混ざったら弾く
-                if exam.subject_id != subject.id:
-                    return Response(
-                        {
-                            "error": f"exam_id={exam_id} は subjectNo={subjectNo}({fsyear}) に属しません",
-                            "stdNo": stdNo,
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+            # adjust を安全に int 化（失敗したら 0）
+            try:
+                adjust = int(adjust_raw)
+            except (TypeError, ValueError):
+                adjust = 0
+
+            # UIが min=0 ならサーバも合わせる（必要なら外してください）
+            if adjust < 0:
+                adjust = 0
+
+            exam = catalog.exam_or_404(exam_id)
+
+            # safety：別科目の exam が混ざったら弾く
+            if exam.subject_id != subject.id:
+                return Response(
+                    {
+                        "error": f"exam_id={exam_id} は subjectNo={subjectNo}({fsyear}) に属しません",
+                        "stdNo": stdNo,
+                    },
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-                student = get_object_or_404(Student, stdNo=stdNo)
+            student_id = catalog.student_id_or_404(stdNo)
+            rows.append((exam, student_id, adjust))
 
+        def write():
+            for exam, student_id, adjust in rows:
                 obj, created = ExamAdjust.objects.get_or_create(
                     exam=exam,
-                    student=student,
-                    defaults={"adjust": adjust},
+                    student_id=student_id,
+                    defaults={"adjust": adjust, "subject": subject},
                 )
                 if not created:
                     if obj.adjust != adjust:  # 無駄なUPDATE削減（任意）
                         obj.adjust = adjust
                         obj.save(update_fields=["adjust"])
 
+        try:
+            run_write(write)
+        except WriteBusy as e:
+            return write_busy_response(e)
+
         return Response({"status": "ok"}, status=status.HTTP_200_OK)
  
 
 
+class WriteMetricsAPIView(APIView):
+    """
+    GET /api/write-metrics/      書き込み層（exam2/dbwrite.py）の待ち時間・再試行の集計
+    DELETE /api/write-metrics/   集計をリセット
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(write_metrics.snapshot(), status=200)
+
+    def delete(self, request, *args, **kwargs):
+        write_metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CatalogStatsAPIView(APIView):
+    """
+    GET /api/catalog-stats/      マスタ参照キャッシュ（exam2/catalog.py）のヒット率など
+    DELETE /api/catalog-stats/   集計をリセット（キャッシュの中身は残す）
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(catalog.catalog.snapshot(), status=200)
+
+    def delete(self, request, *args, **kwargs):
+        catalog.catalog.reset_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 def _students_for_subject(subject: Subject):
     """
     subject.nenji と subject.fsyear から、対象学生を絞る。
@@ -798,15 +956,17 @@ def manage_stdversion(request):
         sev_map = {}
         for sev in (
             StudentExamVersion.objects
-            .filter(exam__subject=subject, student__in=students)
+            .filter(subject=subject, student__in=students)
             .select_related("exam")
         ):
             sev_map[sev.student_id] = sev.exam.version
 
-        tf_points_expr = ExpressionWrapper(
-            F("TF") * F("question__points"),
-            output_field=IntegerField(),
-        )
+        totals = score_totals([e.id for e in exams], [st.id for st in students])
+        adjust_map = {
+            (sid, eid): adj
+            for sid, eid, adj in ExamAdjust.objects.filter(subject=subject, student__in=students)
+            .values_list("student_id", "exam_id", "adjust")
+        }
 
         for st in students:
             current_v = sev_map.get(st.id)
@@ -822,38 +982,14 @@ def manage_stdversion(request):
 
             target_exam = exam_by_version.get(current_v) if current_v else None
 
-            if target_exam:
-                se_qs = StudentExam.objects.filter(
-                    student=st,
-                    exam=target_exam,
-                )
-                adj_qs = ExamAdjust.objects.filter(
-                    student=st,
-                    exam=target_exam,
-                )
-            else:
-                se_qs = StudentExam.objects.filter(
-                    student=st,
-                    exam__subject=subject,
-                )
-                adj_qs = ExamAdjust.objects.filter(
-                    student=st,
-                    exam__subject=subject,
-                )
-
-            tf_points_sum = se_qs.aggregate(
-                total=Coalesce(Sum(tf_points_expr), Value(0))
-            )["total"] or 0
+            # 未割当なら科目内の全 exam を合算（従来どおり）
+            target_exams = [target_exam] if target_exam else exams
 
-            hosei_sum = se_qs.aggregate(
-                total=Coalesce(Sum("hosei"), Value(0))
-            )["total"] or 0
-
-            adjust_val = (
-                adj_qs
-                .values_list("adjust", flat=True)
-                .first()
-                or 0
+            tf_points_sum = sum(totals.get((st.id, e.id), (0, 0))[0] for e in target_exams)
+            hosei_sum = sum(totals.get((st.id, e.id), (0, 0))[1] for e in target_exams)
+            adjust_val = next(
+                (adjust_map[(st.id, e.id)] for e in target_exams if (st.id, e.id) in adjust_map),
+                0,
             )
 
             total_score = tf_points_sum + hosei_sum + adjust_val
@@ -895,7 +1031,7 @@ def manage_stdversion_confirm(request, subject_id, student_id, target_version):
 
     current_sev = (
         StudentExamVersion.objects
-        .filter(student=student, exam__subject=subject)
+        .filter(student=student, subject=subject)
         .select_related("exam")
         .first()
     )
@@ -903,25 +1039,11 @@ def manage_stdversion_confirm(request, subject_id, student_id, target_version):
     current_exam = current_sev.exam if current_sev else None
     current_version = current_exam.version if current_exam else None
 
-    tf_points_expr = ExpressionWrapper(
-        F("TF") * F("question__points"),
-        output_field=IntegerField(),
-    )
-
     if current_exam:
-        se_qs = StudentExam.objects.filter(
-            student=student,
-            exam=current_exam,
+        score, hosei = score_totals([current_exam.id], [student.id]).get(
+            (student.id, current_exam.id), (0, 0)
         )
 
-        score = se_qs.aggregate(
-            total=Coalesce(Sum(tf_points_expr), Value(0))
-        )["total"]
-
-        hosei = se_qs.aggregate(
-            total=Coalesce(Sum("hosei"), Value(0))
-        )["total"]
-
         adj = (
             ExamAdjust.objects
             .filter(student=student, exam=current_exam)
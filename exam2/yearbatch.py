@@ -0,0 +1,173 @@
+# exam2/yearbatch.py
+"""
+年度内の全科目に export_subject_scores / import_subject_scores を回す（--all --fsyear）。
+
+- 科目ごとに別プロセス（ProcessPoolExecutor）で call_command する。
+  DB 接続はプロセスごとに持つ（プールを作る前に親の接続を閉じ、fork 後の子は自分で接続する）
+- 1 科目 = 1 ファイル（<dir>/examTFdata_<subjectNo>.json、--format=binary なら .e2tf）
+- 全科目が終わったら結果（所要時間・出力・失敗理由）を <dir>/<command>_summary.json にまとめる
+
+workers=1 ならプールを使わずこのプロセスで順に実行する（テスト・デバッグ用）。
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import Count
+from django.utils import timezone
+
+from .tfdata import write_json_atomic
+
+
+ORDERS = ("subjectNo", "size")   # size: StudentExam の多い科目から（長い科目を先に始めて待ちを減らす）
+FILE_PATTERNS = {
+    "json": "examTFdata_{subjectNo}.json",
+    "binary": "examTFdata_{subjectNo}.e2tf",
+}
+
+
+def default_workers() -> int:
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def default_dir(fsyear: int) -> Path:
+    """分割ストア（tfstore）の年度ディレクトリ"""
+    from .tfstore import year_dir
+
+    return year_dir(fsyear)
+
+
+def subject_file(directory, subjectNo, fmt: str = "json") -> Path:
+    return Path(directory) / FILE_PATTERNS[fmt].format(subjectNo=subjectNo)
+
+
+def find_subject_file(directory, subjectNo):
+    """import 用：JSON → バイナリの順で、あるほうのファイル（どちらも無ければ None）"""
+    for fmt in FILE_PATTERNS:
+        path = subject_file(directory, subjectNo, fmt)
+        if path.exists():
+            return path
+    return None
+
+
+def year_subjects(fsyear: int, order: str = "subjectNo") -> list[str]:
+    from .models import StudentExam, Subject
+
+    subjects = list(
+        Subject.objects.filter(fsyear=int(fsyear)).order_by("subjectNo").values_list("id", "subjectNo")
+    )
+    if order == "size":
+        sizes = dict(
+            StudentExam.objects.filter(subject__fsyear=int(fsyear))
+            .values("subject_id").order_by().annotate(n=Count("id"))
+            .values_list("subject_id", "n")
+        )
+        subjects.sort(key=lambda s: -sizes.get(s[0], 0))
+    return [subjectNo for _, subjectNo in subjects]
+
+
+# =========================
+# 実行
+# =========================
+
+def _init_worker():
+    # spawn で起動された子は Django を初期化し直す（fork なら何もしない）
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def _run_one(command: str, subjectNo: str, options: dict, *, in_worker: bool = False) -> dict:
+    out, err = StringIO(), StringIO()
+    started = time.perf_counter()
+    error = None
+    try:
+        call_command(command, subjectNo, stdout=out, stderr=err, **options)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        if in_worker:
+            # 子プロセスは次の科目に接続を持ち越さない（親の直列実行では呼び出し側の接続・トランザクションを閉じない）
+            connections.close_all()
+    return {
+        "subjectNo": subjectNo,
+        "ok": error is None,
+        "seconds": round(time.perf_counter() - started, 3),
+        "error": error,
+        "output": out.getvalue().splitlines(),
+        "pid": os.getpid(),
+    }
+
+
+def run_subjects(command: str, subjects, options_for, *, workers: int, summary_path, fsyear, on_result=None) -> dict:
+    """
+    subjects の各科目に call_command(command, subjectNo, **options_for(subjectNo)) を実行し、
+    summary（dict）を summary_path に書いて返す。on_result(result) は 1 科目終わるたびに呼ぶ。
+    """
+    subjects = list(subjects)
+    started_at = timezone.localtime().isoformat()
+    started = time.perf_counter()
+    results = {}
+
+    if workers <= 1:
+        for subjectNo in subjects:
+            results[subjectNo] = _run_one(command, subjectNo, options_for(subjectNo))
+            if on_result:
+                on_result(results[subjectNo])
+    else:
+        # 親の接続を子に持ち越さない（同じソケット / ファイルハンドルを共有させない）
+        connections.close_all()
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+            futures = {
+                pool.submit(_run_one, command, subjectNo, options_for(subjectNo), in_worker=True): subjectNo
+                for subjectNo in subjects
+            }
+            for future in as_completed(futures):
+                subjectNo = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:  # 子プロセスが落ちた（BrokenProcessPool など）
+                    result = {
+                        "subjectNo": subjectNo, "ok": False, "seconds": None,
+                        "error": f"{type(e).__name__}: {e}", "output": [], "pid": None,
+                    }
+                results[subjectNo] = result
+                if on_result:
+                    on_result(result)
+
+    ordered = [results[s] for s in subjects]
+    summary = {
+        "command": command,
+        "fsyear": int(fsyear),
+        "started_at": started_at,
+        "finished_at": timezone.localtime().isoformat(),
+        "seconds": round(time.perf_counter() - started, 3),
+        "workers": workers,
+        "subjects": len(ordered),
+        "succeeded": sum(1 for r in ordered if r["ok"]),
+        "failed": [{"subjectNo": r["subjectNo"], "error": r["error"]} for r in ordered if not r["ok"]],
+        "results": ordered,
+    }
+    write_json_atomic(summary_path, summary)
+    return summary
+
+
+def write_report(cmd, summary: dict, summary_path) -> None:
+    """BaseCommand の stdout に集計を書く"""
+    cmd.stdout.write(
+        f"  fsyear={summary['fsyear']} subjects={summary['subjects']} succeeded={summary['succeeded']}"
+        f" failed={len(summary['failed'])} workers={summary['workers']} elapsed={summary['seconds']}s"
+    )
+    for failure in summary["failed"]:
+        cmd.stdout.write(cmd.style.ERROR(f"  FAILED {failure['subjectNo']}: {failure['error']}"))
+    cmd.stdout.write(f"  summary={summary_path}")
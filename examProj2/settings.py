@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'exam2.archive.FsyearMiddleware',   # ?fsyear= をアーカイブ年度のルーティングに使う
+    'exam2.replica.ReplicaPinMiddleware',   # 書き込み直後は集計も primary を読む
 ]
 
 ROOT_URLCONF = 'examProj2.urls'
@@ -88,6 +91,59 @@ DATABASES = {
     # }
 }
 
+# PostgreSQL を使う場合: EXAM2_DB_ENGINE=postgresql と PG* 環境変数で接続先を指定する
+#   student テーブル（managed=False）は exam2/student_postgres.sql で作成しておくこと
+if os.environ.get("EXAM2_DB_ENGINE") == "postgresql":
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get("PGDATABASE", "exam2"),
+        'USER': os.environ.get("PGUSER", "exam2"),
+        'PASSWORD': os.environ.get("PGPASSWORD", ""),
+        'HOST': os.environ.get("PGHOST", "localhost"),
+        'PORT': os.environ.get("PGPORT", "5432"),
+        'CONN_MAX_AGE': 60,
+    }
+
+# PostgreSQL では load_* / import_subject_scores の一括投入に COPY を使う（False で bulk_create）
+EXAM2_PG_COPY = True
+
+# 過年度アーカイブ（archive_fsyear で作成）: exam2_<fsyear>.sqlite3 を DB エイリアス fsyear_<fsyear> として登録
+#   ?fsyear=<アーカイブ済み年度> のリクエストは exam2/archive.py のルータでそのファイルを読む（読み取り専用）
+EXAM2_ARCHIVE_DIR = BASE_DIR / "archive"
+for _path in sorted(EXAM2_ARCHIVE_DIR.glob("exam2_*.sqlite3")):
+    _year = _path.stem.rsplit("_", 1)[-1]
+    if _year.isdigit():
+        DATABASES[f"fsyear_{_year}"] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': _path}
+
+
+# 集計・出力系の読み取りレプリカ（exam2/replica.py）
+#   SQLite: refresh_replica で db_replica.sqlite3 を作る（cron 等で定期実行）。一度も作っていなければ primary を読む
+#   PostgreSQL: EXAM2_REPLICA_HOST にスタンバイのホストを指定
+#   max_staleness 秒より古いレプリカは使わず primary を読む。書き込み後 pin_seconds 秒は primary に固定
+EXAM2_REPLICA = {
+    "alias": "replica",
+    "max_staleness": 30,
+    "pin_seconds": 10,
+}
+if os.environ.get("EXAM2_REPLICA_HOST") and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ["EXAM2_REPLICA_HOST"],
+        'TEST': {'MIRROR': 'default'},
+    }
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db_replica.sqlite3'}?mode=ro",
+        'READ_ONLY': True,   # exam2/dbprofile.py は journal_mode / synchronous を発行しない
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = [
+    "exam2.archive.FsyearArchiveRouter",   # アーカイブ年度が最優先
+    "exam2.replica.ReplicaRouter",
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -135,4 +191,62 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 ENVIRONMENT = "テスト"
 
 FSYEAR = 2026
-TERM = 1
\ No newline at end of file
+TERM = 1
+
+# 採点データの保存形式
+#   "rows"   : StudentExam（1セル1行）を正とする（従来どおり）
+#   "packed" : AnswerSheet（1学生×1試験で1行）を正とする
+#              切替前に verify_answer_sheets <subjectNo> --rebuild で作成しておくこと
+EXAM2_ANSWER_STORAGE = "rows"
+
+# True: StudentExam を事前作成しない（sparse 運用）
+#   行が無いセルは TF=0, hosei=0 とみなし、最初の採点時に作成する
+#   load_student_exam / studentexam_* / 版変更 は StudentExam を作らなくなる
+EXAM2_SPARSE_STUDENT_EXAM = False
+# SQLite の接続プロファイル（exam2/dbprofile.py が connection_created で適用）
+#   None にすると PRAGMA を一切発行しない（SQLite の既定値のまま）
+#   現在値の確認: python manage.py show_db_pragmas
+SQLITE_PROFILE = {
+    "journal_mode": "WAL",        # 読み込みが書き込みを待たない
+    "synchronous": "NORMAL",      # WAL なら NORMAL で十分（電源断で直近コミットのみ失う可能性）
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -32768,         # 負数は KiB 指定（= 32MB）
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,         # ms。ロック中はこの時間まで待ってから "database is locked"
+}
+
+# 書き込み層（exam2/dbwrite.py）: BEGIN IMMEDIATE + ロック競合時の再試行
+#   serialize=True でプロセス内の書き込みを 1 本に並べる（runserver / スレッド型 WSGI 向け）
+#   状況確認: GET /api/write-metrics/
+EXAM2_WRITE = {
+    "retries": 6,
+    "base_delay": 0.02,
+    "max_delay": 0.5,
+    "serialize": False,
+}
+
+# マスタ参照キャッシュ（exam2/catalog.py）: Subject / Exam / Student の引き直しを省く
+#   stamp: 他プロセス（load_* コマンド等）からの無効化通知に使うファイル
+#   状況確認: GET /api/catalog-stats/
+EXAM2_CATALOG = {
+    "enabled": True,
+    "maxsize": 4096,
+    "stamp": BASE_DIR / ".exam2_catalog.stamp",
+    "check_interval": 1.0,
+}
+
+# 試験設定（answer_xxxx.json のパス・現在の年度）の解決（exam2/examconfig.py）
+#   override: ここに書いた科目は外部の @TTC/util/utils.py を使わずに解決する（無ければ utils）
+#   dirinfo : 外部の dirinfo.yaml。mtime が変わるまで 1 回だけパースし、全科目をそこから引く
+#   watch   : mtime が変わったら解決結果を捨てる YAML（override / dirinfo は常に監視）
+EXAM2_EXAM_CONFIG = {
+    "util_dir": BASE_DIR.parent / "@TTC" / "util",
+    "override": BASE_DIR / "exam2" / "data" / "examconfig.local.yaml",
+    "dirinfo": BASE_DIR.parent / "@TTC" / "dirinfo.yaml",
+    "watch": [BASE_DIR.parent / "@TTC" / "dirinfo.yaml"],
+}
+
+# 採点データ（examTFdata）の分割ストア（exam2/tfstore.py）
+#   <dir>/<fsyear>/examTFdata_<subjectNo>.json + <dir>/index.json
+#   従来の 1 ファイル形式が必要なら: python manage.py assemble_tfdata --fsyear <年度>
+EXAM2_TFSTORE_DIR = BASE_DIR / "exam2" / "data" / "export"
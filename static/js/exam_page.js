@@ -14,9 +14,16 @@ let originalAnswers = null;
 // ★ 追加：一括処理中ロック
 let isBusy = false;
 
+// 年度ヘッダ：URL の fsyear を全 API に X-Fsyear で渡す（アーカイブ済み年度の exam を引くため）
+function withFsyear(options = {}) {
+    const fsyear = new URLSearchParams(location.search).get("fsyear");
+    if (!fsyear) return options;
+    return { ...options, headers: { ...(options.headers || {}), "X-Fsyear": fsyear } };
+}
+
 // 共通 fetch
 async function fetchJSON(url, options = {}) {
-    const res = await fetch(url, options);
+    const res = await fetch(url, withFsyear(options));
     if (!res.ok) {
         console.error("fetch error:", url, res.status);
     }
@@ -145,6 +152,52 @@ function findAnswer(qid) {
     return studentAnswers.find(a => a.question === qid);
 }
 
+// ----------------- 保存（sparse 運用対応） -----------------
+// sparse 運用では未作成セルが id=null で返ってくる。
+// id があれば従来どおり PATCH、無ければ bulk_update に student/exam/question 付きで送り、
+// サーバが作成した id を studentAnswers に書き戻す。
+function answerKey(ans) {
+    return { student: ans.student, exam: ans.exam, question: ans.question };
+}
+
+// 503（サーバ側で書き込みロックが取れなかった）は少し待って再送する
+async function fetchWithRetry(url, options, retries = 3) {
+    for (let i = 0; ; i++) {
+        const res = await fetch(url, withFsyear(options));
+        if (res.status !== 503 || i >= retries) return res;
+        const wait = (Number(res.headers.get("Retry-After")) || 1) * 1000;
+        await new Promise(r => setTimeout(r, wait * (0.5 + Math.random())));
+    }
+}
+
+async function bulkUpdateAnswers(payload) {
+    const res = await fetchWithRetry("/api/student-exams/bulk_update/", {
+        method: "PATCH",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(payload)
+    });
+
+    if (res.ok) {
+        const data = await res.clone().json();
+        (data.created || []).forEach(c => {
+            const a = findAnswer(c.question);
+            if (a) a.id = c.id;
+        });
+    }
+    return res;
+}
+
+function patchAnswer(ans, body) {
+    if (ans.id == null) {
+        return bulkUpdateAnswers([{ ...answerKey(ans), ...body }]);
+    }
+    return fetchWithRetry(`/api/student-exams/${ans.id}/`, {
+        method: "PATCH",
+        headers: {"Content-Type": "application/json"},
+        body: JSON.stringify(body),
+    });
+}
+
 // ----------------- 画面描画 -----------------
 function renderExam() {
 
@@ -263,11 +316,7 @@ async function toggleTF(qid, box) {
     updateScores();
 
     // サーバ保存
-    await fetch(`/api/student-exams/${ans.id}/`, {
-        method: "PATCH",
-        headers: {"Content-Type": "application/json"},
-        body: JSON.stringify({ TF: ans.TF, hosei: ans.hosei }),
-    });
+    await patchAnswer(ans, { TF: ans.TF, hosei: ans.hosei });
 }
 
 // ----------------- 右クリックメニュー -----------------
@@ -389,11 +438,7 @@ async function applyHosei(hoseiValue) {
 
     updateScores();
 
-    await fetch(`/api/student-exams/${ans.id}/`, {
-        method: "PATCH",
-        headers: {"Content-Type": "application/json"},
-        body: JSON.stringify({ hosei: ans.hosei }),
-    });
+    await patchAnswer(ans, { hosei: ans.hosei });
 }
 
 //  *** 統合版：applyRowTF（完成形）  ***
@@ -427,6 +472,7 @@ async function applyRowTF(gyo, tfValue) {
             // bulk 用
             payload.push({
                 id: ans.id,
+                ...answerKey(ans),
                 TF: tfValue,
                 hosei: 0
             });
@@ -436,11 +482,7 @@ async function applyRowTF(gyo, tfValue) {
 
         // DB 更新（1回）
         if (payload.length > 0) {
-            await fetch("/api/student-exams/bulk_update/", {
-                method: "PATCH",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify(payload)
-            });
+            await bulkUpdateAnswers(payload);
         }
 
     } finally {
@@ -471,11 +513,7 @@ async function applyRowCorrect(gyo) {
         }
 
         // ★ ここは元の設計（1件ずつPATCH）は維持
-        reqs.push(fetch(`/api/student-exams/${ans.id}/`, {
-            method: "PATCH",
-            headers: {"Content-Type": "application/json"},
-            body: JSON.stringify({ TF: 1, hosei: 0 }),
-        }));
+        reqs.push(patchAnswer(ans, { TF: 1, hosei: 0 }));
     }
 
     updateScores();
@@ -508,11 +546,7 @@ async function applyRowUnset(gyo) {
             box.classList.remove("hosei");
         }
 
-        reqs.push(fetch(`/api/student-exams/${ans.id}/`, {
-            method: "PATCH",
-            headers: {"Content-Type": "application/json"},
-            body: JSON.stringify({ TF: 0, hosei: 0 }),
-        }));
+        reqs.push(patchAnswer(ans, { TF: 0, hosei: 0 }));
     }
 
     updateScores();
@@ -568,16 +602,13 @@ async function applyCancel() {
     // 2) DB に書き戻す payload
     const payload = studentAnswers.map(ans => ({
         id: ans.id,
+        ...answerKey(ans),
         TF: ans.TF,
         hosei: ans.hosei
     }));
 
     // 3) DB 更新
-    const res = await fetch("/api/student-exams/bulk_update/", {
-        method: "PATCH",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload)
-    });
+    const res = await bulkUpdateAnswers(payload);
 
     if (!res.ok) {
         console.error("キャンセル DBエラー:", await res.text());
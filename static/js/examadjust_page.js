@@ -207,9 +207,10 @@ async function updateAdjustments(subjectNo, fsyear, term) {
 
     // -------- Adjust 更新 --------
     if (changed.length > 0) {
+        // 年度は body だけでなく X-Fsyear でも渡す（アーカイブ済み年度なら 409 で止まる）
         await fetch("/api/exam-adjust-update-subject/", {
             method: "POST",
-            headers: {"Content-Type": "application/json"},
+            headers: {"Content-Type": "application/json", "X-Fsyear": fsyear},
             body: JSON.stringify({
                 subjectNo,
                 fsyear,
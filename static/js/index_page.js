@@ -9,13 +9,37 @@ async function initEnvironment() {
     const res = await fetch("/api/environment/");
     const data = await res.json();
 
-    GLOBAL_FSYEAR = data.fsyear;   // settings から返す年度
+    // URL の fsyear を優先（科目一覧を読む前に年度を確定させる）
+    const urlYear = new URLSearchParams(location.search).get("fsyear");
+    GLOBAL_FSYEAR = urlYear || data.fsyear;   // settings から返す年度
     GLOBAL_TERM  = data.term ?? 2; // settings から返す期（なければ 2）
 
-    document.getElementById("current-year").textContent = GLOBAL_FSYEAR;
     document.getElementById("current-term").textContent = GLOBAL_TERM;
 }
 
+// ---------------- 年度一覧（アーカイブ済み年度を含む） ----------------
+async function loadYears() {
+    const data = await fetchJSON("/api/fsyears/");
+    const sel = document.getElementById("year-dropdown");
+
+    sel.innerHTML = "";
+    data.years.forEach(y => {
+        const op = document.createElement("option");
+        op.value = y.fsyear;
+        op.textContent = y.archived ? `${y.fsyear}（アーカイブ）` : `${y.fsyear}`;
+        op.dataset.archived = y.archived ? "1" : "";
+        sel.appendChild(op);
+    });
+    sel.value = String(GLOBAL_FSYEAR);
+    renderArchivedBadge();
+}
+
+function renderArchivedBadge() {
+    const op = document.getElementById("year-dropdown").selectedOptions[0];
+    document.getElementById("archived-badge").textContent =
+        op && op.dataset.archived ? "※ アーカイブ済み（閲覧のみ）" : "";
+}
+
 // 共通 fetch
 async function fetchJSON(url, options = {}) {
     const res = await fetch(url, options);
@@ -28,6 +52,7 @@ document.addEventListener("DOMContentLoaded", async () => {
 
     // 1. 年度・期設定
     await initEnvironment();
+    await loadYears();
 
     // 2. 科目ドロップダウン設定（完了を await）
     await loadSubjects();
@@ -62,7 +87,7 @@ async function restoreFromURL() {
 
 // ---------------- 科目一覧読み込み ----------------
 async function loadSubjects() {
-    const data = await fetchJSON("/api/subjects/");
+    const data = await fetchJSON(`/api/subjects/?fsyear=${GLOBAL_FSYEAR}`);
     const sel = document.getElementById("subject-dropdown");
 
     sel.innerHTML = `<option value="">科目を選択してください</option>`;
@@ -181,6 +206,16 @@ async function loadStudentList(subjectNo) {
 
 // ---------------- イベント ----------------
 function setupEvents() {
+    document.getElementById("year-dropdown").addEventListener("change", async ev => {
+        GLOBAL_FSYEAR = ev.target.value;
+        renderArchivedBadge();
+        history.pushState({}, "", `/?fsyear=${GLOBAL_FSYEAR}`);
+
+        document.getElementById("students-table-body").innerHTML = "";
+        renderExamInfo(null);
+        await loadSubjects();
+    });
+
     document.getElementById("subject-dropdown").addEventListener("change", ev => {
         const subjectNo = ev.target.value;
         if (!subjectNo) return;